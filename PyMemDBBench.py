@@ -0,0 +1,506 @@
+'''
+    PyMemDBBench ~ repeatable PyMemDB benchmark suite, with JSON results and a comparison against an earlier run
+    depenencies: Python 2.7.x
+
+        load                    - PUT --keys names into an empty PyMemDB, names/sec
+        memory                  - resident bytes per name after the load, measured in a forked child, bytes/name
+        read_heavy_uniform      - --ops commands, 90% PULL 8% PUT 2% DELETE, every name equally likely, commands/sec
+        read_heavy_zipf         - same with Zipf distributed names (--skew), a few hot names get most of the commands
+        write_heavy_uniform     - --ops commands, 40% PULL 50% PUT 10% DELETE, uniform names
+        write_heavy_zipf        - same with Zipf distributed names
+        transactions            - nested START_COMMIT blocks --txn-depth deep with --txn-writes PUTs in each,
+                                  the innermost rolled back with UN_COMMIT and the rest committed with COMMIT
+        num_with_value          - NUM_WITH_VALUE over --values distinct values on --keys names, commands/sec
+        pipeline                - the load and read_heavy_uniform commands piped through PyMemDBImpl.py's stdin,
+                                  end to end including starting the process, commands/sec
+
+    every benchmark builds its commands up front from a random.Random seeded with --seed, so every run of every
+    benchmark sees exactly the same commands, and runs them through process_command_batch in --batch-size batches
+    on a PyMemDB that's been loaded the same way, --warmup runs are thrown away and then --runs runs are kept,
+    the report shows the median with the min and max and how far apart they are
+
+    the command benchmarks are run a second time with the command stats timing every call (PyMemDBStats.py),
+    that run only feeds the latency percentiles, the throughput figures come from the untimed runs
+
+        python PyMemDBBench.py --json before.json
+        python PyMemDBBench.py --compare before.json --threshold 10
+        python PyMemDBBench.py --compare before.json --against after.json
+
+    --compare flags every benchmark whose median (or p99 latency) got worse by more than --threshold percent
+    and exits with 1 if any did, --against compares two saved results without running anything
+'''
+
+import argparse
+import bisect
+import gc
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+import PyMemDBStats
+from PyMemDBImpl import PyMemDB
+
+# bumped whenever the JSON results change shape
+results_format = 1
+
+# (percent PULL, percent PUT, percent DELETE) for each workload mix
+workload_mixes = {
+    "read_heavy": (90, 8, 2),
+    "write_heavy": (40, 50, 10)
+}
+
+# a --compare verdict, how a benchmark moved past the threshold
+regression_verdict = "REGRESSION"
+improved_verdict = "improved"
+same_verdict = "same"
+
+''' ============= COMMAND functions ========== '''
+
+# sampler for Zipf distributed ranks in [0, num_ranks), rank 0 is the most popular
+def zipf_sampler(num_ranks, skew, random_gen):
+    cumulative_weights = []
+    total_weight = 0.0
+
+    for rank in xrange(0, num_ranks):
+        total_weight += 1.0 / ((rank + 1) ** skew)
+        cumulative_weights.append(total_weight)
+
+    def next_rank():
+        return bisect.bisect_left(cumulative_weights, random_gen.random() * total_weight)
+
+    return next_rank
+
+# sampler for the names a workload touches, "uniform" or "zipf"
+def key_sampler(distribution, num_keys, skew, random_gen):
+    if distribution == "zipf":
+        return zipf_sampler(num_keys, skew, random_gen)
+
+    return lambda: random_gen.randrange(num_keys)
+
+# the PUTs that load num_keys names, their values repeat every num_values names
+def make_load_commands(num_keys, num_values):
+    return ["PUT key" + str(i) + " v" + str(i % num_values) for i in xrange(0, num_keys)]
+
+# num_ops PULL/PUT/DELETE commands in the proportions of mix, on names picked by next_key
+def make_mixed_commands(mix, next_key, num_ops, num_values, random_gen):
+    pull_percent, put_percent, delete_percent = workload_mixes[mix]
+    cmd_lines = []
+
+    for i in xrange(0, num_ops):
+        roll = random_gen.random() * 100
+        name = "key" + str(next_key())
+
+        if roll < pull_percent:
+            cmd_lines.append("PULL " + name)
+        elif roll < pull_percent + put_percent:
+            cmd_lines.append("PUT " + name + " v" + str(random_gen.randrange(num_values)))
+        else:
+            cmd_lines.append("DELETE " + name)
+
+    return cmd_lines
+
+# at least num_ops commands of nested blocks, txn_writes PUTs at each of txn_depth levels, the innermost level rolled
+# back and everything else committed in one go
+def make_transaction_commands(next_key, num_ops, txn_depth, txn_writes, num_values, random_gen):
+    cmd_lines = []
+
+    while len(cmd_lines) < num_ops:
+        for level in xrange(0, txn_depth):
+            cmd_lines.append("START_COMMIT")
+
+            for i in xrange(0, txn_writes):
+                cmd_lines.append("PUT key" + str(next_key()) + " v" + str(random_gen.randrange(num_values)))
+
+        cmd_lines.append("UN_COMMIT")
+        cmd_lines.append("COMMIT")
+
+    return cmd_lines
+
+# cmd_lines cut up into the batches the command loop would see
+def split_batches(cmd_lines, batch_size):
+    return [cmd_lines[start:start + batch_size] for start in xrange(0, len(cmd_lines), batch_size)]
+
+''' ============= RUN functions ========== '''
+
+# a PyMemDB holding the same --keys names every time
+def make_loaded_db(args):
+    mem_db = PyMemDB()
+
+    for i in xrange(0, args.keys):
+        mem_db.cmd_PUT("key" + str(i), "v" + str(i % args.values))
+
+    return mem_db
+
+# seconds to run every batch through mem_db, the replies are thrown away a batch at a time like the command loop does
+def time_batches(mem_db, batches):
+    process_command_batch = mem_db.process_command_batch
+
+    # leftovers from building the commands shouldn't be collected on our clock
+    gc.collect()
+
+    start_time = timeit.default_timer()
+
+    for batch in batches:
+        process_command_batch(batch, [])
+
+    return timeit.default_timer() - start_time
+
+# every call's latency, running the batches again on a fresh database with the command stats timing every call
+def time_each_command(make_db, batches):
+    mem_db = make_db()
+
+    PyMemDBStats.enable_command_stats(mem_db, 1)
+
+    for batch in batches:
+        mem_db.process_command_batch(batch, [])
+
+    latency_histogram = PyMemDBStats.LatencyHistogram()
+
+    for histogram in mem_db.command_stats.histograms.itervalues():
+        latency_histogram.merge(histogram)
+
+    PyMemDBStats.disable_command_stats(mem_db)
+
+    return latency_histogram
+
+# commands/sec for cmd_lines on a database from make_db, and every command's latency from a second, timed, run
+def run_workload(make_db, cmd_lines, args):
+    batches = split_batches(cmd_lines, args.batch_size)
+
+    run_secs = time_batches(make_db(), batches)
+
+    return len(cmd_lines) / run_secs, time_each_command(make_db, batches)
+
+# each of these returns (figure, LatencyHistogram or None) for one run
+def run_load(args, random_gen):
+    return run_workload(PyMemDB, make_load_commands(args.keys, args.values), args)
+
+# resident bytes per name, the child starts from a copy of our heap so the load is all it adds
+def run_memory(args, random_gen):
+    read_fd, write_fd = os.pipe()
+
+    child_pid = os.fork()
+
+    if child_pid == 0:
+        exit_code = 1
+
+        try:
+            os.close(read_fd)
+
+            start_bytes = PyMemDBStats.get_resident_bytes()
+            mem_db = make_loaded_db(args)
+
+            os.write(write_fd, str(PyMemDBStats.get_resident_bytes() - start_bytes))
+
+            exit_code = 0
+        finally:
+            os._exit(exit_code)
+
+    os.close(write_fd)
+
+    resident_bytes = os.read(read_fd, 64)
+
+    os.close(read_fd)
+    os.waitpid(child_pid, 0)
+
+    if not resident_bytes:
+        raise RuntimeError("memory benchmark child failed")
+
+    return float(resident_bytes) / args.keys, None
+
+# a run function for a workload mix over uniform or zipf names
+def make_run_mixed(mix, distribution):
+    def run_mixed(args, random_gen):
+        next_key = key_sampler(distribution, args.keys, args.skew, random_gen)
+
+        return run_workload(lambda: make_loaded_db(args), make_mixed_commands(mix, next_key, args.ops, args.values, random_gen), args)
+
+    return run_mixed
+
+# nested blocks on uniform names
+def run_transactions(args, random_gen):
+    next_key = key_sampler("uniform", args.keys, args.skew, random_gen)
+    cmd_lines = make_transaction_commands(next_key, args.ops, args.txn_depth, args.txn_writes, args.values, random_gen)
+
+    return run_workload(lambda: make_loaded_db(args), cmd_lines, args)
+
+# NUM_WITH_VALUE for random values
+def run_num_with_value(args, random_gen):
+    cmd_lines = ["NUM_WITH_VALUE v" + str(random_gen.randrange(args.values)) for i in xrange(0, args.ops)]
+
+    return run_workload(lambda: make_loaded_db(args), cmd_lines, args)
+
+# the load and a read heavy mix written to a file and piped through a new PyMemDBImpl.py process
+def run_pipeline(args, random_gen):
+    next_key = key_sampler("uniform", args.keys, args.skew, random_gen)
+
+    script_file = tempfile.NamedTemporaryFile(suffix=".txt", delete=False)
+
+    try:
+        script_file.write("\n".join(make_load_commands(args.keys, args.values)) + "\n")
+        script_file.write("\n".join(make_mixed_commands("read_heavy", next_key, args.ops, args.values, random_gen)) + "\n")
+        script_file.close()
+
+        mem_db_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "PyMemDBImpl.py")
+
+        with open(script_file.name, "r") as script_in:
+            with open(os.devnull, "w") as null_file:
+                start_time = timeit.default_timer()
+                subprocess.check_call([sys.executable, mem_db_path], stdin=script_in, stdout=null_file)
+                run_secs = timeit.default_timer() - start_time
+
+    finally:
+        os.remove(script_file.name)
+
+    return (args.keys + args.ops) / run_secs, None
+
+# (name, run function, unit, higher is better) for every benchmark, in the order they're run and reported
+benchmark_table = [
+    ("load", run_load, "names/sec", True),
+    ("memory", run_memory, "bytes/name", False),
+    ("read_heavy_uniform", make_run_mixed("read_heavy", "uniform"), "cmds/sec", True),
+    ("read_heavy_zipf", make_run_mixed("read_heavy", "zipf"), "cmds/sec", True),
+    ("write_heavy_uniform", make_run_mixed("write_heavy", "uniform"), "cmds/sec", True),
+    ("write_heavy_zipf", make_run_mixed("write_heavy", "zipf"), "cmds/sec", True),
+    ("transactions", run_transactions, "cmds/sec", True),
+    ("num_with_value", run_num_with_value, "cmds/sec", True),
+    ("pipeline", run_pipeline, "cmds/sec", True)
+]
+
+# the middle of a list of numbers, the mean of the middle two for an even number of them
+def get_median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+
+    if len(values) % 2:
+        return values[middle]
+
+    return (values[middle - 1] + values[middle]) / 2.0
+
+# run one benchmark --warmup + --runs times, returns its result dict
+def run_benchmark(name, args):
+    run_func, unit, higher_is_better = [(run_func, unit, higher_is_better) for table_name, run_func, unit, higher_is_better
+                                        in benchmark_table if table_name == name][0]
+
+    figures = []
+    latency_histogram = PyMemDBStats.LatencyHistogram()
+
+    for run in xrange(0, args.warmup + args.runs):
+        # the same commands every run
+        figure, run_histogram = run_func(args, random.Random(args.seed))
+
+        if run < args.warmup:
+            continue
+
+        figures.append(figure)
+
+        if run_histogram is not None:
+            latency_histogram.merge(run_histogram)
+
+    median = get_median(figures)
+
+    result = {"unit": unit, "higher_is_better": higher_is_better, "runs": figures, "median": median,
+              "min": min(figures), "max": max(figures), "spread_percent": round(100.0 * (max(figures) - min(figures)) / median, 2)}
+
+    if latency_histogram.total_count:
+        result["latency_us"] = {"count": latency_histogram.total_count, "mean": round(latency_histogram.get_mean(), 2),
+                                "p50": latency_histogram.get_percentile(50), "p99": latency_histogram.get_percentile(99),
+                                "p999": latency_histogram.get_percentile(99.9), "max": latency_histogram.max_micros}
+
+    return result
+
+# the short commit the tree is at, None outside of a git checkout
+def get_git_commit():
+    try:
+        with open(os.devnull, "w") as null_file:
+            return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=null_file,
+                                           cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# the settings that change what a benchmark measures, --compare warns when they don't match
+def get_settings(args):
+    return {"keys": args.keys, "ops": args.ops, "values": args.values, "batch_size": args.batch_size, "skew": args.skew,
+            "txn_depth": args.txn_depth, "txn_writes": args.txn_writes, "seed": args.seed, "runs": args.runs, "warmup": args.warmup}
+
+# run every benchmark in names, returns the whole results dict that --json writes out
+def run_suite(names, args, progress_stream=None):
+    results = {}
+
+    for name in names:
+        if progress_stream is not None:
+            progress_stream.write("running " + name + "\n")
+            progress_stream.flush()
+
+        results[name] = run_benchmark(name, args)
+
+    return {"format": results_format, "created": int(time.time()), "commit": get_git_commit(), "python": platform.python_version(),
+            "platform": platform.platform(), "settings": get_settings(args), "results": results}
+
+''' ============= REPORT functions ========== '''
+
+# the benchmarks in results, in benchmark_table order
+def get_result_names(results):
+    return [name for name, run_func, unit, higher_is_better in benchmark_table if name in results["results"]]
+
+# one line per benchmark, "name median unit (min - max, spread%) p50/p99/p999/max us"
+def format_report(results):
+    report_lines = []
+
+    for name in get_result_names(results):
+        result = results["results"][name]
+
+        report_line = "%-20s %12.1f %-10s (%.1f - %.1f, %.1f%%)" % (name, result["median"], result["unit"], result["min"],
+                                                                    result["max"], result["spread_percent"])
+
+        if "latency_us" in result:
+            latency = result["latency_us"]
+            report_line += " p50/p99/p999/max %d/%d/%d/%d us" % (latency["p50"], latency["p99"], latency["p999"], latency["max"])
+
+        report_lines.append(report_line)
+
+    return report_lines
+
+# (name, baseline, current, change percent, verdict) for every benchmark in both, plus a name.p99_us row for each
+# one with latencies, a verdict is REGRESSION when it got worse by more than threshold_percent
+def compare_results(baseline, current, threshold_percent=10.0):
+    comparison_rows = []
+
+    for name in get_result_names(current):
+        if name not in baseline["results"]:
+            continue
+
+        baseline_result = baseline["results"][name]
+        current_result = current["results"][name]
+
+        figures = [(name, baseline_result["median"], current_result["median"], current_result["higher_is_better"])]
+
+        if "latency_us" in baseline_result and "latency_us" in current_result:
+            figures.append((name + ".p99_us", baseline_result["latency_us"]["p99"], current_result["latency_us"]["p99"], False))
+
+        for row_name, baseline_figure, current_figure, higher_is_better in figures:
+            change_percent = 100.0 * (current_figure - baseline_figure) / baseline_figure if baseline_figure else 0.0
+            worse_percent = -change_percent if higher_is_better else change_percent
+
+            if worse_percent > threshold_percent:
+                verdict = regression_verdict
+            elif worse_percent < -threshold_percent:
+                verdict = improved_verdict
+            else:
+                verdict = same_verdict
+
+            comparison_rows.append((row_name, baseline_figure, current_figure, round(change_percent, 2), verdict))
+
+    return comparison_rows
+
+# lines describing a comparison, with a warning first for every setting that doesn't match
+def format_comparison(baseline, current, comparison_rows):
+    comparison_lines = []
+
+    for setting in sorted(set(baseline["settings"]) | set(current["settings"])):
+        if baseline["settings"].get(setting) != current["settings"].get(setting):
+            comparison_lines.append("warning: " + setting + " was " + str(baseline["settings"].get(setting)) + " now " +
+                                    str(current["settings"].get(setting)))
+
+    comparison_lines.append("comparing " + str(current.get("commit")) + " against " + str(baseline.get("commit")))
+
+    for row_name, baseline_figure, current_figure, change_percent, verdict in comparison_rows:
+        comparison_lines.append("%-28s %12.1f -> %12.1f %+7.1f%% %s" % (row_name, baseline_figure, current_figure, change_percent, verdict))
+
+    return comparison_lines
+
+# results saved by save_results
+def load_results(results_path):
+    with open(results_path, "r") as results_file:
+        return json.load(results_file)
+
+# the results as JSON, what --json writes
+def save_results(results, results_path):
+    with open(results_path, "w") as results_file:
+        json.dump(results, results_file, indent=2, sort_keys=True)
+        results_file.write("\n")
+
+''' ============= COMMAND LINE functions ========== '''
+
+# command line options for PyMemDBBench.py
+def add_bench_args(arg_parser):
+    arg_parser.add_argument("--only", help="comma separated benchmarks to run, all of them by default")
+    arg_parser.add_argument("--list", action="store_true", help="list the benchmarks and exit")
+    arg_parser.add_argument("--keys", type=int, default=100000, help="names loaded before every run")
+    arg_parser.add_argument("--ops", type=int, default=200000, help="commands per run")
+    arg_parser.add_argument("--values", type=int, default=100, help="distinct values")
+    arg_parser.add_argument("--batch-size", type=int, default=1000, help="commands per process_command_batch call")
+    arg_parser.add_argument("--skew", type=float, default=0.99, help="Zipf skew for the _zipf workloads")
+    arg_parser.add_argument("--txn-depth", type=int, default=3, help="nesting depth of the transactions benchmark")
+    arg_parser.add_argument("--txn-writes", type=int, default=2, help="PUTs at each level of the transactions benchmark")
+    arg_parser.add_argument("--seed", type=int, default=20160323, help="seed for every run's commands")
+    arg_parser.add_argument("--runs", type=int, default=5, help="runs kept for each benchmark")
+    arg_parser.add_argument("--warmup", type=int, default=1, help="runs thrown away first")
+    arg_parser.add_argument("--json", help="write the results here")
+    arg_parser.add_argument("--compare", help="results to compare against, from an earlier --json")
+    arg_parser.add_argument("--against", help="compare these saved results instead of running the benchmarks")
+    arg_parser.add_argument("--threshold", type=float, default=10.0, help="percent worse that counts as a regression")
+
+# the benchmarks --only asks for, all of them without it
+def get_benchmark_names(args):
+    all_names = [name for name, run_func, unit, higher_is_better in benchmark_table]
+
+    if not args.only:
+        return all_names
+
+    names = args.only.split(",")
+
+    for name in names:
+        if name not in all_names:
+            raise ValueError("unknown benchmark: " + name)
+
+    return names
+
+# run the suite (or load --against), report it and compare it with --compare, exits with 1 on a regression
+if __name__ == "__main__":
+
+    arg_parser = argparse.ArgumentParser(description="PyMemDB benchmark suite")
+    add_bench_args(arg_parser)
+
+    args = arg_parser.parse_args()
+
+    if args.list:
+        for name, run_func, unit, higher_is_better in benchmark_table:
+            print name + " (" + unit + ")"
+
+        sys.exit(0)
+
+    if args.against is not None:
+        if args.compare is None:
+            arg_parser.error("--against needs --compare")
+
+        results = load_results(args.against)
+    else:
+        try:
+            names = get_benchmark_names(args)
+        except ValueError as name_error:
+            arg_parser.error(str(name_error))
+
+        results = run_suite(names, args, sys.stderr)
+
+        for report_line in format_report(results):
+            print report_line
+
+    if args.json is not None:
+        save_results(results, args.json)
+
+    if args.compare is not None:
+        baseline = load_results(args.compare)
+        comparison_rows = compare_results(baseline, results, args.threshold)
+
+        for comparison_line in format_comparison(baseline, results, comparison_rows):
+            print comparison_line
+
+        if [row for row in comparison_rows if row[4] == regression_verdict]:
+            sys.exit(1)
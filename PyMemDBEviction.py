@@ -0,0 +1,241 @@
+'''
+    PyMemDBEviction ~ bounded-memory mode for PyMemDB, evicts names once a key or byte limit is hit
+    depenencies: Python 2.7.x
+
+    every policy keeps the names in a flat list (plus a name -> position dict) so it can pull a random sample in O(1),
+    the access metadata for each name sits in a list parallel to it, so tracking a PULL or PUT is one dict lookup
+    and one list store, removing a name swaps the last name into its spot
+
+    when a PUT takes us over the limit a handful of names are sampled and the worst one by the policy is evicted:
+        lru    - approximate least recently used, the sampled name accessed longest ago
+        lfu    - least frequently used, access counters that halve every lfu_decay_ticks accesses they sit idle
+        random - any sampled name
+
+    names pinned by an open transaction block (any client's) are never evicted, their pre-block values
+    have to still be there to roll back to
+'''
+
+import random
+
+# eviction policy names
+EVICT_LRU = "lru"
+EVICT_LFU = "lfu"
+EVICT_RANDOM = "random"
+
+eviction_policies = [EVICT_LRU, EVICT_LFU, EVICT_RANDOM]
+
+class SampledEvictionPolicy:
+    '''
+        SampledEvictionPolicy ~ names, their sizes and their access metadata in flat lists we can sample from
+            - subclasses decide what the metadata is and which sampled name goes first
+    '''
+
+    # rough bytes a name costs on top of its name and value, the dict entry plus both string headers
+    key_overhead_bytes = 128
+
+    # how many names we look at to pick each one to evict
+    sample_size = 5
+
+    # how many samples we take before giving up when everything we sample is pinned
+    max_samples = 10
+
+    # limits, None means no limit
+    max_keys = None
+    max_bytes = None
+
+    # every name, name -> its position in names, and a parallel list of access metadata
+    names = []
+    positions = {}
+    access_meta = []
+
+    # estimated bytes used by every name we're tracking
+    num_bytes = 0
+
+    # counts every access, used as the clock for access metadata
+    tick = 0
+
+    # how many names we've evicted
+    num_evicted = 0
+
+    def __init__(self, max_keys=None, max_bytes=None, sample_size=5, seed=None):
+        self.max_keys = max_keys
+        self.max_bytes = max_bytes
+        self.sample_size = sample_size
+        self.names = []
+        self.positions = {}
+        self.access_meta = []
+        self.num_bytes = 0
+        self.tick = 0
+        self.num_evicted = 0
+        self.random_gen = random.Random(seed)
+
+    # estimated bytes name set to value costs
+    def get_entry_bytes(self, name, value):
+        return len(name) + len(value) + self.key_overhead_bytes
+
+    # metadata for a name we've just started tracking
+    def new_access_meta(self):
+        return self.tick
+
+    # update the metadata for the name at position, it was just accessed
+    def touch(self, position):
+        self.access_meta[position] = self.tick
+
+    # how much we'd like to keep the name at position, lowest is evicted first
+    def get_keep_score(self, position):
+        return self.access_meta[position]
+
+    # name was PUT, old_value is None if it's new
+    def on_store(self, name, old_value, value):
+        self.tick += 1
+
+        position = self.positions.get(name)
+
+        if position is None:
+            self.positions[name] = len(self.names)
+            self.names.append(name)
+            self.access_meta.append(self.new_access_meta())
+            self.num_bytes += self.get_entry_bytes(name, value)
+
+        else:
+            self.touch(position)
+            self.num_bytes += len(value) - len(old_value)
+
+    # name was PULLed
+    def on_access(self, name):
+        self.tick += 1
+        self.touch(self.positions[name])
+
+    # name was removed, swap the last name into its spot
+    def on_remove(self, name, old_value):
+        position = self.positions.pop(name)
+
+        last_name = self.names.pop()
+        last_access_meta = self.access_meta.pop()
+
+        if position < len(self.names):
+            self.names[position] = last_name
+            self.access_meta[position] = last_access_meta
+            self.positions[last_name] = position
+
+        self.num_bytes -= self.get_entry_bytes(name, old_value)
+
+    # start over from a dict of name -> value, used after bulk loading
+    def rebuild(self, name_values):
+        self.names = name_values.keys()
+        self.positions = dict((name, position) for position, name in enumerate(self.names))
+        self.access_meta = [self.new_access_meta()] * len(self.names)
+        self.num_bytes = sum(self.get_entry_bytes(name, value) for name, value in name_values.iteritems())
+
+    # are we over either limit?
+    def is_over_limit(self):
+        if self.max_keys is not None and len(self.names) > self.max_keys:
+            return True
+
+        if self.max_bytes is not None and self.num_bytes > self.max_bytes:
+            return True
+
+        return False
+
+    # sample names and pick the one to evict, None if every name we sampled is pinned
+    # is_pinned(name) says whether a name is off limits, None when nothing is pinned
+    def choose_victim(self, is_pinned=None):
+        names = self.names
+        num_names = len(names)
+
+        if not num_names:
+            return None
+
+        random_func = self.random_gen.random
+
+        for sample in range(0, self.max_samples):
+            positions = [int(random_func() * num_names) for i in range(0, self.sample_size)]
+
+            if is_pinned is not None:
+                positions = [position for position in positions if not is_pinned(names[position])]
+
+            if positions:
+                return names[min(positions, key=self.get_keep_score)]
+
+        return None
+
+class LRUEvictionPolicy(SampledEvictionPolicy):
+    '''
+        LRUEvictionPolicy ~ approximate LRU, the metadata is the tick of the last access
+    '''
+
+class LFUEvictionPolicy(SampledEvictionPolicy):
+    '''
+        LFUEvictionPolicy ~ LFU with decaying counters
+            - the metadata is a (count, tick of the last access) tuple
+            - a count halves for every lfu_decay_ticks accesses it sits idle, so names that were hot a while ago fade out
+            - new names start at lfu_init_count so they get a chance to build up a count before they're evicted
+    '''
+
+    lfu_init_count = 5
+    lfu_max_count = 255
+
+    # accesses (to any name) before an idle count halves
+    lfu_decay_ticks = 10000
+
+    def __init__(self, max_keys=None, max_bytes=None, sample_size=5, seed=None, lfu_decay_ticks=10000):
+        SampledEvictionPolicy.__init__(self, max_keys, max_bytes, sample_size, seed)
+        self.lfu_decay_ticks = lfu_decay_ticks
+
+    def new_access_meta(self):
+        return (self.lfu_init_count, self.tick)
+
+    # the count at position with the decay since its last access taken off
+    def get_decayed_count(self, position):
+        count, last_tick = self.access_meta[position]
+
+        return count >> min((self.tick - last_tick) // self.lfu_decay_ticks, 8)
+
+    def touch(self, position):
+        self.access_meta[position] = (min(self.get_decayed_count(position) + 1, self.lfu_max_count), self.tick)
+
+    def get_keep_score(self, position):
+        return self.get_decayed_count(position)
+
+class RandomEvictionPolicy(SampledEvictionPolicy):
+    '''
+        RandomEvictionPolicy ~ evicts any sampled name, no access metadata to keep up
+    '''
+
+    def __init__(self, max_keys=None, max_bytes=None, sample_size=1, seed=None):
+        SampledEvictionPolicy.__init__(self, max_keys, max_bytes, sample_size, seed)
+
+    def new_access_meta(self):
+        return 0
+
+    def touch(self, position):
+        pass
+
+# build an eviction policy by name
+def new_eviction_policy(policy_name, max_keys=None, max_bytes=None, sample_size=5, seed=None):
+    if policy_name == EVICT_LRU:
+        return LRUEvictionPolicy(max_keys, max_bytes, sample_size, seed)
+    elif policy_name == EVICT_LFU:
+        return LFUEvictionPolicy(max_keys, max_bytes, sample_size, seed)
+    elif policy_name == EVICT_RANDOM:
+        return RandomEvictionPolicy(max_keys, max_bytes, 1, seed)
+    else:
+        raise ValueError("unknown eviction policy: " + str(policy_name))
+
+# command line options shared by PyMemDBImpl.py and PyMemDBServer.py
+def add_eviction_args(arg_parser):
+    arg_parser.add_argument("--max-keys", type=int, help="evict names once there are more than this many")
+    arg_parser.add_argument("--max-bytes", type=int, help="evict names once they take up (roughly) more than this many bytes")
+    arg_parser.add_argument("--eviction-policy", choices=eviction_policies, default=EVICT_LRU, help="which names to evict first")
+    arg_parser.add_argument("--eviction-samples", type=int, default=5, help="how many names to sample for each eviction")
+
+# set up bounded-memory mode for mem_db from the parsed command line options, only if there's a limit
+def open_eviction(mem_db, args):
+    if args.max_keys is None and args.max_bytes is None:
+        return None
+
+    eviction_policy = new_eviction_policy(args.eviction_policy, args.max_keys, args.max_bytes, args.eviction_samples)
+
+    mem_db.set_eviction_policy(eviction_policy)
+
+    return eviction_policy
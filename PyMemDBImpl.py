@@ -4,206 +4,2068 @@
 '''
 
 # needed for sdin and stdout
+import os
 import sys
+import time
 
-# Class that implements a TransactionBlock, with a reference to its parent
+# min-heap of expiry times for active expiry
+import heapq
 
-class TransactionBlock:
+# old versions waiting to be garbage collected, oldest first
+from collections import deque
+
+# pull cursors apart into blocks of replies
+from itertools import ifilterfalse, imap, islice
+
+# binary search for the ordered key index
+from bisect import bisect_left, bisect_right, insort
+
+# keep track of every client's transaction log without keeping them alive
+from weakref import WeakSet
+
+# Class that implements the transaction log, one flat undo log shared by all of the nested blocks
+
+class TransactionLog(object):
+    '''
+        TransactionLog ~ a single flat undo log plus a stack of savepoints, one per open transaction block
+            - each savepoint is the offset in the undo log where its block starts
+            - START_COMMIT pushes a savepoint, COMMIT drops the whole log, UN_COMMIT only touches the innermost block's entries
+            - when compacting, a block only logs the first write to each name, later writes can't change the pre-block value
+            - undo entries are plain tuples and the log itself has __slots__, the server keeps one log per connection
+            - names with an open undo entry are pinned, expiry (and anything else working behind the client's back)
+              has to leave them alone until the blocks are closed
+            - the names the client is WATCHing, and the version of each one it saw, live here too
+            - a private log (PyMemDB(mvcc=True)) never touches the shared data until END_COMMIT, each block keeps its
+              writes in a dict of its own instead of undo entries, rolling back a block just drops its dict
+            - the innermost block can also be merged into the one around it, how a server-side script's block ends
+              inside a client's block
+    '''
+
+    __slots__ = (
+        # every undo entry is a (name, old_value) tuple, old_value is None if the name didn't exist
+        # names that had a TTL get a (name, old_value, old_expire_at) tuple so roll-back can put the TTL back too
+        "undo_log",
+
+        # name -> number of undo entries for it, every name the open blocks have written
+        "pinned_names",
+
+        # offsets into the undo log where each open block starts, innermost block last
+        "savepoints",
+
+        # names each open block has already logged, innermost block last (only used when compacting)
+        "block_names",
+
+        # keep only the first old value per name per block
+        "compact",
+
+        # name -> version of every name WATCHed, see PyMemDB.cmd_WATCH
+        "watched_versions",
+
+        # name -> [version before, version after] the open blocks wrote to it, for watched names while WATCHing
+        "written_versions",
+
+        # keep the blocks' writes to ourselves until END_COMMIT, see PyMemDB.publish_private_writes
+        "private",
+
+        # name -> (value, expire_at) written by each open block, innermost block last, value is None for a DELETE
+        "private_writes",
+
+        # the commit id the outermost block reads as of, None when no block is open (only for private logs)
+        "snapshot_id",
+
+        # PyMemDB keeps track of every log in a WeakSet
+        "__weakref__",
+    )
+
+    def __init__(self, compact=True, private=False):
+        self.undo_log = []
+        self.pinned_names = {}
+        self.savepoints = []
+        self.block_names = []
+        self.compact = compact
+        self.watched_versions = {}
+        self.written_versions = {}
+        self.private = private
+        self.private_writes = []
+        self.snapshot_id = None
+
+    # are there any open transaction blocks?
+    def is_open(self):
+        return len(self.savepoints) > 0
+
+    # how deeply nested the open transaction blocks are
+    def get_depth(self):
+        return len(self.savepoints)
+
+    # number of undo entries in the innermost block
+    def get_num_cmds_in_current_block(self):
+        if self.savepoints:
+            return len(self.undo_log) - self.savepoints[-1]
+        else:
+            return 0
+
+    # total number of undo entries across all of the open blocks
+    def get_undo_log_size(self):
+        return len(self.undo_log)
+
+    # every distinct name written by any of the open blocks
+    def get_names(self):
+        return set(self.pinned_names)
+
+    # has any of the open blocks written name?
+    def is_pinned(self, name):
+        return name in self.pinned_names
+
+    # open a new (possibly nested) block
+    def start_block(self):
+        self.savepoints.append(len(self.undo_log))
+
+        if self.compact:
+            self.block_names.append(set())
+
+        if self.private:
+            self.private_writes.append({})
+
+    # (value, expire_at) the open blocks last wrote to name, None if they haven't written it
+    def get_private(self, name):
+        for block_writes in reversed(self.private_writes):
+            write = block_writes.get(name)
+
+            if write is not None:
+                return write
+
+        return None
+
+    # write name in the innermost block without anyone else seeing it, value is None for a DELETE
+    def put_private(self, name, value, expire_at=None):
+        self.private_writes[-1][name] = (value, expire_at)
+
+    # name -> (value, expire_at) for everything the open blocks wrote, inner blocks win
+    def get_private_writes(self):
+        if len(self.private_writes) == 1:
+            return self.private_writes[0]
+
+        merged_writes = {}
+
+        for block_writes in self.private_writes:
+            merged_writes.update(block_writes)
+
+        return merged_writes
+
+    # remember the old value (and TTL, if it had one) of name so we can put it back on roll-back
+    def add_undo(self, name, old_value, old_expire_at=None):
+        if self.compact:
+            cur_block_names = self.block_names[-1]
+
+            # first write wins, we already have the value from before this block
+            if name in cur_block_names:
+                return
+
+            cur_block_names.add(name)
+
+        if old_expire_at is None:
+            self.undo_log.append((name, old_value))
+        else:
+            self.undo_log.append((name, old_value, old_expire_at))
+
+        pinned_names = self.pinned_names
+        pinned_names[name] = pinned_names.get(name, 0) + 1
+
+    # remember the old values for a whole group of names at once, each entry is (name, old_value, old_expire_at)
+    def add_undos(self, undo_entries):
+        undo_log = self.undo_log
+        pinned_names = self.pinned_names
+
+        if self.compact:
+            cur_block_names = self.block_names[-1]
+        else:
+            cur_block_names = None
+
+        for name, old_value, old_expire_at in undo_entries:
+            if cur_block_names is not None:
+
+                # first write wins, we already have the value from before this block
+                if name in cur_block_names:
+                    continue
+
+                cur_block_names.add(name)
+
+            if old_expire_at is None:
+                undo_log.append((name, old_value))
+            else:
+                undo_log.append((name, old_value, old_expire_at))
+
+            pinned_names[name] = pinned_names.get(name, 0) + 1
+
+    # roll-back and close the innermost block, only walks this block's entries
+    def roll_back_current(self, smdb):
+        savepoint = self.savepoints.pop()
+        undo_log = self.undo_log
+        pinned_names = self.pinned_names
+
+        if self.compact:
+            self.block_names.pop()
+
+        # nothing was applied, there's nothing to put back
+        if self.private:
+            self.private_writes.pop()
+
+        # pop entries off the end to undo them in reverse order, preserving integrity
+        while len(undo_log) > savepoint:
+            undo_entry = undo_log.pop()
+            name = undo_entry[0]
+            old_value = undo_entry[1]
+
+            # name didn't previously exist, so "DELETE" it, effectively removing it from the data store
+            # set rollback-mode to True so the roll-back itself isn't logged
+            if old_value is None:
+                smdb.cmd_DELETE(name, True)
+
+            # other wise, let's put back whatever original value was there (which also drops any newer TTL)
+            else:
+                smdb.cmd_PUT(name, old_value, True)
+
+                # and the TTL it had before the block
+                if len(undo_entry) > 2:
+                    smdb.set_expire_at(name, undo_entry[2])
+
+            cur_count = pinned_names[name] - 1
+
+            if cur_count:
+                pinned_names[name] = cur_count
+            else:
+                del pinned_names[name]
+
+    # close the innermost block keeping its changes, they become part of the block around it
+    # its undo entries stay where they are, rolling back the outer block undoes them first and its own entries last
+    def merge_current(self):
+        self.savepoints.pop()
+
+        if self.compact:
+            inner_names = self.block_names.pop()
+            self.block_names[-1].update(inner_names)
+
+        if self.private:
+            inner_writes = self.private_writes.pop()
+            self.private_writes[-1].update(inner_writes)
+
+    # close every open block, keeping all of the changes, nothing to replay so just drop the log
+    def commit_all(self):
+        self.undo_log = []
+        self.pinned_names = {}
+        self.savepoints = []
+        self.block_names = []
+        self.private_writes = []
+
+# Class that implements the value count secondary index behind NUM_WITH_VALUE
+
+class ValueCountIndex:
+    '''
+        ValueCountIndex ~ secondary index of value -> number of names currently set to that value
+            - every PUT, DELETE and roll-back goes through add_value/remove_value, each O(1)
+            - values are dropped from the index as soon as their count hits 0
+    '''
+
+    # value -> number of names currently set to it
+    value_counts = {}
+
+    def __init__(self):
+        self.value_counts = {}
+
+    # one more name is set to value, returns the copy of value to store
+    def add_value(self, value):
+        value_counts = self.value_counts
+        value_counts[value] = value_counts.get(value, 0) + 1
+
+        return value
+
+    # one less name is set to value
+    def remove_value(self, value):
+        cur_count = self.value_counts[value] - 1
+
+        if cur_count:
+            self.value_counts[value] = cur_count
+
+        # remove this value from the count cache
+        else:
+            del self.value_counts[value]
+
+    # apply a dict of value -> change in count in one go, used by the multi-key commands
+    def apply_deltas(self, value_deltas):
+        value_counts = self.value_counts
+
+        for value, delta in value_deltas.iteritems():
+            if not delta:
+                continue
+
+            cur_count = value_counts.get(value, 0) + delta
+
+            if cur_count:
+                value_counts[value] = cur_count
+            else:
+                del value_counts[value]
+
+    # number of names set to value, 0 if we have never seen it
+    def get_count(self, value):
+        return self.value_counts.get(value, 0)
+
+    # number of distinct values in the index
+    def get_num_values(self):
+        return len(self.value_counts)
+
+    # throw away the counts and recount every value, used after bulk loading
+    def rebuild(self, values):
+        value_counts = {}
+
+        for value in values:
+            value_counts[value] = value_counts.get(value, 0) + 1
+
+        self.value_counts = value_counts
+
+    # take over an already counted dict of value -> count, used when loading a snapshot
+    def load_counts(self, value_counts):
+        self.value_counts = value_counts
+
+# Class that implements the value count index for compact storage, every name set to the same value shares one copy of it
+
+class InternedValueCountIndex(ValueCountIndex):
+    '''
+        InternedValueCountIndex ~ value count index that also keeps the one shared copy of every value
+            - add_value hands back the copy already in the index, so repeated values are only held in memory once
+            - the shared copy is dropped along with its count as soon as no name is set to it
+    '''
+
+    # value -> the one copy of it that every name set to it shares, the same object used as the key in value_counts
+    value_table = {}
+
+    def __init__(self):
+        ValueCountIndex.__init__(self)
+        self.value_table = {}
+
+    # one more name is set to value, returns the shared copy of value to store
+    def add_value(self, value):
+        shared_value = self.value_table.setdefault(value, value)
+
+        value_counts = self.value_counts
+        value_counts[shared_value] = value_counts.get(shared_value, 0) + 1
+
+        return shared_value
+
+    # one less name is set to value
+    def remove_value(self, value):
+        cur_count = self.value_counts[value] - 1
+
+        if cur_count:
+            self.value_counts[value] = cur_count
+
+        # nothing is set to this value anymore, drop the count and the shared copy
+        else:
+            del self.value_counts[value]
+            del self.value_table[value]
+
+    # apply a dict of value -> change in count in one go, new values become the shared copy
+    def apply_deltas(self, value_deltas):
+        value_counts = self.value_counts
+        value_table = self.value_table
+
+        for value, delta in value_deltas.iteritems():
+            if not delta:
+                continue
+
+            cur_count = value_counts.get(value, 0) + delta
+
+            if cur_count:
+                value_counts[value_table.setdefault(value, value)] = cur_count
+            else:
+                del value_counts[value]
+                del value_table[value]
+
+    # the shared copy of value, value itself if nothing is set to it
+    def get_shared_value(self, value):
+        return self.value_table.get(value, value)
+
+    # number of distinct values in the shared value table
+    def get_num_shared_values(self):
+        return len(self.value_table)
+
+    # recount name_values and point every name at the shared copy of its value, used after bulk loading
+    def intern_dict(self, name_values):
+        value_table = {}
+        value_counts = {}
+
+        for name, value in name_values.iteritems():
+            shared_value = value_table.setdefault(value, value)
+            value_counts[shared_value] = value_counts.get(shared_value, 0) + 1
+
+            # only the value changes, so it's safe to update while we iterate
+            name_values[name] = shared_value
+
+        self.value_table = value_table
+        self.value_counts = value_counts
+
+    # throw away the counts and recount every value, used after bulk loading
+    def rebuild(self, values):
+        self.value_table = {}
+        self.value_counts = {}
+
+        for value in values:
+            self.add_value(value)
+
+    # take over an already counted dict of value -> count, used when loading a snapshot
+    def load_counts(self, value_counts):
+        self.value_table = dict((value, value) for value in value_counts)
+        self.value_counts = value_counts
+
+# Class that implements the reverse value index behind KEYS_WITH_VALUE
+
+class ValueKeysIndex:
+    '''
+        ValueKeysIndex ~ secondary index of value -> set of names currently set to that value
+            - maintained alongside the ValueCountIndex, each add/remove is O(1)
+            - names are handed back as a cursor so huge sets never get copied into a list
+    '''
+
+    # value -> set of names currently set to it
+    value_names = {}
+
+    def __init__(self):
+        self.value_names = {}
+
+    # name is now set to value
+    def add_name(self, value, name):
+        value_names = self.value_names.get(value)
+
+        if value_names is None:
+            self.value_names[value] = set([name])
+        else:
+            value_names.add(name)
+
+    # name is no longer set to value
+    def remove_name(self, value, name):
+        value_names = self.value_names[value]
+        value_names.discard(name)
+
+        # drop the empty set so unused values don't pile up
+        if not value_names:
+            del self.value_names[value]
+
+    # cursor over the names set to value
+    def iter_names(self, value):
+        return iter(self.value_names.get(value, ()))
+
+    # throw away the index and rebuild it from (name, value) pairs, used after bulk loading
+    def rebuild(self, name_values):
+        self.value_names = {}
+
+        for name, value in name_values:
+            self.add_name(value, name)
+
+# Class that implements the ordered name index behind RANGE and PREFIX
+
+class OrderedKeyIndex:
+    '''
+        OrderedKeyIndex ~ every name in sorted order, for range and prefix scans
+            - a B-tree-like two level structure, a list of sorted buckets of at most 2 * bucket_size names each
+              plus a list of the last name in each bucket
+            - finding a name is a bisect over the bucket maxes and then one over the bucket, O(log n)
+            - adding or removing a name only shifts the names in its own bucket, a full bucket is split in two
+            - a scan finds where it starts in O(log n) and then walks the buckets in order, O(log n + k)
+    '''
+
+    # names per bucket after a rebuild, buckets are split once they get to twice this
+    bucket_size = 1000
+
+    # sorted buckets of names and the last name in each one
+    buckets = []
+    bucket_maxes = []
+
+    def __init__(self, bucket_size=1000):
+        self.bucket_size = bucket_size
+        self.buckets = []
+        self.bucket_maxes = []
+
+    # name was just added to the database, returns the number of the bucket it went into
+    def add_name(self, name):
+        bucket_maxes = self.bucket_maxes
+
+        if not bucket_maxes:
+            self.buckets.append([name])
+            bucket_maxes.append(name)
+            return 0
+
+        bucket_num = bisect_left(bucket_maxes, name)
+
+        # past the end of the last bucket, it's the new max
+        if bucket_num == len(bucket_maxes):
+            bucket_num -= 1
+            self.buckets[bucket_num].append(name)
+            bucket_maxes[bucket_num] = name
+        else:
+            insort(self.buckets[bucket_num], name)
+
+        bucket = self.buckets[bucket_num]
+
+        if len(bucket) > 2 * self.bucket_size:
+            self.buckets.insert(bucket_num + 1, bucket[self.bucket_size:])
+            del bucket[self.bucket_size:]
+
+            bucket_maxes.insert(bucket_num, bucket[-1])
+
+        return bucket_num
+
+    # name was just removed from the database, returns the number of the bucket it came out of
+    def remove_name(self, name):
+        bucket_num = bisect_left(self.bucket_maxes, name)
+        bucket = self.buckets[bucket_num]
+
+        del bucket[bisect_left(bucket, name)]
+
+        # drop an empty bucket, otherwise its max may have changed
+        if not bucket:
+            del self.buckets[bucket_num]
+            del self.bucket_maxes[bucket_num]
+        else:
+            self.bucket_maxes[bucket_num] = bucket[-1]
+
+        return bucket_num
+
+    # (bucket number, position in the bucket) of the first name >= name, (number of buckets, 0) if there isn't one
+    def locate(self, name):
+        bucket_num = bisect_left(self.bucket_maxes, name)
+
+        if bucket_num == len(self.buckets):
+            return bucket_num, 0
+
+        return bucket_num, bisect_left(self.buckets[bucket_num], name)
+
+    # number of names with start <= name < end, end None means no upper bound
+    # only the bucket lengths in between are added up, O(log n + k / bucket_size)
+    def count_range(self, start, end):
+        start_bucket_num, start_pos = self.locate(start)
+
+        if end is None:
+            end_bucket_num, end_pos = len(self.buckets), 0
+        else:
+            end_bucket_num, end_pos = self.locate(end)
+
+        if end_bucket_num < start_bucket_num:
+            return 0
+
+        if end_bucket_num == start_bucket_num:
+            return max(end_pos - start_pos, 0)
+
+        return (len(self.buckets[start_bucket_num]) - start_pos + end_pos +
+                sum(len(bucket) for bucket in islice(self.buckets, start_bucket_num + 1, end_bucket_num)))
+
+    # cursor over the names with start <= name < end in order, end None means no upper bound
+    def iter_range(self, start, end):
+        buckets = self.buckets
+        bucket_num, pos = self.locate(start)
+
+        while bucket_num < len(buckets):
+            bucket = buckets[bucket_num]
+
+            # the range ends in this bucket
+            if end is not None and bucket[-1] >= end:
+                for name in islice(bucket, pos, bisect_left(bucket, end)):
+                    yield name
+
+                return
+
+            for name in islice(bucket, pos, None):
+                yield name
+
+            bucket_num += 1
+            pos = 0
+
+    # throw away the index and rebuild it from every name, used after bulk loading
+    def rebuild(self, names):
+        sorted_names = sorted(names)
+        bucket_size = self.bucket_size
+
+        self.buckets = [sorted_names[i:i + bucket_size] for i in xrange(0, len(sorted_names), bucket_size)]
+        self.bucket_maxes = [bucket[-1] for bucket in self.buckets]
+
+# Class that implements the numeric value index behind COUNT_VALUE_RANGE
+
+class NumericValueIndex(OrderedKeyIndex):
     '''
-        TransactionBlock ~ a simple class that stores a list of commands and a reference to a parent transaction block
+        NumericValueIndex ~ the numeric value of every name that has one, sorted, for counting names in a value range
+            - the same sorted buckets as OrderedKeyIndex, holding numbers instead of names, one per name so repeats are fine
+            - plus a Fenwick tree over the bucket lengths, so the number of values before any position is O(log n)
+              and counting a range never walks the buckets in between
+            - adding or removing a value is one Fenwick update, the tree is only rebuilt when a bucket is split or dropped
     '''
 
-    # need this for recursive commits
-    parent_tb = None
+    # Fenwick tree over the bucket lengths, 1-based
+    bucket_tree = []
+
+    def __init__(self, bucket_size=1000):
+        OrderedKeyIndex.__init__(self, bucket_size)
+        self.bucket_tree = [0]
+
+    # add delta to the length of bucket_num in the tree
+    def update_tree(self, bucket_num, delta):
+        bucket_tree = self.bucket_tree
+        tree_pos = bucket_num + 1
+
+        while tree_pos < len(bucket_tree):
+            bucket_tree[tree_pos] += delta
+            tree_pos += tree_pos & -tree_pos
+
+    # the total length of the buckets before bucket_num
+    def count_before_bucket(self, bucket_num):
+        bucket_tree = self.bucket_tree
+        count = 0
+
+        while bucket_num > 0:
+            count += bucket_tree[bucket_num]
+            bucket_num -= bucket_num & -bucket_num
+
+        return count
+
+    # build the tree from scratch in O(number of buckets)
+    def rebuild_tree(self):
+        bucket_tree = [0] + [len(bucket) for bucket in self.buckets]
+
+        for tree_pos in xrange(1, len(bucket_tree)):
+            parent_pos = tree_pos + (tree_pos & -tree_pos)
+
+            if parent_pos < len(bucket_tree):
+                bucket_tree[parent_pos] += bucket_tree[tree_pos]
+
+        self.bucket_tree = bucket_tree
+
+    # a name now has the value number
+    def add_number(self, number):
+        num_buckets = len(self.buckets)
+        bucket_num = self.add_name(number)
+
+        if len(self.buckets) != num_buckets:
+            self.rebuild_tree()
+        else:
+            self.update_tree(bucket_num, 1)
+
+    # a name no longer has the value number
+    def remove_number(self, number):
+        num_buckets = len(self.buckets)
+        bucket_num = self.remove_name(number)
+
+        if len(self.buckets) != num_buckets:
+            self.rebuild_tree()
+        else:
+            self.update_tree(bucket_num, -1)
+
+    # how many values are < number, or <= number with or_equal
+    def count_below(self, number, or_equal=False):
+        bisect_func = bisect_right if or_equal else bisect_left
+        bucket_num = bisect_func(self.bucket_maxes, number)
+
+        if bucket_num == len(self.buckets):
+            return self.count_before_bucket(bucket_num)
+
+        return self.count_before_bucket(bucket_num) + bisect_func(self.buckets[bucket_num], number)
+
+    # how many values are >= low and <= high, O(log n)
+    def count_between(self, low, high):
+        return max(self.count_below(high, True) - self.count_below(low), 0)
+
+    def rebuild(self, numbers):
+        OrderedKeyIndex.rebuild(self, numbers)
+        self.rebuild_tree()
+
+# the number a value holds, None if it isn't one
+# integers stay exact, anything else float() takes (but not nan, which has no order) is a float
+def parse_number(value):
+    if not value or value[0] not in "+-.0123456789":
+        return None
+
+    try:
+        return int(value)
+    except ValueError:
+        pass
+
+    try:
+        number = float(value)
+    except ValueError:
+        return None
+
+    if number != number:
+        return None
+
+    return number
+
+# the first name after every name starting with prefix, None if there isn't one (prefix is all "\xff")
+def get_prefix_end(prefix):
+    prefix = prefix.rstrip("\xff")
+
+    if not prefix:
+        return None
+
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+# read commands from in_stream in large chunks, process_batch(cmd_lines, out_list) gets every chunk's complete lines
+# and the replies for each chunk are written to out_stream in one go, until process_batch returns False or the input ends
+# os.read hands back whatever is available (up to read_size) so this works for piped scripts and interactive use
+def run_command_stream(in_stream, out_stream, process_batch, read_size=1048576):
+    in_fd = in_stream.fileno()
+
+    # a partial command left over from the end of the last chunk
+    left_over = ""
+
+    keep_processing = True
+
+    while keep_processing:
+        data = os.read(in_fd, read_size)
+
+        # end of input, process a last command that had no trailing newline
+        if not data:
+            cmd_lines = [left_over]
+            left_over = ""
+            keep_processing = False
+
+        else:
+            data = left_over + data
+
+            last_newline = data.rfind("\n")
+
+            # no complete command yet, keep reading
+            if last_newline < 0:
+                left_over = data
+                continue
+
+            cmd_lines = data[:last_newline].split("\n")
+            left_over = data[last_newline + 1:]
+
+        out_list = []
+
+        if not process_batch(cmd_lines, out_list):
+            keep_processing = False
+
+        if out_list:
+            out_stream.write("\n".join(out_list) + "\n")
+
+        out_stream.flush()
+
+class PyMemDB:
+    '''
+        PyMemDB ~ a simple name/value in-memory data store that supports nested t-log capabilities
+    '''
+
+    # lets you turn on debugging so you can trace commands
+    enable_debugging = False
+
+    # we can implement the in-memory database using a python dictionary as it satisfies the O(log n) requirement
+    mem_db_dict = {}
+
+    # implement separate value count index to satisfy O(log n) requirement on count lookup
+    mem_db_value_count_index = None
+
+    # optional value -> names index for KEYS_WITH_VALUE, None means KEYS_WITH_VALUE scans instead
+    mem_db_value_keys_index = None
+
+    # optional sorted index of every name for RANGE and PREFIX, None means they scan and sort instead
+    mem_db_ordered_index = None
+
+    # optional sorted index of every numeric value for COUNT_VALUE_RANGE, None means it scans instead
+    mem_db_numeric_index = None
+
+    # name -> absolute time (from clock) the name expires at, only names with a TTL are in here
+    mem_db_expires = {}
+
+    # min-heap of (check_at, expire_at, name) for active expiry
+    # entries whose expire_at no longer matches mem_db_expires are stale and just skipped
+    mem_db_expiry_heap = []
+
+    # where expiry gets the time from, swap in a fake clock for testing
+    clock = None
+
+    # each active expiry cycle checks at most this many names and spends at most this many seconds
+    expire_cycle_max_names = 1000
+    expire_cycle_time_budget = 0.001
+
+    # how long an expired name pinned by another client's open block waits before we check it again
+    expire_retry_secs = 0.1
+
+    # the expired names that were pinned the last time we tried to remove them, scans check these straight away
+    mem_db_expiry_retries = set()
+
+    # bounded-memory mode, see PyMemDBEviction, None means we never evict
+    eviction_policy = None
+
+    # name -> version, only for names some client is WATCHing, every write to one of them moves it to a new version
+    mem_db_versions = {}
+
+    # name -> number of clients WATCHing it, a name's version is dropped once no one is
+    mem_db_watch_counts = {}
+
+    # where new versions come from
+    mem_db_version_clock = 0
+
+    # multi-version mode, open blocks keep their writes private until END_COMMIT and read a snapshot, see MVCC functions
+    mvcc = False
+
+    # id of the latest commit, every committed change (or whole END_COMMIT) gets the next one
+    mem_db_commit_id = 0
+
+    # snapshot id -> number of open transactions reading as of it
+    mem_db_snapshot_counts = {}
+
+    # name -> list of (commit_id, old_value, old_expire_at) oldest first, the value (None if it didn't exist) and TTL
+    # name had before that commit, only kept while some open transaction's snapshot is older than the commit
+    mem_db_old_versions = {}
+
+    # (commit_id, name) for every old version, oldest first, so garbage collection can work from the front
+    mem_db_old_version_queue = None
+
+    # set while END_COMMIT publishes, everything it stores shares one commit id
+    mem_db_publishing = False
+
+    # each garbage collection cycle drops at most this many old versions
+    collect_cycle_max_versions = 1000
+
+    # every name set to the same value shares one copy of it, kept by the value count index
+    # *note* names and values are already plain byte strings (python 2 str), so there's nothing to encode
+    compact_storage = False
+
+    # undo log and savepoints for the open (possibly nested) transaction blocks
+    mem_db_transaction_log = None
+
+    # every transaction log handed out by new_transaction_log, so we can find all of the open blocks
+    mem_db_transaction_logs = None
+
+    # no transaction message
+    no_transaction_msg = "NO TRANSACTION"
+
+    # INCR/INCRBY/DECR on a value that isn't an integer
+    not_integer_msg = "NOT AN INTEGER"
+
+    # replies to a COMMIT after a WATCH
+    committed_msg = "OK"
+    aborted_msg = "ABORTED"
+
+    # cursors are streamed out in blocks of this many replies
+    reply_block_size = 4096
+
+    # when set, called with the pending replies so cursors can flush them out part way through a batch
+    reply_writer = None
+
+    # objects told about every committed change, see add_commit_listener
+    commit_listeners = []
+
+    # per-command counts and latency histograms, see PyMemDBStats, None means nothing is counted
+    command_stats = None
+
+    # command tables kept outside of ours (a replica's table for applying its primary's writes), see add_command_table
+    extra_command_tables = []
+
+    def __init__(self, debugging=False, keys_with_value_index=False, compact_storage=False, ordered_index=False, numeric_index=False,
+                 mvcc=False):
+        self.enable_debugging = debugging
+        self.compact_storage = compact_storage
+        self.mvcc = mvcc
+        self.mem_db_commit_id = 0
+        self.mem_db_snapshot_counts = {}
+        self.mem_db_old_versions = {}
+        self.mem_db_old_version_queue = deque()
+        self.mem_db_publishing = False
+        self.mem_db_dict = {}
+        self.mem_db_transaction_logs = WeakSet()
+        self.mem_db_transaction_log = self.new_transaction_log()
+        self.mem_db_expires = {}
+        self.mem_db_expiry_heap = []
+        self.mem_db_expiry_retries = set()
+        self.clock = time.time
+        self.eviction_policy = None
+        self.mem_db_versions = {}
+        self.mem_db_watch_counts = {}
+        self.mem_db_version_clock = 0
+        self.reply_writer = None
+        self.commit_listeners = []
+        self.command_stats = None
+        self.extra_command_tables = []
+
+        if compact_storage:
+            self.mem_db_value_count_index = InternedValueCountIndex()
+        else:
+            self.mem_db_value_count_index = ValueCountIndex()
+
+        if keys_with_value_index:
+            self.mem_db_value_keys_index = ValueKeysIndex()
+        else:
+            self.mem_db_value_keys_index = None
+
+        if ordered_index:
+            self.mem_db_ordered_index = OrderedKeyIndex()
+        else:
+            self.mem_db_ordered_index = None
+
+        if numeric_index:
+            self.mem_db_numeric_index = NumericValueIndex()
+        else:
+            self.mem_db_numeric_index = None
+
+        self.build_command_tables()
+
+    ''' =============  HELPER functions ==========
+        custom functions needed to fully flush out all the requirements
+    '''
+
+    # get the size of the database, useful for asserts in unit tests
+    def get_mem_db_size(self):
+        return self.mem_db_dict.__len__()
+
+    # see if we have a current commit block
+    def is_in_commit_block(self):
+        return self.mem_db_transaction_log.is_open()
+
+    # get the number of commands in the current transaction block
+    def get_num_cmds_in_current_transaction_block(self):
+        return self.mem_db_transaction_log.get_num_cmds_in_current_block()
+
+    # get how deeply nested the open transaction blocks are
+    def get_transaction_depth(self):
+        return self.mem_db_transaction_log.get_depth()
+
+    # every transaction log (ours and any client's) that has open blocks
+    def get_open_transaction_logs(self):
+        open_transaction_logs = [transaction_log for transaction_log in self.mem_db_transaction_logs if transaction_log.is_open()]
+
+        if self.mem_db_transaction_log.is_open() and self.mem_db_transaction_log not in self.mem_db_transaction_logs:
+            open_transaction_logs.append(self.mem_db_transaction_log)
+
+        return open_transaction_logs
+
+    # the database as it would be if every open block were rolled back, only copies when there are open blocks
+    def get_committed_dict(self):
+
+        # open blocks never touch the shared data in multi-version mode
+        if self.mvcc:
+            return self.mem_db_dict
+
+        open_transaction_logs = self.get_open_transaction_logs()
+
+        if not open_transaction_logs:
+            return self.mem_db_dict
+
+        committed_dict = dict(self.mem_db_dict)
+
+        for transaction_log in open_transaction_logs:
+            for undo_entry in reversed(transaction_log.undo_log):
+                name = undo_entry[0]
+                old_value = undo_entry[1]
+
+                if old_value is None:
+                    committed_dict.pop(name, None)
+                else:
+                    committed_dict[name] = old_value
+
+        return committed_dict
+
+    ''' =============  STORAGE functions ==========
+        every change to mem_db_dict goes through here so the secondary indexes always stay in step
+    '''
+
+    # set name to value, moving it in the value indexes from the old value to the new one
+    # with compact storage the value count index hands back the shared copy of value, that's the one we keep
+    def store_value(self, name, value):
+        old_value = self.mem_db_dict.get(name)
+
+        # a new value starts out without a TTL
+        mem_db_expires = self.mem_db_expires
+
+        if self.mvcc:
+            self.save_old_version(name, old_value, mem_db_expires.get(name))
+
+        if mem_db_expires and name in mem_db_expires:
+            del mem_db_expires[name]
+
+        if old_value is not None:
+            self.mem_db_value_count_index.remove_value(old_value)
+
+            if self.mem_db_value_keys_index is not None:
+                self.mem_db_value_keys_index.remove_name(old_value, name)
+
+        value = self.mem_db_value_count_index.add_value(value)
+
+        if self.mem_db_value_keys_index is not None:
+            self.mem_db_value_keys_index.add_name(value, name)
+
+        if self.eviction_policy is not None:
+            self.eviction_policy.on_store(name, old_value, value)
+
+        if old_value is None and self.mem_db_ordered_index is not None:
+            self.mem_db_ordered_index.add_name(name)
+
+        if self.mem_db_numeric_index is not None:
+            self.update_numeric_index(old_value, value)
+
+        if self.mem_db_versions and name in self.mem_db_versions:
+            self.bump_version(name)
+
+        self.mem_db_dict[name] = value
+
+    # remove name, returning the value it had (None if it didn't exist)
+    def remove_name(self, name):
+        old_value = self.mem_db_dict.pop(name, None)
+
+        mem_db_expires = self.mem_db_expires
+
+        if self.mvcc and old_value is not None:
+            self.save_old_version(name, old_value, mem_db_expires.get(name))
+
+        if mem_db_expires and name in mem_db_expires:
+            del mem_db_expires[name]
+
+        if old_value is not None:
+            self.mem_db_value_count_index.remove_value(old_value)
+
+            if self.mem_db_value_keys_index is not None:
+                self.mem_db_value_keys_index.remove_name(old_value, name)
+
+            if self.eviction_policy is not None:
+                self.eviction_policy.on_remove(name, old_value)
+
+            if self.mem_db_ordered_index is not None:
+                self.mem_db_ordered_index.remove_name(name)
+
+            if self.mem_db_numeric_index is not None:
+                self.update_numeric_index(old_value, None)
+
+            if self.mem_db_versions and name in self.mem_db_versions:
+                self.bump_version(name)
+
+        return old_value
+
+    # a name's value went from old_value to value (either can be None), move its number in the numeric index
+    def update_numeric_index(self, old_value, value):
+        if old_value is not None:
+            old_number = parse_number(old_value)
+
+            if old_number is not None:
+                self.mem_db_numeric_index.remove_number(old_number)
+
+        if value is not None:
+            number = parse_number(value)
+
+            if number is not None:
+                self.mem_db_numeric_index.add_number(number)
+
+    # is anything keeping track of individual names, so bulk changes have to go one name at a time?
+    def needs_every_name(self):
+        return (self.mem_db_value_keys_index is not None or self.mem_db_ordered_index is not None or
+                self.mem_db_numeric_index is not None or self.eviction_policy is not None or len(self.mem_db_versions) > 0 or
+                self.mvcc)
+
+    # set every (name, value) pair in one go, the value counts are updated once per distinct value rather than once per name
+    # the keys, ordered and numeric indexes and eviction need to see every name, so with any of them we just store one name at a time
+    def store_values(self, name_values):
+        if self.needs_every_name():
+            for name, value in name_values:
+                self.store_value(name, value)
+
+            return
+
+        mem_db_dict = self.mem_db_dict
+        mem_db_expires = self.mem_db_expires
+        value_deltas = {}
+
+        for name, value in name_values:
+            old_value = mem_db_dict.get(name)
+
+            if old_value is not None:
+                value_deltas[old_value] = value_deltas.get(old_value, 0) - 1
+
+            value_deltas[value] = value_deltas.get(value, 0) + 1
+
+            mem_db_dict[name] = value
+
+            # a new value starts out without a TTL
+            if mem_db_expires and name in mem_db_expires:
+                del mem_db_expires[name]
+
+        self.mem_db_value_count_index.apply_deltas(value_deltas)
+
+        # point the names at the shared copies now that the value count index has them
+        if self.compact_storage:
+            get_shared_value = self.mem_db_value_count_index.get_shared_value
+
+            for name, value in name_values:
+                mem_db_dict[name] = get_shared_value(value)
+
+    # remove every name in names in one go, same idea as store_values
+    def remove_names(self, names):
+        if self.needs_every_name():
+            for name in names:
+                self.remove_name(name)
+
+            return
+
+        mem_db_dict = self.mem_db_dict
+        mem_db_expires = self.mem_db_expires
+        value_deltas = {}
+
+        for name in names:
+            old_value = mem_db_dict.pop(name, None)
+
+            if old_value is not None:
+                value_deltas[old_value] = value_deltas.get(old_value, 0) - 1
+
+                if mem_db_expires and name in mem_db_expires:
+                    del mem_db_expires[name]
+
+        self.mem_db_value_count_index.apply_deltas(value_deltas)
+
+    # replace everything with a dict of name -> value in one go, rebuilding the indexes once at the end
+    # much faster than PUTting every name, used when loading persisted state at startup
+    # pass in value_counts if they're already counted (a snapshot) to skip recounting
+    def load_dict(self, name_values, value_counts=None):
+        self.mem_db_dict = name_values
+        self.mem_db_expires = {}
+        self.mem_db_expiry_heap = []
+        self.mem_db_expiry_retries = set()
+
+        # loaded values are all separate copies, share them as we count them
+        if self.compact_storage:
+            self.mem_db_value_count_index.intern_dict(name_values)
+
+        elif value_counts is not None:
+            self.mem_db_value_count_index.load_counts(value_counts)
+        else:
+            self.mem_db_value_count_index.rebuild(name_values.itervalues())
+
+        if self.mem_db_value_keys_index is not None:
+            self.mem_db_value_keys_index.rebuild(name_values.iteritems())
+
+        if self.mem_db_ordered_index is not None:
+            self.mem_db_ordered_index.rebuild(name_values.iterkeys())
+
+        if self.mem_db_numeric_index is not None:
+            self.mem_db_numeric_index.rebuild(number for number in imap(parse_number, name_values.itervalues()) if number is not None)
+
+        if self.eviction_policy is not None:
+            self.eviction_policy.rebuild(name_values)
+            self.evict_if_needed()
+
+        # every watched name may have changed
+        for name in self.mem_db_versions.keys():
+            self.bump_version(name, False)
+
+    ''' =============  EXPIRY functions ==========
+        names with a TTL are removed lazily, when they are read after expiring, and actively by expire_cycle
+        which works through a min-heap of expiry times a bounded slice at a time between batches of commands
+
+        an expired name is removed with a plain DELETE, so it shows up as a committed DELETE to commit listeners,
+        or is logged in the current client's open block and put back (TTL and all) if the block is rolled back
+        names pinned by any other client's open block are left alone until that block is closed
+
+        NUM_WITH_VALUE, KEYS_WITH_VALUE, RANGE, PREFIX and COUNT_VALUE_RANGE remove every expired name before they
+        look (expire_due), and skip any that are pinned
+
+        *note* TTLs only live in memory, commit listeners see PUTEX as a PUT and the expiry itself as a DELETE
+    '''
+
+    # absolute time name expires at, None if it has no TTL
+    def get_expire_at(self, name):
+        return self.mem_db_expires.get(name)
+
+    # set the absolute time an existing name expires at, None clears its TTL
+    def set_expire_at(self, name, expire_at):
+        if expire_at is None:
+            self.mem_db_expires.pop(name, None)
+
+            return
+
+        self.mem_db_expires[name] = expire_at
+
+        expiry_heap = self.mem_db_expiry_heap
+        heapq.heappush(expiry_heap, (expire_at, expire_at, name))
+
+        # changing TTLs over and over leaves stale entries behind, start over once they outnumber the live ones
+        if len(expiry_heap) > 2 * len(self.mem_db_expires) + 1024:
+            self.rebuild_expiry_heap()
+
+    # throw away the stale entries, one heap entry per name with a TTL
+    def rebuild_expiry_heap(self):
+        expiry_heap = [(expire_at, expire_at, name) for name, expire_at in self.mem_db_expires.iteritems()]
+        heapq.heapify(expiry_heap)
+
+        self.mem_db_expiry_heap = expiry_heap
+
+    # has name's TTL run out? it may not have been removed yet
+    def is_expired(self, name):
+        expire_at = self.mem_db_expires.get(name)
+
+        return expire_at is not None and expire_at <= self.clock()
+
+    # every other client's open transaction log, the names they've written are pinned
+    def get_other_open_transaction_logs(self):
+        return [transaction_log for transaction_log in self.get_open_transaction_logs() if transaction_log is not self.mem_db_transaction_log]
+
+    # is name pinned by any of the passed in transaction logs?
+    def is_pinned(self, name, transaction_logs):
+        for transaction_log in transaction_logs:
+            if transaction_log.is_pinned(name):
+                return True
+
+        return False
+
+    # lazy expiry, removes name if its TTL has run out
+    # returns True if name is expired, even when another client's open block keeps us from removing it yet
+    def expire_if_due(self, name):
+        if not self.is_expired(name):
+            return False
+
+        if not self.is_pinned(name, self.get_other_open_transaction_logs()):
+            self.remove_expired(name)
+
+            # running out of time is never the client's own change, even when its command is what noticed
+            if name in self.mem_db_versions:
+                self.bump_version(name, False)
+
+        return True
+
+    # remove an expired name, a plain DELETE (logged in the current client's open block)
+    # in multi-version mode it's a committed change of its own, it can't wait for the client's END_COMMIT
+    def remove_expired(self, name):
+        if self.mvcc:
+            self.evict_name(name)
+        else:
+            self.cmd_DELETE(name)
+
+    # remove every name whose TTL has run out, so a scan never lists a name that PULL says is gone
+    # returns the expired names other clients' open blocks keep us from removing yet, scans have to skip those
+    def expire_due(self):
+        expiry_heap = self.mem_db_expiry_heap
+
+        # nothing due, the common case costs one comparison
+        if expiry_heap and expiry_heap[0][0] <= self.clock():
+            self.expire_cycle(len(expiry_heap), float("inf"))
+
+        expiry_retries = self.mem_db_expiry_retries
+
+        if not expiry_retries:
+            return frozenset()
+
+        # the blocks pinning them may have closed since, and their TTLs may have changed
+        for name in list(expiry_retries):
+            if not self.expire_if_due(name) or name not in self.mem_db_expires:
+                expiry_retries.discard(name)
+
+        return frozenset(expiry_retries)
+
+    # active expiry, removes names whose TTL has run out from the front of the expiry heap
+    # stops after max_names heap entries or time_budget seconds so a flood of expiring names never stalls the command loop
+    # returns how many names were removed
+    def expire_cycle(self, max_names=None, time_budget=None):
+        expiry_heap = self.mem_db_expiry_heap
+
+        # nothing due, the common case costs one comparison
+        if not expiry_heap:
+            return 0
+
+        now = self.clock()
+
+        if expiry_heap[0][0] > now:
+            return 0
+
+        if max_names is None:
+            max_names = self.expire_cycle_max_names
+
+        if time_budget is None:
+            time_budget = self.expire_cycle_time_budget
+
+        deadline = time.time() + time_budget
+
+        mem_db_expires = self.mem_db_expires
+        other_transaction_logs = self.get_other_open_transaction_logs()
+
+        num_checked = 0
+        num_expired = 0
+        retry_entries = []
+
+        while expiry_heap and expiry_heap[0][0] <= now and num_checked < max_names:
+            check_at, expire_at, name = heapq.heappop(expiry_heap)
+            num_checked += 1
+
+            # the TTL was changed or cleared since this entry went in
+            if mem_db_expires.get(name) != expire_at:
+                continue
+
+            if self.is_pinned(name, other_transaction_logs):
+                retry_entries.append((now + self.expire_retry_secs, expire_at, name))
+                self.mem_db_expiry_retries.add(name)
+            else:
+                self.remove_expired(name)
+                self.mem_db_expiry_retries.discard(name)
+                num_expired += 1
+
+                if name in self.mem_db_versions:
+                    self.bump_version(name, False)
+
+            # checking the time isn't free, only do it every so often
+            if num_checked % 32 == 0 and time.time() > deadline:
+                break
+
+        for retry_entry in retry_entries:
+            heapq.heappush(expiry_heap, retry_entry)
+
+        return num_expired
+
+    ''' =============  WATCH functions ==========
+        every name some client is WATCHing has a version, any write to it (PUT, DELETE, expiry, eviction, roll-back)
+        moves it to a new one, a COMMIT after a WATCH only goes through if every watched name is still at the version
+        the client saw when it WATCHed it
+        the client's own writes keep its view of the name up to date, so only other clients' changes abort it
+        names no one is watching have no version and cost store_value/remove_name one empty dict check
+    '''
+
+    # move a watched name on to a new version
+    # own_change keeps the current client's view up to date, as long as no one else changed the name in between
+    def bump_version(self, name, own_change=True):
+        old_version = self.mem_db_versions[name]
+
+        self.mem_db_version_clock += 1
+        self.mem_db_versions[name] = self.mem_db_version_clock
+
+        transaction_log = self.mem_db_transaction_log
+        watched_versions = transaction_log.watched_versions
+
+        if own_change and watched_versions:
+            if watched_versions.get(name) == old_version:
+                watched_versions[name] = self.mem_db_version_clock
+
+            # remember where the name was before the blocks wrote to it, see roll_back_watched
+            if transaction_log.is_open():
+                written_version = transaction_log.written_versions.get(name)
+
+                if written_version is None:
+                    transaction_log.written_versions[name] = [old_version, self.mem_db_version_clock]
+                else:
+                    written_version[1] = self.mem_db_version_clock
+
+    # roll back every open block of a COMMIT that lost, putting names back at the version they had before the blocks
+    # as long as no one else wrote them since, otherwise every abort would abort every other client watching them too
+    def roll_back_watched(self):
+        transaction_log = self.mem_db_transaction_log
+        mem_db_versions = self.mem_db_versions
+
+        restore_versions = [(name, written_version[0]) for name, written_version in transaction_log.written_versions.iteritems()
+                            if mem_db_versions.get(name) == written_version[1]]
+
+        while transaction_log.is_open():
+            self.roll_back_block()
+
+        for name, version in restore_versions:
+            if name in mem_db_versions:
+                mem_db_versions[name] = version
+
+    # has any name the current client is WATCHing been changed by someone else?
+    def is_watch_broken(self):
+        mem_db_versions = self.mem_db_versions
+
+        for name, version in self.mem_db_transaction_log.watched_versions.iteritems():
+            if mem_db_versions.get(name) != version:
+                return True
+
+        return False
+
+    ''' =============  MVCC functions ==========
+        with PyMemDB(mvcc=True) the shared data only ever holds committed values
+            - writes in an open block go into the client's private writes, END_COMMIT of the outermost block publishes
+              them all under one commit id, UN_COMMIT just drops the innermost block's writes, nothing to put back
+            - the outermost START_COMMIT takes a snapshot (the latest commit id), PULL/MPULL/TTL/INCR/CAS... in the block
+              see the client's own writes on top of the data as of the snapshot, no matter what commits after it
+            - while a snapshot is open every committed change keeps the value (and TTL) it replaced, a short chain of
+              (commit_id, old_value, old_expire_at) per name, a reader walks it for the first commit after its snapshot
+            - old versions no open snapshot can reach are garbage collected a bounded slice at a time, oldest first,
+              and all in one go once the last snapshot closes
+            - counts, scans and the indexes (NUM_WITH_VALUE, KEYS_WITH_VALUE, RANGE, COUNT_VALUE_RANGE...) always see
+              the latest committed data, never anyone's uncommitted writes
+            - outside of a block every command reads and writes the latest committed data, just like without mvcc
+    '''
+
+    # are the current client's writes private? only in multi-version mode with a block open
+    def is_private(self):
+        return self.mvcc and self.mem_db_transaction_log.is_open()
+
+    # name was committed to a new value, keep the one it replaced for any snapshot older than this commit
+    def save_old_version(self, name, old_value, old_expire_at):
+
+        # everything published by one END_COMMIT shares the commit id publish_private_writes took
+        if not self.mem_db_publishing:
+            self.mem_db_commit_id += 1
+
+        # no open snapshot, nobody can read it
+        if not self.mem_db_snapshot_counts:
+            return
+
+        old_versions = self.mem_db_old_versions.get(name)
+
+        if old_versions is None:
+            self.mem_db_old_versions[name] = [(self.mem_db_commit_id, old_value, old_expire_at)]
+        else:
+            old_versions.append((self.mem_db_commit_id, old_value, old_expire_at))
+
+        self.mem_db_old_version_queue.append((self.mem_db_commit_id, name))
+
+    # the current client's outermost block starts reading as of the latest commit
+    def begin_snapshot(self):
+        transaction_log = self.mem_db_transaction_log
+        snapshot_counts = self.mem_db_snapshot_counts
+
+        transaction_log.snapshot_id = self.mem_db_commit_id
+        snapshot_counts[transaction_log.snapshot_id] = snapshot_counts.get(transaction_log.snapshot_id, 0) + 1
+
+    # the current client's last block closed, its snapshot may have been holding on to old versions
+    def end_snapshot(self):
+        transaction_log = self.mem_db_transaction_log
+        snapshot_counts = self.mem_db_snapshot_counts
+        snapshot_id = transaction_log.snapshot_id
+
+        if snapshot_id is None:
+            return
+
+        transaction_log.snapshot_id = None
+
+        if snapshot_counts[snapshot_id] > 1:
+            snapshot_counts[snapshot_id] -= 1
+        else:
+            del snapshot_counts[snapshot_id]
+
+        # no one is left to read an old version, drop them all at once
+        if not snapshot_counts:
+            self.mem_db_old_versions = {}
+            self.mem_db_old_version_queue = deque()
+        else:
+            self.collect_old_versions()
+
+    # garbage collect old versions no open snapshot can reach, oldest first, at most max_versions of them
+    # cheap when there's nothing to collect, called between batches like expire_cycle, returns how many were dropped
+    def collect_old_versions(self, max_versions=None):
+        old_version_queue = self.mem_db_old_version_queue
+
+        if not old_version_queue:
+            return 0
+
+        if max_versions is None:
+            max_versions = self.collect_cycle_max_versions
+
+        # an old version is only needed by snapshots from before its commit
+        if self.mem_db_snapshot_counts:
+            oldest_snapshot_id = min(self.mem_db_snapshot_counts)
+        else:
+            oldest_snapshot_id = self.mem_db_commit_id
+
+        old_versions = self.mem_db_old_versions
+        num_collected = 0
+
+        while old_version_queue and old_version_queue[0][0] <= oldest_snapshot_id and num_collected < max_versions:
+            commit_id, name = old_version_queue.popleft()
+
+            # the queue and every chain are both oldest first, so this is always the front of the chain
+            name_versions = old_versions[name]
+            del name_versions[0]
+
+            if not name_versions:
+                del old_versions[name]
+
+            num_collected += 1
+
+        return num_collected
+
+    # the committed (value, expire_at) of name as of snapshot_id, value is None if it didn't exist
+    def get_snapshot_value(self, name, snapshot_id):
+        old_versions = self.mem_db_old_versions.get(name)
+
+        if old_versions is not None:
+            for old_version in old_versions:
+                if old_version[0] > snapshot_id:
+                    return old_version[1], old_version[2]
+
+        return self.mem_db_dict.get(name), self.mem_db_expires.get(name)
+
+    # (value, expire_at) of name as the current client's open blocks see it, (None, None) if it doesn't exist or has expired
+    def get_private_value(self, name):
+        transaction_log = self.mem_db_transaction_log
+        private_write = transaction_log.get_private(name)
+
+        if private_write is None:
+            private_write = self.get_snapshot_value(name, transaction_log.snapshot_id)
+
+        # the block can't remove a committed name that ran out of time, but it can't see it either
+        if private_write[1] is not None and private_write[1] <= self.clock():
+            return None, None
+
+        return private_write
+
+    # publish everything the current client's blocks wrote as one commit, applied to the shared data in one go
+    def publish_private_writes(self):
+        private_writes = self.mem_db_transaction_log.get_private_writes()
+
+        if not private_writes:
+            return
+
+        self.mem_db_commit_id += 1
+        self.mem_db_publishing = True
+
+        try:
+            for name, (value, expire_at) in private_writes.iteritems():
+                if value is None:
+                    self.remove_name(name)
+                else:
+                    self.store_value(name, value)
+
+                    if expire_at is not None:
+                        self.set_expire_at(name, expire_at)
+        finally:
+            self.mem_db_publishing = False
+
+        if self.commit_listeners:
+            self.publish_commit([(name, private_write[0]) for name, private_write in private_writes.iteritems()], True)
+
+        if self.eviction_policy is not None:
+            self.evict_if_needed()
+
+    # roll back and close the current client's innermost block
+    def roll_back_block(self):
+        self.mem_db_transaction_log.roll_back_current(self)
+
+        if self.mvcc and not self.mem_db_transaction_log.is_open():
+            self.end_snapshot()
+
+    # close the current client's innermost (but not outermost) block, its changes now belong to the block around it
+    def merge_block(self):
+        self.mem_db_transaction_log.merge_current()
+
+    ''' =============  EVICTION functions ==========
+        with an eviction policy set, every PUT that takes us over its key or byte limit evicts names until we're back under
+        an evicted name is removed outside of any transaction block and shows up as a committed DELETE to commit listeners
+        names pinned by any open transaction block are never evicted, if that's all there is we stay over the limit
+    '''
+
+    # start evicting with eviction_policy (None turns eviction off), it picks up every name we already have
+    def set_eviction_policy(self, eviction_policy):
+        self.eviction_policy = eviction_policy
+
+        if eviction_policy is not None:
+            eviction_policy.rebuild(self.mem_db_dict)
+            self.evict_if_needed()
+
+    # evict names until we're back under the eviction policy's limits, returns how many were evicted
+    def evict_if_needed(self):
+        eviction_policy = self.eviction_policy
+
+        if not eviction_policy.is_over_limit():
+            return 0
+
+        open_transaction_logs = self.get_open_transaction_logs()
+
+        def is_pinned(name):
+            return self.is_pinned(name, open_transaction_logs)
+
+        # skip the pinned checks altogether when no blocks are open
+        if not open_transaction_logs:
+            is_pinned = None
+
+        num_evicted = 0
+
+        while eviction_policy.is_over_limit():
+            name = eviction_policy.choose_victim(is_pinned)
+
+            # everything we sampled is pinned, try again at the next PUT
+            if name is None:
+                break
+
+            self.evict_name(name)
+            num_evicted += 1
+
+        eviction_policy.num_evicted += num_evicted
+
+        return num_evicted
+
+    # remove name behind the transaction log's back, it isn't pinned so its value is already committed
+    def evict_name(self, name):
+        self.remove_name(name)
+
+        if self.commit_listeners:
+            self.publish_commit([(name, None)])
+
+    ''' =============  COMMIT LISTENER functions ==========
+        listeners are told about committed changes only, PUT/DELETE outside of a transaction block
+        or everything written in the blocks closed by END_COMMIT, anything rolled back by UN_COMMIT never shows up
+
+        a listener needs three functions:
+            on_commit(mutations, transaction) - list of (name, value) pairs, value is None for a DELETE
+                                                transaction is True when they came from END_COMMIT and should be applied together
+            sync()                            - called at the end of every batch of commands, a good time to flush
+            close()                           - called when we are shutting down
+    '''
+
+    def add_commit_listener(self, listener):
+        self.commit_listeners.append(listener)
+
+    def remove_commit_listener(self, listener):
+        self.commit_listeners.remove(listener)
+
+    # tell every listener about committed changes
+    def publish_commit(self, mutations, transaction=False):
+        for listener in self.commit_listeners:
+            listener.on_commit(mutations, transaction)
+
+    # let every listener flush whatever it has buffered up
+    def sync_commit_listeners(self):
+        for listener in self.commit_listeners:
+            listener.sync()
+
+    def close_commit_listeners(self):
+        for listener in self.commit_listeners:
+            listener.close()
+
+    ''' =============  PROCESS command functions ==========
+        contains actual processing of the SIMPLE and TRANSACTION commands
+    '''
+
+    # precompute the command tables, command name -> (number of split tokens, process function)
+    # commands that take any number of tokens have None and check the tokens themselves
+    # one dict lookup per command replaces searching the allowed command lists and walking the if/elif chains
+    def build_command_tables(self):
+        self.simple_command_table = {
+            "PUT": (3, self.process_PUT),
+            "PULL": (2, self.process_PULL),
+            "DELETE": (2, self.process_DELETE),
+            "NUM_WITH_VALUE": (2, self.process_NUM_WITH_VALUE),
+            "KEYS_WITH_VALUE": (2, self.process_KEYS_WITH_VALUE),
+            "EXPIRE": (3, self.process_EXPIRE),
+            "TTL": (2, self.process_TTL),
+            "PERSIST": (2, self.process_PERSIST),
+            "PUTEX": (4, self.process_PUTEX),
+            "MPUT": (None, self.process_MPUT),
+            "MPULL": (None, self.process_MPULL),
+            "MDELETE": (None, self.process_MDELETE),
+            "RANGE": (None, self.process_RANGE),
+            "PREFIX": (None, self.process_PREFIX),
+            "INCR": (2, self.process_INCR),
+            "INCRBY": (3, self.process_INCRBY),
+            "DECR": (2, self.process_DECR),
+            "COUNT_VALUE_RANGE": (3, self.process_COUNT_VALUE_RANGE),
+            "CAS": (4, self.process_CAS),
+            "QUIT": (1, self.process_QUIT),
+        }
+
+        self.transaction_command_table = {
+            "START_COMMIT": (1, self.process_START_COMMIT),
+            "COMMIT": (1, self.process_COMMIT),
+            "UN_COMMIT": (1, self.process_UN_COMMIT),
+            "WATCH": (None, self.process_WATCH),
+            "UNWATCH": (1, self.process_UNWATCH),
+        }
+
+        # everything we will accept, all other commands will be ignored
+        self.command_table = {}
+        self.command_table.update(self.simple_command_table)
+        self.command_table.update(self.transaction_command_table)
+
+    # add an extra command, process_func(split_cmd, out_list) works just like the process_* functions below
+    def add_command(self, cmd_name, num_tokens, process_func):
+
+        # counted and timed like every other command
+        if self.command_stats is not None:
+            process_func = self.command_stats.wrap(cmd_name, process_func)
+
+        self.simple_command_table[cmd_name] = (num_tokens, process_func)
+        self.command_table[cmd_name] = (num_tokens, process_func)
+
+    # a command table of someone else's that dispatches our process functions, it's counted and timed just like ours
+    def add_command_table(self, command_table):
+        self.extra_command_tables.append(command_table)
+
+    # send a reply either to stdout or, when an output list is passed in, to the caller's buffer
+    def output_reply(self, reply, out_list=None):
+        if out_list is None:
+            print reply
+        else:
+            out_list.append(reply)
+
+    # stream out a cursor of replies in blocks, flushing through reply_writer (if set) rather than building one giant list
+    def output_cursor(self, cursor, out_list=None):
+        if out_list is None:
+            for reply in cursor:
+                print reply
+
+            return
+
+        while True:
+            reply_block = list(islice(cursor, self.reply_block_size))
+
+            if not reply_block:
+                break
+
+            out_list.extend(reply_block)
+
+            if self.reply_writer is not None and len(out_list) >= self.reply_block_size:
+                self.reply_writer(out_list)
+                del out_list[:]
+
+    # swap in a different transaction log, returning the one we replaced
+    # lets a front-end with many clients give each client its own nested transaction blocks
+    def swap_transaction_log(self, transaction_log):
+        cur_transaction_log = self.mem_db_transaction_log
+
+        self.mem_db_transaction_log = transaction_log
+
+        return cur_transaction_log
+
+    # empty transaction log for a new client, see swap_transaction_log
+    def new_transaction_log(self, compact=True):
+        transaction_log = TransactionLog(compact, self.mvcc)
 
-    # list of commands in this transaction block
-    cmd_list = []
+        self.mem_db_transaction_logs.add(transaction_log)
 
-    def __init__(self, parent=None):
-        self.cmd_list = []
-        self.parent_tb = parent
+        return transaction_log
 
-    def add_cmd(self, command_str):
-        self.cmd_list.append(command_str)
+    # look up and run an already split command in the passed in command table
+    # badly formed and unknown commands are ignored, returns False once we receive a QUIT
+    def dispatch_command(self, command_table, split_cmd, out_list=None):
+        if not split_cmd:
+            return True
 
-    def set_parent(self, tb):
-        self.parent_tb = tb
+        command_entry = command_table.get(split_cmd[0])
 
-    def get_parent(self):
-        return self.parent_tb
+        # each command expects a fixed number of parameters, simple length check here
+        if command_entry is None or (command_entry[0] != len(split_cmd) and command_entry[0] is not None):
+            return True
 
-    def get_cmd_list(self):
-        return self.cmd_list
+        return command_entry[1](split_cmd, out_list)
 
-    # recursively commit blocks until all commands have been committed
-    # don't define this as an instance function and rely on self or we get a max rec depth exceeded
-    @staticmethod
-    def recursive_commit_blocks(smdb, tb):
-        for cur_cmd in tb.get_cmd_list():
-            # if it's a TransactionBlock, commit it!
-            if cur_cmd.__class__.__name__ == "TransactionBlock":
-                cur_cmd.recursive_commit_blocks(smdb, cur_cmd)
+    # process a single raw command line, replies go to stdout or the passed in out_list
+    # returns False once we receive a QUIT
+    def process_command_line(self, mem_db_cmd, out_list=None):
+        split_cmd = mem_db_cmd.split()
 
-                # remove this commit block
-                tb.get_cmd_list().remove(cur_cmd)
+        if self.enable_debugging and split_cmd:
+            if split_cmd[0] in self.simple_command_table:
+                print "SIMPLE: " + mem_db_cmd
+            elif split_cmd[0] in self.transaction_command_table:
+                print "TRANSACTION" + mem_db_cmd
 
-    # roll-back the current commit block
-    def roll_back_current(self, smdb):
+        return self.dispatch_command(self.command_table, split_cmd, out_list)
 
-        # since we are rolling back, reverse the list
-        self.cmd_list.reverse()
+    # process a batch of raw command lines, all replies are appended to out_list
+    # returns False once we receive a QUIT, any commands after it are not processed
+    def process_command_batch(self, cmd_lines, out_list):
 
-        # now run each command in reverse order to preserve integrity
-        for cmd_to_reverse in self.cmd_list:
+        # tracing needs the raw lines, so take the slower path
+        if self.enable_debugging:
+            for mem_db_cmd in cmd_lines:
+                if not self.process_command_line(mem_db_cmd, out_list):
+                    return False
 
-            # each t-log entry has the name and value of the old
-            # need to handle non-existent or removed values
-            for cmd_name in cmd_to_reverse:
+            return True
 
-                # get the old value so we can re-set it
-                old_value = cmd_to_reverse[cmd_name]
+        # keep the table in a local for the tight loop below
+        command_table = self.command_table
 
-                # if the previous value was "NULL" (assuming they didn't PUT it to null, explicitly =P)
-                # then we can "DELETE" it, effectively removing it from the data store
-                if old_value == "NULL":
+        # tokenize the whole batch in one go, then dispatch straight out of the command table
+        for split_cmd in map(str.split, cmd_lines):
+            if not split_cmd:
+                continue
 
-                    # clear it out as it didn't previously exist
-                    # set rollback-mode to True, needed after we add to log in the cmd_DELETE function
-                    smdb.cmd_DELETE(cmd_name, True)
+            command_entry = command_table.get(split_cmd[0])
 
-                # other wise, let's update it using whatever original value was there
-                else:
+            if command_entry is None or (command_entry[0] != len(split_cmd) and command_entry[0] is not None):
+                continue
 
-                    # set the value using the previous value
-                    # should handle multiple sets in the same transaction block of the same value
-                    # set rollback-mode to True, needed after we add to log in the cmd_DELETE function
-                    smdb.cmd_PUT(cmd_name, old_value, True)
+            if not command_entry[1](split_cmd, out_list):
+                return False
 
-class PyMemDB:
-    '''
-        PyMemDB ~ a simple name/value in-memory data store that supports nested t-log capabilities
-    '''
+        return True
 
-    # lets you turn on debugging so you can trace commands
-    enable_debugging = False
+    # process commands from in_stream in large chunks, writing the replies for each chunk to out_stream in one go
+    def process_command_stream(self, in_stream, out_stream, read_size=1048576):
 
-    # we can implement the in-memory database using a python dictionary as it satisfies the O(log n) requirement
-    mem_db_dict = {}
+        # write a block of replies straight out, lets cursors stream part way through a batch
+        # whatever the batch has committed so far is flushed first, a reply never goes out ahead of its write
+        def write_replies(out_list):
+            self.sync_commit_listeners()
+            out_stream.write("\n".join(out_list) + "\n")
 
-    # implement separate value count cache to satisfy O(log n) requirement on count lookup
-    mem_db_value_count_dict = {}
+        self.reply_writer = write_replies
 
-    # python's list data structure can pop() so we will use that for our queue data structure
-    mem_db_transaction_blocks = None
+        try:
+            run_command_stream(in_stream, out_stream, self.process_stream_batch, read_size)
+        finally:
+            self.reply_writer = None
 
-    # reference to the current transaction block we are adding commands to
-    mem_db_current_transaction_block = None
+    # process one chunk of process_command_stream, and do our upkeep before its replies go out
+    def process_stream_batch(self, cmd_lines, out_list):
+        keep_processing = self.process_command_batch(cmd_lines, out_list)
 
-    # no transaction message
-    no_transaction_msg = "NO TRANSACTION"
+        # a slice of active expiry between batches, anything it removes goes out with the batch's changes
+        self.expire_cycle()
 
-    def __init__(self, debugging=False):
-        self.enable_debugging = debugging
-        self.mem_db_dict = {}
-        self.mem_db_transaction_blocks = None
-        self.mem_db_current_transaction_block = None
-        self.mem_db_value_count_dict = {}
+        # and a slice of garbage collection for multi-version mode
+        self.collect_old_versions()
 
-    ''' =============  HELPER functions ==========
-        custom functions needed to fully flush out all the requirements
-    '''
+        # group commit, everything the batch committed is flushed before we reply
+        self.sync_commit_listeners()
 
-    # get the size of the database, useful for asserts in unit tests
-    def get_mem_db_size(self):
-        return self.mem_db_dict.__len__()
+        return keep_processing
 
-    # see if we have a current commit block
-    def is_in_commit_block(self):
-        if self.mem_db_current_transaction_block:
+    # process split simple commands
+    def process_simple_command(self, split_cmd, out_list=None):
+        return self.dispatch_command(self.simple_command_table, split_cmd, out_list)
+
+    # process split transaction commands
+    def process_transaction_command(self, split_cmd, out_list=None):
+        return self.dispatch_command(self.transaction_command_table, split_cmd, out_list)
+
+    # PUT name value, NO output
+    def process_PUT(self, split_cmd, out_list):
+        self.cmd_PUT(split_cmd[1], split_cmd[2])
+
+        return True
+
+    # PULL name
+    def process_PULL(self, split_cmd, out_list):
+        self.output_reply(self.cmd_PULL(split_cmd[1]), out_list)
+
+        return True
+
+    # DELETE name, clear the entry, NO output
+    def process_DELETE(self, split_cmd, out_list):
+        self.cmd_DELETE(split_cmd[1])
+
+        return True
+
+    # NUM_WITH_VALUE value
+    def process_NUM_WITH_VALUE(self, split_cmd, out_list):
+
+        # value is numeric convert to string
+        self.output_reply(str(self.cmd_NUM_WITH_VALUE(split_cmd[1])), out_list)
+
+        return True
+
+    # KEYS_WITH_VALUE value, the number of names followed by one name per line
+    def process_KEYS_WITH_VALUE(self, split_cmd, out_list):
+        num_names, cursor = self.get_keys_with_value(split_cmd[1])
+
+        self.output_reply(str(num_names), out_list)
+        self.output_cursor(cursor, out_list)
+
+        return True
+
+    # EXPIRE name seconds, 1 if the TTL was set, 0 if name doesn't exist
+    def process_EXPIRE(self, split_cmd, out_list):
+        try:
+            seconds = int(split_cmd[2])
+        except ValueError:
             return True
-        else:
-            return False
 
-    # get the number of commands blocks in the current transaction block
-    def get_num_cmds_in_current_transaction_block(self):
-        if self.is_in_commit_block():
-            return self.mem_db_current_transaction_block.get_cmd_list().__len__()
-        else:
-            return 0
+        self.output_reply(str(int(self.cmd_EXPIRE(split_cmd[1], seconds))), out_list)
 
-    ''' =============  PROCESS command functions ==========
-        contains actual processing of the SIMPLE and TRANSACTION commands
-    '''
+        return True
 
-    # process split simple commands
-    def process_simple_command(self, split_cmd):
-        cur_cmd = split_cmd[0].strip()
+    # TTL name, seconds left, -1 if name has no TTL, -2 if name doesn't exist
+    def process_TTL(self, split_cmd, out_list):
+        self.output_reply(str(self.cmd_TTL(split_cmd[1])), out_list)
 
-        # PUT command expects 2 parameters, simple length check here
-        if cur_cmd == "PUT" and split_cmd.__len__() == 3:
+        return True
 
-            name = split_cmd[1].strip()
-            value = split_cmd[2].strip()
+    # PERSIST name, 1 if the TTL was cleared, 0 if name doesn't exist or has no TTL
+    def process_PERSIST(self, split_cmd, out_list):
+        self.output_reply(str(int(self.cmd_PERSIST(split_cmd[1]))), out_list)
 
-            simple_mem_db.cmd_PUT(name, value)
+        return True
 
+    # PUTEX name value seconds, NO output
+    def process_PUTEX(self, split_cmd, out_list):
+        try:
+            seconds = int(split_cmd[3])
+        except ValueError:
             return True
 
-        # PULL command expects 1 parameters, simple length check here
-        elif cur_cmd == "PULL" and split_cmd.__len__() == 2:
+        self.cmd_PUTEX(split_cmd[1], split_cmd[2], seconds)
+
+        return True
+
+    # MPUT name value [name value ...], NO output
+    def process_MPUT(self, split_cmd, out_list):
+        num_tokens = len(split_cmd)
+
+        if num_tokens < 3 or num_tokens % 2 == 0:
+            return True
 
-            name = split_cmd[1].strip()
+        self.cmd_MPUT(zip(split_cmd[1::2], split_cmd[2::2]))
 
-            print simple_mem_db.cmd_PULL(name)
+        return True
 
+    # MPULL name [name ...], one value per name (or NULL) in the same order
+    def process_MPULL(self, split_cmd, out_list):
+        if len(split_cmd) < 2:
             return True
 
-        # DELETE command expects 1 parameters, simple length check here
-        elif cur_cmd == "DELETE" and split_cmd.__len__() == 2:
+        values = self.cmd_MPULL(split_cmd[1:])
 
-            name = split_cmd[1].strip()
+        if out_list is None:
+            for value in values:
+                print value
+        else:
+            out_list.extend(values)
+
+        return True
+
+    # MDELETE name [name ...], NO output
+    def process_MDELETE(self, split_cmd, out_list):
+        if len(split_cmd) < 2:
+            return True
 
-            # clear the entry, NO output
-            simple_mem_db.cmd_DELETE(name)
+        self.cmd_MDELETE(split_cmd[1:])
 
+        return True
+
+    # RANGE start end [limit], the number of names with start <= name < end (at most limit) followed by those names in order
+    def process_RANGE(self, split_cmd, out_list):
+        if len(split_cmd) == 3:
+            limit = None
+        elif len(split_cmd) == 4:
+            try:
+                limit = max(int(split_cmd[3]), 0)
+            except ValueError:
+                return True
+        else:
             return True
 
-        # NUM_WITH_VALUE command expects 1 parameters, simple length check here
-        elif cur_cmd == "NUM_WITH_VALUE" and split_cmd.__len__() == 2:
+        num_names, cursor = self.cmd_RANGE(split_cmd[1], split_cmd[2], limit)
 
-            value = split_cmd[1].strip()
+        self.output_reply(str(num_names), out_list)
+        self.output_cursor(cursor, out_list)
 
-            # value is numeric convert to string
-            print str(simple_mem_db.cmd_NUM_WITH_VALUE(value))
+        return True
 
+    # PREFIX prefix [limit], same replies as RANGE for the names starting with prefix
+    def process_PREFIX(self, split_cmd, out_list):
+        if len(split_cmd) == 2:
+            limit = None
+        elif len(split_cmd) == 3:
+            try:
+                limit = max(int(split_cmd[2]), 0)
+            except ValueError:
+                return True
+        else:
             return True
 
-        # QUIT command expects 0 parameters, simple length check here
-        elif cur_cmd == "QUIT" and split_cmd.__len__() == 1:
+        num_names, cursor = self.cmd_PREFIX(split_cmd[1], limit)
 
-            # call the cmd_QUIT in case we want to do something in the class later
-            simple_mem_db.cmd_QUIT()
+        self.output_reply(str(num_names), out_list)
+        self.output_cursor(cursor, out_list)
 
-            #stop processing
-            return False
+        return True
 
-    # process split transaction commands
-    def process_transaction_command(self, split_cmd):
-            cur_cmd = split_cmd[0].strip()
+    # reply with the new value of a counter, or that it wasn't an integer
+    def output_counter(self, value, out_list):
+        if value is None:
+            self.output_reply(self.not_integer_msg, out_list)
+        else:
+            self.output_reply(value, out_list)
+
+    # INCR name, the new value
+    def process_INCR(self, split_cmd, out_list):
+        self.output_counter(self.cmd_INCRBY(split_cmd[1], 1), out_list)
+
+        return True
+
+    # INCRBY name delta, the new value
+    def process_INCRBY(self, split_cmd, out_list):
+        try:
+            delta = int(split_cmd[2])
+        except ValueError:
+            return True
+
+        self.output_counter(self.cmd_INCRBY(split_cmd[1], delta), out_list)
+
+        return True
+
+    # DECR name, the new value
+    def process_DECR(self, split_cmd, out_list):
+        self.output_counter(self.cmd_INCRBY(split_cmd[1], -1), out_list)
+
+        return True
+
+    # COUNT_VALUE_RANGE low high, the number of names with a numeric value >= low and <= high
+    def process_COUNT_VALUE_RANGE(self, split_cmd, out_list):
+        low = parse_number(split_cmd[1])
+        high = parse_number(split_cmd[2])
+
+        if low is None or high is None:
+            return True
+
+        self.output_reply(str(self.cmd_COUNT_VALUE_RANGE(low, high)), out_list)
+
+        return True
+
+    # CAS name expected value, "1" if name was expected and is now value, "0" otherwise
+    def process_CAS(self, split_cmd, out_list):
+        if self.cmd_CAS(split_cmd[1], split_cmd[2], split_cmd[3]):
+            self.output_reply("1", out_list)
+        else:
+            self.output_reply("0", out_list)
+
+        return True
+
+    # QUIT
+    def process_QUIT(self, split_cmd, out_list):
+
+        # call the cmd_QUIT in case we want to do something in the class later
+        self.cmd_QUIT()
+
+        #stop processing
+        return False
+
+    # START_COMMIT
+    def process_START_COMMIT(self, split_cmd, out_list):
+        self.cmd_START_COMMIT()
+
+        return True
+
+    # COMMIT, after a WATCH the client always hears whether the blocks went through
+    def process_COMMIT(self, split_cmd, out_list):
+        if self.mem_db_transaction_log.watched_versions:
+            committed = self.cmd_CHECKED_COMMIT()
+
+            if committed is None:
+                self.output_reply(self.no_transaction_msg, out_list)
+            elif committed:
+                self.output_reply(self.committed_msg, out_list)
+            else:
+                self.output_reply(self.aborted_msg, out_list)
+
+        elif not self.cmd_END_COMMIT():
+            self.output_reply(self.no_transaction_msg, out_list)
+
+        return True
+
+    # UN_COMMIT
+    def process_UN_COMMIT(self, split_cmd, out_list):
+        if not self.cmd_UN_COMMIT():
+            self.output_reply(self.no_transaction_msg, out_list)
+
+        return True
+
+    # WATCH name [name ...]
+    def process_WATCH(self, split_cmd, out_list):
+        if len(split_cmd) < 2:
+            return True
+
+        self.cmd_WATCH(split_cmd[1:])
 
-            # START_COMMIT command expects 0 parameters, simple length check here
-            if cur_cmd == "START_COMMIT" and split_cmd.__len__() == 1:
-                simple_mem_db.cmd_START_COMMIT()
+        return True
 
-            # COMMIT command expects 0 parameters, simple length check here
-            elif cur_cmd == "COMMIT" and split_cmd.__len__() == 1:
-                if not simple_mem_db.cmd_END_COMMIT():
-                    print self.no_transaction_msg
+    # UNWATCH
+    def process_UNWATCH(self, split_cmd, out_list):
+        self.cmd_UNWATCH()
 
-            # UN_COMMIT command expects 0 parameters, simple length check here
-            elif cur_cmd == "UN_COMMIT" and split_cmd.__len__() == 1:
-                if not simple_mem_db.cmd_UN_COMMIT():
-                    print self.no_transaction_msg
+        return True
 
     '''================== SIMPLE commands ==================
         PUT(name, value)
@@ -224,63 +2086,133 @@ class PyMemDB:
             -value - print out the number of variables set to the passed in value
                      if no variables are equal to the passed in value, print "0"
 
+        KEYS_WITH_VALUE(value)
+            -value - print out the number of variables set to the passed in value, then each of their names
+                     one per line, names are streamed out in blocks
+
+        EXPIRE(name, seconds)
+            -name    - the key to expire, print out "1" if it exists, "0" otherwise
+            -seconds - how long until the key is removed, 0 or less removes it right away
+
+        TTL(name)
+            -name - print out the number of seconds until the key expires, "-1" if it has no TTL, "-2" if it doesn't exist
+
+        PERSIST(name)
+            -name - clear the key's TTL, print out "1" if it had one, "0" otherwise
+
+        PUTEX(name, value, seconds)
+            - PUT that expires after seconds, a plain PUT clears any TTL
+
+        MPUT(name, value, [name, value, ...])
+            - PUT every pair in one go, committed together
+
+        MPULL(name, [name, ...])
+            - print out the value of every name (or "NULL") one per line, in the same order
+
+        MDELETE(name, [name, ...])
+            - DELETE every name in one go, committed together
+
+        RANGE(start, end, [limit])
+            - print out the number of names with start <= name < end (at most limit), then each of those names
+              one per line in sorted order, names are streamed out in blocks
+
+        PREFIX(prefix, [limit])
+            - same as RANGE for the names starting with prefix
+
+        INCR(name), INCRBY(name, delta), DECR(name)
+            - add 1, delta or -1 to the integer value of name (a missing name counts as 0), print out the new value
+              or "NOT AN INTEGER" if the value isn't one, the name keeps its TTL
+
+        COUNT_VALUE_RANGE(low, high)
+            - print out the number of names whose value is a number >= low and <= high
+
+        CAS(name, expected, value)
+            - PUT value only if name is currently expected ("NULL" for a name that doesn't exist)
+              print out "1" if it was, "0" otherwise
+
         QUIT()
             - exit the program
     '''
 
     def cmd_PUT(self, name, value, roll_back_mode=False):
 
+        # multi-version mode, no one else sees it until END_COMMIT
+        if self.mvcc and self.mem_db_transaction_log.is_open():
+            self.mem_db_transaction_log.put_private(name, value)
+
+            return
+
         # if we currently have open transaction blocks, start adding to t-log
         # after unit testing, we use the PUT value in rollback as well, so DON'T log while rolling back
-        if self.mem_db_current_transaction_block is not None and not roll_back_mode:
-            old_val = self.cmd_PULL(name)
+        if not roll_back_mode and self.mem_db_transaction_log.is_open():
 
-            # t-log record contains {name: old_val}
-            self.mem_db_current_transaction_block.add_cmd({name: old_val})
+            # t-log record contains (name, old_val), old_val is None if name doesn't exist yet
+            self.mem_db_transaction_log.add_undo(name, self.mem_db_dict.get(name), self.mem_db_expires.get(name))
 
-        # increment count cache for specific value
-        if value in self.mem_db_value_count_dict:
-            self.mem_db_value_count_dict[value] += 1
-        else:
-            self.mem_db_value_count_dict[value] = 1
+        self.store_value(name, value)
 
-        self.mem_db_dict[name] = value
+        # outside of a transaction block the write is committed right away
+        if self.commit_listeners and not roll_back_mode and not self.mem_db_transaction_log.is_open():
+            self.publish_commit([(name, value)])
+
+        # make room, roll-backs just put back what was there so they never evict
+        if self.eviction_policy is not None and not roll_back_mode:
+            self.evict_if_needed()
 
     def cmd_PULL(self, name):
 
+        # multi-version mode, our own writes on top of the snapshot
+        if self.mvcc and self.mem_db_transaction_log.is_open():
+            value = self.get_private_value(name)[0]
+
+            return "NULL" if value is None else value
+
+        # lazy expiry, only names with a TTL pay for the check
+        if name in self.mem_db_expires and self.expire_if_due(name):
+            return "NULL"
+
         if name in self.mem_db_dict:
+            if self.eviction_policy is not None:
+                self.eviction_policy.on_access(name)
+
             return self.mem_db_dict[name]
         else:
             return "NULL"
 
     def cmd_DELETE(self, name, roll_back_mode=False):
 
-        # if we currently have open transaction blocks, start adding to t-log
-        if self.mem_db_current_transaction_block is not None and not roll_back_mode:
-            old_val = self.cmd_PULL(name)
+        # multi-version mode, nothing to delete unless the block can see it
+        if self.mvcc and self.mem_db_transaction_log.is_open():
+            if self.get_private_value(name)[0] is not None:
+                self.mem_db_transaction_log.put_private(name, None)
 
-            # t-log record contains {name: old_val}
-            self.mem_db_current_transaction_block.add_cmd({name: old_val})
+            return
 
-        cur_value = None
+        # if we currently have open transaction blocks, start adding to t-log
+        if not roll_back_mode and self.mem_db_transaction_log.is_open():
 
-        if name in self.mem_db_dict:
-            cur_value = self.cmd_PULL(name)
+            # t-log record contains (name, old_val), old_val is None if name doesn't exist yet
+            self.mem_db_transaction_log.add_undo(name, self.mem_db_dict.get(name), self.mem_db_expires.get(name))
 
-            del self.mem_db_dict[name]
+        old_value = self.remove_name(name)
 
-        # increment count for specific value
-        if cur_value is not None and cur_value in self.mem_db_value_count_dict:
-             self.mem_db_value_count_dict[cur_value] -= 1
+        # outside of a transaction block the delete is committed right away, nothing to tell anyone if it didn't exist
+        if self.commit_listeners and not roll_back_mode and old_value is not None and not self.mem_db_transaction_log.is_open():
+            self.publish_commit([(name, None)])
 
-        # final check to remove the value count cache
-        if self.mem_db_value_count_dict[cur_value] == 0:
+    # number of names set to value, out of the value count index, expired names aren't counted
+    def cmd_NUM_WITH_VALUE(self, value):
+        return self.count_with_value(value, self.expire_due())
 
-            # remove this value from the count cache
-            del self.mem_db_value_count_dict[cur_value]
+    # number of names set to value, leaving out expired_names
+    def count_with_value(self, value, expired_names):
+        num_names = self.mem_db_value_count_index.get_count(value)
 
-    def cmd_NUM_WITH_VALUE(self, value):
-        return self.mem_db_value_count_dict[value]
+        for name in expired_names:
+            if self.mem_db_dict.get(name) == value:
+                num_names -= 1
+
+        return num_names
 
     def cmd_NUM_WITH_VALUE_SLOW(self, value):
         count_value = 0
@@ -291,6 +2223,284 @@ class PyMemDB:
 
         return count_value
 
+    # cursor over the names set to value, straight out of the value keys index when we have one
+    def cmd_KEYS_WITH_VALUE(self, value):
+        return self.get_keys_with_value(value)[1]
+
+    # (number of names, cursor over the names) set to value, leaving out any that have expired
+    def get_keys_with_value(self, value):
+        expired_names = self.expire_due()
+
+        num_names = self.count_with_value(value, expired_names)
+
+        if self.mem_db_value_keys_index is not None:
+            cursor = self.mem_db_value_keys_index.iter_names(value)
+        else:
+            cursor = self.cmd_KEYS_WITH_VALUE_SLOW(value)
+
+        if expired_names:
+            cursor = ifilterfalse(expired_names.__contains__, cursor)
+
+        return num_names, cursor
+
+    # cursor over the names set to value, using a simple iteration and value check
+    def cmd_KEYS_WITH_VALUE_SLOW(self, value):
+        for cur_name, cur_value in self.mem_db_dict.iteritems():
+            if cur_value == value:
+                yield cur_name
+
+    # PUT every (name, value) pair, one undo group in the open block, or one committed group for the commit listeners
+    def cmd_MPUT(self, name_values):
+        transaction_log = self.mem_db_transaction_log
+
+        if self.is_private():
+            for name, value in name_values:
+                transaction_log.put_private(name, value)
+
+            return
+
+        if transaction_log.is_open():
+            mem_db_dict = self.mem_db_dict
+            mem_db_expires = self.mem_db_expires
+
+            transaction_log.add_undos([(name, mem_db_dict.get(name), mem_db_expires.get(name)) for name, value in name_values])
+
+        self.store_values(name_values)
+
+        # outside of a transaction block the writes are committed right away, and all together
+        if self.commit_listeners and not transaction_log.is_open():
+            self.publish_commit(list(name_values), True)
+
+        if self.eviction_policy is not None:
+            self.evict_if_needed()
+
+    # the value of every name in names, "NULL" for missing names
+    def cmd_MPULL(self, names):
+
+        # expiry, eviction and snapshots need to see every read
+        if self.mem_db_expires or self.eviction_policy is not None or self.is_private():
+            return [self.cmd_PULL(name) for name in names]
+
+        mem_db_dict = self.mem_db_dict
+
+        return [mem_db_dict.get(name, "NULL") for name in names]
+
+    # DELETE every name in names, one undo group in the open block, or one committed group for the commit listeners
+    def cmd_MDELETE(self, names):
+        transaction_log = self.mem_db_transaction_log
+        mem_db_dict = self.mem_db_dict
+
+        if self.is_private():
+            for name in names:
+                self.cmd_DELETE(name)
+
+            return
+
+        if transaction_log.is_open():
+            mem_db_expires = self.mem_db_expires
+
+            transaction_log.add_undos([(name, mem_db_dict.get(name), mem_db_expires.get(name)) for name in names])
+
+        # nothing to tell anyone about names that didn't exist
+        if self.commit_listeners and not transaction_log.is_open():
+            mutations = [(name, None) for name in names if name in mem_db_dict]
+        else:
+            mutations = None
+
+        self.remove_names(names)
+
+        if mutations:
+            self.publish_commit(mutations, True)
+
+    # (number of names, cursor over the names) with start <= name < end in order, at most limit of them
+    # end None means no upper bound, straight out of the ordered index when we have one, expired names are left out
+    def cmd_RANGE(self, start, end, limit=None):
+        expired_names = self.expire_due()
+
+        if self.mem_db_ordered_index is None:
+            return self.cmd_RANGE_SLOW(start, end, limit, expired_names)
+
+        num_names = self.mem_db_ordered_index.count_range(start, end)
+        cursor = self.mem_db_ordered_index.iter_range(start, end)
+
+        if expired_names:
+            num_names -= sum(1 for name in expired_names if name in self.mem_db_dict and name >= start and (end is None or name < end))
+            cursor = ifilterfalse(expired_names.__contains__, cursor)
+
+        if limit is not None and limit < num_names:
+            return limit, islice(cursor, limit)
+
+        return num_names, cursor
+
+    # same as cmd_RANGE, scanning every name and sorting the ones in range, leaving out skip_names
+    def cmd_RANGE_SLOW(self, start, end, limit=None, skip_names=frozenset()):
+        names = sorted(name for name in self.mem_db_dict if name >= start and (end is None or name < end) and name not in skip_names)
+
+        if limit is not None:
+            del names[limit:]
+
+        return len(names), iter(names)
+
+    # (number of names, cursor over the names) starting with prefix in order, at most limit of them
+    def cmd_PREFIX(self, prefix, limit=None):
+        return self.cmd_RANGE(prefix, get_prefix_end(prefix), limit)
+
+    # add delta to the integer value of name in one step, returns the new value, None if the value isn't an integer
+    # it's a single PUT, so it's one undo entry in an open block and one committed PUT for the commit listeners
+    def cmd_INCRBY(self, name, delta):
+
+        # multi-version mode, the counter as the block sees it
+        if self.is_private():
+            old_value, expire_at = self.get_private_value(name)
+
+        else:
+            # an expired counter starts over from 0
+            if name in self.mem_db_expires:
+                self.expire_if_due(name)
+
+            old_value = self.mem_db_dict.get(name)
+            expire_at = self.mem_db_expires.get(name)
+
+        if old_value is None:
+            number = 0
+        else:
+            try:
+                number = int(old_value)
+            except ValueError:
+                return None
+
+        value = str(number + delta)
+
+        # unlike a plain PUT a counter keeps its TTL
+        if self.is_private():
+            self.mem_db_transaction_log.put_private(name, value, expire_at)
+
+        else:
+            self.cmd_PUT(name, value)
+
+            if expire_at is not None and name in self.mem_db_dict:
+                self.set_expire_at(name, expire_at)
+
+        return value
+
+    # number of names whose value is a number >= low and <= high, O(log n) out of the numeric index when we have one
+    # expired names aren't counted
+    def cmd_COUNT_VALUE_RANGE(self, low, high):
+        expired_names = self.expire_due()
+
+        if self.mem_db_numeric_index is not None:
+            count_value = self.mem_db_numeric_index.count_between(low, high)
+        else:
+            count_value = self.cmd_COUNT_VALUE_RANGE_SLOW(low, high)
+
+        for name in expired_names:
+            number = parse_number(self.mem_db_dict.get(name))
+
+            if number is not None and low <= number <= high:
+                count_value -= 1
+
+        return count_value
+
+    # same as cmd_COUNT_VALUE_RANGE, parsing every value
+    def cmd_COUNT_VALUE_RANGE_SLOW(self, low, high):
+        count_value = 0
+
+        for number in imap(parse_number, self.mem_db_dict.itervalues()):
+            if number is not None and low <= number <= high:
+                count_value += 1
+
+        return count_value
+
+    # compare-and-set, PUT value only if name is currently expected, True if it was
+    # one round trip and no transaction block, the cheap way to make a single read-modify-write safe
+    def cmd_CAS(self, name, expected, value):
+        if self.cmd_PULL(name) != expected:
+            return False
+
+        self.cmd_PUT(name, value)
+
+        return True
+
+    # set name to expire seconds from now, False if name doesn't exist
+    def cmd_EXPIRE(self, name, seconds):
+
+        # multi-version mode, the new TTL goes in with the block's other writes
+        if self.is_private():
+            value = self.get_private_value(name)[0]
+
+            if value is None:
+                return False
+
+            if seconds <= 0:
+                self.mem_db_transaction_log.put_private(name, None)
+            else:
+                self.mem_db_transaction_log.put_private(name, value, self.clock() + seconds)
+
+            return True
+
+        if name not in self.mem_db_dict or self.expire_if_due(name):
+            return False
+
+        # no time left, it's just a DELETE
+        if seconds <= 0:
+            self.cmd_DELETE(name)
+
+            return True
+
+        # the TTL is part of the block, roll-back puts the old one back
+        if self.mem_db_transaction_log.is_open():
+            self.mem_db_transaction_log.add_undo(name, self.mem_db_dict[name], self.mem_db_expires.get(name))
+
+        self.set_expire_at(name, self.clock() + seconds)
+
+        return True
+
+    # seconds until name expires, -1 if it has no TTL, -2 if it doesn't exist
+    def cmd_TTL(self, name):
+        if self.is_private():
+            value, expire_at = self.get_private_value(name)
+
+            if value is None:
+                return -2
+
+        else:
+            if name not in self.mem_db_dict or self.expire_if_due(name):
+                return -2
+
+            expire_at = self.mem_db_expires.get(name)
+
+        if expire_at is None:
+            return -1
+
+        return int(round(expire_at - self.clock()))
+
+    # clear name's TTL, False if it doesn't exist or has no TTL
+    def cmd_PERSIST(self, name):
+        if self.is_private():
+            value, expire_at = self.get_private_value(name)
+
+            if expire_at is None:
+                return False
+
+            self.mem_db_transaction_log.put_private(name, value)
+
+            return True
+
+        if name not in self.mem_db_expires or self.expire_if_due(name):
+            return False
+
+        if self.mem_db_transaction_log.is_open():
+            self.mem_db_transaction_log.add_undo(name, self.mem_db_dict[name], self.mem_db_expires[name])
+
+        self.set_expire_at(name, None)
+
+        return True
+
+    # PUT name value, expiring seconds from now
+    def cmd_PUTEX(self, name, value, seconds):
+        self.cmd_PUT(name, value)
+        self.cmd_EXPIRE(name, seconds)
+
     def cmd_QUIT(self):
         return "TheCakeIsALie!"
 
@@ -309,36 +2519,35 @@ class PyMemDB:
             - Print nothing if successful
             - Print "NO TRANSACTION" if no transaction is in progress
 
-    '''
+        WATCH(name, [name, ...])
+            - Optimistic locking, remember the version of every name; if any of them is changed by another client
+              before the next COMMIT, that COMMIT rolls back every open block instead and prints "ABORTED"
+            - A COMMIT after a WATCH prints "OK" when it goes through; COMMIT, the last UN_COMMIT and UNWATCH all
+              forget the watched names
 
-    def cmd_START_COMMIT(self):
+        UNWATCH()
+            - Forget every watched name
 
-        # new transaction block
-        new_transaction_block = TransactionBlock()
+    '''
 
-        # if we have a current block, assign it as parent for the new and swap new to the current
-        if self.mem_db_current_transaction_block:
-            new_transaction_block.set_parent(self.mem_db_current_transaction_block)
-            self.mem_db_current_transaction_block = new_transaction_block
+    def cmd_START_COMMIT(self):
 
-            new_transaction_block.get_parent().add_cmd(new_transaction_block)
+        # push a savepoint, nested blocks just push another one
+        self.mem_db_transaction_log.start_block()
 
-        # no transaction blocks, so set the "head" as the current
-        elif self.mem_db_transaction_blocks is None:
-            self.mem_db_transaction_blocks = new_transaction_block
-            self.mem_db_current_transaction_block = self.mem_db_transaction_blocks
+        # the outermost block reads as of now until it's closed
+        if self.mvcc and self.mem_db_transaction_log.get_depth() == 1:
+            self.begin_snapshot()
 
     def cmd_UN_COMMIT(self):
-        if self.mem_db_current_transaction_block:
+        if self.mem_db_transaction_log.is_open():
 
             # roll back the current transaction block
-            self.mem_db_current_transaction_block.roll_back_current(self)
+            self.roll_back_block()
 
-            parent_block = self.mem_db_current_transaction_block.get_parent()
-
-            if parent_block:
-                parent_block.get_cmd_list().remove(self.mem_db_current_transaction_block)
-                self.mem_db_current_transaction_block = parent_block
+            # discarding the outermost block discards the WATCH along with it
+            if not self.mem_db_transaction_log.is_open() and self.mem_db_transaction_log.watched_versions:
+                self.cmd_UNWATCH()
 
             return True
         else:
@@ -346,62 +2555,128 @@ class PyMemDB:
             return False
 
     def cmd_END_COMMIT(self):
-        if self.mem_db_transaction_blocks:
-            # let's process the transaction blocks recursively to keep them in order since START_COMMIT is nested
-            self.mem_db_transaction_blocks.recursive_commit_blocks(self, self.mem_db_transaction_blocks)
+        if self.is_private():
+
+            # nothing has been applied yet, apply it all as one commit
+            self.publish_private_writes()
+            self.mem_db_transaction_log.commit_all()
+            self.end_snapshot()
 
-            # clear out the current block
-            self.mem_db_current_transaction_block = None
+            return True
+
+        elif self.mem_db_transaction_log.is_open():
 
-            # clear out the head block
-            self.mem_db_transaction_blocks = None
+            # the committed state of every name the blocks touched is whatever it is now
+            if self.commit_listeners:
+                mem_db_dict = self.mem_db_dict
+                self.publish_commit([(name, mem_db_dict.get(name)) for name in self.mem_db_transaction_log.get_names()], True)
+
+            # all of the changes are already applied, closing every block is just dropping the undo log
+            self.mem_db_transaction_log.commit_all()
 
             return True
         else:
             # need to output NO TRANSACTION if no TBs
             return False
 
-# start up the application and listen to our PyMemDB commands!
-if __name__ == "__main__":
+    # COMMIT for a client that's WATCHing, None if there's no block open, True if it went through
+    # False if someone else changed a watched name, every open block is rolled back instead
+    def cmd_CHECKED_COMMIT(self):
+        transaction_log = self.mem_db_transaction_log
 
-    # enable/disable debugging
-    allow_debug = False;
+        if not transaction_log.is_open():
+            committed = None
 
-    # commands we will accept, all others will be ignored
-    allowed_commit_commands = ["PUT", "DELETE"]
-    allowed_simple_commands = allowed_commit_commands + ["PULL", "NUM_WITH_VALUE", "QUIT"]
-    allowed_transaction_commands = ["START_COMMIT", "COMMIT", "UN_COMMIT"]
+        elif self.is_watch_broken():
+            self.roll_back_watched()
 
-    # implementation of the simple memory db
-    simple_mem_db = PyMemDB()
+            committed = False
 
-    # start reading in the first command
-    mem_db_cmd = sys.stdin.readline()
+        else:
+            committed = self.cmd_END_COMMIT()
 
-    # keep reading commands until we receive "QUIT"
-    while mem_db_cmd:
-        split_cmd = mem_db_cmd.split(" ")
+        # a WATCH only covers the next COMMIT
+        self.cmd_UNWATCH()
 
-        # the first entry is always the command
-        cur_cmd = split_cmd[0].strip()
+        return committed
 
-        # if it's a simple command, handle it here
-        if cur_cmd in allowed_simple_commands:
-            if allow_debug:
-                print "SIMPLE: " + mem_db_cmd
+    # start watching names for the current client, a name already watched keeps the version it was first seen at
+    def cmd_WATCH(self, names):
+        mem_db_versions = self.mem_db_versions
+        watch_counts = self.mem_db_watch_counts
+        watched_versions = self.mem_db_transaction_log.watched_versions
 
-            # process simple commands until we get an QUIT which returns false
-            if not simple_mem_db.process_simple_command(split_cmd):
-                break
+        for name in names:
+            if name in watched_versions:
+                continue
 
-        # if it's a transaction command, handle it here
-        elif cur_cmd in allowed_transaction_commands:
-            if allow_debug:
-                print "TRANSACTION" + mem_db_cmd
+            # a name no one was watching starts out at the current clock, any write moves it past that
+            if name not in mem_db_versions:
+                mem_db_versions[name] = self.mem_db_version_clock
+
+            watch_counts[name] = watch_counts.get(name, 0) + 1
+            watched_versions[name] = mem_db_versions[name]
+
+    # stop watching everything for the current client, names no one else is watching lose their version
+    def cmd_UNWATCH(self):
+        mem_db_versions = self.mem_db_versions
+        watch_counts = self.mem_db_watch_counts
+        watched_versions = self.mem_db_transaction_log.watched_versions
+
+        for name in watched_versions:
+            if watch_counts[name] > 1:
+                watch_counts[name] -= 1
+            else:
+                del watch_counts[name]
+                del mem_db_versions[name]
+
+        watched_versions.clear()
+        self.mem_db_transaction_log.written_versions.clear()
+
+# start up the application and listen to our PyMemDB commands!
+if __name__ == "__main__":
+
+    # only needed when running as a program
+    import argparse
+    import PyMemDBEviction
+    import PyMemDBPersistence
+    import PyMemDBProfiler
+    import PyMemDBScripts
+    import PyMemDBStats
+
+    arg_parser = argparse.ArgumentParser(description="PyMemDB reading commands from stdin")
+    arg_parser.add_argument("--debug", action="store_true", help="trace every command")
+    arg_parser.add_argument("--compact-storage", action="store_true", help="share one copy of every repeated value")
+    arg_parser.add_argument("--ordered-index", action="store_true", help="keep every name sorted for RANGE and PREFIX")
+    arg_parser.add_argument("--numeric-index", action="store_true", help="keep every numeric value sorted for COUNT_VALUE_RANGE")
+    arg_parser.add_argument("--mvcc", action="store_true", help="keep transaction writes private until COMMIT, blocks read a snapshot")
+    PyMemDBPersistence.add_persistence_args(arg_parser)
+    PyMemDBEviction.add_eviction_args(arg_parser)
+    PyMemDBStats.add_stats_args(arg_parser)
+    PyMemDBProfiler.add_profiler_args(arg_parser)
+
+    args = arg_parser.parse_args()
+
+    # implementation of the simple memory db
+    simple_mem_db = PyMemDB(args.debug, compact_storage=args.compact_storage, ordered_index=args.ordered_index,
+                            numeric_index=args.numeric_index, mvcc=args.mvcc)
+
+    # load anything we persisted last time and keep persisting
+    PyMemDBPersistence.open_persistence(simple_mem_db, args)
+
+    # cap the number of names or bytes, if asked to
+    PyMemDBEviction.open_eviction(simple_mem_db, args)
+
+    # INFO, STATS and SLOWLOG, and per-command stats and the slow log if asked for
+    PyMemDBStats.open_stats(simple_mem_db, args)
+
+    # PROFILE, to profile the command loop while it runs
+    PyMemDBProfiler.open_profiler(simple_mem_db, args)
 
-            simple_mem_db.process_transaction_command(split_cmd)
+    # SCRIPT_LOAD, EVAL and EVALSHA
+    PyMemDBScripts.open_scripts(simple_mem_db)
 
-        # all other commands will be ignored
+    # keep reading commands in large chunks until we receive "QUIT" or run out of input
+    simple_mem_db.process_command_stream(sys.stdin, sys.stdout)
 
-        # pull in the next command
-        mem_db_cmd = sys.stdin.readline()
\ No newline at end of file
+    simple_mem_db.close_commit_listeners()
@@ -0,0 +1,673 @@
+'''
+    PyMemDBPersistence ~ append-only log of committed PyMemDB changes with crash recovery, and binary snapshots
+    depenencies: Python 2.7.x
+
+    the log is made up of the same PUT/DELETE lines the command protocol uses, so it can be read (or piped into
+    PyMemDBImpl.py) by hand, changes committed together by END_COMMIT are wrapped in START_COMMIT/COMMIT lines
+    and are only replayed if the COMMIT line made it to disk
+
+    snapshots are a compact length-prefixed binary dump of the committed names, values and value counts:
+        magic          8 bytes "PYMEMDB1"
+        header         <II number of distinct values, number of names
+        value counts   one uint32 per value
+        value lengths  one uint32 per value
+        values         every value back to back
+        name lengths   one uint32 per name
+        name values    one uint32 per name, the index of its value
+        names          every name back to back
+    every value is only stored once, no matter how many names are set to it
+'''
+
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+
+from array import array
+from itertools import imap, izip
+
+# how often we fsync
+FSYNC_ALWAYS = "always"
+FSYNC_INTERVAL = "interval"
+FSYNC_NEVER = "never"
+
+fsync_policies = [FSYNC_ALWAYS, FSYNC_INTERVAL, FSYNC_NEVER]
+
+# append the log records for committed mutations to records, one PUT/DELETE line each
+# a transaction is wrapped in START_COMMIT/COMMIT so replay only applies it if the whole thing made it to disk
+def encode_mutations(mutations, transaction, records):
+    transaction = transaction and len(mutations) > 1
+
+    if transaction:
+        records.append("START_COMMIT\n")
+
+    for name, value in mutations:
+        if value is None:
+            records.append("DELETE " + name + "\n")
+        else:
+            records.append("PUT " + name + " " + value + "\n")
+
+    if transaction:
+        records.append("COMMIT\n")
+
+class AppendOnlyLog:
+    '''
+        AppendOnlyLog ~ commit listener that appends every committed change to a log file
+            - records are buffered and written in one go (group commit) when sync() is called at the end of a batch,
+              or sooner if group_commit_size records pile up
+            - fsync_policy decides when the written records are fsync'd:
+                always   - at every sync(), nothing is replied to until it's on disk
+                interval - at most once every fsync_interval_ms
+                never    - leave it up to the OS
+            - start_rewrite() writes a new minimal log (one PUT per live name) in the background, anything committed
+              meanwhile goes to both the old log and a side buffer, the side buffer is tacked onto the new log
+              and the new log is renamed over the old one at the first sync() after the rewrite finishes
+    '''
+
+    # file we are appending to
+    log_path = None
+    log_file = None
+
+    # one of fsync_policies
+    fsync_policy = FSYNC_INTERVAL
+    fsync_interval_ms = 1000
+
+    # write early once this many records are waiting
+    group_commit_size = 65536
+
+    # records waiting to be written
+    pending_records = []
+
+    # has anything been written since we last fsync'd?
+    unsynced = False
+    last_fsync_time = 0
+
+    # database we're logging, needed to rewrite the log
+    mem_db = None
+
+    # the background task writing the new log, and the side buffer of records committed since it started
+    rewrite_task = None
+    rewrite_records = None
+
+    # before/after size and replay time of the last finished rewrite
+    last_rewrite_stats = None
+
+    def __init__(self, log_path, fsync_policy=FSYNC_INTERVAL, fsync_interval_ms=1000, group_commit_size=65536):
+        if fsync_policy not in fsync_policies:
+            raise ValueError("fsync_policy must be one of " + ", ".join(fsync_policies))
+
+        self.log_path = log_path
+        self.fsync_policy = fsync_policy
+        self.fsync_interval_ms = fsync_interval_ms
+        self.group_commit_size = group_commit_size
+
+        self.pending_records = []
+        self.unsynced = False
+        self.last_fsync_time = time.time()
+
+        self.mem_db = None
+        self.rewrite_task = None
+        self.rewrite_records = None
+        self.last_rewrite_stats = None
+
+        self.log_file = open(log_path, "ab")
+
+    # buffer the committed changes, they get written out together at the next sync()
+    def on_commit(self, mutations, transaction):
+        pending_records = self.pending_records
+
+        # while rewriting, the records also go to the side buffer for the new log
+        if self.rewrite_records is not None:
+            pending_records = []
+
+        encode_mutations(mutations, transaction, pending_records)
+
+        if self.rewrite_records is not None:
+            self.pending_records.extend(pending_records)
+            self.rewrite_records.extend(pending_records)
+
+        if len(self.pending_records) >= self.group_commit_size:
+            self.write_pending()
+
+    # write every buffered record with a single write
+    def write_pending(self):
+        if self.pending_records:
+            self.log_file.write("".join(self.pending_records))
+            self.log_file.flush()
+
+            self.pending_records = []
+            self.unsynced = True
+
+    # write out everything buffered, then fsync if the policy says it's time
+    def sync(self):
+        self.write_pending()
+
+        if self.rewrite_task is not None and not self.rewrite_task.is_running():
+            self.finish_rewrite()
+
+        if not self.unsynced or self.fsync_policy == FSYNC_NEVER:
+            return
+
+        cur_time = time.time()
+
+        if self.fsync_policy == FSYNC_ALWAYS or (cur_time - self.last_fsync_time) * 1000 >= self.fsync_interval_ms:
+            os.fsync(self.log_file.fileno())
+
+            self.unsynced = False
+            self.last_fsync_time = cur_time
+
+    # where the new log is written while rewriting
+    def get_rewrite_path(self):
+        return self.log_path + ".rewrite"
+
+    # is a rewrite still in progress?
+    def is_rewriting(self):
+        return self.rewrite_task is not None
+
+    # start rewriting the log down to one PUT per live name in the background, False if we already are
+    def start_rewrite(self):
+        if self.rewrite_task is not None:
+            return False
+
+        # everything committed so far has to be in the old log, the new log starts from the same point
+        self.write_pending()
+
+        self.rewrite_records = []
+        self.rewrite_task = BackgroundTask()
+        self.rewrite_task.start(self.mem_db, self.write_rewrite)
+
+        return True
+
+    # runs in the background, writes the new log and reports "before_bytes before_replay_secs after_replay_secs"
+    def write_rewrite(self, name_values, value_counts):
+        rewrite_path = self.get_rewrite_path()
+
+        write_log(rewrite_path, name_values)
+
+        before_bytes = os.path.getsize(self.log_path)
+        before_replay_secs = time_read_log(self.log_path)
+        after_replay_secs = time_read_log(rewrite_path)
+
+        return str(before_bytes) + " " + str(before_replay_secs) + " " + str(after_replay_secs)
+
+    # the new log is written, tack on the side buffer and swap it in for the old one
+    def finish_rewrite(self):
+        rewrite_task = self.rewrite_task
+        rewrite_path = self.get_rewrite_path()
+
+        if rewrite_task.ok:
+            # the old log stays complete right up until the swap
+            self.write_pending()
+
+            with open(rewrite_path, "ab") as rewrite_file:
+                rewrite_file.write("".join(self.rewrite_records))
+                rewrite_file.flush()
+                os.fsync(rewrite_file.fileno())
+
+            self.log_file.close()
+
+            os.rename(rewrite_path, self.log_path)
+
+            self.log_file = open(self.log_path, "ab")
+            self.unsynced = False
+
+            before_bytes, before_replay_secs, after_replay_secs = rewrite_task.result.split()
+
+            self.last_rewrite_stats = {
+                "before_bytes": int(before_bytes),
+                "after_bytes": os.path.getsize(self.log_path),
+                "before_replay_secs": float(before_replay_secs),
+                "after_replay_secs": float(after_replay_secs),
+            }
+
+            sys.stderr.write("PyMemDB log rewrite: " + str(self.last_rewrite_stats) + "\n")
+
+        elif os.path.exists(rewrite_path):
+            os.remove(rewrite_path)
+
+        self.rewrite_task = None
+        self.rewrite_records = None
+
+    # block until the current rewrite (if any) is written and swapped in
+    def wait_rewrite(self):
+        if self.rewrite_task is not None:
+            self.rewrite_task.wait()
+            self.finish_rewrite()
+
+    # REWRITE_LOG, start rewriting the log in the background
+    def process_REWRITE_LOG(self, split_cmd, out_list):
+        if self.start_rewrite():
+            self.mem_db.output_reply("OK", out_list)
+        else:
+            self.mem_db.output_reply("REWRITE IN PROGRESS", out_list)
+
+        return True
+
+    def close(self):
+        self.wait_rewrite()
+
+        self.write_pending()
+
+        if self.unsynced and self.fsync_policy != FSYNC_NEVER:
+            os.fsync(self.log_file.fileno())
+
+        self.log_file.close()
+
+# read a log back into a dict of name -> value, without going through command dispatch
+# a transaction missing its COMMIT (we crashed part way through writing it) and a torn last line are thrown away
+def read_log(log_path):
+    name_values = {}
+
+    if not os.path.exists(log_path):
+        return name_values
+
+    with open(log_path, "rb") as log_file:
+        log_data = log_file.read()
+
+    # anything after the last newline never finished being written
+    log_data = log_data[:log_data.rfind("\n") + 1]
+
+    # changes from a START_COMMIT we haven't seen the COMMIT for yet
+    transaction_records = None
+
+    for split_record in map(str.split, log_data.split("\n")):
+        if not split_record:
+            continue
+
+        record_type = split_record[0]
+
+        if transaction_records is not None and (record_type == "PUT" or record_type == "DELETE"):
+            transaction_records.append(split_record)
+
+        elif record_type == "PUT":
+            name_values[split_record[1]] = split_record[2]
+
+        elif record_type == "DELETE":
+            name_values.pop(split_record[1], None)
+
+        elif record_type == "START_COMMIT":
+            transaction_records = []
+
+        elif record_type == "COMMIT" and transaction_records is not None:
+            for split_transaction_record in transaction_records:
+                if split_transaction_record[0] == "PUT":
+                    name_values[split_transaction_record[1]] = split_transaction_record[2]
+                else:
+                    name_values.pop(split_transaction_record[1], None)
+
+            transaction_records = None
+
+    return name_values
+
+# write a minimal log with one PUT per name, fsync'd before we return
+def write_log(log_path, name_values, chunk_size=100000):
+    with open(log_path, "wb") as log_file:
+        log_chunk = []
+
+        for name, value in name_values.iteritems():
+            log_chunk.append("PUT " + name + " " + value + "\n")
+
+            if len(log_chunk) >= chunk_size:
+                log_file.write("".join(log_chunk))
+                log_chunk = []
+
+        log_file.write("".join(log_chunk))
+        log_file.flush()
+        os.fsync(log_file.fileno())
+
+# how long it takes to read a log back in
+def time_read_log(log_path):
+    start_time = time.time()
+
+    read_log(log_path)
+
+    return time.time() - start_time
+
+# bulk load everything in the log into mem_db, rebuilding the indexes once instead of PUTting every record
+# returns the number of names loaded
+def replay_log(log_path, mem_db):
+    name_values = read_log(log_path)
+
+    mem_db.load_dict(name_values)
+
+    return len(name_values)
+
+# replay log_path into mem_db and then keep appending every change mem_db commits to it
+def open_append_only_log(mem_db, log_path, fsync_policy=FSYNC_INTERVAL, fsync_interval_ms=1000):
+    if os.path.exists(log_path):
+        replay_log(log_path, mem_db)
+
+    append_only_log = AppendOnlyLog(log_path, fsync_policy, fsync_interval_ms)
+    append_only_log.mem_db = mem_db
+
+    mem_db.add_commit_listener(append_only_log)
+
+    return append_only_log
+
+''' =============  SNAPSHOT functions ========== '''
+
+snapshot_magic = "PYMEMDB1"
+snapshot_header = struct.Struct("<II")
+
+# array type for all of the lengths, counts and value indexes in a snapshot, 4 bytes each
+snapshot_array_type = "I"
+
+# snapshot arrays are always little endian on disk
+def snapshot_array_bytes(snapshot_array):
+    if sys.byteorder != "little":
+        snapshot_array = array(snapshot_array_type, snapshot_array)
+        snapshot_array.byteswap()
+
+    return snapshot_array.tostring()
+
+def snapshot_array_from_bytes(snapshot_bytes):
+    snapshot_array = array(snapshot_array_type)
+    snapshot_array.fromstring(snapshot_bytes)
+
+    if sys.byteorder != "little":
+        snapshot_array.byteswap()
+
+    return snapshot_array
+
+# cut a blob of back to back strings apart using their lengths
+def split_blob(blob, lengths):
+    pieces = []
+    append_piece = pieces.append
+    offset = 0
+
+    for length in lengths:
+        next_offset = offset + length
+        append_piece(blob[offset:next_offset])
+        offset = next_offset
+
+    return pieces
+
+# the committed names and value counts of mem_db, copy=True if the caller needs them to stay put while mem_db changes
+def get_committed_state(mem_db, copy=False):
+    name_values = mem_db.get_committed_dict()
+
+    # nothing open, the value count index is already exactly right
+    if name_values is mem_db.mem_db_dict:
+        value_counts = mem_db.mem_db_value_count_index.value_counts
+
+        if copy:
+            name_values = dict(name_values)
+            value_counts = dict(value_counts)
+
+        return name_values, value_counts
+
+    # open blocks were rolled back in a copy, so count its values
+    value_counts = {}
+
+    for value in name_values.itervalues():
+        value_counts[value] = value_counts.get(value, 0) + 1
+
+    return name_values, value_counts
+
+# write a snapshot of name_values/value_counts, written to a temp file first and then renamed so it's all or nothing
+def write_snapshot(snapshot_path, name_values, value_counts):
+    assert(array(snapshot_array_type).itemsize == 4)
+
+    values = value_counts.keys()
+    value_ids = dict(izip(values, xrange(len(values))))
+
+    names = name_values.keys()
+
+    temp_path = snapshot_path + ".tmp"
+
+    with open(temp_path, "wb") as snapshot_file:
+        snapshot_file.write(snapshot_magic)
+        snapshot_file.write(snapshot_header.pack(len(values), len(names)))
+
+        snapshot_file.write(snapshot_array_bytes(array(snapshot_array_type, imap(value_counts.__getitem__, values))))
+        snapshot_file.write(snapshot_array_bytes(array(snapshot_array_type, imap(len, values))))
+        snapshot_file.write("".join(values))
+
+        snapshot_file.write(snapshot_array_bytes(array(snapshot_array_type, imap(len, names))))
+        snapshot_file.write(snapshot_array_bytes(array(snapshot_array_type, imap(value_ids.__getitem__, imap(name_values.__getitem__, names)))))
+        snapshot_file.write("".join(names))
+
+        snapshot_file.flush()
+        os.fsync(snapshot_file.fileno())
+
+    os.rename(temp_path, snapshot_path)
+
+# write a snapshot of everything mem_db has committed, blocking until it's done
+def save_snapshot(mem_db, snapshot_path):
+    name_values, value_counts = get_committed_state(mem_db)
+
+    write_snapshot(snapshot_path, name_values, value_counts)
+
+# read count uint32s out of a snapshot starting at offset, returns the array and the offset just past it
+def read_snapshot_array(snapshot_map, offset, count):
+    next_offset = offset + count * 4
+
+    return snapshot_array_from_bytes(snapshot_map[offset:next_offset]), next_offset
+
+# read back to back strings out of a snapshot starting at offset, returns the strings and the offset just past them
+def read_snapshot_blob(snapshot_map, offset, lengths):
+    next_offset = offset + sum(lengths)
+
+    return split_blob(snapshot_map[offset:next_offset], lengths), next_offset
+
+# read a snapshot back into (dict of name -> value, dict of value -> count), memory mapping the file
+def read_snapshot(snapshot_path):
+    with open(snapshot_path, "rb") as snapshot_file:
+        snapshot_map = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    try:
+        if snapshot_map[:len(snapshot_magic)] != snapshot_magic:
+            raise ValueError(snapshot_path + " is not a PyMemDB snapshot")
+
+        offset = len(snapshot_magic)
+        num_values, num_names = snapshot_header.unpack_from(snapshot_map, offset)
+        offset += snapshot_header.size
+
+        counts, offset = read_snapshot_array(snapshot_map, offset, num_values)
+        value_lengths, offset = read_snapshot_array(snapshot_map, offset, num_values)
+        values, offset = read_snapshot_blob(snapshot_map, offset, value_lengths)
+
+        name_lengths, offset = read_snapshot_array(snapshot_map, offset, num_names)
+        name_value_ids, offset = read_snapshot_array(snapshot_map, offset, num_names)
+        names, offset = read_snapshot_blob(snapshot_map, offset, name_lengths)
+
+    finally:
+        snapshot_map.close()
+
+    # build both dicts in bulk, every name shares the one copy of its value
+    name_values = dict(izip(names, imap(values.__getitem__, name_value_ids)))
+    value_counts = dict(izip(values, counts))
+
+    return name_values, value_counts
+
+# replace everything in mem_db with a snapshot, returns the number of names loaded
+def load_snapshot(snapshot_path, mem_db):
+    name_values, value_counts = read_snapshot(snapshot_path)
+
+    mem_db.load_dict(name_values, value_counts)
+
+    return len(name_values)
+
+class BackgroundTask:
+    '''
+        BackgroundTask ~ runs a function over a PyMemDB's committed state without holding up the command loop
+            - where we can fork, the child process works on its copy-on-write view of the database
+            - otherwise we take a quick in-memory copy and work on it on a thread
+            the function is called with (name_values, value_counts) and can return a short result string
+    '''
+
+    # forked child (and the pipe it sends its result back on) or thread doing the work
+    task_pid = None
+    result_fd = None
+    task_thread = None
+
+    # how the last run went, None until one finishes
+    ok = None
+    result = None
+
+    def __init__(self):
+        self.task_pid = None
+        self.result_fd = None
+        self.task_thread = None
+        self.ok = None
+        self.result = None
+
+    # start running task_func in the background, False if it's already running
+    def start(self, mem_db, task_func):
+        if self.is_running():
+            return False
+
+        self.ok = None
+        self.result = None
+
+        if hasattr(os, "fork"):
+            read_fd, write_fd = os.pipe()
+
+            self.task_pid = os.fork()
+
+            if self.task_pid == 0:
+                exit_code = 1
+
+                # the child never returns, whatever happens
+                try:
+                    os.close(read_fd)
+
+                    name_values, value_counts = get_committed_state(mem_db)
+                    os.write(write_fd, task_func(name_values, value_counts) or "")
+
+                    exit_code = 0
+                finally:
+                    os._exit(exit_code)
+
+            os.close(write_fd)
+            self.result_fd = read_fd
+
+        else:
+            name_values, value_counts = get_committed_state(mem_db, True)
+
+            self.task_thread = threading.Thread(target=self.run_on_thread, args=(task_func, name_values, value_counts))
+            self.task_thread.daemon = True
+            self.task_thread.start()
+
+        return True
+
+    def run_on_thread(self, task_func, name_values, value_counts):
+        self.ok = False
+        self.result = task_func(name_values, value_counts)
+        self.ok = True
+
+    # the child is done, pick up its result
+    def finish_child(self, status):
+        result_chunks = []
+
+        while True:
+            result_chunk = os.read(self.result_fd, 65536)
+
+            if not result_chunk:
+                break
+
+            result_chunks.append(result_chunk)
+
+        os.close(self.result_fd)
+
+        self.task_pid = None
+        self.result_fd = None
+        self.ok = status == 0
+        self.result = "".join(result_chunks)
+
+    # is the task still running?
+    def is_running(self):
+        if self.task_pid is not None:
+            pid, status = os.waitpid(self.task_pid, os.WNOHANG)
+
+            if pid == 0:
+                return True
+
+            self.finish_child(status)
+
+        if self.task_thread is not None:
+            if self.task_thread.is_alive():
+                return True
+
+            self.task_thread = None
+
+        return False
+
+    # block until the task (if any) is done
+    def wait(self):
+        if self.task_pid is not None:
+            pid, status = os.waitpid(self.task_pid, 0)
+
+            self.finish_child(status)
+
+        if self.task_thread is not None:
+            self.task_thread.join()
+            self.task_thread = None
+
+class SnapshotWriter:
+    '''
+        SnapshotWriter ~ writes snapshots of a PyMemDB in the background so the command loop keeps going
+    '''
+
+    mem_db = None
+    snapshot_path = None
+
+    # the background task writing the current snapshot
+    snapshot_task = None
+
+    def __init__(self, mem_db, snapshot_path):
+        self.mem_db = mem_db
+        self.snapshot_path = snapshot_path
+        self.snapshot_task = BackgroundTask()
+
+    # is a snapshot still being written?
+    def is_running(self):
+        return self.snapshot_task.is_running()
+
+    # how the last snapshot went, None until one finishes
+    def last_snapshot_ok(self):
+        return self.snapshot_task.ok
+
+    # start writing a snapshot in the background, False if one is already being written
+    def start(self):
+        return self.snapshot_task.start(self.mem_db, self.write_snapshot)
+
+    def write_snapshot(self, name_values, value_counts):
+        write_snapshot(self.snapshot_path, name_values, value_counts)
+
+    # block until the current snapshot (if any) is written
+    def wait(self):
+        self.snapshot_task.wait()
+
+    # SNAPSHOT, start writing a snapshot in the background
+    def process_SNAPSHOT(self, split_cmd, out_list):
+        if self.start():
+            self.mem_db.output_reply("OK", out_list)
+        else:
+            self.mem_db.output_reply("SNAPSHOT IN PROGRESS", out_list)
+
+        return True
+
+# command line options shared by PyMemDBImpl.py and PyMemDBServer.py
+def add_persistence_args(arg_parser):
+    arg_parser.add_argument("--aof", help="append-only log file, replayed at startup and appended to with every committed change")
+    arg_parser.add_argument("--fsync", choices=fsync_policies, default=FSYNC_INTERVAL, help="when the append-only log is fsync'd")
+    arg_parser.add_argument("--fsync-interval-ms", type=int, default=1000, help="how often to fsync with --fsync interval")
+    arg_parser.add_argument("--snapshot", help="binary snapshot file, loaded at startup (unless there is an --aof to replay) and written by SNAPSHOT")
+
+# set up persistence for mem_db from the parsed command line options
+def open_persistence(mem_db, args):
+
+    # the append-only log has every committed change so it wins over a snapshot
+    if args.snapshot and os.path.exists(args.snapshot) and not (args.aof and os.path.exists(args.aof)):
+        load_snapshot(args.snapshot, mem_db)
+
+    if args.aof:
+        append_only_log = open_append_only_log(mem_db, args.aof, args.fsync, args.fsync_interval_ms)
+        mem_db.add_command("REWRITE_LOG", 1, append_only_log.process_REWRITE_LOG)
+
+    if args.snapshot:
+        snapshot_writer = SnapshotWriter(mem_db, args.snapshot)
+        mem_db.add_command("SNAPSHOT", 1, snapshot_writer.process_SNAPSHOT)
@@ -0,0 +1,273 @@
+'''
+    PyMemDBProfiler ~ profile the PyMemDB command loop under live load, switched on and off with the PROFILE command
+    depenencies: Python 2.7.x
+
+        PROFILE START CPROFILE          - cProfile every function call the command loop makes from here on
+        PROFILE START SAMPLE [usecs]    - a background thread looks at the command loop's stack every usecs (1000 by
+                                          default), the loop itself runs untouched, a lot cheaper than cProfile
+        PROFILE STOP [top]              - stop, replies with the number of lines and then the top (20 by default)
+                                          functions, by own time for cProfile and by own samples for SAMPLE
+        PROFILE STATUS                  - "off", "cprofile" or "sample"
+
+    with --profile-dir every PROFILE STOP also writes the whole profile there, a .pstats file for cProfile (load it
+    with pstats or snakeviz) or a .folded file of collapsed stacks for SAMPLE (flamegraph.pl reads it), the first line
+    after the count is "dump:<path>", clients only ever name the kind of profile, never a path
+
+    both profile the thread that sent PROFILE START, which is the command loop for PyMemDBImpl.py and PyMemDBServer.py
+'''
+
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import time
+
+# replies to a PROFILE command that can't be done
+profiler_running_msg = "PROFILER RUNNING"
+profiler_not_running_msg = "PROFILER NOT RUNNING"
+bad_profile_msg = "BAD PROFILE OPTION"
+
+# how a function is shown in a report, "name (file:line)"
+def format_function(filename, line, func_name):
+    return func_name + " (" + os.path.basename(filename) + ":" + str(line) + ")"
+
+class CProfileProfiler:
+    '''
+        CProfileProfiler ~ cProfile on the calling thread, exact call counts and times but every call pays for it
+    '''
+
+    # what PROFILE STATUS shows and the dump file ends with
+    kind = "cprofile"
+    dump_extension = ".pstats"
+
+    profile = None
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    # the top functions by own time, "own_ms cumulative_ms calls name (file:line)"
+    def get_report(self, top=20):
+        function_stats = pstats.Stats(self.profile).stats
+
+        by_own_time = sorted(function_stats.iteritems(), key=lambda item: item[1][2], reverse=True)[:top]
+
+        report_lines = ["own_ms cumulative_ms calls function"]
+
+        for (filename, line, func_name), (prim_calls, num_calls, own_secs, cum_secs, callers) in by_own_time:
+            report_lines.append("%.3f %.3f %d %s" % (own_secs * 1000, cum_secs * 1000, num_calls, format_function(filename, line, func_name)))
+
+        return report_lines
+
+    def dump(self, path):
+        self.profile.dump_stats(path)
+
+class SamplingProfiler:
+    '''
+        SamplingProfiler ~ a background thread counting the stacks it sees on another thread every interval_secs
+    '''
+
+    kind = "sample"
+    dump_extension = ".folded"
+
+    # the thread we're sampling and how often
+    thread_id = None
+    interval_secs = 0.001
+
+    # stack (tuple of (filename, line, function) outermost first) -> number of samples it was seen in
+    stack_counts = {}
+    num_samples = 0
+
+    # set to stop the sampling thread
+    stop_event = None
+    sample_thread = None
+
+    def __init__(self, thread_id, interval_secs=0.001):
+        self.thread_id = thread_id
+        self.interval_secs = interval_secs
+        self.stack_counts = {}
+        self.num_samples = 0
+        self.stop_event = threading.Event()
+        self.sample_thread = None
+
+    def start(self):
+        self.sample_thread = threading.Thread(target=self.run_sampling)
+        self.sample_thread.daemon = True
+        self.sample_thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.sample_thread.join()
+
+    # runs on the sampling thread, the GIL hands it a turn every few bytecodes of the command loop
+    def run_sampling(self):
+        stack_counts = self.stack_counts
+
+        while not self.stop_event.is_set():
+            frame = sys._current_frames().get(self.thread_id)
+
+            # the sampled thread is gone, nothing more to see
+            if frame is None:
+                break
+
+            stack = []
+
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+                frame = frame.f_back
+
+            stack.reverse()
+            stack = tuple(stack)
+
+            stack_counts[stack] = stack_counts.get(stack, 0) + 1
+            self.num_samples += 1
+
+            time.sleep(self.interval_secs)
+
+    # the top functions by own samples, "own_% total_% own_samples name (file:line)"
+    # total counts every sample the function was anywhere on the stack in, once per sample
+    def get_report(self, top=20):
+        own_counts = {}
+        total_counts = {}
+
+        for stack, count in self.stack_counts.iteritems():
+            own_counts[stack[-1]] = own_counts.get(stack[-1], 0) + count
+
+            for function in set(stack):
+                total_counts[function] = total_counts.get(function, 0) + count
+
+        num_samples = max(self.num_samples, 1)
+
+        report_lines = ["samples:" + str(self.num_samples), "own_% total_% own_samples function"]
+
+        for function, count in sorted(own_counts.iteritems(), key=lambda item: item[1], reverse=True)[:top]:
+            report_lines.append("%.1f %.1f %d %s" % (100.0 * count / num_samples, 100.0 * total_counts[function] / num_samples, count,
+                                                     format_function(*function)))
+
+        return report_lines
+
+    # collapsed stacks, "outer;inner;innermost count" one stack per line
+    def dump(self, path):
+        with open(path, "w") as dump_file:
+            for stack, count in self.stack_counts.iteritems():
+                dump_file.write(";".join(func_name + ":" + os.path.basename(filename) for filename, line, func_name in stack) +
+                                " " + str(count) + "\n")
+
+class ProfileCommand:
+    '''
+        ProfileCommand ~ the PROFILE command for one PyMemDB, at most one profiler running at a time
+    '''
+
+    # the running profiler, None when nothing is being profiled
+    profiler = None
+
+    # where PROFILE STOP writes the whole profile, None means nowhere
+    profile_dir = None
+
+    def __init__(self, mem_db, profile_dir=None):
+        self.mem_db = mem_db
+        self.profiler = None
+        self.profile_dir = profile_dir
+
+    # start a "cprofile" or "sample" profiler on the calling thread, False if one is already running
+    def start(self, kind, interval_secs=0.001):
+        if self.profiler is not None:
+            return False
+
+        if kind == CProfileProfiler.kind:
+            self.profiler = CProfileProfiler()
+        else:
+            self.profiler = SamplingProfiler(threading.current_thread().ident, interval_secs)
+
+        self.profiler.start()
+
+        return True
+
+    # stop profiling, returns the report lines (with the dump path first when there is one), None if nothing was running
+    def stop(self, top=20):
+        profiler = self.profiler
+
+        if profiler is None:
+            return None
+
+        profiler.stop()
+        self.profiler = None
+
+        report_lines = profiler.get_report(top)
+
+        if self.profile_dir is not None:
+            dump_path = os.path.join(self.profile_dir, "pymemdb-" + profiler.kind + "-" + str(int(time.time() * 1000)) + profiler.dump_extension)
+            # a bad --profile-dir shouldn't take the command loop down with it
+            try:
+                profiler.dump(dump_path)
+
+                report_lines.insert(0, "dump:" + dump_path)
+            except (IOError, OSError) as dump_error:
+                report_lines.insert(0, "dump_failed:" + str(dump_error).replace("\n", " "))
+
+        return report_lines
+
+    # PROFILE START CPROFILE|SAMPLE [usecs], PROFILE STOP [top], PROFILE STATUS
+    def process_PROFILE(self, split_cmd, out_list):
+        output_reply = self.mem_db.output_reply
+
+        option = split_cmd[1] if len(split_cmd) > 1 else None
+
+        try:
+            if option == "START" and len(split_cmd) == 3 and split_cmd[2] == "CPROFILE":
+                started = self.start(CProfileProfiler.kind)
+
+            elif option == "START" and len(split_cmd) in (3, 4) and split_cmd[2] == "SAMPLE":
+                interval_usecs = int(split_cmd[3]) if len(split_cmd) == 4 else 1000
+                started = self.start(SamplingProfiler.kind, max(interval_usecs, 1) / 1000000.0)
+
+            elif option == "STOP" and len(split_cmd) in (2, 3):
+                report_lines = self.stop(max(int(split_cmd[2]), 0) if len(split_cmd) == 3 else 20)
+
+                if report_lines is None:
+                    output_reply(profiler_not_running_msg, out_list)
+                else:
+                    output_reply(str(len(report_lines)), out_list)
+
+                    for report_line in report_lines:
+                        output_reply(report_line, out_list)
+
+                return True
+
+            elif option == "STATUS" and len(split_cmd) == 2:
+                output_reply(self.profiler.kind if self.profiler is not None else "off", out_list)
+
+                return True
+
+            else:
+                output_reply(bad_profile_msg, out_list)
+
+                return True
+
+        except ValueError:
+            output_reply(bad_profile_msg, out_list)
+
+            return True
+
+        output_reply("OK" if started else profiler_running_msg, out_list)
+
+        return True
+
+# command line options for PyMemDBImpl.py and PyMemDBServer.py
+def add_profiler_args(arg_parser):
+    arg_parser.add_argument("--profile-dir", help="PROFILE STOP writes the whole profile to a new file in here")
+
+# add the PROFILE command to mem_db, returns the ProfileCommand
+def open_profiler(mem_db, args):
+    profile_command = ProfileCommand(mem_db, args.profile_dir)
+
+    mem_db.add_command("PROFILE", None, profile_command.process_PROFILE)
+
+    return profile_command
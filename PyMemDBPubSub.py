@@ -0,0 +1,411 @@
+'''
+    PyMemDBPubSub ~ publish/subscribe for PyMemDBServer clients, with keyspace notifications for committed changes
+    depenencies: Python 2.7.x
+
+        SUBSCRIBE channel [channel ...]     - get every message published on the channels, replies with how many
+                                              channels and patterns the client is now subscribed to
+        PSUBSCRIBE pattern [pattern ...]    - same for every channel matching the glob style patterns (*, ?, [abc])
+        UNSUBSCRIBE [channel ...]           - stop, every channel when none are given, replies like SUBSCRIBE
+        PUNSUBSCRIBE [pattern ...]          - same for patterns
+        PUBLISH channel message             - send message to the channel's subscribers, replies with how many got it
+        PUBSUB_INFO                         - the number of lines and then one "key:value" line each
+
+    a message reaches a client as "MESSAGE channel message", or "PMESSAGE pattern channel message" for a pattern,
+    every committed PUT or DELETE is published on "__key__:name" as "PUT" or "DELETE", so a cache can PSUBSCRIBE to
+    "__key__:user:*" instead of polling, the hub is a commit listener so writes in a transaction block only go out
+    once the outermost block commits and nothing rolled back by UN_COMMIT ever does, and it's only a commit listener
+    while someone is subscribed, so pub/sub costs the writes nothing until then
+
+    the write path only tacks the committed changes onto a list, they are matched against the subscriptions and
+    handed to the subscribers at the end of the batch in one block per subscriber (a PUBLISH publishes them first so
+    the order holds), a subscriber with more than max_out_bytes still waiting to be sent isn't handed any more until
+    it catches up, its messages wait in a queue of at most max_pending and past that the oldest are dropped, the next
+    block it gets starts with "DROPPED count" so it knows to throw its cache away, a slow subscriber costs memory up
+    to its limits and never stalls the writers
+'''
+
+import fnmatch
+import re
+
+from collections import deque
+
+# reply to a pub/sub command without enough arguments
+bad_pubsub_msg = "BAD PUBSUB COMMAND"
+
+# committed changes to name are published on key_channel_prefix + name
+key_channel_prefix = "__key__:"
+
+# the message for a committed PUT and a committed DELETE
+put_event = "PUT"
+delete_event = "DELETE"
+
+class Subscriber:
+    '''
+        Subscriber ~ one client's subscriptions and the messages waiting to be handed to it
+    '''
+
+    # what it's subscribed to, pattern -> compiled pattern
+    channels = set()
+    patterns = {}
+
+    # messages waiting to go out, at most max_pending of them
+    pending = None
+    max_pending = 10000
+
+    # messages dropped since the last block went out, and in total
+    num_dropped = 0
+    total_dropped = 0
+
+    # the client's connection, has queue_messages(data) and get_queued_bytes(), None means take_messages() is the
+    # only way the messages come out
+    client = None
+
+    def __init__(self, client=None, max_pending=10000):
+        self.channels = set()
+        self.patterns = {}
+        self.pending = deque()
+        self.max_pending = max_pending
+        self.num_dropped = 0
+        self.total_dropped = 0
+        self.client = client
+
+    # how many channels and patterns it's subscribed to, what (P)SUBSCRIBE and (P)UNSUBSCRIBE reply with
+    def get_num_subscriptions(self):
+        return len(self.channels) + len(self.patterns)
+
+    # queue a message line, dropping the oldest one when the queue is full
+    def add_message(self, message_line):
+        pending = self.pending
+
+        if len(pending) >= self.max_pending:
+            pending.popleft()
+            self.num_dropped += 1
+            self.total_dropped += 1
+
+        pending.append(message_line)
+
+    # every waiting message line, with a DROPPED line first if any were dropped since last time
+    def take_messages(self):
+        message_lines = list(self.pending)
+        self.pending.clear()
+
+        if self.num_dropped:
+            message_lines.insert(0, "DROPPED " + str(self.num_dropped))
+            self.num_dropped = 0
+
+        return message_lines
+
+    # hand the waiting messages to the client in one block, unless it already has max_out_bytes waiting to be sent
+    # returns how many messages went out
+    def flush(self, max_out_bytes):
+        client = self.client
+
+        if client is None or not (self.pending or self.num_dropped) or client.get_queued_bytes() >= max_out_bytes:
+            return 0
+
+        num_messages = len(self.pending)
+
+        client.queue_messages("\n".join(self.take_messages()) + "\n")
+
+        return num_messages
+
+class PubSubHub:
+    '''
+        PubSubHub ~ every subscription on one PyMemDB, a commit listener turning committed changes into messages
+    '''
+
+    # limits for every subscriber, see the module docs
+    max_pending = 10000
+    max_out_bytes = 1048576
+
+    mem_db = None
+
+    # transaction log -> the client connection that owns it, each connection has its own transaction log
+    clients = {}
+
+    # transaction log -> Subscriber, only for clients that have subscribed to something
+    subscribers = {}
+
+    # channel -> set of Subscribers, pattern -> (compiled pattern, set of Subscribers)
+    channel_subscribers = {}
+    pattern_subscribers = {}
+
+    # committed (name, value) changes since the last sync()
+    pending_mutations = []
+
+    # whether we're one of mem_db's commit listeners, only while anyone is subscribed so writes cost nothing otherwise
+    listening = False
+
+    # messages published (counting every subscriber that got one) and handed to clients so far
+    num_published = 0
+    num_delivered = 0
+
+    def __init__(self, mem_db, max_pending=10000, max_out_bytes=1048576):
+        self.mem_db = mem_db
+        self.max_pending = max_pending
+        self.max_out_bytes = max_out_bytes
+        self.clients = {}
+        self.subscribers = {}
+        self.channel_subscribers = {}
+        self.pattern_subscribers = {}
+        self.pending_mutations = []
+        self.listening = False
+        self.num_published = 0
+        self.num_delivered = 0
+
+    # start hearing about commits once there's a subscription, stop once there are none left
+    # never called from inside sync(), so the commit listeners aren't changed while they're being synced
+    def update_listening(self):
+        subscribed = bool(self.channel_subscribers or self.pattern_subscribers)
+
+        if subscribed and not self.listening:
+            self.mem_db.add_commit_listener(self)
+            self.listening = True
+
+        elif not subscribed and self.listening:
+            self.mem_db.remove_commit_listener(self)
+            self.listening = False
+
+            # nothing more will be published, hand out what we can, a client still too far behind loses the rest
+            # but it has unsubscribed from everything by now
+            self.pending_mutations = []
+
+            for subscriber in self.subscribers.itervalues():
+                self.num_delivered += subscriber.flush(self.max_out_bytes)
+                subscriber.pending.clear()
+                subscriber.num_dropped = 0
+
+    # a connection's messages go to client, it has queue_messages(data) and get_queued_bytes()
+    def add_client(self, transaction_log, client):
+        self.clients[transaction_log] = client
+
+        if transaction_log in self.subscribers:
+            self.subscribers[transaction_log].client = client
+
+    # the connection is gone, so are its subscriptions
+    def remove_client(self, transaction_log):
+        self.clients.pop(transaction_log, None)
+
+        subscriber = self.subscribers.pop(transaction_log, None)
+
+        if subscriber is not None:
+            self.unsubscribe(subscriber, list(subscriber.channels))
+            self.punsubscribe(subscriber, list(subscriber.patterns))
+
+    # the Subscriber for the client whose commands are running now
+    def get_subscriber(self):
+        transaction_log = self.mem_db.mem_db_transaction_log
+        subscriber = self.subscribers.get(transaction_log)
+
+        if subscriber is None:
+            subscriber = Subscriber(self.clients.get(transaction_log), self.max_pending)
+            self.subscribers[transaction_log] = subscriber
+
+        return subscriber
+
+    # add channels to subscriber's subscriptions
+    def subscribe(self, subscriber, channels):
+        for channel in channels:
+            subscriber.channels.add(channel)
+            self.channel_subscribers.setdefault(channel, set()).add(subscriber)
+
+        self.update_listening()
+
+    # take channels out of subscriber's subscriptions, forgetting channels no one is subscribed to any more
+    def unsubscribe(self, subscriber, channels):
+        for channel in channels:
+            subscriber.channels.discard(channel)
+            channel_subscribers = self.channel_subscribers.get(channel)
+
+            if channel_subscribers is not None:
+                channel_subscribers.discard(subscriber)
+
+                if not channel_subscribers:
+                    del self.channel_subscribers[channel]
+
+        self.update_listening()
+
+    # add patterns to subscriber's subscriptions, each pattern is compiled once however many subscribe to it
+    def psubscribe(self, subscriber, patterns):
+        for pattern in patterns:
+            if pattern not in self.pattern_subscribers:
+                self.pattern_subscribers[pattern] = (re.compile(fnmatch.translate(pattern)), set())
+
+            compiled_pattern, pattern_subscribers = self.pattern_subscribers[pattern]
+
+            subscriber.patterns[pattern] = compiled_pattern
+            pattern_subscribers.add(subscriber)
+
+        self.update_listening()
+
+    # take patterns out of subscriber's subscriptions
+    def punsubscribe(self, subscriber, patterns):
+        for pattern in patterns:
+            subscriber.patterns.pop(pattern, None)
+            compiled_pattern, pattern_subscribers = self.pattern_subscribers.get(pattern, (None, None))
+
+            if pattern_subscribers is not None:
+                pattern_subscribers.discard(subscriber)
+
+                if not pattern_subscribers:
+                    del self.pattern_subscribers[pattern]
+
+        self.update_listening()
+
+    # queue message for everyone subscribed to channel or a pattern matching it, returns how many that was
+    def publish(self, channel, message):
+        num_receivers = 0
+
+        channel_subscribers = self.channel_subscribers.get(channel)
+
+        if channel_subscribers:
+            message_line = "MESSAGE " + channel + " " + message
+
+            for subscriber in channel_subscribers:
+                subscriber.add_message(message_line)
+
+            num_receivers += len(channel_subscribers)
+
+        for pattern, (compiled_pattern, pattern_subscribers) in self.pattern_subscribers.iteritems():
+            if compiled_pattern.match(channel):
+                message_line = "PMESSAGE " + pattern + " " + channel + " " + message
+
+                for subscriber in pattern_subscribers:
+                    subscriber.add_message(message_line)
+
+                num_receivers += len(pattern_subscribers)
+
+        self.num_published += num_receivers
+
+        return num_receivers
+
+    # the write path only remembers the changes
+    def on_commit(self, mutations, transaction):
+        self.pending_mutations.extend(mutations)
+
+    # publish the committed changes remembered so far
+    def publish_pending_mutations(self):
+        pending_mutations = self.pending_mutations
+        self.pending_mutations = []
+
+        for name, value in pending_mutations:
+            self.publish(key_channel_prefix + name, delete_event if value is None else put_event)
+
+    # publish the batch's committed changes and hand every subscriber its messages
+    def sync(self):
+        if self.pending_mutations:
+            self.publish_pending_mutations()
+
+        for subscriber in self.subscribers.itervalues():
+            if subscriber.pending or subscriber.num_dropped:
+                self.num_delivered += subscriber.flush(self.max_out_bytes)
+
+    # nothing to flush, undelivered messages go with the connections
+    def close(self):
+        pass
+
+    # SUBSCRIBE channel [channel ...]
+    def process_SUBSCRIBE(self, split_cmd, out_list):
+        if len(split_cmd) < 2:
+            self.mem_db.output_reply(bad_pubsub_msg, out_list)
+
+            return True
+
+        subscriber = self.get_subscriber()
+        self.subscribe(subscriber, split_cmd[1:])
+        self.mem_db.output_reply(str(subscriber.get_num_subscriptions()), out_list)
+
+        return True
+
+    # PSUBSCRIBE pattern [pattern ...]
+    def process_PSUBSCRIBE(self, split_cmd, out_list):
+        if len(split_cmd) < 2:
+            self.mem_db.output_reply(bad_pubsub_msg, out_list)
+
+            return True
+
+        subscriber = self.get_subscriber()
+        self.psubscribe(subscriber, split_cmd[1:])
+        self.mem_db.output_reply(str(subscriber.get_num_subscriptions()), out_list)
+
+        return True
+
+    # UNSUBSCRIBE [channel ...]
+    def process_UNSUBSCRIBE(self, split_cmd, out_list):
+        subscriber = self.get_subscriber()
+        self.unsubscribe(subscriber, split_cmd[1:] if len(split_cmd) > 1 else list(subscriber.channels))
+        self.mem_db.output_reply(str(subscriber.get_num_subscriptions()), out_list)
+
+        return True
+
+    # PUNSUBSCRIBE [pattern ...]
+    def process_PUNSUBSCRIBE(self, split_cmd, out_list):
+        subscriber = self.get_subscriber()
+        self.punsubscribe(subscriber, split_cmd[1:] if len(split_cmd) > 1 else list(subscriber.patterns))
+        self.mem_db.output_reply(str(subscriber.get_num_subscriptions()), out_list)
+
+        return True
+
+    # PUBLISH channel message, the rest of the line is the message
+    def process_PUBLISH(self, split_cmd, out_list):
+        if len(split_cmd) < 3:
+            self.mem_db.output_reply(bad_pubsub_msg, out_list)
+
+            return True
+
+        # anything committed before the PUBLISH goes out before it
+        if self.pending_mutations:
+            self.publish_pending_mutations()
+
+        self.mem_db.output_reply(str(self.publish(split_cmd[1], " ".join(split_cmd[2:]))), out_list)
+
+        return True
+
+    # PUBSUB_INFO, the number of lines and then one "key:value" line each
+    def process_PUBSUB_INFO(self, split_cmd, out_list):
+        subscribers = self.subscribers.values()
+
+        info_lines = [
+            "subscribers:" + str(len([subscriber for subscriber in subscribers if subscriber.get_num_subscriptions()])),
+            "channels:" + str(len(self.channel_subscribers)),
+            "patterns:" + str(len(self.pattern_subscribers)),
+            "published:" + str(self.num_published),
+            "delivered:" + str(self.num_delivered),
+            "pending:" + str(sum(len(subscriber.pending) for subscriber in subscribers)),
+            "dropped:" + str(sum(subscriber.total_dropped for subscriber in subscribers))
+        ]
+
+        self.mem_db.output_reply(str(len(info_lines)), out_list)
+
+        for info_line in info_lines:
+            self.mem_db.output_reply(info_line, out_list)
+
+        return True
+
+# add the pub/sub commands to mem_db, its committed changes are published once someone subscribes, returns the PubSubHub
+def open_pubsub(mem_db, max_pending=10000, max_out_bytes=1048576):
+    pubsub_hub = PubSubHub(mem_db, max_pending, max_out_bytes)
+
+    mem_db.add_command("SUBSCRIBE", None, pubsub_hub.process_SUBSCRIBE)
+    mem_db.add_command("PSUBSCRIBE", None, pubsub_hub.process_PSUBSCRIBE)
+    mem_db.add_command("UNSUBSCRIBE", None, pubsub_hub.process_UNSUBSCRIBE)
+    mem_db.add_command("PUNSUBSCRIBE", None, pubsub_hub.process_PUNSUBSCRIBE)
+    mem_db.add_command("PUBLISH", None, pubsub_hub.process_PUBLISH)
+    mem_db.add_command("PUBSUB_INFO", 1, pubsub_hub.process_PUBSUB_INFO)
+
+    return pubsub_hub
+
+# command line options for PyMemDBServer.py
+def add_pubsub_args(arg_parser):
+    arg_parser.add_argument("--pubsub", action="store_true", help="SUBSCRIBE/PUBLISH and keyspace notifications for committed changes")
+    arg_parser.add_argument("--pubsub-max-pending", type=int, default=10000, help="messages kept for a subscriber that's behind, the oldest are dropped past this")
+    arg_parser.add_argument("--pubsub-max-out-bytes", type=int, default=1048576, help="a subscriber with this many bytes unsent isn't handed any more")
+
+# set up pub/sub for a PyMemDBServer from the parsed command line options, returns the PubSubHub or None
+def open_server_pubsub(mem_db_server, args):
+    if not args.pubsub:
+        return None
+
+    mem_db_server.pubsub_hub = open_pubsub(mem_db_server.mem_db, args.pubsub_max_pending, args.pubsub_max_out_bytes)
+
+    return mem_db_server.pubsub_hub
@@ -0,0 +1,812 @@
+'''
+    PyMemDBReplication ~ primary/replica replication for PyMemDBServer, the primary streams its committed changes
+    depenencies: Python 2.7.x
+
+    the primary's ReplicationFeed is a commit listener, every committed change is encoded into the same PUT/DELETE
+    (and START_COMMIT/COMMIT) lines the append-only log uses and streamed to every replica, the feed's offset is the
+    number of bytes of changes it has produced so far and the last backlog_size bytes are kept around
+
+    a replica connects to the primary's replication port and sends "SYNC replid offset":
+        CONTINUE replid offset               - it's our history and the offset is still in the backlog, everything
+                                               after the offset follows
+        FULLSYNC replid offset num_bytes     - a snapshot of num_bytes (written in the background, like SNAPSHOT)
+                                               follows, then everything committed after it was taken
+    after that the primary sends a "PING offset time" line every ping_interval seconds so the replica knows how far
+    behind it is, and the replica sends "ACK offset" lines back as it applies changes so the primary knows too
+
+    replicas only apply a transaction once its COMMIT line arrives, reconnect on their own and pick up where they
+    left off from the backlog when they can, and turn away every write from their own clients with "READ ONLY REPLICA"
+'''
+
+import asyncore
+import collections
+import os
+import socket
+import sys
+import tempfile
+import time
+
+import PyMemDBPersistence
+
+# the commands a replica's clients aren't allowed to send
+write_commands = ["PUT", "DELETE", "EXPIRE", "PERSIST", "PUTEX", "MPUT", "MDELETE", "INCR", "INCRBY", "DECR", "CAS"]
+
+read_only_msg = "READ ONLY REPLICA"
+
+# replica connection states, as reported by REPLICATION_INFO
+STATE_CONNECTING = "connecting"
+STATE_HANDSHAKE = "handshake"
+STATE_WAIT_SNAPSHOT = "wait_snapshot"
+STATE_LOADING = "loading"
+STATE_ONLINE = "online"
+STATE_DISCONNECTED = "disconnected"
+
+# a new random id for a history of changes, a replica can only continue from an offset in the same history
+def new_replid():
+    return os.urandom(8).encode("hex")
+
+class ReplicationFeed:
+    '''
+        ReplicationFeed ~ commit listener on the primary, keeps the backlog and pushes changes to every replica
+    '''
+
+    # how many bytes of changes we keep for replicas catching up after a disconnect
+    backlog_size = 16777216
+
+    # how often online replicas are sent a PING
+    ping_interval = 1.0
+
+    mem_db = None
+
+    # our history and how many bytes of changes it has so far
+    replid = None
+    offset = 0
+
+    # changes committed since the last sync()
+    pending_records = []
+
+    # (start offset, data) chunks covering backlog_start up to offset
+    backlog = None
+    backlog_start = 0
+    backlog_bytes = 0
+
+    # every connected ReplicaConnection
+    replicas = []
+
+    # the background snapshot for full syncs, where it's written and the offset it was taken at
+    snapshot_task = None
+    snapshot_path = None
+    snapshot_offset = 0
+
+    last_ping_time = 0
+
+    def __init__(self, mem_db, backlog_size=16777216):
+        self.mem_db = mem_db
+        self.backlog_size = backlog_size
+
+        self.replid = new_replid()
+        self.offset = 0
+        self.pending_records = []
+
+        self.backlog = collections.deque()
+        self.backlog_start = 0
+        self.backlog_bytes = 0
+
+        self.replicas = []
+
+        self.snapshot_task = None
+        self.snapshot_path = None
+        self.snapshot_offset = 0
+
+        self.last_ping_time = time.time()
+
+    # buffer the committed changes, they go out to the replicas together at the next sync()
+    def on_commit(self, mutations, transaction):
+        PyMemDBPersistence.encode_mutations(mutations, transaction, self.pending_records)
+
+    # move everything buffered into the backlog and out to the online replicas
+    def flush_pending(self):
+        if not self.pending_records:
+            return
+
+        data = "".join(self.pending_records)
+        self.pending_records = []
+
+        self.backlog.append((self.offset, data))
+        self.backlog_bytes += len(data)
+        self.offset += len(data)
+
+        # always keep the newest chunk, however big it is
+        while self.backlog_bytes > self.backlog_size and len(self.backlog) > 1:
+            start_offset, old_data = self.backlog.popleft()
+            self.backlog_bytes -= len(old_data)
+            self.backlog_start = start_offset + len(old_data)
+
+        for replica in list(self.replicas):
+            if replica.state == STATE_ONLINE:
+                replica.queue_data(data)
+
+    # can a replica that's applied everything up to offset in our history catch up from the backlog?
+    def has_backlog_from(self, offset):
+        return self.backlog_start <= offset <= self.offset
+
+    # everything in the backlog after offset
+    def get_backlog_from(self, offset):
+        chunks = []
+
+        for start_offset, data in self.backlog:
+            if start_offset + len(data) <= offset:
+                continue
+
+            if start_offset < offset:
+                data = data[offset - start_offset:]
+
+            chunks.append(data)
+
+        return "".join(chunks)
+
+    # start over with a new history, used when a replica that is also a primary loads a full sync
+    # our own replicas can't continue from the old history, so they're dropped and come back for a full sync
+    def reset_history(self):
+        self.pending_records = []
+        self.replid = new_replid()
+        self.backlog = collections.deque()
+        self.backlog_start = self.offset
+        self.backlog_bytes = 0
+
+        for replica in list(self.replicas):
+            replica.handle_close()
+
+    def add_replica(self, replica):
+        self.replicas.append(replica)
+
+    def remove_replica(self, replica):
+        if replica in self.replicas:
+            self.replicas.remove(replica)
+
+    # a replica sent "SYNC replid offset", continue from the backlog if we can, otherwise it needs a full sync
+    def sync_replica(self, replica, replid, offset):
+        self.flush_pending()
+
+        if replid == self.replid and self.has_backlog_from(offset):
+            replica.start_continue(self.replid, offset, self.get_backlog_from(offset))
+        else:
+            replica.state = STATE_WAIT_SNAPSHOT
+
+    # the replicas waiting on a snapshot for a full sync
+    def get_waiting_replicas(self):
+        return [replica for replica in self.replicas if replica.state == STATE_WAIT_SNAPSHOT]
+
+    # start writing a snapshot in the background for the replicas waiting on one
+    def start_snapshot(self):
+        snapshot_fd, self.snapshot_path = tempfile.mkstemp(prefix="pymemdb_repl_", suffix=".snap")
+        os.close(snapshot_fd)
+
+        # everything committed so far is in the snapshot, the replicas pick up the stream from here
+        self.flush_pending()
+        self.snapshot_offset = self.offset
+
+        self.snapshot_task = PyMemDBPersistence.BackgroundTask()
+        self.snapshot_task.start(self.mem_db, self.write_snapshot)
+
+    def write_snapshot(self, name_values, value_counts):
+        PyMemDBPersistence.write_snapshot(self.snapshot_path, name_values, value_counts)
+
+    # the snapshot is written, send it to every replica waiting on one
+    def finish_snapshot(self):
+        snapshot_path = self.snapshot_path
+
+        if self.snapshot_task.ok:
+            for replica in self.get_waiting_replicas():
+
+                # a replica that waited so long the backlog moved on waits for the next snapshot
+                if self.has_backlog_from(self.snapshot_offset):
+                    replica.start_full_sync(self.replid, self.snapshot_offset, snapshot_path,
+                                            self.get_backlog_from(self.snapshot_offset))
+
+        else:
+            sys.stderr.write("PyMemDB replication snapshot failed\n")
+
+        # the replicas have it open, we can let go of the name
+        if os.path.exists(snapshot_path):
+            os.remove(snapshot_path)
+
+        self.snapshot_task = None
+        self.snapshot_path = None
+
+    # send every online replica a PING with our offset and the time
+    def send_pings(self):
+        ping = "PING " + str(self.offset) + " " + repr(time.time()) + "\n"
+
+        for replica in self.replicas:
+            if replica.state == STATE_ONLINE:
+                replica.queue_data(ping)
+
+    # push out the changes from the last batch, keep full syncs moving and PING every so often
+    def sync(self):
+        self.flush_pending()
+
+        if self.snapshot_task is not None and not self.snapshot_task.is_running():
+            self.finish_snapshot()
+
+        if self.snapshot_task is None and self.get_waiting_replicas():
+            self.start_snapshot()
+
+        cur_time = time.time()
+
+        if cur_time - self.last_ping_time >= self.ping_interval:
+            self.send_pings()
+            self.last_ping_time = cur_time
+
+    def close(self):
+        if self.snapshot_task is not None:
+            self.snapshot_task.wait()
+            self.finish_snapshot()
+
+        for replica in list(self.replicas):
+            replica.close()
+
+    # REPLICATION_INFO, the number of lines and then one "key:value" line each
+    def process_REPLICATION_INFO(self, split_cmd, out_list):
+        cur_time = time.time()
+
+        info_lines = [
+            "role:primary",
+            "replid:" + self.replid,
+            "offset:" + str(self.offset),
+            "backlog_bytes:" + str(self.backlog_bytes),
+            "connected_replicas:" + str(len(self.replicas)),
+        ]
+
+        for replica_num, replica in enumerate(self.replicas):
+            info_lines.append("replica" + str(replica_num) + ":" + replica.get_info(self.offset, cur_time))
+
+        self.mem_db.output_reply(str(len(info_lines)), out_list)
+
+        for info_line in info_lines:
+            self.mem_db.output_reply(info_line, out_list)
+
+        return True
+
+class ReplicaConnection(asyncore.dispatcher):
+    '''
+        ReplicaConnection ~ the primary's end of a connection from one replica
+    '''
+
+    read_size = 65536
+
+    # how much of the snapshot we read in at once, and how much we hand to send() at once
+    snapshot_read_size = 262144
+    send_size = 262144
+
+    # a replica that falls this far behind on reading is dropped, it can catch up from the backlog when it reconnects
+    max_queued_bytes = 67108864
+
+    def __init__(self, sock, feed, socket_map=None):
+        asyncore.dispatcher.__init__(self, sock, socket_map)
+
+        self.feed = feed
+        self.state = STATE_HANDSHAKE
+
+        try:
+            self.peer_name = "%s:%d" % sock.getpeername()[:2]
+        except socket.error:
+            self.peer_name = "?"
+
+        self.in_buffer = ""
+
+        # what's being sent right now and how far into it we are
+        self.out_buffer = ""
+        self.out_pos = 0
+
+        # the snapshot being sent during a full sync, goes out before anything in out_chunks
+        self.snapshot_file = None
+
+        # changes queued up behind the snapshot (or behind out_buffer)
+        self.out_chunks = collections.deque()
+        self.queued_bytes = 0
+
+        # the offset the replica last told us it applied, and when
+        self.acked_offset = 0
+        self.last_ack_time = time.time()
+
+        feed.add_replica(self)
+
+    # queue changes for the replica
+    def queue_data(self, data):
+        self.out_chunks.append(data)
+        self.queued_bytes += len(data)
+
+        if self.queued_bytes > self.max_queued_bytes:
+            sys.stderr.write("PyMemDB replica " + self.peer_name + " fell too far behind, dropping it\n")
+            self.handle_close()
+
+    # the replica can continue from offset in our history
+    def start_continue(self, replid, offset, backlog_data):
+        self.state = STATE_ONLINE
+        self.acked_offset = offset
+        self.out_chunks.append("CONTINUE " + replid + " " + str(offset) + "\n")
+        self.queue_data(backlog_data)
+
+    # send the replica a snapshot taken at offset, then everything after it
+    def start_full_sync(self, replid, offset, snapshot_path, backlog_data):
+        self.state = STATE_ONLINE
+        self.acked_offset = offset
+        self.snapshot_file = open(snapshot_path, "rb")
+
+        num_bytes = os.fstat(self.snapshot_file.fileno()).st_size
+
+        self.out_buffer = "FULLSYNC " + replid + " " + str(offset) + " " + str(num_bytes) + "\n"
+        self.out_pos = 0
+        self.queue_data(backlog_data)
+
+    # a one line summary for REPLICATION_INFO
+    def get_info(self, offset, cur_time):
+        lag_bytes = max(offset - self.acked_offset, 0)
+
+        return (self.peer_name + " state=" + self.state + " acked_offset=" + str(self.acked_offset) +
+                " lag_bytes=" + str(lag_bytes) + " last_ack_secs=" + ("%.3f" % (cur_time - self.last_ack_time)))
+
+    # the replica only ever sends SYNC and ACK lines
+    def process_line(self, line):
+        split_line = line.split()
+
+        if len(split_line) == 3 and split_line[0] == "SYNC" and self.state == STATE_HANDSHAKE:
+            try:
+                offset = int(split_line[2])
+            except ValueError:
+                offset = -1
+
+            self.feed.sync_replica(self, split_line[1], offset)
+
+        elif len(split_line) == 2 and split_line[0] == "ACK":
+            try:
+                self.acked_offset = int(split_line[1])
+            except ValueError:
+                return
+
+            self.last_ack_time = time.time()
+
+    def handle_read(self):
+        data = self.recv(self.read_size)
+
+        if not data:
+            return
+
+        self.in_buffer += data
+
+        last_newline = self.in_buffer.rfind("\n")
+
+        if last_newline < 0:
+            return
+
+        lines = self.in_buffer[:last_newline].split("\n")
+        self.in_buffer = self.in_buffer[last_newline + 1:]
+
+        for line in lines:
+            self.process_line(line)
+
+    # refill out_buffer from the snapshot, or from the queued changes once the snapshot is all out
+    def fill_out_buffer(self):
+        if self.snapshot_file is not None:
+            self.out_buffer = self.snapshot_file.read(self.snapshot_read_size)
+            self.out_pos = 0
+
+            if self.out_buffer:
+                return
+
+            self.snapshot_file.close()
+            self.snapshot_file = None
+
+        self.out_buffer = "".join(self.out_chunks)
+        self.out_pos = 0
+        self.out_chunks.clear()
+        self.queued_bytes = 0
+
+    def writable(self):
+        return self.out_pos < len(self.out_buffer) or self.snapshot_file is not None or len(self.out_chunks) > 0
+
+    def handle_write(self):
+        if self.out_pos >= len(self.out_buffer):
+            self.fill_out_buffer()
+
+        if self.out_pos < len(self.out_buffer):
+            self.out_pos += self.send(self.out_buffer[self.out_pos:self.out_pos + self.send_size])
+
+    def handle_close(self):
+        self.close()
+
+    def close(self):
+        if self.snapshot_file is not None:
+            self.snapshot_file.close()
+            self.snapshot_file = None
+
+        self.state = STATE_DISCONNECTED
+        self.feed.remove_replica(self)
+
+        asyncore.dispatcher.close(self)
+
+class ReplicationListener(asyncore.dispatcher):
+    '''
+        ReplicationListener ~ accepts replica connections on the primary's replication port
+    '''
+
+    listen_backlog = 16
+
+    def __init__(self, feed, host="127.0.0.1", port=6381, socket_map=None):
+        asyncore.dispatcher.__init__(self, map=socket_map)
+
+        self.feed = feed
+        self.socket_map = socket_map
+
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.set_reuse_addr()
+        self.bind((host, port))
+        self.listen(self.listen_backlog)
+
+    # the address we actually bound to, useful when passing in port 0
+    def get_address(self):
+        return self.socket.getsockname()
+
+    def handle_accept(self):
+        pair = self.accept()
+
+        if pair is not None:
+            sock, addr = pair
+            ReplicaConnection(sock, self.feed, self.socket_map)
+
+class ReplicaClient(asyncore.dispatcher):
+    '''
+        ReplicaClient ~ the replica's connection to its primary, applies the primary's changes as they're streamed in
+            - also a commit listener on the replica, purely so sync() gets called every tick to ACK and reconnect
+    '''
+
+    read_size = 65536
+
+    # how long we wait between attempts to reconnect, and how often we ACK when nothing is coming in
+    reconnect_secs = 1.0
+    ack_interval = 1.0
+
+    mem_db = None
+
+    # the full command table, with the writes the replica's own clients aren't allowed
+    apply_command_table = None
+
+    # where our primary is
+    primary_address = None
+
+    # the primary's history we're following and how much of it we've applied, "?" and -1 until our first sync
+    replid = "?"
+    offset = -1
+
+    # the primary's offset as of its last PING, and when we last heard anything from it
+    primary_offset = 0
+    last_contact_time = 0
+
+    # our own ReplicationFeed when we're also a primary for other replicas, reset after every full sync
+    feed = None
+
+    def __init__(self, mem_db, primary_host, primary_port, socket_map=None, feed=None):
+        asyncore.dispatcher.__init__(self, map=socket_map)
+
+        self.mem_db = mem_db
+        self.primary_address = (primary_host, primary_port)
+        self.socket_map = socket_map
+        self.feed = feed
+
+        # switching the command stats or the slow log on or off rewraps this along with mem_db's own tables
+        self.apply_command_table = dict(mem_db.command_table)
+        mem_db.add_command_table(self.apply_command_table)
+
+        self.replid = "?"
+        self.offset = -1
+        self.primary_offset = 0
+
+        self.state = STATE_DISCONNECTED
+        self.in_buffer = ""
+        self.out_buffer = ""
+
+        # the snapshot coming in during a full sync, and how much of it is left
+        self.snapshot_file = None
+        self.snapshot_path = None
+        self.snapshot_bytes_left = 0
+
+        self.num_full_syncs = 0
+        self.num_partial_syncs = 0
+
+        self.last_contact_time = time.time()
+        self.last_connect_time = 0
+        self.last_ack_time = 0
+        self.acked_offset = -1
+
+        self.connect_to_primary()
+
+    def connect_to_primary(self):
+        self.last_connect_time = time.time()
+        self.state = STATE_CONNECTING
+        self.in_buffer = ""
+        self.out_buffer = ""
+
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+
+        try:
+            self.connect(self.primary_address)
+        except socket.error:
+            self.handle_close()
+
+    def handle_connect(self):
+        self.state = STATE_HANDSHAKE
+        self.last_contact_time = time.time()
+        self.out_buffer += "SYNC " + self.replid + " " + str(self.offset) + "\n"
+
+    # apply a run of complete change lines, returns the number of bytes applied
+    def apply_lines(self, lines):
+        dispatch_command = self.mem_db.dispatch_command
+        apply_command_table = self.apply_command_table
+        out_list = []
+
+        for line in lines:
+            dispatch_command(apply_command_table, line.split(), out_list)
+
+        return sum(len(line) + 1 for line in lines)
+
+    # pull complete change lines out of in_buffer and apply them, a transaction is only applied once its COMMIT is in
+    def process_stream(self):
+        last_newline = self.in_buffer.rfind("\n")
+
+        if last_newline < 0:
+            return
+
+        lines = self.in_buffer[:last_newline].split("\n")
+
+        # the lines that make up complete changes, and the start of a transaction we're still waiting on the rest of
+        apply_lines = []
+        transaction_start = None
+        num_consumed = 0
+
+        for line_num, line in enumerate(lines):
+            if line.startswith("PING "):
+                if transaction_start is None:
+                    self.process_ping(line)
+                    num_consumed = line_num + 1
+
+                continue
+
+            apply_lines.append(line)
+
+            if line == "START_COMMIT":
+                transaction_start = len(apply_lines) - 1
+            elif line == "COMMIT":
+                transaction_start = None
+
+            if transaction_start is None:
+                num_consumed = line_num + 1
+
+        if transaction_start is not None:
+            del apply_lines[transaction_start:]
+
+        # hang on to an unfinished transaction (and any partial line) until the rest arrives
+        self.in_buffer = "\n".join(lines[num_consumed:] + [self.in_buffer[last_newline + 1:]])
+
+        if apply_lines:
+            self.offset += self.apply_lines(apply_lines)
+            self.primary_offset = max(self.primary_offset, self.offset)
+
+            # the batch's changes go out to our own commit listeners right away
+            self.mem_db.sync_commit_listeners()
+
+    # "PING offset time" from the primary
+    def process_ping(self, line):
+        split_line = line.split()
+
+        try:
+            self.primary_offset = max(int(split_line[1]), self.offset)
+        except (IndexError, ValueError):
+            pass
+
+    # the first line back from the primary, CONTINUE or FULLSYNC
+    def process_handshake(self):
+        newline = self.in_buffer.find("\n")
+
+        if newline < 0:
+            return False
+
+        split_line = self.in_buffer[:newline].split()
+        self.in_buffer = self.in_buffer[newline + 1:]
+
+        if len(split_line) == 3 and split_line[0] == "CONTINUE":
+            self.replid = split_line[1]
+            self.offset = int(split_line[2])
+            self.num_partial_syncs += 1
+            self.state = STATE_ONLINE
+
+        elif len(split_line) == 4 and split_line[0] == "FULLSYNC":
+            self.replid = split_line[1]
+            self.offset = int(split_line[2])
+            self.snapshot_bytes_left = int(split_line[3])
+
+            snapshot_fd, self.snapshot_path = tempfile.mkstemp(prefix="pymemdb_replica_", suffix=".snap")
+            self.snapshot_file = os.fdopen(snapshot_fd, "wb")
+            self.state = STATE_LOADING
+
+        else:
+            sys.stderr.write("PyMemDB replica got a bad handshake from the primary: " + " ".join(split_line) + "\n")
+            self.handle_close()
+            return False
+
+        return True
+
+    # write the snapshot out as it comes in, load it once it's all here
+    def process_snapshot(self):
+        snapshot_data = self.in_buffer[:self.snapshot_bytes_left]
+        self.in_buffer = self.in_buffer[len(snapshot_data):]
+
+        self.snapshot_file.write(snapshot_data)
+        self.snapshot_bytes_left -= len(snapshot_data)
+
+        if self.snapshot_bytes_left > 0:
+            return False
+
+        self.snapshot_file.close()
+        self.snapshot_file = None
+
+        PyMemDBPersistence.load_snapshot(self.snapshot_path, self.mem_db)
+
+        os.remove(self.snapshot_path)
+        self.snapshot_path = None
+
+        self.num_full_syncs += 1
+        self.primary_offset = self.offset
+        self.state = STATE_ONLINE
+
+        if self.feed is not None:
+            self.feed.reset_history()
+
+        return True
+
+    def handle_read(self):
+        data = self.recv(self.read_size)
+
+        if not data:
+            return
+
+        self.in_buffer += data
+        self.last_contact_time = time.time()
+
+        if self.state == STATE_HANDSHAKE and not self.process_handshake():
+            return
+
+        if self.state == STATE_LOADING and not self.process_snapshot():
+            return
+
+        if self.state == STATE_ONLINE:
+            self.process_stream()
+            self.send_ack()
+
+    # tell the primary how far we've got, if it's moved since we last did
+    def send_ack(self):
+        if self.offset != self.acked_offset:
+            self.out_buffer += "ACK " + str(self.offset) + "\n"
+            self.acked_offset = self.offset
+            self.last_ack_time = time.time()
+
+    def writable(self):
+        return self.connecting or len(self.out_buffer) > 0
+
+    def handle_write(self):
+        if self.out_buffer:
+            sent = self.send(self.out_buffer)
+            self.out_buffer = self.out_buffer[sent:]
+
+    # lost the primary (or couldn't reach it), sync() tries again after reconnect_secs
+    def handle_close(self):
+        if self.snapshot_file is not None:
+            self.snapshot_file.close()
+            self.snapshot_file = None
+
+            os.remove(self.snapshot_path)
+            self.snapshot_path = None
+
+        self.state = STATE_DISCONNECTED
+        self.close()
+
+    # report losing the primary once, not every failed attempt to reconnect
+    def handle_error(self):
+        if self.state != STATE_CONNECTING:
+            sys.stderr.write("PyMemDB replica lost its primary: " + str(sys.exc_info()[1]) + "\n")
+
+        self.handle_close()
+
+    def on_commit(self, mutations, transaction):
+        pass
+
+    # reconnect if we've lost the primary and ACK every so often even when nothing's changing
+    def sync(self):
+        cur_time = time.time()
+
+        if self.state == STATE_DISCONNECTED:
+            if cur_time - self.last_connect_time >= self.reconnect_secs:
+                self.connect_to_primary()
+
+        elif self.state == STATE_ONLINE and cur_time - self.last_ack_time >= self.ack_interval:
+            self.acked_offset = -1
+            self.send_ack()
+
+    # REPLICATION_INFO, the number of lines and then one "key:value" line each
+    def process_REPLICATION_INFO(self, split_cmd, out_list):
+        info_lines = [
+            "role:replica",
+            "primary:%s:%d" % self.primary_address,
+            "state:" + self.state,
+            "replid:" + self.replid,
+            "offset:" + str(self.offset),
+            "primary_offset:" + str(self.primary_offset),
+            "lag_bytes:" + str(max(self.primary_offset - self.offset, 0)),
+            "last_contact_secs:" + ("%.3f" % (time.time() - self.last_contact_time)),
+            "full_syncs:" + str(self.num_full_syncs),
+            "partial_syncs:" + str(self.num_partial_syncs),
+        ]
+
+        self.mem_db.output_reply(str(len(info_lines)), out_list)
+
+        for info_line in info_lines:
+            self.mem_db.output_reply(info_line, out_list)
+
+        return True
+
+# turn away every write from mem_db's clients, writes can only come from the primary
+def make_read_only(mem_db):
+    def process_read_only(split_cmd, out_list):
+        mem_db.output_reply(read_only_msg, out_list)
+
+        return True
+
+    for cmd_name in write_commands:
+        num_tokens = mem_db.command_table[cmd_name][0]
+        mem_db.add_command(cmd_name, num_tokens, process_read_only)
+
+# start streaming mem_db's committed changes to replicas connecting on host:port, returns the feed and its listener
+def open_primary(mem_db, host, port, socket_map=None, backlog_size=16777216):
+    feed = ReplicationFeed(mem_db, backlog_size)
+    mem_db.add_commit_listener(feed)
+
+    listener = ReplicationListener(feed, host, port, socket_map)
+
+    mem_db.add_command("REPLICATION_INFO", 1, feed.process_REPLICATION_INFO)
+
+    return feed, listener
+
+# make mem_db a read-only replica of the primary replicating on primary_host:primary_port, returns the ReplicaClient
+# feed is our own ReplicationFeed, if we're passing the changes on to replicas of our own
+def open_replica(mem_db, primary_host, primary_port, socket_map=None, feed=None):
+    replica_client = ReplicaClient(mem_db, primary_host, primary_port, socket_map, feed)
+
+    make_read_only(mem_db)
+    mem_db.add_commit_listener(replica_client)
+
+    # a replica reports its own view, even when it has replicas of its own
+    mem_db.add_command("REPLICATION_INFO", 1, replica_client.process_REPLICATION_INFO)
+
+    return replica_client
+
+# command line options for PyMemDBServer.py
+def add_replication_args(arg_parser):
+    arg_parser.add_argument("--replication-port", type=int, help="stream committed changes to replicas connecting on this port")
+    arg_parser.add_argument("--replication-backlog-bytes", type=int, default=16777216, help="how many bytes of changes to keep for replicas catching up")
+    arg_parser.add_argument("--replica-of", help="host:port of a primary's replication port, makes this a read-only replica of it")
+
+# set up replication for a PyMemDBServer from the parsed command line options
+def open_replication(mem_db_server, args):
+    mem_db = mem_db_server.mem_db
+    feed = None
+    replica_client = None
+
+    if args.replication_port is not None:
+        feed, listener = open_primary(mem_db, mem_db_server.get_address()[0], args.replication_port,
+                                      mem_db_server.socket_map, args.replication_backlog_bytes)
+
+    if args.replica_of:
+        primary_host, primary_port = args.replica_of.rsplit(":", 1)
+        replica_client = open_replica(mem_db, primary_host, int(primary_port), mem_db_server.socket_map, feed)
+
+    return feed, replica_client
@@ -0,0 +1,297 @@
+'''
+    PyMemDBScripts ~ server-side scripts for PyMemDB, a short program of commands run atomically in one call
+    depenencies: Python 2.7.x
+
+        SCRIPT_LOAD step [; step ...]               - compile the script and cache it, replies with its sha1
+        EVALSHA sha1 [arg ...]                      - run a cached script, replies with the number of lines and then
+                                                      every step's replies, "ABORTED" if it was aborted or
+                                                      "NO SCRIPT" if there's no script with that sha1
+        EVAL num_args [arg ...] step [; step ...]   - SCRIPT_LOAD and EVALSHA in one go
+        SCRIPT_EXISTS sha1                          - "1" if the script is cached, "0" if not
+        SCRIPT_FLUSH                                - forget every cached script, replies "OK"
+
+    a step is one of the data commands (script_commands) with its arguments, any argument can be $1, $2, ... for
+    the script's arguments or %1, %2, ... for the first reply line of an earlier step ("NULL" if it had none),
+    CHECK a b aborts the script unless a and b are the same and CHECK_NOT a b aborts if they are, so a rename is
+    "PULL $1 ; CHECK_NOT %1 NULL ; PUT $2 %1 ; DELETE $1" and a compare and set is "PULL $1 ; CHECK %1 $2 ; PUT $1 $3"
+
+    a script runs in a transaction block of its own, commit listeners (the append-only log, replicas) get everything
+    it wrote as one transaction, an abort (a failed CHECK or a step replying "NOT AN INTEGER" or "READ ONLY REPLICA")
+    rolls back everything it wrote, run inside a client's open block the script's writes become part of that block
+
+    scripts are compiled once, every step's command is checked and its arguments are resolved to slots, so running
+    one is a command table lookup and a list copy per step, the command loop runs one command at a time so nothing
+    else can run in the middle of a script, there's no way to loop or call anything but the data commands
+'''
+
+import hashlib
+
+import PyMemDBReplication
+
+# replies for scripts that can't be compiled or run
+bad_script_msg = "BAD SCRIPT"
+no_script_msg = "NO SCRIPT"
+
+# splits a script into steps
+step_separator = ";"
+
+# the commands a step can run, everything else (transaction blocks, QUIT, admin and pub/sub commands) is refused
+script_commands = ["PUT", "PULL", "DELETE", "NUM_WITH_VALUE", "KEYS_WITH_VALUE", "EXPIRE", "TTL", "PERSIST", "PUTEX",
+                   "MPUT", "MPULL", "MDELETE", "RANGE", "PREFIX", "INCR", "INCRBY", "DECR", "COUNT_VALUE_RANGE", "CAS"]
+
+# script only steps, CHECK a b aborts unless a == b, CHECK_NOT a b aborts if a == b, neither replies
+check_steps = {"CHECK": True, "CHECK_NOT": False}
+
+class ScriptError(Exception):
+    pass
+
+class Script:
+    '''
+        Script ~ a compiled script, one (command name, tokens, slots) entry per step
+    '''
+
+    # the script's text, normalized to single spaces, and its sha1
+    text = None
+    sha1 = None
+
+    # every step, slots is a list of (token position, True for an argument or False for a step reply, index)
+    steps = []
+
+    # how many arguments it needs, the biggest $n in it
+    num_args = 0
+
+    def __init__(self, text, steps, num_args):
+        self.text = text
+        self.sha1 = hashlib.sha1(text).hexdigest()
+        self.steps = steps
+        self.num_args = num_args
+
+# a $n or %n token as (True for $, False for %, n - 1), None for any other token
+def parse_slot(token):
+    if len(token) < 2 or token[0] not in "$%" or not token[1:].isdigit() or int(token[1:]) < 1:
+        return None
+
+    return token[0] == "$", int(token[1:]) - 1
+
+# compile the split tokens of a script, raises ScriptError if there's anything in it we won't run
+def compile_script(script_tokens, command_table):
+    steps = []
+    num_args = 0
+    step_tokens = []
+
+    for token in script_tokens + [step_separator]:
+        if token != step_separator:
+            step_tokens.append(token)
+            continue
+
+        if not step_tokens:
+            raise ScriptError("empty step")
+
+        cmd_name = step_tokens[0]
+
+        if cmd_name in check_steps:
+            if len(step_tokens) != 3:
+                raise ScriptError(cmd_name + " needs two arguments")
+
+        elif cmd_name not in script_commands or cmd_name not in command_table:
+            raise ScriptError(cmd_name + " can't be run in a script")
+
+        elif command_table[cmd_name][0] is not None and command_table[cmd_name][0] != len(step_tokens):
+            raise ScriptError(cmd_name + " takes " + str(command_table[cmd_name][0] - 1) + " arguments")
+
+        slots = []
+
+        for position, token in enumerate(step_tokens):
+            slot = parse_slot(token)
+
+            if position == 0 or slot is None:
+                continue
+
+            is_arg, index = slot
+
+            if is_arg:
+                num_args = max(num_args, index + 1)
+
+            # a step can only use the replies of the steps before it
+            elif index >= len(steps):
+                raise ScriptError(token + " isn't an earlier step")
+
+            slots.append((position, is_arg, index))
+
+        steps.append((cmd_name, step_tokens, slots))
+        step_tokens = []
+
+    return Script(" ".join(script_tokens), steps, num_args)
+
+class ScriptRunner:
+    '''
+        ScriptRunner ~ the script cache and the script commands for one PyMemDB
+    '''
+
+    mem_db = None
+
+    # sha1 -> compiled Script
+    scripts = {}
+
+    # a step replying one of these aborts the script
+    abort_replies = set()
+
+    def __init__(self, mem_db):
+        self.mem_db = mem_db
+        self.scripts = {}
+        self.abort_replies = set([mem_db.not_integer_msg, PyMemDBReplication.read_only_msg])
+
+    # compile and cache a script given as split tokens, returns the Script, the cached one if we've seen it before
+    def load_script(self, script_tokens):
+        script = compile_script(script_tokens, self.mem_db.command_table)
+
+        return self.scripts.setdefault(script.sha1, script)
+
+    # run script with args in a block of its own, returns the replies or None if it was aborted
+    def run_script(self, script, args):
+        mem_db = self.mem_db
+        command_table = mem_db.command_table
+        abort_replies = self.abort_replies
+
+        outermost = not mem_db.is_in_commit_block()
+
+        # a cursor mustn't flush the script's replies out ahead of the reply count
+        reply_writer = mem_db.reply_writer
+        mem_db.reply_writer = None
+
+        script_out = []
+        step_replies = []
+        aborted = False
+
+        mem_db.cmd_START_COMMIT()
+
+        try:
+            for cmd_name, step_tokens, slots in script.steps:
+                split_cmd = list(step_tokens)
+
+                for position, is_arg, index in slots:
+                    split_cmd[position] = args[index] if is_arg else step_replies[index]
+
+                if cmd_name in check_steps:
+                    if (split_cmd[1] == split_cmd[2]) != check_steps[cmd_name]:
+                        aborted = True
+                        break
+
+                    step_replies.append("NULL")
+                    continue
+
+                num_replies = len(script_out)
+
+                command_table[cmd_name][1](split_cmd, script_out)
+
+                step_reply = script_out[num_replies] if len(script_out) > num_replies else "NULL"
+
+                if step_reply in abort_replies:
+                    aborted = True
+                    break
+
+                step_replies.append(step_reply)
+
+        except Exception:
+            mem_db.roll_back_block()
+            raise
+
+        finally:
+            mem_db.reply_writer = reply_writer
+
+        if aborted:
+            mem_db.roll_back_block()
+
+            return None
+
+        if outermost:
+            mem_db.cmd_END_COMMIT()
+        else:
+            mem_db.merge_block()
+
+        return script_out
+
+    # run script with args and reply with the number of lines and the lines, or ABORTED
+    def output_run(self, script, args, out_list):
+        output_reply = self.mem_db.output_reply
+
+        if len(args) < script.num_args:
+            output_reply(bad_script_msg, out_list)
+
+            return
+
+        script_out = self.run_script(script, args)
+
+        if script_out is None:
+            output_reply(self.mem_db.aborted_msg, out_list)
+
+            return
+
+        output_reply(str(len(script_out)), out_list)
+
+        for reply in script_out:
+            output_reply(reply, out_list)
+
+    # SCRIPT_LOAD step [; step ...]
+    def process_SCRIPT_LOAD(self, split_cmd, out_list):
+        try:
+            self.mem_db.output_reply(self.load_script(split_cmd[1:]).sha1, out_list)
+        except ScriptError:
+            self.mem_db.output_reply(bad_script_msg, out_list)
+
+        return True
+
+    # EVALSHA sha1 [arg ...]
+    def process_EVALSHA(self, split_cmd, out_list):
+        script = self.scripts.get(split_cmd[1]) if len(split_cmd) > 1 else None
+
+        if script is None:
+            self.mem_db.output_reply(no_script_msg, out_list)
+        else:
+            self.output_run(script, split_cmd[2:], out_list)
+
+        return True
+
+    # EVAL num_args [arg ...] step [; step ...]
+    def process_EVAL(self, split_cmd, out_list):
+        try:
+            num_args = int(split_cmd[1]) if len(split_cmd) > 1 else -1
+
+            if num_args < 0:
+                raise ScriptError("bad number of arguments")
+
+            script = self.load_script(split_cmd[2 + num_args:])
+
+        except (ValueError, ScriptError):
+            self.mem_db.output_reply(bad_script_msg, out_list)
+
+            return True
+
+        self.output_run(script, split_cmd[2:2 + num_args], out_list)
+
+        return True
+
+    # SCRIPT_EXISTS sha1
+    def process_SCRIPT_EXISTS(self, split_cmd, out_list):
+        self.mem_db.output_reply("1" if split_cmd[1] in self.scripts else "0", out_list)
+
+        return True
+
+    # SCRIPT_FLUSH
+    def process_SCRIPT_FLUSH(self, split_cmd, out_list):
+        self.scripts = {}
+        self.mem_db.output_reply("OK", out_list)
+
+        return True
+
+# add the script commands to mem_db, returns the ScriptRunner
+def open_scripts(mem_db):
+    script_runner = ScriptRunner(mem_db)
+
+    mem_db.add_command("SCRIPT_LOAD", None, script_runner.process_SCRIPT_LOAD)
+    mem_db.add_command("EVALSHA", None, script_runner.process_EVALSHA)
+    mem_db.add_command("EVAL", None, script_runner.process_EVAL)
+    mem_db.add_command("SCRIPT_EXISTS", 2, script_runner.process_SCRIPT_EXISTS)
+    mem_db.add_command("SCRIPT_FLUSH", 1, script_runner.process_SCRIPT_FLUSH)
+
+    return script_runner
@@ -0,0 +1,292 @@
+'''
+    PyMemDBServer ~ TCP front-end that shares a single PyMemDB between many clients
+    depenencies: Python 2.7.x
+
+    speaks the same line based command protocol as PyMemDBImpl reading from stdin
+    pipelined commands are processed in batches, one batch per socket read, and the
+    replies for a batch are written back with a single buffered flush, cursors queue theirs up in blocks as they go
+'''
+
+# asyncore gives us a single threaded event loop so the shared PyMemDB needs no locking
+import asyncore
+import argparse
+import collections
+import socket
+import sys
+import threading
+
+import PyMemDBEviction
+import PyMemDBPersistence
+import PyMemDBProfiler
+import PyMemDBPubSub
+import PyMemDBReplication
+import PyMemDBScripts
+import PyMemDBStats
+from PyMemDBImpl import PyMemDB
+
+class PyMemDBConnection(asyncore.dispatcher):
+    '''
+        PyMemDBConnection ~ one connected client, with its own nested transaction blocks
+    '''
+
+    # how much we pull off of the socket at once, everything in here is processed as one batch
+    read_size = 65536
+
+    # how much we hand to the socket at once, a big reply goes out a slice at a time
+    send_size = 262144
+
+    def __init__(self, sock, mem_db, socket_map=None, pubsub_hub=None):
+        asyncore.dispatcher.__init__(self, sock, socket_map)
+
+        self.mem_db = mem_db
+
+        # any partial command left over from the last read
+        self.in_buffer = ""
+
+        # what's being sent right now and how far into it we are
+        self.out_buffer = ""
+        self.out_pos = 0
+
+        # blocks of replies (and pub/sub messages) queued up behind out_buffer
+        self.out_chunks = collections.deque()
+        self.queued_bytes = 0
+
+        # each client gets its own transaction blocks so its START_COMMIT doesn't capture other clients' writes
+        self.transaction_log = mem_db.new_transaction_log()
+
+        # set once we receive a QUIT, we close after flushing the remaining replies
+        self.closing = False
+
+        # anything the client subscribes to is delivered straight into our out_buffer
+        self.pubsub_hub = pubsub_hub
+
+        if pubsub_hub is not None:
+            pubsub_hub.add_client(self.transaction_log, self)
+
+    # queue up a block of data for the client, it goes out after everything queued before it
+    def queue_output(self, data):
+        self.out_chunks.append(data)
+        self.queued_bytes += len(data)
+
+    # a block of pub/sub messages for the client, they go out along with the replies
+    def queue_messages(self, data):
+        self.queue_output(data)
+
+    # how much is still waiting to be sent, the pub/sub hub holds back messages while this is too big
+    def get_queued_bytes(self):
+        return len(self.out_buffer) - self.out_pos + self.queued_bytes
+
+    # queue up a block of replies, cursors call this part way through a batch so a big reply is never one giant list
+    def write_replies(self, out_list):
+        self.queue_output("\n".join(out_list) + "\n")
+
+    # process a batch of complete command lines, buffering all of the replies
+    def process_batch(self, cmd_lines):
+        out_list = []
+
+        # swap in this client's transaction log for the whole batch
+        other_transaction_log = self.mem_db.swap_transaction_log(self.transaction_log)
+        self.mem_db.reply_writer = self.write_replies
+
+        try:
+            if not self.mem_db.process_command_batch(cmd_lines, out_list):
+                self.closing = True
+        finally:
+            self.mem_db.reply_writer = None
+            self.transaction_log = self.mem_db.swap_transaction_log(other_transaction_log)
+
+        # a slice of active expiry, anything it removes goes out with the batch's changes
+        self.mem_db.expire_cycle()
+        self.mem_db.collect_old_versions()
+
+        # group commit, everything the batch committed is flushed before we reply
+        self.mem_db.sync_commit_listeners()
+
+        if out_list:
+            self.write_replies(out_list)
+
+    # roll back anything the client left open and forget its WATCH, a dropped connection never commits
+    def roll_back_open_blocks(self):
+        other_transaction_log = self.mem_db.swap_transaction_log(self.transaction_log)
+
+        try:
+            while self.mem_db.is_in_commit_block():
+                self.mem_db.cmd_UN_COMMIT()
+
+            self.mem_db.cmd_UNWATCH()
+        finally:
+            self.transaction_log = self.mem_db.swap_transaction_log(other_transaction_log)
+
+    def readable(self):
+        return not self.closing
+
+    def writable(self):
+        return self.get_queued_bytes() > 0 or self.closing
+
+    def handle_read(self):
+        data = self.recv(self.read_size)
+
+        if not data:
+            return
+
+        self.in_buffer += data
+
+        # only process complete lines, hang on to a partial command until the rest arrives
+        last_newline = self.in_buffer.rfind("\n")
+
+        if last_newline < 0:
+            return
+
+        cmd_lines = self.in_buffer[:last_newline].split("\n")
+        self.in_buffer = self.in_buffer[last_newline + 1:]
+
+        self.process_batch(cmd_lines)
+
+    # refill out_buffer from the queued blocks
+    def fill_out_buffer(self):
+        self.out_buffer = "".join(self.out_chunks)
+        self.out_pos = 0
+        self.out_chunks.clear()
+        self.queued_bytes = 0
+
+    def handle_write(self):
+        if self.out_pos >= len(self.out_buffer):
+            self.fill_out_buffer()
+
+        # only ever copy a send_size slice, never everything that's left
+        if self.out_pos < len(self.out_buffer):
+            self.out_pos += self.send(self.out_buffer[self.out_pos:self.out_pos + self.send_size])
+
+        # all of the replies made it out, we can hang up now
+        if self.closing and self.get_queued_bytes() == 0:
+            self.handle_close()
+
+    def handle_close(self):
+        self.roll_back_open_blocks()
+
+        if self.pubsub_hub is not None:
+            self.pubsub_hub.remove_client(self.transaction_log)
+
+        self.close()
+
+class PyMemDBServer(asyncore.dispatcher):
+    '''
+        PyMemDBServer ~ accepts client connections for a single shared PyMemDB instance
+    '''
+
+    # how many pending connections we let queue up
+    listen_backlog = 128
+
+    def __init__(self, host="127.0.0.1", port=6380, mem_db=None):
+        # keep our own socket map so more than one server can run in a process (handy for tests)
+        self.socket_map = {}
+
+        asyncore.dispatcher.__init__(self, map=self.socket_map)
+
+        if mem_db is None:
+            mem_db = PyMemDB()
+
+        self.mem_db = mem_db
+        self.running = False
+
+        # every connection registers with this, see PyMemDBPubSub.open_server_pubsub
+        self.pubsub_hub = None
+
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.set_reuse_addr()
+        self.bind((host, port))
+        self.listen(self.listen_backlog)
+
+    # the address we actually bound to, useful when passing in port 0
+    def get_address(self):
+        return self.socket.getsockname()
+
+    def handle_accept(self):
+        pair = self.accept()
+
+        if pair is not None:
+            sock, addr = pair
+            PyMemDBConnection(sock, self.mem_db, self.socket_map, self.pubsub_hub)
+
+    # run the event loop until shutdown() is called
+    def serve_forever(self, poll_interval=0.1):
+        self.running = True
+
+        while self.running:
+            # poll scales to many more connections than select
+            asyncore.loop(timeout=poll_interval, use_poll=True, map=self.socket_map, count=1)
+
+            # keeps expiring names and gives interval based fsyncs a chance to run even when no one is writing
+            self.mem_db.expire_cycle()
+            self.mem_db.collect_old_versions()
+            self.mem_db.sync_commit_listeners()
+
+        asyncore.close_all(self.socket_map)
+
+    # stop the event loop, safe to call from another thread
+    def shutdown(self):
+        self.running = False
+
+    # start serving on a background thread, returns the thread
+    def start_background(self):
+        server_thread = threading.Thread(target=self.serve_forever)
+        server_thread.daemon = True
+        server_thread.start()
+
+        return server_thread
+
+# start up the server and listen for PyMemDB clients!
+if __name__ == "__main__":
+
+    arg_parser = argparse.ArgumentParser(description="PyMemDB TCP server")
+    arg_parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    arg_parser.add_argument("--port", type=int, default=6380, help="port to listen on")
+    arg_parser.add_argument("--debug", action="store_true", help="trace every command")
+    arg_parser.add_argument("--compact-storage", action="store_true", help="share one copy of every repeated value")
+    arg_parser.add_argument("--ordered-index", action="store_true", help="keep every name sorted for RANGE and PREFIX")
+    arg_parser.add_argument("--numeric-index", action="store_true", help="keep every numeric value sorted for COUNT_VALUE_RANGE")
+    arg_parser.add_argument("--mvcc", action="store_true", help="keep transaction writes private until COMMIT, blocks read a snapshot")
+    PyMemDBPersistence.add_persistence_args(arg_parser)
+    PyMemDBEviction.add_eviction_args(arg_parser)
+    PyMemDBReplication.add_replication_args(arg_parser)
+    PyMemDBStats.add_stats_args(arg_parser)
+    PyMemDBProfiler.add_profiler_args(arg_parser)
+    PyMemDBPubSub.add_pubsub_args(arg_parser)
+
+    args = arg_parser.parse_args()
+
+    mem_db = PyMemDB(args.debug, compact_storage=args.compact_storage, ordered_index=args.ordered_index,
+                     numeric_index=args.numeric_index, mvcc=args.mvcc)
+
+    # load anything we persisted last time and keep persisting
+    PyMemDBPersistence.open_persistence(mem_db, args)
+
+    # cap the number of names or bytes, if asked to
+    PyMemDBEviction.open_eviction(mem_db, args)
+
+    # INFO, STATS and SLOWLOG, and per-command stats and the slow log if asked for
+    PyMemDBStats.open_stats(mem_db, args)
+
+    # PROFILE, to profile the command loop while it runs
+    PyMemDBProfiler.open_profiler(mem_db, args)
+
+    # SCRIPT_LOAD, EVAL and EVALSHA
+    PyMemDBScripts.open_scripts(mem_db)
+
+    mem_db_server = PyMemDBServer(args.host, args.port, mem_db)
+
+    # stream our changes to replicas and/or follow a primary
+    PyMemDBReplication.open_replication(mem_db_server, args)
+
+    # SUBSCRIBE/PUBLISH and keyspace notifications, if asked for
+    PyMemDBPubSub.open_server_pubsub(mem_db_server, args)
+
+    print "PyMemDBServer listening on: " + str(mem_db_server.get_address())
+    sys.stdout.flush()
+
+    try:
+        mem_db_server.serve_forever()
+    except KeyboardInterrupt:
+        mem_db_server.shutdown()
+
+    mem_db.close_commit_listeners()
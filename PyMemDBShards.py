@@ -0,0 +1,474 @@
+'''
+    PyMemDBShards ~ hash-sharded PyMemDB, N worker processes each owning the names that hash to them
+    depenencies: Python 2.7.x
+
+    the GIL keeps a single PyMemDB on one core, so ShardRouter splits the names across worker processes by crc32
+    and sends each worker its share of a batch of commands over a pipe in one go, every worker works on its
+    share at the same time and the replies are stitched back together in the original order
+
+        PUT/PULL/DELETE/EXPIRE/TTL/PERSIST/PUTEX  - go to the shard that owns the name
+        INCR/INCRBY/DECR/CAS                      - same
+        MPUT/MPULL/MDELETE                        - split up by shard, MPULL replies come back in the original order
+        NUM_WITH_VALUE/KEYS_WITH_VALUE            - scatter-gather, sent to every shard and the counts summed
+        COUNT_VALUE_RANGE                         - same
+        RANGE/PREFIX                              - scatter-gather, every shard's sorted names are merged
+
+    transaction blocks are tracked by the router and only reach a shard once something is written in them,
+    every write in a block has to go to the same shard as the first one, any other write is rejected with
+    "CROSS SHARD TRANSACTION" and not applied, reads can go to any shard
+    the router is a single client of every shard, so WATCH/UNWATCH have nothing to guard against and aren't routed
+'''
+
+import argparse
+import heapq
+import multiprocessing
+import sys
+
+from itertools import islice
+from zlib import crc32
+
+from PyMemDBImpl import PyMemDB, parse_number, run_command_stream
+
+# runs in each worker process, processes batches of command lines sent down shard_conn until it's sent None
+# replies go back as one flat list of replies plus the offset in it where each command's replies start
+# (with one extra offset at the end), much cheaper to pickle than a list of replies per command
+def run_shard_worker(shard_conn, db_kwargs):
+    mem_db = PyMemDB(**db_kwargs)
+    command_table = mem_db.command_table
+    dispatch_command = mem_db.dispatch_command
+
+    while True:
+        cmd_batch = shard_conn.recv()
+
+        if cmd_batch is None:
+            break
+
+        out_list = []
+        reply_offsets = []
+
+        for split_cmd in map(str.split, cmd_batch.split("\n")):
+            reply_offsets.append(len(out_list))
+
+            dispatch_command(command_table, split_cmd, out_list)
+
+        reply_offsets.append(len(out_list))
+
+        mem_db.expire_cycle()
+        mem_db.collect_old_versions()
+        mem_db.sync_commit_listeners()
+
+        shard_conn.send((out_list, reply_offsets))
+
+    mem_db.close_commit_listeners()
+    shard_conn.close()
+
+# the replies for the command at position in a shard's batch
+def get_shard_reply(shard_replies, shard, position):
+    out_list, reply_offsets = shard_replies[shard]
+
+    return out_list[reply_offsets[position]:reply_offsets[position + 1]]
+
+class ShardRouter:
+    '''
+        ShardRouter ~ splits batches of commands across the shard workers and stitches the replies back together
+            - process_command_batch works just like PyMemDB's so it can sit behind the same stdin/stdout loop
+            - every command in a batch queues its line(s) on one or more shards and leaves a reply slot behind,
+              once the shards have answered each slot picks its replies out of the shard replies, a slot is either
+              a (shard, position) tuple for a command that went to one shard or a function that gathers the replies
+    '''
+
+    cross_shard_msg = "CROSS SHARD TRANSACTION"
+    no_transaction_msg = "NO TRANSACTION"
+
+    # commands that write the name they're given
+    write_commands = set(["PUT", "DELETE", "EXPIRE", "PERSIST", "PUTEX", "INCR", "INCRBY", "DECR", "CAS"])
+
+    # depth of the open transaction blocks, and the one shard they've written to (None until the first write)
+    transaction_depth = 0
+    transaction_shard = None
+
+    def __init__(self, num_shards, db_kwargs={}):
+        self.num_shards = num_shards
+        self.shard_conns = []
+        self.shard_processes = []
+        self.transaction_depth = 0
+        self.transaction_shard = None
+
+        for shard in range(0, num_shards):
+            router_conn, shard_conn = multiprocessing.Pipe()
+
+            shard_process = multiprocessing.Process(target=run_shard_worker, args=(shard_conn, db_kwargs))
+            shard_process.daemon = True
+            shard_process.start()
+
+            # the worker has its own copy of its end
+            shard_conn.close()
+
+            self.shard_conns.append(router_conn)
+            self.shard_processes.append(shard_process)
+
+        self.build_route_table()
+
+    # command name -> (number of split tokens, route function), None takes any number of tokens like PyMemDB
+    def build_route_table(self):
+        self.route_table = {
+            "PUT": (3, self.route_key),
+            "PULL": (2, self.route_key),
+            "DELETE": (2, self.route_key),
+            "EXPIRE": (3, self.route_key),
+            "TTL": (2, self.route_key),
+            "PERSIST": (2, self.route_key),
+            "PUTEX": (4, self.route_key),
+            "INCR": (2, self.route_key),
+            "INCRBY": (3, self.route_key),
+            "DECR": (2, self.route_key),
+            "CAS": (4, self.route_key),
+            "MPUT": (None, self.route_MPUT),
+            "MPULL": (None, self.route_MPULL),
+            "MDELETE": (None, self.route_MDELETE),
+            "NUM_WITH_VALUE": (2, self.route_NUM_WITH_VALUE),
+            "COUNT_VALUE_RANGE": (3, self.route_COUNT_VALUE_RANGE),
+            "KEYS_WITH_VALUE": (2, self.route_KEYS_WITH_VALUE),
+            "RANGE": (None, self.route_RANGE),
+            "PREFIX": (None, self.route_RANGE),
+            "START_COMMIT": (1, self.route_START_COMMIT),
+            "COMMIT": (1, self.route_COMMIT),
+            "UN_COMMIT": (1, self.route_UN_COMMIT),
+            "QUIT": (1, self.route_QUIT),
+        }
+
+    # the shard that owns name, crc32 so every process agrees
+    def get_shard(self, name):
+        return (crc32(name) & 0xffffffff) % self.num_shards
+
+    # queue a command line on a shard, returns its position in the shard's batch
+    def queue_line(self, shard_lines, shard, cmd_line):
+        shard_lines[shard].append(cmd_line)
+
+        return len(shard_lines[shard]) - 1
+
+    # can the open blocks write to shards? the first write decides which shard the blocks live on
+    def pin_transaction(self, shards, shard_lines):
+        if not self.transaction_depth:
+            return True
+
+        shards = set(shards)
+
+        if self.transaction_shard is None:
+            if len(shards) > 1:
+                return False
+
+            self.transaction_shard = shards.pop()
+
+            # the shard catches up on the blocks opened before it was written to
+            for depth in range(0, self.transaction_depth):
+                self.queue_line(shard_lines, self.transaction_shard, "START_COMMIT")
+
+            return True
+
+        return shards == set([self.transaction_shard])
+
+    # a reply slot for a reply from the router itself
+    def router_reply(self, reply_slots, reply):
+        reply_slots.append(lambda shard_replies: [reply])
+
+    # PUT/PULL/DELETE/EXPIRE/TTL/PERSIST/PUTEX name ..., straight to the owning shard
+    # by far the most common route, so get_shard and queue_line are inlined and the reply slot is a plain tuple
+    def route_key(self, split_cmd, cmd_line, shard_lines, reply_slots):
+        shard = (crc32(split_cmd[1]) & 0xffffffff) % self.num_shards
+
+        if self.transaction_depth and split_cmd[0] in self.write_commands and not self.pin_transaction([shard], shard_lines):
+            self.router_reply(reply_slots, self.cross_shard_msg)
+
+            return True
+
+        cmd_lines = shard_lines[shard]
+        cmd_lines.append(cmd_line)
+
+        reply_slots.append((shard, len(cmd_lines) - 1))
+
+        return True
+
+    # split names up by the shard that owns them, shard -> list of (position in names, name)
+    def split_names(self, names):
+        shard_names = {}
+
+        for position, name in enumerate(names):
+            shard_names.setdefault(self.get_shard(name), []).append((position, name))
+
+        return shard_names
+
+    # MPUT name value [name value ...], one MPUT per shard
+    def route_MPUT(self, split_cmd, cmd_line, shard_lines, reply_slots):
+        if len(split_cmd) < 3 or len(split_cmd) % 2 == 0:
+            return True
+
+        shard_names = self.split_names(split_cmd[1::2])
+
+        if not self.pin_transaction(shard_names.keys(), shard_lines):
+            self.router_reply(reply_slots, self.cross_shard_msg)
+
+            return True
+
+        values = split_cmd[2::2]
+
+        for shard, positions_names in shard_names.iteritems():
+            self.queue_line(shard_lines, shard, "MPUT " + " ".join(name + " " + values[position] for position, name in positions_names))
+
+        return True
+
+    # MDELETE name [name ...], one MDELETE per shard
+    def route_MDELETE(self, split_cmd, cmd_line, shard_lines, reply_slots):
+        if len(split_cmd) < 2:
+            return True
+
+        shard_names = self.split_names(split_cmd[1:])
+
+        if not self.pin_transaction(shard_names.keys(), shard_lines):
+            self.router_reply(reply_slots, self.cross_shard_msg)
+
+            return True
+
+        for shard, positions_names in shard_names.iteritems():
+            self.queue_line(shard_lines, shard, "MDELETE " + " ".join(name for position, name in positions_names))
+
+        return True
+
+    # MPULL name [name ...], one MPULL per shard, the values are put back in the order they were asked for
+    def route_MPULL(self, split_cmd, cmd_line, shard_lines, reply_slots):
+        names = split_cmd[1:]
+
+        if not names:
+            return True
+
+        shard_names = self.split_names(names)
+        shard_positions = []
+
+        for shard, positions_names in shard_names.iteritems():
+            batch_position = self.queue_line(shard_lines, shard, "MPULL " + " ".join(name for position, name in positions_names))
+            shard_positions.append((shard, batch_position, [position for position, name in positions_names]))
+
+        def gather_values(shard_replies):
+            values = [None] * len(names)
+
+            for shard, batch_position, positions in shard_positions:
+                for position, value in zip(positions, get_shard_reply(shard_replies, shard, batch_position)):
+                    values[position] = value
+
+            return values
+
+        reply_slots.append(gather_values)
+
+        return True
+
+    # queue the same line on every shard, returns each shard's position
+    def scatter_line(self, shard_lines, cmd_line):
+        return [self.queue_line(shard_lines, shard, cmd_line) for shard in range(0, self.num_shards)]
+
+    # NUM_WITH_VALUE value, the sum of every shard's count
+    def route_NUM_WITH_VALUE(self, split_cmd, cmd_line, shard_lines, reply_slots):
+        positions = self.scatter_line(shard_lines, cmd_line)
+
+        def gather_count(shard_replies):
+            return [str(sum(int(get_shard_reply(shard_replies, shard, position)[0]) for shard, position in enumerate(positions)))]
+
+        reply_slots.append(gather_count)
+
+        return True
+
+    # COUNT_VALUE_RANGE low high, summed like NUM_WITH_VALUE
+    # bounds that aren't numbers get no reply from any shard, so the line is dropped here and never sent
+    def route_COUNT_VALUE_RANGE(self, split_cmd, cmd_line, shard_lines, reply_slots):
+        if parse_number(split_cmd[1]) is None or parse_number(split_cmd[2]) is None:
+            return True
+
+        return self.route_NUM_WITH_VALUE(split_cmd, cmd_line, shard_lines, reply_slots)
+
+    # KEYS_WITH_VALUE value, the sum of every shard's count followed by all of their names
+    def route_KEYS_WITH_VALUE(self, split_cmd, cmd_line, shard_lines, reply_slots):
+        positions = self.scatter_line(shard_lines, cmd_line)
+
+        def gather_names(shard_replies):
+            replies = [get_shard_reply(shard_replies, shard, position) for shard, position in enumerate(positions)]
+
+            names = [str(sum(int(shard_reply[0]) for shard_reply in replies))]
+
+            for shard_reply in replies:
+                names.extend(shard_reply[1:])
+
+            return names
+
+        reply_slots.append(gather_names)
+
+        return True
+
+    # RANGE start end [limit] and PREFIX prefix [limit], every shard's names merged back into order
+    # each shard already stops at limit, so the merge never has to look at more than limit names per shard
+    def route_RANGE(self, split_cmd, cmd_line, shard_lines, reply_slots):
+        limit_token = 3 if split_cmd[0] == "RANGE" else 2
+
+        if len(split_cmd) not in (limit_token, limit_token + 1):
+            return True
+
+        if len(split_cmd) > limit_token:
+            try:
+                limit = max(int(split_cmd[limit_token]), 0)
+            except ValueError:
+                return True
+        else:
+            limit = None
+
+        positions = self.scatter_line(shard_lines, cmd_line)
+
+        def gather_range(shard_replies):
+            replies = [get_shard_reply(shard_replies, shard, position) for shard, position in enumerate(positions)]
+
+            num_names = sum(int(shard_reply[0]) for shard_reply in replies)
+
+            if limit is not None:
+                num_names = min(num_names, limit)
+
+            return [str(num_names)] + list(islice(heapq.merge(*[shard_reply[1:] for shard_reply in replies]), num_names))
+
+        reply_slots.append(gather_range)
+
+        return True
+
+    # START_COMMIT, only passed on once the blocks have a shard
+    def route_START_COMMIT(self, split_cmd, cmd_line, shard_lines, reply_slots):
+        self.transaction_depth += 1
+
+        if self.transaction_shard is not None:
+            self.queue_line(shard_lines, self.transaction_shard, cmd_line)
+
+        return True
+
+    # COMMIT, closes every block
+    def route_COMMIT(self, split_cmd, cmd_line, shard_lines, reply_slots):
+        if not self.transaction_depth:
+            self.router_reply(reply_slots, self.no_transaction_msg)
+
+            return True
+
+        if self.transaction_shard is not None:
+            self.queue_line(shard_lines, self.transaction_shard, cmd_line)
+
+        self.transaction_depth = 0
+        self.transaction_shard = None
+
+        return True
+
+    # UN_COMMIT, rolls back the innermost block
+    def route_UN_COMMIT(self, split_cmd, cmd_line, shard_lines, reply_slots):
+        if not self.transaction_depth:
+            self.router_reply(reply_slots, self.no_transaction_msg)
+
+            return True
+
+        if self.transaction_shard is not None:
+            self.queue_line(shard_lines, self.transaction_shard, cmd_line)
+
+        self.transaction_depth -= 1
+
+        # every block is closed, the next one can go to any shard
+        if not self.transaction_depth:
+            self.transaction_shard = None
+
+        return True
+
+    # QUIT, stop processing
+    def route_QUIT(self, split_cmd, cmd_line, shard_lines, reply_slots):
+        return False
+
+    # send every shard its share of the batch at once, then collect each shard's (replies, reply offsets)
+    def run_shard_batches(self, shard_lines):
+        for shard, cmd_lines in enumerate(shard_lines):
+            if cmd_lines:
+                self.shard_conns[shard].send("\n".join(cmd_lines))
+
+        shard_replies = []
+
+        for shard, cmd_lines in enumerate(shard_lines):
+            if cmd_lines:
+                shard_replies.append(self.shard_conns[shard].recv())
+            else:
+                shard_replies.append(([], [0]))
+
+        return shard_replies
+
+    # process a batch of raw command lines, all replies are appended to out_list
+    # returns False once we receive a QUIT, any commands after it are not processed
+    def process_command_batch(self, cmd_lines, out_list):
+        route_table = self.route_table
+
+        shard_lines = [[] for shard in range(0, self.num_shards)]
+        reply_slots = []
+
+        keep_processing = True
+
+        for cmd_line in cmd_lines:
+            split_cmd = cmd_line.split()
+
+            if not split_cmd:
+                continue
+
+            route_entry = route_table.get(split_cmd[0])
+
+            # badly formed and unknown commands are ignored, just like PyMemDB
+            if route_entry is None or (route_entry[0] != len(split_cmd) and route_entry[0] is not None):
+                continue
+
+            if not route_entry[1](split_cmd, cmd_line, shard_lines, reply_slots):
+                keep_processing = False
+                break
+
+        shard_replies = self.run_shard_batches(shard_lines)
+
+        for reply_slot in reply_slots:
+            if reply_slot.__class__ is tuple:
+                shard_out_list, reply_offsets = shard_replies[reply_slot[0]]
+                position = reply_slot[1]
+
+                out_list.extend(shard_out_list[reply_offsets[position]:reply_offsets[position + 1]])
+            else:
+                out_list.extend(reply_slot(shard_replies))
+
+        return keep_processing
+
+    # process commands from in_stream in large chunks, writing the replies for each chunk to out_stream in one go
+    def process_command_stream(self, in_stream, out_stream, read_size=1048576):
+        run_command_stream(in_stream, out_stream, self.process_command_batch, read_size)
+
+    # stop every worker and wait for them to finish
+    def close(self):
+        for shard_conn in self.shard_conns:
+            shard_conn.send(None)
+
+        for shard_process in self.shard_processes:
+            shard_process.join()
+
+        for shard_conn in self.shard_conns:
+            shard_conn.close()
+
+        self.shard_conns = []
+        self.shard_processes = []
+
+# start up the shards and listen to our PyMemDB commands!
+if __name__ == "__main__":
+
+    arg_parser = argparse.ArgumentParser(description="hash-sharded PyMemDB reading commands from stdin")
+    arg_parser.add_argument("--shards", type=int, default=multiprocessing.cpu_count(), help="number of worker processes")
+    arg_parser.add_argument("--compact-storage", action="store_true", help="share one copy of every repeated value")
+    arg_parser.add_argument("--ordered-index", action="store_true", help="keep every name sorted for RANGE and PREFIX")
+    arg_parser.add_argument("--numeric-index", action="store_true", help="keep every numeric value sorted for COUNT_VALUE_RANGE")
+    arg_parser.add_argument("--mvcc", action="store_true", help="keep transaction writes private until COMMIT, blocks read a snapshot")
+
+    args = arg_parser.parse_args()
+
+    shard_router = ShardRouter(args.shards, {"compact_storage": args.compact_storage, "ordered_index": args.ordered_index,
+                                              "numeric_index": args.numeric_index, "mvcc": args.mvcc})
+
+    try:
+        shard_router.process_command_stream(sys.stdin, sys.stdout)
+    finally:
+        shard_router.close()
@@ -0,0 +1,578 @@
+'''
+    PyMemDBStats ~ per-command counts and latency histograms for PyMemDB, plus the INFO command
+    depenencies: Python 2.7.x
+
+    with stats on every entry in the command tables is swapped for a wrapper that counts the call and times it
+    into that command's LatencyHistogram, with stats off the command tables are the plain ones again, so there's
+    nothing left in the command path at all, STATS ON/OFF/RESET switches them at run time
+
+    LatencyHistogram is HDR-style, whole microseconds below 32us and 16 buckets per power of two above that,
+    so any recorded latency is off by at most 1/16 (~6%) whatever its size, and recording one is a couple of shifts
+    every call is counted but only 1 in --stats-sample (16 by default) of each command's calls is timed
+
+    INFO replies with the number of lines and then one "key:value" line each, like REPLICATION_INFO, INFO JSON
+    replies with one line of JSON holding the same figures (and every histogram's percentiles) for scripts
+
+    the slow log (SLOWLOG ON usecs) keeps the last slowlog_max_len commands that took at least usecs, with their
+    arguments, how long they took and how deep the client's transaction blocks were when they started, it needs
+    every call timed so it switches the command stats on and times every call while it's on
+'''
+
+import argparse
+import json
+import os
+import sys
+import time
+
+from collections import deque
+from itertools import islice
+
+# reply to STATS with anything but ON/OFF/RESET
+bad_stats_msg = "BAD STATS OPTION"
+
+# reply to SLOWLOG with anything but GET/LEN/RESET/ON/OFF
+bad_slowlog_msg = "BAD SLOWLOG OPTION"
+
+class LatencyHistogram:
+    '''
+        LatencyHistogram ~ counts of latencies in microseconds, log-linear buckets with a fixed relative error
+    '''
+
+    # latencies under 2 ** sub_bucket_bits us get a bucket each, every power of two above gets half that many
+    sub_bucket_bits = 5
+
+    # bucket -> number of latencies recorded in it, grows as bigger latencies show up
+    bucket_counts = []
+
+    # how many latencies, their sum and the biggest one, all in us
+    total_count = 0
+    total_micros = 0
+    max_micros = 0
+
+    def __init__(self):
+        self.bucket_counts = []
+        self.total_count = 0
+        self.total_micros = 0
+        self.max_micros = 0
+
+    # the bucket micros goes in
+    def get_bucket(self, micros):
+        sub_bucket_bits = self.sub_bucket_bits
+
+        if micros >> sub_bucket_bits == 0:
+            return micros
+
+        shift = micros.bit_length() - sub_bucket_bits
+
+        return (shift << (sub_bucket_bits - 1)) + (micros >> shift)
+
+    # the biggest latency that goes in bucket
+    def get_bucket_top(self, bucket):
+        half_bits = self.sub_bucket_bits - 1
+
+        if bucket >> self.sub_bucket_bits == 0:
+            return bucket
+
+        shift = (bucket >> half_bits) - 1
+        sub_bucket = bucket - (shift << half_bits)
+
+        return ((sub_bucket + 1) << shift) - 1
+
+    # count a latency given in seconds
+    def record(self, secs):
+        micros = int(secs * 1000000)
+        bucket = self.get_bucket(micros)
+        bucket_counts = self.bucket_counts
+
+        if bucket >= len(bucket_counts):
+            bucket_counts.extend([0] * (bucket + 1 - len(bucket_counts)))
+
+        bucket_counts[bucket] += 1
+
+        self.total_count += 1
+        self.total_micros += micros
+
+        if micros > self.max_micros:
+            self.max_micros = micros
+
+    # the latency (in us) that percent of everything recorded is at or under, 0 if nothing has been recorded
+    def get_percentile(self, percent):
+        if not self.total_count:
+            return 0
+
+        # the rank of the latency we want, at least the first one
+        rank = max(int(self.total_count * percent / 100.0 + 0.5), 1)
+        seen = 0
+
+        for bucket, count in enumerate(self.bucket_counts):
+            seen += count
+
+            if seen >= rank:
+                return min(self.get_bucket_top(bucket), self.max_micros)
+
+        return self.max_micros
+
+    # add everything recorded in other_histogram to this one
+    def merge(self, other_histogram):
+        bucket_counts = self.bucket_counts
+        other_counts = other_histogram.bucket_counts
+
+        if len(other_counts) > len(bucket_counts):
+            bucket_counts.extend([0] * (len(other_counts) - len(bucket_counts)))
+
+        for bucket, count in enumerate(other_counts):
+            bucket_counts[bucket] += count
+
+        self.total_count += other_histogram.total_count
+        self.total_micros += other_histogram.total_micros
+        self.max_micros = max(self.max_micros, other_histogram.max_micros)
+
+    # mean latency in us
+    def get_mean(self):
+        if not self.total_count:
+            return 0.0
+
+        return float(self.total_micros) / self.total_count
+
+class SlowLog:
+    '''
+        SlowLog ~ ring buffer of the most recent commands that took at least threshold_secs, newest first
+    '''
+
+    # commands that took at least this long are logged
+    threshold_secs = 0.01
+
+    # (id, unix time, duration in us, transaction depth, command tokens) newest first, at most max_len of them
+    entries = None
+
+    # long commands (an MPUT of thousands of names) only keep this many tokens, each cut down to max_token_len
+    max_tokens = 32
+    max_token_len = 128
+
+    # id for the next entry, keeps counting across resets so entries can be told apart
+    next_id = 0
+
+    def __init__(self, threshold_secs=0.01, max_len=128):
+        self.threshold_secs = threshold_secs
+        self.entries = deque(maxlen=max_len)
+        self.next_id = 0
+
+    # log a command that took secs, depth is how deeply nested the client's blocks were when it started
+    def add(self, split_cmd, secs, depth):
+        cmd_tokens = [token[:self.max_token_len] for token in split_cmd[:self.max_tokens]]
+
+        if len(split_cmd) > self.max_tokens:
+            cmd_tokens.append("...+" + str(len(split_cmd) - self.max_tokens))
+
+        self.entries.appendleft((self.next_id, int(time.time()), int(secs * 1000000), depth, cmd_tokens))
+        self.next_id += 1
+
+    # the newest count entries, all of them for None
+    def get_entries(self, count=None):
+        return list(islice(self.entries, count))
+
+    def reset(self):
+        self.entries.clear()
+
+class CommandStats:
+    '''
+        CommandStats ~ a call count and a LatencyHistogram for every command mem_db runs
+    '''
+
+    # percentiles shown by INFO
+    percentiles = [50, 99, 99.9]
+
+    # command name -> [number of calls], bumped by the command's wrapper
+    call_counts = {}
+
+    # command name -> LatencyHistogram
+    histograms = {}
+
+    # only every sample_every'th call of each command is timed, 1 times them all
+    # two clock calls and a record cost about as much as a PULL, timing 1 in 16 cuts most of that
+    sample_every = 16
+
+    # the slow log, None when it's off, while it's on every call is timed but only sampled ones go in the histograms
+    slow_log = None
+
+    # the PyMemDB we're counting, the slow log reads the current client's transaction depth from it
+    mem_db = None
+
+    # where the times come from
+    clock = None
+
+    # when the counts were last reset
+    start_time = 0
+
+    def __init__(self, mem_db, sample_every=16):
+        self.mem_db = mem_db
+        self.sample_every = sample_every
+        self.slow_log = None
+        self.clock = time.time
+        self.call_counts = {}
+        self.histograms = {}
+        self.start_time = time.time()
+
+    # start counting from scratch, the wrappers hang on to their own count and histogram so we clear them in place
+    def reset(self):
+        for call_count in self.call_counts.itervalues():
+            call_count[0] = 0
+
+        for cmd_name in self.histograms:
+            self.histograms[cmd_name].__init__()
+
+        self.start_time = time.time()
+
+    # a process function that counts and times process_func as cmd_name
+    def wrap(self, cmd_name, process_func):
+        call_count = self.call_counts.setdefault(cmd_name, [0])
+        histogram = self.histograms.setdefault(cmd_name, LatencyHistogram())
+        sample_every = self.sample_every
+        clock = self.clock
+        slow_log = self.slow_log
+        mem_db = self.mem_db
+
+        if slow_log is not None:
+            def process_timed(split_cmd, out_list):
+                call_count[0] += 1
+                depth = mem_db.mem_db_transaction_log.get_depth()
+                start_time = clock()
+                keep_processing = process_func(split_cmd, out_list)
+                run_secs = clock() - start_time
+
+                if not call_count[0] % sample_every:
+                    histogram.record(run_secs)
+
+                if run_secs >= slow_log.threshold_secs:
+                    slow_log.add(split_cmd, run_secs, depth)
+
+                return keep_processing
+
+        elif sample_every == 1:
+            def process_timed(split_cmd, out_list):
+                call_count[0] += 1
+                start_time = clock()
+                keep_processing = process_func(split_cmd, out_list)
+                histogram.record(clock() - start_time)
+
+                return keep_processing
+        else:
+            def process_timed(split_cmd, out_list):
+                call_count[0] += 1
+
+                if call_count[0] % sample_every:
+                    return process_func(split_cmd, out_list)
+
+                start_time = clock()
+                keep_processing = process_func(split_cmd, out_list)
+                histogram.record(clock() - start_time)
+
+                return keep_processing
+
+        # so we can put the plain one back
+        process_timed.process_func = process_func
+
+        return process_timed
+
+    # total number of commands run since the last reset
+    def get_total_calls(self):
+        return sum(call_count[0] for call_count in self.call_counts.itervalues())
+
+    # cmd_name -> dict of calls and latency figures, only for commands that have been run
+    def get_command_info(self):
+        command_info = {}
+
+        for cmd_name, call_count in self.call_counts.iteritems():
+            if not call_count[0]:
+                continue
+
+            histogram = self.histograms[cmd_name]
+
+            cmd_info = {"calls": call_count[0], "timed": histogram.total_count, "mean_us": round(histogram.get_mean(), 2),
+                        "max_us": histogram.max_micros}
+
+            for percent in self.percentiles:
+                cmd_info["p" + str(percent).replace(".", "") + "_us"] = histogram.get_percentile(percent)
+
+            command_info[cmd_name] = cmd_info
+
+        return command_info
+
+''' ============= INSTRUMENTATION functions ========== '''
+
+# every command table mem_db dispatches from, and any others dispatching its process functions
+def get_command_tables(mem_db):
+    return [mem_db.command_table, mem_db.simple_command_table, mem_db.transaction_command_table] + mem_db.extra_command_tables
+
+# wrap every command again, after the command stats were created or the slow log switched on or off
+def rewrap_commands(mem_db):
+    command_stats = mem_db.command_stats
+
+    for command_table in get_command_tables(mem_db):
+        for cmd_name, (num_tokens, process_func) in command_table.items():
+            process_func = getattr(process_func, "process_func", process_func)
+            command_table[cmd_name] = (num_tokens, command_stats.wrap(cmd_name, process_func))
+
+# start counting and timing every command mem_db runs, commands added later with add_command are wrapped too
+# sample_every below 1 times every call, the same as 1
+def enable_command_stats(mem_db, sample_every=16):
+    if mem_db.command_stats is not None:
+        return mem_db.command_stats
+
+    mem_db.command_stats = CommandStats(mem_db, max(sample_every, 1))
+
+    rewrap_commands(mem_db)
+
+    return mem_db.command_stats
+
+# put the plain process functions back, nothing is counted or timed after this, the slow log goes too
+def disable_command_stats(mem_db):
+    for command_table in get_command_tables(mem_db):
+        for cmd_name, (num_tokens, process_func) in command_table.items():
+            command_table[cmd_name] = (num_tokens, getattr(process_func, "process_func", process_func))
+
+    mem_db.command_stats = None
+
+# log every command that takes at least threshold_usecs, switches the command stats on if they aren't already
+# a slow log that's already on keeps its entries and just gets the new threshold
+def enable_slow_log(mem_db, threshold_usecs, max_len=128, sample_every=16):
+    command_stats = enable_command_stats(mem_db, sample_every)
+
+    if command_stats.slow_log is not None:
+        command_stats.slow_log.threshold_secs = threshold_usecs / 1000000.0
+
+        return command_stats.slow_log
+
+    command_stats.slow_log = SlowLog(threshold_usecs / 1000000.0, max_len)
+
+    rewrap_commands(mem_db)
+
+    return command_stats.slow_log
+
+# stop logging slow commands, back to timing only the sampled calls
+def disable_slow_log(mem_db):
+    command_stats = mem_db.command_stats
+
+    if command_stats is None or command_stats.slow_log is None:
+        return
+
+    command_stats.slow_log = None
+
+    rewrap_commands(mem_db)
+
+''' ============= INFO functions ========== '''
+
+# bytes of resident memory for the whole process, None where there's no /proc
+def get_resident_bytes():
+    try:
+        with open("/proc/self/statm") as statm_file:
+            return int(statm_file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (IOError, OSError):
+        return None
+
+# rough bytes used by the names and values, the dict itself plus an average entry from a sample of them
+# a scan of every name would stall the command loop on a big database, the sample is enough for an estimate
+def estimate_data_bytes(mem_db, sample_size=1000):
+    mem_db_dict = mem_db.mem_db_dict
+
+    num_bytes = sys.getsizeof(mem_db_dict)
+
+    sample = list(islice(mem_db_dict.iteritems(), sample_size))
+
+    if not sample:
+        return num_bytes
+
+    # shared values are only paid for once
+    if mem_db.compact_storage:
+        entry_bytes = sum(sys.getsizeof(name) for name, value in sample)
+        num_bytes += sum(sys.getsizeof(value) for value in mem_db.mem_db_value_count_index.value_counts)
+    else:
+        entry_bytes = sum(sys.getsizeof(name) + sys.getsizeof(value) for name, value in sample)
+
+    return num_bytes + entry_bytes * len(mem_db_dict) / len(sample)
+
+# every INFO figure for mem_db as a list of (key, value), the command stats are added as a dict under "commands"
+def get_info(mem_db):
+    open_transaction_logs = mem_db.get_open_transaction_logs()
+
+    info = [
+        ("keys", mem_db.get_mem_db_size()),
+        ("distinct_values", mem_db.mem_db_value_count_index.get_num_values()),
+        ("expiring_keys", len(mem_db.mem_db_expires)),
+        ("watched_keys", len(mem_db.mem_db_versions)),
+        ("open_transactions", len(open_transaction_logs)),
+        ("max_transaction_depth", max([transaction_log.get_depth() for transaction_log in open_transaction_logs] or [0])),
+        ("undo_log_entries", sum(transaction_log.get_undo_log_size() for transaction_log in open_transaction_logs)),
+        ("mvcc", int(mem_db.mvcc)),
+        ("old_versions", len(mem_db.mem_db_old_version_queue)),
+        ("compact_storage", int(mem_db.compact_storage)),
+        ("estimated_data_bytes", estimate_data_bytes(mem_db)),
+    ]
+
+    resident_bytes = get_resident_bytes()
+
+    if resident_bytes is not None:
+        info.append(("resident_bytes", resident_bytes))
+
+    if mem_db.eviction_policy is not None:
+        info.append(("evicted_keys", mem_db.eviction_policy.num_evicted))
+
+    command_stats = mem_db.command_stats
+
+    info.append(("command_stats", "on" if command_stats is not None else "off"))
+
+    if command_stats is not None:
+        info.append(("stats_secs", round(time.time() - command_stats.start_time, 3)))
+        info.append(("total_commands", command_stats.get_total_calls()))
+        info.append(("slowlog", "on" if command_stats.slow_log is not None else "off"))
+
+        if command_stats.slow_log is not None:
+            info.append(("slowlog_usecs", int(command_stats.slow_log.threshold_secs * 1000000)))
+            info.append(("slowlog_len", len(command_stats.slow_log.entries)))
+
+        info.append(("commands", command_stats.get_command_info()))
+
+    return info
+
+# the INFO command for mem_db, INFO lists "key:value" lines, INFO JSON is one line of JSON
+# one "cmd_NAME:calls=...,p50_us=...,..." line per command that's been run
+def make_process_INFO(mem_db):
+    def process_INFO(split_cmd, out_list):
+        if len(split_cmd) > 2 or (len(split_cmd) == 2 and split_cmd[1] != "JSON"):
+            return True
+
+        info = get_info(mem_db)
+
+        if len(split_cmd) == 2:
+            mem_db.output_reply(json.dumps(dict(info), sort_keys=True), out_list)
+
+            return True
+
+        info_lines = []
+
+        for key, value in info:
+            if key != "commands":
+                info_lines.append(key + ":" + str(value))
+                continue
+
+            for cmd_name, cmd_info in sorted(value.iteritems()):
+                info_lines.append("cmd_" + cmd_name + ":" + ",".join(cmd_key + "=" + str(cmd_info[cmd_key]) for cmd_key in sorted(cmd_info)))
+
+        mem_db.output_reply(str(len(info_lines)), out_list)
+
+        for info_line in info_lines:
+            mem_db.output_reply(info_line, out_list)
+
+        return True
+
+    return process_INFO
+
+# the STATS ON|OFF|RESET command for mem_db, replies "OK"
+def make_process_STATS(mem_db, sample_every=16):
+    def process_STATS(split_cmd, out_list):
+        option = split_cmd[1]
+
+        if option == "ON":
+            enable_command_stats(mem_db, sample_every)
+        elif option == "OFF":
+            disable_command_stats(mem_db)
+        elif option == "RESET":
+            if mem_db.command_stats is not None:
+                mem_db.command_stats.reset()
+        else:
+            mem_db.output_reply(bad_stats_msg, out_list)
+
+            return True
+
+        mem_db.output_reply("OK", out_list)
+
+        return True
+
+    return process_STATS
+
+# SLOWLOG GET [count]   - the number of entries and then "id unix_time duration_us depth CMD arg ..." for each, newest first
+# SLOWLOG LEN           - the number of entries
+# SLOWLOG RESET         - forget every entry, replies "OK"
+# SLOWLOG ON usecs      - log every command that takes at least usecs, replies "OK"
+# SLOWLOG OFF           - stop logging, replies "OK"
+def make_process_SLOWLOG(mem_db, max_len=128, sample_every=16):
+    def process_SLOWLOG(split_cmd, out_list):
+        command_stats = mem_db.command_stats
+        slow_log = command_stats.slow_log if command_stats is not None else None
+
+        option = split_cmd[1] if len(split_cmd) > 1 else None
+        number = None
+
+        if len(split_cmd) == 3 and option in ("GET", "ON"):
+            try:
+                number = max(int(split_cmd[2]), 0)
+            except ValueError:
+                option = None
+
+        elif len(split_cmd) != 2:
+            option = None
+
+        if option == "GET":
+            entries = slow_log.get_entries(number) if slow_log is not None else []
+
+            mem_db.output_reply(str(len(entries)), out_list)
+
+            for entry_id, log_time, duration_us, depth, cmd_tokens in entries:
+                mem_db.output_reply(" ".join([str(entry_id), str(log_time), str(duration_us), str(depth)] + cmd_tokens), out_list)
+
+        elif option == "LEN":
+            mem_db.output_reply(str(len(slow_log.entries) if slow_log is not None else 0), out_list)
+
+        elif option == "RESET":
+            if slow_log is not None:
+                slow_log.reset()
+
+            mem_db.output_reply("OK", out_list)
+
+        elif option == "ON" and number is not None:
+            enable_slow_log(mem_db, number, max_len, sample_every)
+            mem_db.output_reply("OK", out_list)
+
+        elif option == "OFF":
+            disable_slow_log(mem_db)
+            mem_db.output_reply("OK", out_list)
+
+        else:
+            mem_db.output_reply(bad_slowlog_msg, out_list)
+
+        return True
+
+    return process_SLOWLOG
+
+# argparse type for --stats-sample, a whole number of at least 1
+def parse_sample_every(text):
+    try:
+        sample_every = int(text)
+    except ValueError:
+        sample_every = 0
+
+    if sample_every < 1:
+        raise argparse.ArgumentTypeError("must be a whole number of at least 1, not " + repr(text))
+
+    return sample_every
+
+# command line options for PyMemDBImpl.py and PyMemDBServer.py
+def add_stats_args(arg_parser):
+    arg_parser.add_argument("--stats", action="store_true", help="count and time every command for INFO (STATS ON does the same)")
+    arg_parser.add_argument("--stats-sample", type=parse_sample_every, default=16, help="only time every Nth call of each command (1 times them all), every call is still counted")
+    arg_parser.add_argument("--slowlog-usecs", type=int, help="log every command that takes at least this many microseconds (SLOWLOG ON does the same)")
+    arg_parser.add_argument("--slowlog-max-len", type=int, default=128, help="how many slow commands the slow log keeps")
+
+# add INFO, STATS and SLOWLOG to mem_db, and start the command stats and the slow log if asked to
+def open_stats(mem_db, args):
+    mem_db.add_command("INFO", None, make_process_INFO(mem_db))
+    mem_db.add_command("STATS", 2, make_process_STATS(mem_db, args.stats_sample))
+    mem_db.add_command("SLOWLOG", None, make_process_SLOWLOG(mem_db, args.slowlog_max_len, args.stats_sample))
+
+    if args.slowlog_usecs is not None:
+        enable_slow_log(mem_db, args.slowlog_usecs, args.slowlog_max_len, args.stats_sample)
+
+    elif args.stats:
+        enable_command_stats(mem_db, args.stats_sample)
+
+    return mem_db.command_stats
@@ -5,9 +5,38 @@
 
     2016-03-21 ~ added HUGE testing for O(n) vs O(log n) timing
 '''
+import argparse
+import gc
+import hashlib
+import json
+import multiprocessing
+import os
+import pstats
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import timeit
 
+from itertools import imap
+
+import PyMemDBBench
+import PyMemDBEviction
+import PyMemDBImpl
+import PyMemDBPersistence
+import PyMemDBProfiler
+import PyMemDBPubSub
+import PyMemDBReplication
+import PyMemDBScripts
+import PyMemDBShards
+import PyMemDBStats
+import PyMemDBThreads
 from PyMemDBImpl import PyMemDB
+from PyMemDBServer import PyMemDBConnection, PyMemDBServer
 
 ''' ========= SIMPLE command tests ======== '''
 
@@ -91,6 +120,533 @@ def Test_cmd_NUM_WITH_VALUE():
 
     print "cmd_NUM_WITH_VALUE: passed"
 
+# testing the value count index stays correct on overwrite, DELETE of missing names and unseen values
+def Test_value_count_index():
+    simple_test_db = PyMemDB()
+
+    # never seen values count as 0
+    assert(simple_test_db.cmd_NUM_WITH_VALUE("derp") == 0)
+
+    simple_test_db.cmd_PUT("herp", "derp")
+    simple_test_db.cmd_PUT("flerp", "derp")
+
+    # overwriting moves the count to the new value
+    simple_test_db.cmd_PUT("herp", "lie")
+    assert(simple_test_db.cmd_NUM_WITH_VALUE("derp") == 1)
+    assert(simple_test_db.cmd_NUM_WITH_VALUE("lie") == 1)
+
+    # overwriting with the same value doesn't change anything
+    simple_test_db.cmd_PUT("herp", "lie")
+    assert(simple_test_db.cmd_NUM_WITH_VALUE("lie") == 1)
+
+    # deleting a missing name leaves the counts alone
+    simple_test_db.cmd_DELETE("not_exist")
+    assert(simple_test_db.cmd_NUM_WITH_VALUE("derp") == 1)
+
+    # roll-back puts the counts back the way they were
+    simple_test_db.cmd_START_COMMIT()
+    simple_test_db.cmd_PUT("flerp", "lie")
+    simple_test_db.cmd_DELETE("herp")
+    simple_test_db.cmd_PUT("onefish", "derp")
+    simple_test_db.cmd_UN_COMMIT()
+
+    assert(simple_test_db.cmd_NUM_WITH_VALUE("derp") == 1)
+    assert(simple_test_db.cmd_NUM_WITH_VALUE("lie") == 1)
+    assert(simple_test_db.mem_db_value_count_index.get_num_values() == 2)
+
+    # once nothing is set to a value it drops out of the index
+    simple_test_db.cmd_DELETE("herp")
+    simple_test_db.cmd_DELETE("flerp")
+    assert(simple_test_db.mem_db_value_count_index.get_num_values() == 0)
+
+    print "value count index: passed"
+
+# testing compact storage shares one copy of every repeated value, and lets go of it once it's unused
+def Test_compact_storage():
+    simple_test_db = PyMemDB(compact_storage=True)
+
+    # every value comes in as a separate copy, like it would off of a command line
+    for i in range(0, 100):
+        simple_test_db.cmd_PUT("herp" + str(i), "de" + str("rp"))
+
+    assert(simple_test_db.cmd_NUM_WITH_VALUE("derp") == 100)
+    assert(len(set(id(value) for value in simple_test_db.mem_db_dict.itervalues())) == 1)
+    assert(simple_test_db.mem_db_value_count_index.get_num_shared_values() == 1)
+
+    # roll-back puts back the shared copy
+    simple_test_db.cmd_START_COMMIT()
+    simple_test_db.cmd_PUT("herp0", "lie")
+    simple_test_db.cmd_DELETE("herp1")
+    simple_test_db.cmd_UN_COMMIT()
+
+    assert(simple_test_db.mem_db_dict["herp0"] is simple_test_db.mem_db_dict["herp1"])
+    assert(simple_test_db.mem_db_value_count_index.get_num_shared_values() == 1)
+
+    # once nothing is set to a value its shared copy is dropped
+    for i in range(0, 100):
+        simple_test_db.cmd_DELETE("herp" + str(i))
+
+    assert(simple_test_db.cmd_NUM_WITH_VALUE("derp") == 0)
+    assert(simple_test_db.mem_db_value_count_index.get_num_shared_values() == 0)
+
+    # bulk loaded values get shared too
+    simple_test_db.load_dict(dict(("onefish" + str(i), "two" + str("fish")) for i in range(0, 100)))
+
+    assert(simple_test_db.cmd_NUM_WITH_VALUE("twofish") == 100)
+    assert(len(set(id(value) for value in simple_test_db.mem_db_dict.itervalues())) == 1)
+
+    print "compact storage: passed"
+
+# testing the KEYS_WITH_VALUE command, with and without the value keys index
+def Test_cmd_KEYS_WITH_VALUE():
+    for keys_with_value_index in [False, True]:
+        simple_test_db = PyMemDB(keys_with_value_index=keys_with_value_index)
+
+        # never seen values have no names
+        assert(list(simple_test_db.cmd_KEYS_WITH_VALUE("derp")) == [])
+
+        simple_test_db.cmd_PUT("herp", "derp")
+        simple_test_db.cmd_PUT("flerp", "derp")
+        simple_test_db.cmd_PUT("cake", "lie")
+
+        assert(sorted(simple_test_db.cmd_KEYS_WITH_VALUE("derp")) == ["flerp", "herp"])
+
+        # overwrites, deletes and roll-backs all move names between values
+        simple_test_db.cmd_START_COMMIT()
+        simple_test_db.cmd_PUT("herp", "lie")
+        simple_test_db.cmd_DELETE("cake")
+
+        assert(sorted(simple_test_db.cmd_KEYS_WITH_VALUE("derp")) == ["flerp"])
+        assert(sorted(simple_test_db.cmd_KEYS_WITH_VALUE("lie")) == ["herp"])
+
+        simple_test_db.cmd_UN_COMMIT()
+
+        assert(sorted(simple_test_db.cmd_KEYS_WITH_VALUE("derp")) == ["flerp", "herp"])
+        assert(sorted(simple_test_db.cmd_KEYS_WITH_VALUE("lie")) == ["cake"])
+
+        # the command replies with the count and then the names
+        out_list = []
+        simple_test_db.process_command_line("KEYS_WITH_VALUE lie", out_list)
+        assert(out_list == ["1", "cake"])
+
+    print "cmd_KEYS_WITH_VALUE: passed"
+
+# testing the RANGE and PREFIX commands, with and without the ordered index
+def Test_cmd_RANGE_PREFIX():
+    for ordered_index in [False, True]:
+        simple_test_db = PyMemDB(ordered_index=ordered_index)
+
+        # tiny buckets so the index has to split and drop buckets
+        if ordered_index:
+            simple_test_db.mem_db_ordered_index.bucket_size = 2
+
+        num_names, cursor = simple_test_db.cmd_RANGE("a", "z")
+        assert(num_names == 0 and list(cursor) == [])
+
+        for name in ["herp", "derp", "flerp", "cake", "lie", "herpderp", "herq", "her"]:
+            simple_test_db.cmd_PUT(name, "value")
+
+        # start is included, end isn't
+        num_names, cursor = simple_test_db.cmd_RANGE("derp", "herp")
+        assert(num_names == 3 and list(cursor) == ["derp", "flerp", "her"])
+
+        num_names, cursor = simple_test_db.cmd_RANGE("derp", "zzz", 2)
+        assert(num_names == 2 and list(cursor) == ["derp", "flerp"])
+
+        num_names, cursor = simple_test_db.cmd_PREFIX("herp")
+        assert(num_names == 2 and list(cursor) == ["herp", "herpderp"])
+
+        # deletes and roll-backs keep the order up to date
+        simple_test_db.cmd_START_COMMIT()
+        simple_test_db.cmd_DELETE("herp")
+        simple_test_db.cmd_PUT("herpes", "value")
+        simple_test_db.cmd_MDELETE(["herq", "her"])
+
+        num_names, cursor = simple_test_db.cmd_PREFIX("her")
+        assert(num_names == 2 and list(cursor) == ["herpderp", "herpes"])
+
+        simple_test_db.cmd_UN_COMMIT()
+
+        num_names, cursor = simple_test_db.cmd_PREFIX("her")
+        assert(num_names == 4 and list(cursor) == ["her", "herp", "herpderp", "herq"])
+
+        # the commands reply with the count and then the names, a bad limit is ignored
+        out_list = []
+        simple_test_db.process_command_batch(["RANGE a d", "PREFIX he 1", "RANGE z a", "PREFIX he nope", "RANGE a"], out_list)
+        assert(out_list == ["1", "cake", "1", "her", "0"])
+
+        # random writes and roll-backs, every range has to match a sorted scan
+        random_gen = random.Random(20160323)
+
+        for i in range(0, 5000):
+            name = "n" + str(random_gen.randint(0, 300))
+            op = random_gen.randint(0, 9)
+
+            if op < 5:
+                simple_test_db.cmd_PUT(name, "value")
+            elif op < 8:
+                simple_test_db.cmd_DELETE(name)
+            elif simple_test_db.is_in_commit_block() and op == 8:
+                simple_test_db.cmd_UN_COMMIT()
+            else:
+                simple_test_db.cmd_START_COMMIT()
+
+        all_names = sorted(simple_test_db.mem_db_dict)
+
+        for i in range(0, 200):
+            start, end = sorted(["n" + str(random_gen.randint(0, 300)), "n" + str(random_gen.randint(0, 300))])
+            expected_names = [name for name in all_names if start <= name < end]
+
+            num_names, cursor = simple_test_db.cmd_RANGE(start, end)
+            assert(num_names == len(expected_names) and list(cursor) == expected_names)
+
+            prefix = "n" + str(random_gen.randint(0, 30))
+            expected_names = [name for name in all_names if name.startswith(prefix)]
+
+            num_names, cursor = simple_test_db.cmd_PREFIX(prefix)
+            assert(num_names == len(expected_names) and list(cursor) == expected_names)
+
+        # bulk loading rebuilds the order
+        simple_test_db.load_dict({"b": "1", "a": "2", "c": "3"})
+
+        num_names, cursor = simple_test_db.cmd_RANGE("a", "c")
+        assert(num_names == 2 and list(cursor) == ["a", "b"])
+
+    # the first name after a prefix
+    assert(PyMemDBImpl.get_prefix_end("her") == "hes")
+    assert(PyMemDBImpl.get_prefix_end("h\xff") == "i")
+    assert(PyMemDBImpl.get_prefix_end("\xff\xff") is None)
+
+    print "cmd_RANGE_PREFIX: passed"
+
+# testing the INCR, INCRBY and DECR commands
+def Test_cmd_INCR():
+    simple_test_db = PyMemDB()
+    simple_test_db.clock = FakeClock()
+
+    # a missing name counts as 0
+    assert(simple_test_db.cmd_INCRBY("counter", 1) == "1")
+    assert(simple_test_db.cmd_INCRBY("counter", 41) == "42")
+    assert(simple_test_db.cmd_INCRBY("counter", -50) == "-8")
+    assert(simple_test_db.cmd_NUM_WITH_VALUE("-8") == 1)
+    assert(simple_test_db.cmd_NUM_WITH_VALUE("42") == 0)
+
+    # anything that isn't an integer is left alone
+    simple_test_db.cmd_PUT("herp", "derp")
+    simple_test_db.cmd_PUT("pi", "3.14")
+    assert(simple_test_db.cmd_INCRBY("herp", 1) is None and simple_test_db.cmd_PULL("herp") == "derp")
+    assert(simple_test_db.cmd_INCRBY("pi", 1) is None and simple_test_db.cmd_PULL("pi") == "3.14")
+
+    # each increment is a single undo entry, and the whole lot rolls back
+    simple_test_db.cmd_START_COMMIT()
+    simple_test_db.cmd_INCRBY("counter", 10)
+    assert(simple_test_db.get_num_cmds_in_current_transaction_block() == 1)
+    simple_test_db.cmd_INCRBY("counter", 10)
+    simple_test_db.cmd_INCRBY("fresh", 1)
+    assert(simple_test_db.cmd_PULL("counter") == "12")
+    simple_test_db.cmd_UN_COMMIT()
+
+    assert(simple_test_db.cmd_PULL("counter") == "-8" and simple_test_db.cmd_PULL("fresh") == "NULL")
+    assert(simple_test_db.cmd_NUM_WITH_VALUE("12") == 0 and simple_test_db.cmd_NUM_WITH_VALUE("-8") == 1)
+
+    # a counter keeps its TTL, and starts over once it expires
+    simple_test_db.cmd_EXPIRE("counter", 10)
+    simple_test_db.cmd_INCRBY("counter", 1)
+    assert(simple_test_db.cmd_TTL("counter") == 10)
+
+    simple_test_db.clock.now += 11
+    assert(simple_test_db.cmd_INCRBY("counter", 1) == "1" and simple_test_db.cmd_TTL("counter") == -1)
+
+    # the commands reply with the new value, a bad delta is ignored
+    out_list = []
+    simple_test_db.process_command_batch(["INCR hits", "INCRBY hits 9", "DECR hits", "INCR herp", "INCRBY hits nope", "INCR"], out_list)
+    assert(out_list == ["1", "10", "9", "NOT AN INTEGER"])
+
+    # the commit listeners see a plain PUT of the new value
+    commit_recorder = CommitRecorder()
+    simple_test_db.add_commit_listener(commit_recorder)
+    simple_test_db.cmd_INCRBY("hits", 1)
+    assert(commit_recorder.commits == [([("hits", "10")], False)])
+
+    print "cmd_INCR: passed"
+
+# testing the COUNT_VALUE_RANGE command, with and without the numeric index
+def Test_cmd_COUNT_VALUE_RANGE():
+    assert(PyMemDBImpl.parse_number("42") == 42 and PyMemDBImpl.parse_number("-1.5") == -1.5)
+    assert(PyMemDBImpl.parse_number("1e3") == 1000.0 and PyMemDBImpl.parse_number("+7") == 7)
+    assert(PyMemDBImpl.parse_number("derp") is None and PyMemDBImpl.parse_number("nan") is None)
+    assert(PyMemDBImpl.parse_number("1.2.3") is None and PyMemDBImpl.parse_number("-") is None)
+
+    for numeric_index in [False, True]:
+        simple_test_db = PyMemDB(numeric_index=numeric_index)
+
+        # tiny buckets so the index has to split and drop buckets
+        if numeric_index:
+            simple_test_db.mem_db_numeric_index.bucket_size = 2
+
+        assert(simple_test_db.cmd_COUNT_VALUE_RANGE(0, 100) == 0)
+
+        for name, value in [("a", "1"), ("b", "5"), ("c", "5"), ("d", "10.5"), ("e", "-3"), ("f", "derp"), ("g", "100")]:
+            simple_test_db.cmd_PUT(name, value)
+
+        # both ends are included, values that aren't numbers never count
+        assert(simple_test_db.cmd_COUNT_VALUE_RANGE(1, 10) == 3)
+        assert(simple_test_db.cmd_COUNT_VALUE_RANGE(5, 5) == 2)
+        assert(simple_test_db.cmd_COUNT_VALUE_RANGE(-100, 1000) == 6)
+        assert(simple_test_db.cmd_COUNT_VALUE_RANGE(10, 1) == 0)
+
+        # overwrites, counters and roll-backs move values around
+        simple_test_db.cmd_START_COMMIT()
+        simple_test_db.cmd_PUT("b", "herp")
+        simple_test_db.cmd_INCRBY("a", 99)
+        simple_test_db.cmd_DELETE("e")
+        assert(simple_test_db.cmd_COUNT_VALUE_RANGE(1, 10) == 1)
+        assert(simple_test_db.cmd_COUNT_VALUE_RANGE(100, 100) == 2)
+        simple_test_db.cmd_UN_COMMIT()
+
+        assert(simple_test_db.cmd_COUNT_VALUE_RANGE(1, 10) == 3)
+        assert(simple_test_db.cmd_COUNT_VALUE_RANGE(-3, -3) == 1)
+
+        out_list = []
+        simple_test_db.process_command_batch(["COUNT_VALUE_RANGE 1 5", "COUNT_VALUE_RANGE -1e9 1e9", "COUNT_VALUE_RANGE a 5"], out_list)
+        assert(out_list == ["3", "6"])
+
+        # random counters, writes and roll-backs, every range has to match a scan
+        random_gen = random.Random(20160323)
+
+        for i in range(0, 5000):
+            name = "n" + str(random_gen.randint(0, 300))
+            op = random_gen.randint(0, 11)
+
+            if op < 4:
+                simple_test_db.cmd_PUT(name, str(random_gen.randint(-50, 50)))
+            elif op < 6:
+                simple_test_db.cmd_INCRBY(name, random_gen.randint(-5, 5))
+            elif op < 7:
+                simple_test_db.cmd_PUT(name, random_gen.choice(["derp", "1.5", "-0.25"]))
+            elif op < 9:
+                simple_test_db.cmd_DELETE(name)
+            elif simple_test_db.is_in_commit_block() and op == 9:
+                simple_test_db.cmd_UN_COMMIT()
+            else:
+                simple_test_db.cmd_START_COMMIT()
+
+        for i in range(0, 200):
+            low, high = sorted([random_gen.randint(-60, 60), random_gen.randint(-60, 60)])
+            assert(simple_test_db.cmd_COUNT_VALUE_RANGE(low, high) == simple_test_db.cmd_COUNT_VALUE_RANGE_SLOW(low, high))
+
+        # bulk loading rebuilds the index
+        simple_test_db.load_dict({"a": "1", "b": "2", "c": "herp", "d": "2.5"})
+        assert(simple_test_db.cmd_COUNT_VALUE_RANGE(2, 3) == 2)
+
+    print "cmd_COUNT_VALUE_RANGE: passed"
+
+# a clock we can move by hand for testing TTLs
+class FakeClock:
+    now = 1000.0
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+# commit listener that just remembers everything it's told
+class CommitRecorder:
+    commits = []
+
+    def __init__(self):
+        self.commits = []
+
+    def on_commit(self, mutations, transaction):
+        self.commits.append((mutations, transaction))
+
+    def sync(self):
+        pass
+
+    def close(self):
+        pass
+
+# testing the MPUT, MPULL and MDELETE commands, on their own and inside transaction blocks
+def Test_cmd_MPUT_MPULL_MDELETE():
+    for db_args in [{}, {"compact_storage": True}, {"keys_with_value_index": True}]:
+        simple_test_db = PyMemDB(**db_args)
+
+        commit_recorder = CommitRecorder()
+        simple_test_db.add_commit_listener(commit_recorder)
+
+        simple_test_db.cmd_PUT("herp", "lie")
+
+        # later pairs win, counts follow every overwrite
+        simple_test_db.cmd_MPUT([("herp", "derp"), ("flerp", "derp"), ("onefish", "twofish"), ("flerp", "de" + str("rp"))])
+
+        assert(simple_test_db.cmd_MPULL(["herp", "flerp", "onefish", "redfish"]) == ["derp", "derp", "twofish", "NULL"])
+        assert(simple_test_db.cmd_NUM_WITH_VALUE("derp") == 2)
+        assert(simple_test_db.cmd_NUM_WITH_VALUE("lie") == 0)
+        check_value_count_index(simple_test_db, ["derp", "lie", "twofish"])
+
+        # committed together
+        assert(commit_recorder.commits[-1] == ([("herp", "derp"), ("flerp", "derp"), ("onefish", "twofish"), ("flerp", "derp")], True))
+
+        # missing names are skipped
+        simple_test_db.cmd_MDELETE(["herp", "redfish"])
+        assert(commit_recorder.commits[-1] == ([("herp", None)], True))
+        assert(simple_test_db.cmd_NUM_WITH_VALUE("derp") == 1)
+
+        # one undo group per command, rolled back with the block
+        simple_test_db.cmd_START_COMMIT()
+        simple_test_db.cmd_MPUT([("herp", "lie"), ("flerp", "lie")])
+        simple_test_db.cmd_MDELETE(["onefish", "flerp"])
+        assert(simple_test_db.get_num_cmds_in_current_transaction_block() == 3)
+        simple_test_db.cmd_UN_COMMIT()
+
+        assert(simple_test_db.cmd_MPULL(["herp", "flerp", "onefish"]) == ["NULL", "derp", "twofish"])
+        check_value_count_index(simple_test_db, ["derp", "lie", "twofish"])
+
+        # and through the command line, badly formed commands are ignored
+        out_list = []
+        simple_test_db.process_command_line("MPUT a 1 b 2 c", out_list)
+        simple_test_db.process_command_line("MPUT a 1 b 2", out_list)
+        simple_test_db.process_command_line("MPULL", out_list)
+        simple_test_db.process_command_line("MDELETE b", out_list)
+        simple_test_db.process_command_line("MPULL a b flerp", out_list)
+        assert(out_list == ["1", "NULL", "derp"])
+
+    print "cmd_MPUT_MPULL_MDELETE: passed"
+
+# testing the EXPIRE, TTL, PERSIST and PUTEX commands with lazy expiry on PULL
+def Test_cmd_EXPIRE():
+    simple_test_db = PyMemDB()
+    fake_clock = FakeClock()
+    simple_test_db.clock = fake_clock
+
+    commit_recorder = CommitRecorder()
+    simple_test_db.add_commit_listener(commit_recorder)
+
+    # missing names can't expire
+    assert(simple_test_db.cmd_EXPIRE("herp", 10) == False)
+    assert(simple_test_db.cmd_TTL("herp") == -2)
+
+    simple_test_db.cmd_PUT("herp", "derp")
+    assert(simple_test_db.cmd_TTL("herp") == -1)
+
+    assert(simple_test_db.cmd_EXPIRE("herp", 10) == True)
+    assert(simple_test_db.cmd_TTL("herp") == 10)
+
+    fake_clock.now += 4
+    assert(simple_test_db.cmd_TTL("herp") == 6)
+    assert(simple_test_db.cmd_PULL("herp") == "derp")
+
+    # lazily removed on the first read after it expires, counts and listeners follow
+    fake_clock.now += 6
+    assert(simple_test_db.cmd_PULL("herp") == "NULL")
+    assert(simple_test_db.get_mem_db_size() == 0)
+    assert(simple_test_db.cmd_NUM_WITH_VALUE("derp") == 0)
+    assert(commit_recorder.commits[-1] == ([("herp", None)], False))
+
+    # PERSIST clears the TTL, a plain PUT does too
+    simple_test_db.cmd_PUTEX("herp", "derp", 5)
+    assert(simple_test_db.cmd_TTL("herp") == 5)
+    assert(simple_test_db.cmd_PERSIST("herp") == True)
+    assert(simple_test_db.cmd_PERSIST("herp") == False)
+    assert(simple_test_db.cmd_TTL("herp") == -1)
+
+    simple_test_db.cmd_EXPIRE("herp", 5)
+    simple_test_db.cmd_PUT("herp", "lie")
+    assert(simple_test_db.cmd_TTL("herp") == -1)
+
+    # no time left is just a DELETE
+    assert(simple_test_db.cmd_EXPIRE("herp", 0) == True)
+    assert(simple_test_db.cmd_PULL("herp") == "NULL")
+
+    # and through the command line, badly formed seconds are ignored
+    out_list = []
+    simple_test_db.process_command_line("PUTEX onefish twofish 30", out_list)
+    simple_test_db.process_command_line("TTL onefish", out_list)
+    simple_test_db.process_command_line("EXPIRE onefish soon", out_list)
+    simple_test_db.process_command_line("EXPIRE redfish 30", out_list)
+    simple_test_db.process_command_line("PERSIST onefish", out_list)
+    simple_test_db.process_command_line("TTL onefish", out_list)
+    simple_test_db.process_command_line("TTL redfish", out_list)
+    assert(out_list == ["30", "0", "1", "-1", "-2"])
+
+    # counts and scans never include a name that's already expired, NUM_WITH_VALUE agrees with KEYS_WITH_VALUE
+    for db_args in [{}, {"keys_with_value_index": True, "ordered_index": True, "numeric_index": True}]:
+        scan_test_db = PyMemDB(**db_args)
+        scan_test_db.clock = fake_clock
+
+        out_list = []
+        scan_test_db.process_command_batch(["PUTEX a 5 10", "PUT b 5", "PUTEX c 5 10"], out_list)
+        fake_clock.now += 20
+        scan_test_db.process_command_batch(["NUM_WITH_VALUE 5", "KEYS_WITH_VALUE 5", "RANGE a z", "PREFIX a", "COUNT_VALUE_RANGE 0 10",
+                                            "PULL a"], out_list)
+        assert(out_list == ["1", "1", "b", "1", "b", "0", "1", "NULL"])
+        assert(scan_test_db.get_mem_db_size() == 1)
+
+        # another client's open block keeps an expired name around, the scans still leave it out
+        scan_test_db.cmd_PUTEX("d", "5", 10)
+
+        other_transaction_log = scan_test_db.swap_transaction_log(scan_test_db.new_transaction_log())
+        scan_test_db.cmd_START_COMMIT()
+        scan_test_db.cmd_EXPIRE("d", 5)
+        client_transaction_log = scan_test_db.swap_transaction_log(other_transaction_log)
+
+        fake_clock.now += 5
+
+        out_list = []
+        scan_test_db.process_command_batch(["KEYS_WITH_VALUE 5", "NUM_WITH_VALUE 5", "RANGE a z", "COUNT_VALUE_RANGE 0 10", "PULL d"],
+                                           out_list)
+        assert(out_list == ["1", "b", "1", "1", "b", "1", "NULL"])
+        assert(scan_test_db.get_mem_db_size() == 2)
+
+        scan_test_db.swap_transaction_log(client_transaction_log)
+        scan_test_db.cmd_END_COMMIT()
+        scan_test_db.swap_transaction_log(other_transaction_log)
+
+        assert(scan_test_db.cmd_RANGE("a", None)[0] == 1 and scan_test_db.get_mem_db_size() == 1)
+
+    print "cmd_EXPIRE: passed"
+
+# testing active expiry removes expired names in bounded slices
+def Test_expire_cycle():
+    simple_test_db = PyMemDB()
+    fake_clock = FakeClock()
+    simple_test_db.clock = fake_clock
+
+    for i in range(0, 1000):
+        simple_test_db.cmd_PUTEX("herp" + str(i), "derp", 10 + i % 2)
+
+    simple_test_db.cmd_PUT("cake", "lie")
+
+    # nothing due yet
+    assert(simple_test_db.expire_cycle() == 0)
+
+    # changing TTLs leaves stale heap entries, they're skipped
+    simple_test_db.cmd_EXPIRE("herp0", 100)
+
+    fake_clock.now += 10
+
+    # each cycle stops after max_names
+    assert(simple_test_db.expire_cycle(max_names=100) == 99)
+    assert(simple_test_db.expire_cycle(max_names=100) == 100)
+
+    while simple_test_db.expire_cycle():
+        pass
+
+    assert(simple_test_db.get_mem_db_size() == 502)
+    assert(simple_test_db.cmd_NUM_WITH_VALUE("derp") == 501)
+
+    fake_clock.now += 1
+
+    while simple_test_db.expire_cycle():
+        pass
+
+    assert(simple_test_db.get_mem_db_size() == 2)
+    assert(simple_test_db.cmd_PULL("herp0") == "derp")
+    assert(simple_test_db.cmd_PULL("cake") == "lie")
+
+    print "expire cycle: passed"
+
 def Test_cmd_QUIT():
     simple_test_db = PyMemDB()
 
@@ -231,64 +787,3156 @@ def Test_cmd_END_COMMIT():
     print "cmd_END_COMMIT: passed"
     
 
-# O(log n) performing NUM_WITH_VALUE using value count cache
-# slightly slower inserts/deletes, MUCH faster returns
-def Test_cmd_NUM_WITH_VALUE_HUGE_O_N(simple_db):
-    simple_db.cmd_NUM_WITH_VALUE_SLOW("a")
+# testing deeply nested blocks rolled back one at a time and then committed
+def Test_nested_UN_COMMIT():
+    simple_test_db = PyMemDB()
+    simple_test_db.cmd_PUT("herp", "derp")
+
+    # every nested block overwrites herp, adds its own name and removes the previous block's name
+    for depth in range(0, 100):
+        simple_test_db.cmd_START_COMMIT()
+        simple_test_db.cmd_PUT("herp", "derp" + str(depth))
+        simple_test_db.cmd_PUT("fish" + str(depth), "twofish")
+
+        if depth > 0:
+            simple_test_db.cmd_DELETE("fish" + str(depth - 1))
+
+    assert(simple_test_db.get_transaction_depth() == 100)
+    assert(simple_test_db.get_num_cmds_in_current_transaction_block() == 3)
 
-# O(n) performing NUM_WITH_VALUE using a simple iteration and value check (ick!!!!)
-def Test_cmd_NUM_WITH_VALUE_HUGE_O_LOG_N(simple_db):
-    simple_db.cmd_NUM_WITH_VALUE("a")
+    # roll back half of the blocks, each one should put back the previous block's state
+    for depth in range(99, 49, -1):
+        assert(simple_test_db.cmd_PULL("herp") == "derp" + str(depth))
+        assert(simple_test_db.cmd_UN_COMMIT() == True)
+        assert(simple_test_db.cmd_PULL("fish" + str(depth)) == "NULL")
+        assert(simple_test_db.cmd_PULL("fish" + str(depth - 1)) == "twofish")
 
-# not my idea, taken from
-# http://pythoncentral.io/time-a-python-function/
-def wrapper(func, *args, **kwargs):
-    def wrapped():
-        return func(*args, **kwargs)
+    assert(simple_test_db.get_transaction_depth() == 50)
+
+    # commit the rest, the changes stick and there are no more blocks
+    assert(simple_test_db.cmd_END_COMMIT() == True)
+    assert(simple_test_db.is_in_commit_block() == False)
+    assert(simple_test_db.cmd_UN_COMMIT() == False)
+    assert(simple_test_db.cmd_PULL("herp") == "derp49")
+    assert(simple_test_db.get_mem_db_size() == 2)
 
-    return wrapped
+    print "nested cmd_UN_COMMIT: passed"
 
-# test O(log n) vs O(n) value count changes
-def TestBigODifferences():
+# testing that a block only keeps the first old value for each name it writes
+def Test_undo_log_compaction():
     simple_test_db = PyMemDB()
-    max_num_values = 10000000
+    simple_test_db.cmd_PUT("herp", "derp")
 
-    print "Populating PyMemDB with: " + str(max_num_values) + " key-value pairs with the same value. be patient"
-    for i in range(0, max_num_values):
-        simple_test_db.cmd_PUT(str(i), "a")
+    simple_test_db.cmd_START_COMMIT()
 
-    wrapped = wrapper(Test_cmd_NUM_WITH_VALUE_HUGE_O_N, simple_test_db)
-    time_o_n = timeit.timeit(wrapped, number=1)
+    # hammer the same names, only the first write to each one gets logged
+    for i in range(0, 1000):
+        simple_test_db.cmd_PUT("herp", "flerp" + str(i))
+        simple_test_db.cmd_PUT("onefish", "twofish" + str(i))
+        simple_test_db.cmd_DELETE("onefish")
 
-    wrapped = wrapper(Test_cmd_NUM_WITH_VALUE_HUGE_O_LOG_N, simple_test_db)
-    time_o_log_n = timeit.timeit(wrapped, number=1)
+    assert(simple_test_db.get_num_cmds_in_current_transaction_block() == 2)
 
-    print "O(log n) time: " + str(time_o_log_n) + " for " + str(max_num_values) + " records is " + str(time_o_n/time_o_log_n) + " times faster than O(n) time of " + str(time_o_n)
+    # a nested block logs its own first write to the same name
+    simple_test_db.cmd_START_COMMIT()
+    simple_test_db.cmd_PUT("herp", "nested")
+    simple_test_db.cmd_PUT("herp", "nested2")
 
-    # if we can return a count of 1,000,000 of the same value in under a second, this passes!
-    assert(time_o_log_n < 1.0)
+    assert(simple_test_db.get_num_cmds_in_current_transaction_block() == 1)
 
-    print "O(log n) function: passed"
+    # rolling back the nested block puts back the value from the start of that block
+    assert(simple_test_db.cmd_UN_COMMIT() == True)
+    assert(simple_test_db.cmd_PULL("herp") == "flerp999")
 
-    # we assume the non O(n) will take longer than 1 second and fail
-    assert(time_o_n > 1.0)
+    # rolling back the outer block puts back the values from before any of the writes
+    assert(simple_test_db.cmd_UN_COMMIT() == True)
+    assert(simple_test_db.cmd_PULL("herp") == "derp")
+    assert(simple_test_db.cmd_PULL("onefish") == "NULL")
 
-    print "O(n) function: failed"
+    print "undo log compaction: passed"
 
-# start up the application and listen to our SimpleMemDB commands!
-if __name__ == "__main__":
+# testing TTLs roll back with their block, and names pinned by another client's open block aren't expired
+def Test_expiry_transactions():
+    simple_test_db = PyMemDB()
+    fake_clock = FakeClock()
+    simple_test_db.clock = fake_clock
 
-    ''' ===== SIMPLE tests ===== '''
-    Test_cmd_PUT()
-    Test_cmd_PULL()
-    Test_cmd_DELETE()
-    Test_cmd_NUM_WITH_VALUE()
-    Test_cmd_QUIT()
+    simple_test_db.cmd_PUTEX("herp", "derp", 10)
+    simple_test_db.cmd_PUT("flerp", "derp")
 
-    ''' ===== TRANSACTION tests ===== '''
-    Test_cmd_START_COMMIT()
-    Test_cmd_UN_COMMIT()
-    Test_cmd_END_COMMIT()
+    # TTL changes inside a block are rolled back with it
+    simple_test_db.cmd_START_COMMIT()
+    simple_test_db.cmd_PERSIST("herp")
+    simple_test_db.cmd_EXPIRE("flerp", 5)
+    simple_test_db.cmd_UN_COMMIT()
+
+    assert(simple_test_db.cmd_TTL("herp") == 10)
+    assert(simple_test_db.cmd_TTL("flerp") == -1)
+
+    # a PUT or DELETE in a block that's rolled back puts the old TTL back too
+    simple_test_db.cmd_START_COMMIT()
+    simple_test_db.cmd_PUT("herp", "lie")
+    simple_test_db.cmd_START_COMMIT()
+    simple_test_db.cmd_DELETE("herp")
+    simple_test_db.cmd_UN_COMMIT()
+    assert(simple_test_db.cmd_TTL("herp") == -1)
+    simple_test_db.cmd_UN_COMMIT()
+
+    assert(simple_test_db.cmd_PULL("herp") == "derp")
+    assert(simple_test_db.cmd_TTL("herp") == 10)
+
+    # expiring inside our own block is part of the block, roll-back brings the name back until the next cycle
+    simple_test_db.cmd_START_COMMIT()
+    fake_clock.now += 10
+    assert(simple_test_db.cmd_PULL("herp") == "NULL")
+    simple_test_db.cmd_UN_COMMIT()
+
+    assert(simple_test_db.get_mem_db_size() == 2)
+    assert(simple_test_db.expire_cycle() == 1)
+    assert(simple_test_db.cmd_NUM_WITH_VALUE("derp") == 1)
+
+    # another client's open block pins the name, it reads (and counts) as expired but stays put until the block closes
+    simple_test_db.cmd_PUTEX("onefish", "twofish", 10)
+
+    other_transaction_log = simple_test_db.swap_transaction_log(simple_test_db.new_transaction_log())
+    simple_test_db.cmd_START_COMMIT()
+    simple_test_db.cmd_PUT("onefish", "redfish")
+    simple_test_db.cmd_EXPIRE("onefish", 5)
+    client_transaction_log = simple_test_db.swap_transaction_log(other_transaction_log)
+
+    fake_clock.now += 5
+    assert(simple_test_db.expire_cycle() == 0)
+    assert(simple_test_db.cmd_PULL("onefish") == "NULL")
+    assert(simple_test_db.cmd_NUM_WITH_VALUE("redfish") == 0)
+    assert(simple_test_db.get_mem_db_size() == 2)
+
+    # the client rolls back, the original TTL hasn't run out yet
+    simple_test_db.swap_transaction_log(client_transaction_log)
+    simple_test_db.cmd_UN_COMMIT()
+    simple_test_db.swap_transaction_log(other_transaction_log)
+
+    assert(simple_test_db.cmd_PULL("onefish") == "twofish")
+    assert(simple_test_db.cmd_TTL("onefish") == 5)
+
+    fake_clock.now += 5
+    assert(simple_test_db.expire_cycle() == 1)
+    assert(simple_test_db.get_mem_db_size() == 1)
+
+    print "expiry transactions: passed"
+
+# run a batch of command lines as one client, returning the replies
+def run_as_client(mem_db, transaction_log, cmd_lines):
+    out_list = []
+
+    other_transaction_log = mem_db.swap_transaction_log(transaction_log)
+    mem_db.process_command_batch(cmd_lines, out_list)
+    mem_db.swap_transaction_log(other_transaction_log)
+
+    return out_list
+
+# testing optimistic locking, WATCH aborts a COMMIT when someone else got there first, CAS in a single command
+def Test_cmd_WATCH_CAS(mvcc=False):
+    simple_test_db = PyMemDB(mvcc=mvcc)
+    fake_clock = FakeClock()
+    simple_test_db.clock = fake_clock
+
+    client_a = simple_test_db.new_transaction_log()
+    client_b = simple_test_db.new_transaction_log()
+
+    simple_test_db.cmd_PUT("herp", "1")
+
+    # nobody else touched herp, the COMMIT goes through, a name no one is watching has no version
+    assert(run_as_client(simple_test_db, client_a, ["WATCH herp", "START_COMMIT", "PUT herp 2", "COMMIT"]) == ["OK"])
+    assert(simple_test_db.cmd_PULL("herp") == "2")
+    assert(simple_test_db.mem_db_versions == {} and simple_test_db.mem_db_watch_counts == {})
+
+    # client b changes herp between client a's WATCH and COMMIT, client a's whole block is rolled back
+    assert(run_as_client(simple_test_db, client_a, ["WATCH herp flerp", "PULL herp"]) == ["2"])
+    assert(run_as_client(simple_test_db, client_b, ["PUT herp 10"]) == [])
+    assert(run_as_client(simple_test_db, client_a, ["START_COMMIT", "PUT herp 3", "START_COMMIT", "PUT flerp derp",
+                                                    "COMMIT", "PULL herp", "PULL flerp", "COMMIT"]) ==
+           ["ABORTED", "10", "NULL", "NO TRANSACTION"])
+    assert(not client_a.is_open() and simple_test_db.mem_db_versions == {})
+
+    # client a's own writes (even a DELETE and a roll-back) don't count as a conflict
+    assert(run_as_client(simple_test_db, client_a, ["WATCH herp", "PUT herp 11", "START_COMMIT", "DELETE herp",
+                                                    "START_COMMIT", "PUT herp 12", "UN_COMMIT", "COMMIT"]) == ["OK"])
+    assert(simple_test_db.cmd_PULL("herp") == "NULL")
+
+    # both clients watch the same name, the first COMMIT wins
+    simple_test_db.cmd_PUT("herp", "0")
+    run_as_client(simple_test_db, client_a, ["WATCH herp", "START_COMMIT"])
+    run_as_client(simple_test_db, client_b, ["WATCH herp", "START_COMMIT"])
+    assert(simple_test_db.mem_db_watch_counts == {"herp": 2})
+    assert(run_as_client(simple_test_db, client_b, ["PUT herp b", "COMMIT"]) == ["OK"])
+    assert(run_as_client(simple_test_db, client_a, ["PUT herp a", "COMMIT"]) == ["ABORTED"])
+    assert(simple_test_db.cmd_PULL("herp") == "b")
+
+    # a COMMIT that loses puts what it wrote back at the version it had, it doesn't take anyone else down with it
+    run_as_client(simple_test_db, client_a, ["WATCH herp flerp"])
+    run_as_client(simple_test_db, client_b, ["WATCH herp"])
+    simple_test_db.cmd_PUT("flerp", "derp")
+    assert(run_as_client(simple_test_db, client_a, ["START_COMMIT", "PUT herp a", "COMMIT"]) == ["ABORTED"])
+    assert(run_as_client(simple_test_db, client_b, ["START_COMMIT", "PUT herp c", "COMMIT"]) == ["OK"])
+    assert(simple_test_db.cmd_PULL("herp") == "c")
+    simple_test_db.cmd_DELETE("flerp")
+
+    # a name running out of time is a change too, even when the client's own PULL is what expires it
+    # (in multi-version mode reads in a block never remove anything, active expiry does)
+    simple_test_db.cmd_PUTEX("herp", "derp", 10)
+    run_as_client(simple_test_db, client_a, ["WATCH herp", "START_COMMIT"])
+    fake_clock.now += 10
+
+    if mvcc:
+        assert(simple_test_db.expire_cycle() == 1)
+    assert(run_as_client(simple_test_db, client_a, ["PULL herp", "PUT herp flerp", "COMMIT"]) == ["NULL", "ABORTED"])
+    assert(simple_test_db.cmd_PULL("herp") == "NULL")
+
+    # UNWATCH and discarding the outermost block both forget the watched names
+    run_as_client(simple_test_db, client_a, ["WATCH herp", "UNWATCH"])
+    simple_test_db.cmd_PUT("herp", "1")
+    assert(run_as_client(simple_test_db, client_a, ["START_COMMIT", "PUT herp 2", "COMMIT"]) == [])
+
+    run_as_client(simple_test_db, client_a, ["WATCH herp", "START_COMMIT", "UN_COMMIT"])
+    assert(simple_test_db.mem_db_versions == {} and client_a.watched_versions == {})
+
+    # CAS only writes when the value is what we expected, "NULL" expects a missing name
+    assert(run_as_client(simple_test_db, client_a, ["CAS herp 1 3", "PULL herp"]) == ["0", "2"])
+    assert(run_as_client(simple_test_db, client_a, ["CAS herp 2 4", "CAS flerp NULL 1", "CAS flerp NULL 2"]) == ["1", "1", "0"])
+    assert(simple_test_db.cmd_PULL("herp") == "4" and simple_test_db.cmd_PULL("flerp") == "1")
+
+    # a CAS by someone else breaks a WATCH like any other write
+    run_as_client(simple_test_db, client_a, ["WATCH flerp"])
+    assert(run_as_client(simple_test_db, client_b, ["CAS flerp 1 6"]) == ["1"])
+    assert(run_as_client(simple_test_db, client_a, ["START_COMMIT", "PUT flerp 7", "COMMIT"]) == ["ABORTED"])
+    assert(simple_test_db.cmd_PULL("flerp") == "6")
+
+    print "WATCH and CAS" + (" (mvcc)" if mvcc else "") + ": passed"
+
+# testing multi-version mode, open blocks write privately and read a snapshot, old versions are garbage collected
+def Test_mvcc():
+    simple_test_db = PyMemDB(mvcc=True)
+    fake_clock = FakeClock()
+    simple_test_db.clock = fake_clock
+    commit_recorder = CommitRecorder()
+    simple_test_db.add_commit_listener(commit_recorder)
+
+    client_a = simple_test_db.new_transaction_log()
+    client_b = simple_test_db.new_transaction_log()
+
+    simple_test_db.cmd_MPUT([("herp", "derp"), ("flerp", "derp"), ("counter", "5")])
+    del commit_recorder.commits[:]
+
+    # client a's writes are its own until it commits, even its nested blocks see them
+    assert(run_as_client(simple_test_db, client_a, ["START_COMMIT", "PUT herp lie", "DELETE flerp", "INCR counter",
+                                                    "START_COMMIT", "PUT onefish twofish", "PULL herp", "PULL flerp",
+                                                    "MPULL counter onefish"]) == ["6", "lie", "NULL", "6", "twofish"])
+    assert(run_as_client(simple_test_db, client_b, ["PULL herp", "PULL flerp", "PULL counter", "PULL onefish",
+                                                    "NUM_WITH_VALUE derp", "NUM_WITH_VALUE lie"]) == ["derp", "derp", "5", "NULL", "2", "0"])
+    assert(simple_test_db.mem_db_dict == {"herp": "derp", "flerp": "derp", "counter": "5"} and commit_recorder.commits == [])
+
+    # rolling back the inner block just drops its writes
+    assert(run_as_client(simple_test_db, client_a, ["UN_COMMIT", "PULL onefish", "PULL herp"]) == ["NULL", "lie"])
+
+    # client b opens a block, its snapshot is from before client a's COMMIT
+    assert(run_as_client(simple_test_db, client_b, ["START_COMMIT", "PULL herp"]) == ["derp"])
+
+    # everything goes in at once, as one transaction for the commit listeners
+    assert(run_as_client(simple_test_db, client_a, ["COMMIT", "PULL herp", "PULL flerp", "PULL counter"]) == ["lie", "NULL", "6"])
+    assert(simple_test_db.mem_db_dict == {"herp": "lie", "counter": "6"})
+    assert(len(commit_recorder.commits) == 1 and commit_recorder.commits[0][1] == True)
+    assert(sorted(commit_recorder.commits[0][0]) == [("counter", "6"), ("flerp", None), ("herp", "lie")])
+
+    # client b still reads its snapshot, plus its own writes, until it's done
+    assert(run_as_client(simple_test_db, client_b, ["PULL herp", "PULL flerp", "PULL counter", "INCR counter", "PULL counter",
+                                                    "NUM_WITH_VALUE lie"]) == ["derp", "derp", "5", "6", "6", "1"])
+    assert(sorted(simple_test_db.mem_db_old_versions) == ["counter", "flerp", "herp"])
+
+    # reading outside of a block is always the latest committed data
+    simple_test_db.cmd_PUT("herp", "cake")
+    assert(simple_test_db.cmd_PULL("herp") == "cake")
+    assert(run_as_client(simple_test_db, client_b, ["PULL herp"]) == ["derp"])
+    assert(simple_test_db.mem_db_old_versions["herp"] == [(4, "derp", None), (5, "lie", None)])
+
+    # client a's new snapshot sees all of that, client b's older one still holds the old versions
+    assert(run_as_client(simple_test_db, client_a, ["START_COMMIT", "PULL herp"]) == ["cake"])
+
+    # when client b is done the versions only it could see are collected, client a's snapshot only needs the newest one
+    # last writer wins, client b's INCR was from its snapshot
+    assert(run_as_client(simple_test_db, client_b, ["COMMIT"]) == [])
+    assert(simple_test_db.cmd_PULL("counter") == "6")
+    assert(simple_test_db.mem_db_old_versions == {"counter": [(6, "6", None)]})
+    assert(simple_test_db.collect_old_versions() == 0)
+    assert(run_as_client(simple_test_db, client_a, ["PULL counter"]) == ["6"])
+
+    # and once the last snapshot closes, every old version goes at once
+    assert(run_as_client(simple_test_db, client_a, ["UN_COMMIT"]) == [])
+    assert(simple_test_db.mem_db_old_versions == {} and len(simple_test_db.mem_db_old_version_queue) == 0)
+    assert(simple_test_db.mem_db_snapshot_counts == {})
+
+    # TTLs go in with the block, a committed name running out of time is committed straight away
+    simple_test_db.cmd_PUTEX("onefish", "twofish", 10)
+    del commit_recorder.commits[:]
+
+    assert(run_as_client(simple_test_db, client_a, ["START_COMMIT", "PUTEX redfish bluefish 5", "PERSIST onefish",
+                                                    "TTL redfish", "TTL onefish"]) == ["1", "5", "-1"])
+    assert(simple_test_db.cmd_TTL("onefish") == 10 and simple_test_db.cmd_TTL("redfish") == -2)
+
+    fake_clock.now += 5
+    assert(run_as_client(simple_test_db, client_a, ["PULL redfish", "PULL onefish", "EXPIRE onefish 1"]) == ["NULL", "twofish", "1"])
+
+    fake_clock.now += 5
+    assert(simple_test_db.expire_cycle() == 1)
+    assert(commit_recorder.commits == [([("onefish", None)], False)])
+
+    # everything client a wrote had run out of time by its COMMIT
+    assert(run_as_client(simple_test_db, client_a, ["PULL onefish", "COMMIT"]) == ["NULL"])
+    assert(simple_test_db.cmd_PULL("onefish") == "NULL" and simple_test_db.cmd_PULL("redfish") == "NULL")
+
+    # a single client gets exactly the same replies as without multi-version mode
+    random_gen = random.Random(20160323)
+    plain_test_db = PyMemDB()
+    mvcc_test_db = PyMemDB(mvcc=True)
+    cmd_lines = []
+    depth = 0
+
+    for i in xrange(0, 20000):
+        op = random_gen.randint(0, 9)
+        name = "herp" + str(random_gen.randint(0, 20))
+
+        if op < 3:
+            cmd_lines.append("PUT " + name + " " + str(random_gen.randint(0, 5)))
+        elif op < 5:
+            cmd_lines.append(random_gen.choice(["PULL ", "DELETE ", "INCR "]) + name)
+        elif op == 5:
+            cmd_lines.append("MPUT " + name + " 1 herp" + str(random_gen.randint(0, 20)) + " 2")
+        elif op == 6:
+            cmd_lines.append("CAS " + name + " " + str(random_gen.randint(0, 5)) + " 3")
+        elif op == 7 and depth < 4:
+            cmd_lines.append("START_COMMIT")
+            depth += 1
+        elif op == 8:
+            cmd_lines.append("UN_COMMIT")
+            depth = max(depth - 1, 0)
+        else:
+            cmd_lines.append(random_gen.choice(["COMMIT", "NUM_WITH_VALUE 3", "MPULL herp1 herp2 herp3"]))
+
+            if cmd_lines[-1] == "COMMIT":
+                depth = 0
+
+        # everything a block writes only shows up in counts once it's committed, so only compare those outside of one
+        if depth and cmd_lines[-1].startswith("NUM_WITH_VALUE"):
+            cmd_lines.pop()
+
+    plain_out_list = []
+    mvcc_out_list = []
+    plain_test_db.process_command_batch(cmd_lines + ["COMMIT"], plain_out_list)
+    mvcc_test_db.process_command_batch(cmd_lines + ["COMMIT"], mvcc_out_list)
+
+    assert(plain_out_list == mvcc_out_list)
+    assert(plain_test_db.mem_db_dict == mvcc_test_db.mem_db_dict)
+    assert(mvcc_test_db.mem_db_old_versions == {})
+
+    print "mvcc: passed"
+
+''' ======== DIFFERENTIAL tests ======== '''
+
+# check every value in the value count index against a full scan of the database
+def check_value_count_index(simple_test_db, values):
+    for value in values:
+        assert(simple_test_db.cmd_NUM_WITH_VALUE(value) == simple_test_db.cmd_NUM_WITH_VALUE_SLOW(value))
+
+    # no value should hang around in the index with a zero count
+    assert(simple_test_db.mem_db_value_count_index.get_num_values() == len(set(simple_test_db.mem_db_dict.values())))
+
+    # nor in the shared value table
+    if simple_test_db.compact_storage:
+        assert(simple_test_db.mem_db_value_count_index.get_num_shared_values() == simple_test_db.mem_db_value_count_index.get_num_values())
+
+# randomized differential test, the value count index vs. cmd_NUM_WITH_VALUE_SLOW over mixed operations
+def Test_value_count_index_differential(num_ops=2000000, num_names=50, num_values=10, seed=20160323, compact_storage=False):
+    simple_test_db = PyMemDB(compact_storage=compact_storage)
+    random_gen = random.Random(seed)
+
+    names = ["name" + str(i) for i in range(0, num_names)]
+    values = ["value" + str(i) for i in range(0, num_values)]
+
+    for op_num in xrange(0, num_ops):
+        op = random_gen.random()
+
+        if op < 0.5:
+            simple_test_db.cmd_PUT(random_gen.choice(names), random_gen.choice(values))
+        elif op < 0.75:
+            simple_test_db.cmd_DELETE(random_gen.choice(names))
+        elif op < 0.85:
+            simple_test_db.cmd_START_COMMIT()
+        elif op < 0.97:
+            simple_test_db.cmd_UN_COMMIT()
+        else:
+            simple_test_db.cmd_END_COMMIT()
+
+        # spot check a random value after every operation, the whole index every so often
+        value = random_gen.choice(values)
+        assert(simple_test_db.cmd_NUM_WITH_VALUE(value) == simple_test_db.cmd_NUM_WITH_VALUE_SLOW(value))
+
+        if op_num % 10000 == 0:
+            check_value_count_index(simple_test_db, values)
+
+    # unwind whatever is still open, the index should follow every roll-back
+    while simple_test_db.cmd_UN_COMMIT():
+        check_value_count_index(simple_test_db, values)
+
+    check_value_count_index(simple_test_db, values)
+
+    print "value count index differential (compact_storage=" + str(compact_storage) + "): passed"
+
+''' ======== EVICTION tests ======== '''
+
+# testing the key and byte limits hold, the indexes follow every eviction and pinned names are never evicted
+def Test_eviction():
+    for policy_name in PyMemDBEviction.eviction_policies:
+        simple_test_db = PyMemDB(keys_with_value_index=True)
+        simple_test_db.set_eviction_policy(PyMemDBEviction.new_eviction_policy(policy_name, max_keys=100, seed=1))
+
+        commit_recorder = CommitRecorder()
+        simple_test_db.add_commit_listener(commit_recorder)
+
+        for i in range(0, 1000):
+            simple_test_db.cmd_PUT("herp" + str(i), "derp" + str(i % 10))
+
+        assert(simple_test_db.get_mem_db_size() == 100)
+        assert(simple_test_db.eviction_policy.num_evicted == 900)
+        check_value_count_index(simple_test_db, ["derp" + str(i) for i in range(0, 10)])
+        assert(sum(len(list(simple_test_db.cmd_KEYS_WITH_VALUE("derp" + str(i)))) for i in range(0, 10)) == 100)
+
+        # every eviction is a committed DELETE
+        assert(len([mutations for mutations, transaction in commit_recorder.commits if mutations[0][1] is None]) == 900)
+
+        # names written by another client's open block are pinned
+        other_transaction_log = simple_test_db.swap_transaction_log(simple_test_db.new_transaction_log())
+        simple_test_db.cmd_START_COMMIT()
+
+        pinned_names = list(simple_test_db.mem_db_dict)[:10]
+
+        for name in pinned_names:
+            simple_test_db.cmd_PUT(name, "lie")
+
+        client_transaction_log = simple_test_db.swap_transaction_log(other_transaction_log)
+
+        for i in range(0, 1000):
+            simple_test_db.cmd_PUT("flerp" + str(i), "derp")
+
+        assert(simple_test_db.get_mem_db_size() == 100)
+        assert(simple_test_db.cmd_NUM_WITH_VALUE("lie") == 10)
+
+        # roll-back puts back the pre-block values
+        simple_test_db.swap_transaction_log(client_transaction_log)
+        simple_test_db.cmd_UN_COMMIT()
+        simple_test_db.swap_transaction_log(other_transaction_log)
+
+        for name in pinned_names:
+            assert(simple_test_db.cmd_PULL(name).startswith("derp"))
+
+    # byte limit
+    simple_test_db = PyMemDB()
+    eviction_policy = PyMemDBEviction.new_eviction_policy(PyMemDBEviction.EVICT_LRU, max_bytes=100000)
+    simple_test_db.set_eviction_policy(eviction_policy)
+
+    for i in range(0, 10000):
+        simple_test_db.cmd_PUT("herp" + str(i), "derp" * (i % 50))
+        assert(eviction_policy.num_bytes <= 100000)
+
+    assert(eviction_policy.num_bytes == sum(eviction_policy.get_entry_bytes(name, value) for name, value in simple_test_db.mem_db_dict.iteritems()))
+
+    print "eviction: passed"
+
+# testing LRU keeps the recently used names and LFU keeps the frequently used ones
+def Test_eviction_policies():
+
+    # sampling every name makes the LRU exact
+    simple_test_db = PyMemDB()
+    simple_test_db.set_eviction_policy(PyMemDBEviction.new_eviction_policy(PyMemDBEviction.EVICT_LRU, max_keys=10, sample_size=100))
+
+    for i in range(0, 10):
+        simple_test_db.cmd_PUT("herp" + str(i), "derp")
+
+    # herp0 was PULLed most recently, so herp1 is the least recently used
+    simple_test_db.cmd_PULL("herp0")
+    simple_test_db.cmd_PUT("flerp", "derp")
+
+    assert(simple_test_db.cmd_PULL("herp0") == "derp")
+    assert(simple_test_db.cmd_PULL("herp1") == "NULL")
+
+    # the hot names are PULLed over and over, the cold ones only once
+    simple_test_db = PyMemDB()
+    simple_test_db.set_eviction_policy(PyMemDBEviction.new_eviction_policy(PyMemDBEviction.EVICT_LFU, max_keys=10, sample_size=100))
+
+    for i in range(0, 10):
+        simple_test_db.cmd_PUT("herp" + str(i), "derp")
+
+    for j in range(0, 20):
+        for i in range(0, 5):
+            simple_test_db.cmd_PULL("herp" + str(i))
+
+    for i in range(0, 5):
+        simple_test_db.cmd_PUT("flerp" + str(i), "derp")
+
+    for i in range(0, 5):
+        assert(simple_test_db.cmd_PULL("herp" + str(i)) == "derp")
+
+    # idle counts decay, so once the hot names go cold for long enough the new ones can push them out
+    eviction_policy = simple_test_db.eviction_policy
+    eviction_policy.tick += eviction_policy.lfu_decay_ticks * 8
+
+    for i in range(0, 10):
+        simple_test_db.cmd_PUT("onefish" + str(i), "twofish")
+
+        for j in range(0, 10):
+            simple_test_db.cmd_PULL("onefish" + str(i))
+
+    assert(simple_test_db.cmd_NUM_WITH_VALUE("twofish") == 10)
+
+    print "eviction policies: passed"
+
+''' ======== STATS tests ======== '''
+
+# testing the latency histogram, the per-command stats and INFO
+def Test_stats():
+    histogram = PyMemDBStats.LatencyHistogram()
+
+    # every latency lands in a bucket whose top is at most 1/16 above it
+    for micros in range(0, 100000, 7):
+        bucket_top = histogram.get_bucket_top(histogram.get_bucket(micros))
+        assert(micros <= bucket_top <= micros + micros / 16)
+
+    for micros in range(1, 1001):
+        histogram.record(micros / 1000000.0)
+
+    assert(histogram.total_count == 1000 and histogram.max_micros == 1000)
+    assert(abs(histogram.get_percentile(50) - 500) <= 500 / 16)
+    assert(abs(histogram.get_percentile(99) - 990) <= 990 / 16)
+    assert(histogram.get_percentile(100) == 1000)
+    assert(PyMemDBStats.LatencyHistogram().get_percentile(99) == 0)
+
+    simple_test_db = PyMemDB()
+    process_PUT = simple_test_db.command_table["PUT"][1]
+
+    # INFO and STATS go in like they do from the command line, stats off
+    arg_parser = argparse.ArgumentParser()
+    PyMemDBStats.add_stats_args(arg_parser)
+    PyMemDBStats.open_stats(simple_test_db, arg_parser.parse_args([]))
+    assert(simple_test_db.command_stats is None)
+
+    # time every call so the timed counts are exact
+    out_list = []
+    simple_test_db.process_command_batch(["STATS BOGUS", "PUT herp derp", "STATS RESET"], out_list)
+    assert(out_list == [PyMemDBStats.bad_stats_msg, "OK"])
+
+    command_stats = PyMemDBStats.enable_command_stats(simple_test_db, 1)
+    assert(simple_test_db.command_table["PUT"][1] != process_PUT)
+
+    cmd_lines = ["PUT herp" + str(i) + " derp" + str(i % 3) for i in range(0, 10)] + ["PULL herp1", "PULL nope", "BOGUS"]
+    cmd_lines += ["EXPIRE herp2 100", "START_COMMIT", "PUT herp1 cake", "START_COMMIT", "DELETE herp3", "DELETE herp4"]
+
+    simple_test_db.process_command_batch(cmd_lines, [])
+
+    # a command added after the stats were switched on is counted too
+    simple_test_db.add_command("HELLO", 1, lambda split_cmd, out_list: True)
+    simple_test_db.process_command_batch(["HELLO", "HELLO"], [])
+
+    out_list = []
+    simple_test_db.process_command_batch(["INFO"], out_list)
+    assert(int(out_list[0]) == len(out_list) - 1)
+
+    info = dict(info_line.split(":", 1) for info_line in out_list[1:])
+
+    assert(info["keys"] == "9" and info["distinct_values"] == "5" and info["expiring_keys"] == "1")
+    assert(info["open_transactions"] == "1" and info["max_transaction_depth"] == "2" and info["undo_log_entries"] == "3")
+    assert(info["command_stats"] == "on" and info["total_commands"] == "21")
+    assert(int(info["estimated_data_bytes"]) > 0)
+
+    # the INFO being run is already counted, it just hasn't been timed yet
+    cmd_info = dict(cmd_stat.split("=") for cmd_stat in info["cmd_PUT"].split(","))
+    assert(cmd_info["calls"] == "11" and cmd_info["timed"] == "11")
+    assert(int(cmd_info["p50_us"]) <= int(cmd_info["p99_us"]) <= int(cmd_info["max_us"]))
+    assert(info["cmd_PULL"].startswith("calls=2,") and info["cmd_HELLO"].startswith("calls=2,"))
+    assert("cmd_BOGUS" not in info and "cmd_MPUT" not in info)
+
+    # INFO JSON, the same figures in one line
+    out_list = []
+    simple_test_db.process_command_batch(["INFO JSON", "INFO BOGUS", "INFO JSON JSON"], out_list)
+    assert(len(out_list) == 1)
+
+    json_info = json.loads(out_list[0])
+    assert(json_info["keys"] == 9 and json_info["commands"]["PUT"]["calls"] == 11 and json_info["commands"]["INFO"]["calls"] == 2)
+
+    # sampling still counts every call, but only times 1 in sample_every
+    assert(command_stats.histograms["DELETE"].total_count == 2)
+
+    out_list = []
+    simple_test_db.process_command_batch(["STATS RESET", "STATS OFF", "PUT herp derp"], out_list)
+    assert(out_list == ["OK", "OK"])
+    assert(command_stats.get_total_calls() == 1)
+
+    # the plain process functions are back, nothing left in the command path
+    assert(simple_test_db.command_stats is None and simple_test_db.command_table["PUT"][1] == process_PUT)
+    assert(all(not hasattr(process_func, "process_func") for num_tokens, process_func in simple_test_db.command_table.itervalues()))
+
+    out_list = []
+    simple_test_db.process_command_batch(["INFO"], out_list)
+    assert("command_stats:off" in out_list and not [info_line for info_line in out_list if info_line.startswith("cmd_")])
+
+    command_stats = PyMemDBStats.enable_command_stats(simple_test_db, 4)
+    simple_test_db.process_command_batch(["PULL herp"] * 10, [])
+    assert(command_stats.call_counts["PULL"][0] == 10 and command_stats.histograms["PULL"].total_count == 2)
+
+    print "stats: passed"
+
+# testing the slow log catches the slow commands, with their arguments and transaction depth, and stays bounded
+def Test_slowlog():
+    simple_test_db = PyMemDB()
+
+    arg_parser = argparse.ArgumentParser()
+    PyMemDBStats.add_stats_args(arg_parser)
+
+    # every call's count is taken modulo --stats-sample, 0 and below are turned away up front
+    assert(arg_parser.parse_args(["--stats-sample", "1"]).stats_sample == 1)
+
+    for bad_sample in ["0", "-3", "often"]:
+        try:
+            PyMemDBStats.parse_sample_every(bad_sample)
+            assert(False)
+        except argparse.ArgumentTypeError:
+            pass
+
+    # and enable_command_stats never divides by one of them either
+    clamped_test_db = PyMemDB()
+    assert(PyMemDBStats.enable_command_stats(clamped_test_db, 0).sample_every == 1)
+    clamped_test_db.process_command_batch(["PUT herp derp", "PULL herp"], [])
+    assert(clamped_test_db.command_stats.get_command_info()["PULL"]["timed"] == 1)
+    PyMemDBStats.open_stats(simple_test_db, arg_parser.parse_args(["--slowlog-usecs", "20000", "--slowlog-max-len", "3"]))
+
+    # a command that's always slow
+    simple_test_db.add_command("NAP", None, lambda split_cmd, out_list: time.sleep(0.03) or True)
+
+    out_list = []
+    simple_test_db.process_command_batch(["PUT herp derp", "NAP one", "START_COMMIT", "START_COMMIT", "NAP two", "UN_COMMIT",
+                                          "NAP " + " ".join(str(i) for i in range(0, 40)), "SLOWLOG LEN", "SLOWLOG GET"], out_list)
+
+    # newest first, the fast commands never show up
+    assert(out_list[0] == "3" and out_list[1] == "3")
+
+    entries = [entry_line.split() for entry_line in out_list[2:]]
+    assert([int(entry[0]) for entry in entries] == [2, 1, 0])
+    assert(all(int(entry[2]) >= 20000 for entry in entries))
+    assert([entry[3] for entry in entries] == ["1", "2", "0"])
+    assert(entries[1][4:] == ["NAP", "two"] and entries[2][4:] == ["NAP", "one"])
+
+    # a long command only keeps its first tokens
+    assert(len(entries[0]) == 4 + 32 + 1 and entries[0][4] == "NAP" and entries[0][-1] == "...+9")
+
+    # only the newest slowlog_max_len are kept, ids keep counting
+    out_list = []
+    simple_test_db.process_command_batch(["NAP three", "SLOWLOG GET 1", "SLOWLOG LEN", "SLOWLOG GET x", "SLOWLOG ON", "SLOWLOG"], out_list)
+    assert(out_list[0] == "1" and out_list[1].split()[0] == "3" and out_list[1].split()[4:] == ["NAP", "three"])
+    assert(out_list[2:] == ["3", PyMemDBStats.bad_slowlog_msg, PyMemDBStats.bad_slowlog_msg, PyMemDBStats.bad_slowlog_msg])
+
+    # a new threshold keeps the entries, RESET drops them
+    out_list = []
+    simple_test_db.process_command_batch(["SLOWLOG ON 0", "PULL herp", "SLOWLOG LEN", "SLOWLOG RESET", "SLOWLOG LEN"], out_list)
+    assert(out_list == ["OK", "derp", "3", "OK", "1"])
+
+    out_list = []
+    simple_test_db.process_command_batch(["INFO"], out_list)
+    assert("slowlog:on" in out_list and "slowlog_usecs:0" in out_list)
+
+    # the command stats stay on, the histograms only get the sampled calls
+    assert(simple_test_db.command_stats.call_counts["NAP"][0] == 4)
+
+    out_list = []
+    simple_test_db.process_command_batch(["SLOWLOG OFF", "NAP four", "SLOWLOG LEN", "SLOWLOG GET", "STATS OFF", "SLOWLOG LEN"], out_list)
+    assert(out_list == ["OK", "0", "0", "OK", "0"])
+    assert(simple_test_db.command_stats is None)
+
+    print "slowlog: passed"
+
+# testing PROFILE, both profilers have to see the command loop's functions
+def Test_profiler():
+    simple_test_db = PyMemDB()
+    profile_dir = tempfile.mkdtemp()
+
+    try:
+        arg_parser = argparse.ArgumentParser()
+        PyMemDBProfiler.add_profiler_args(arg_parser)
+        PyMemDBProfiler.open_profiler(simple_test_db, arg_parser.parse_args(["--profile-dir", profile_dir]))
+
+        put_lines = ["PUT herp" + str(i) + " derp" + str(i % 10) for i in range(0, 2000)]
+
+        out_list = []
+        simple_test_db.process_command_batch(["PROFILE STATUS", "PROFILE START CPROFILE", "PROFILE STATUS", "PROFILE START SAMPLE"] +
+                                             put_lines + ["PROFILE STOP 5", "PROFILE STATUS"], out_list)
+        assert(out_list[:4] == ["off", "OK", "cprofile", PyMemDBProfiler.profiler_running_msg])
+        assert(out_list[-1] == "off")
+
+        # the count, the dump, the header and the top 5
+        report = out_list[4:-1]
+        assert(report[0] == "7" and len(report) == 8 and report[1].startswith("dump:"))
+        assert([report_line for report_line in report[3:] if "store_value" in report_line or "cmd_PUT" in report_line])
+
+        # the dump is a regular pstats file
+        profile_stats = pstats.Stats(report[1][len("dump:"):])
+        assert([function for function in profile_stats.stats if function[2] == "cmd_PUT"][0])
+
+        # the sampler needs the command loop to run for a while
+        out_list = []
+        simple_test_db.process_command_batch(["PROFILE START SAMPLE 100"], out_list)
+
+        start_time = time.time()
+
+        while time.time() - start_time < 0.3:
+            simple_test_db.process_command_batch(put_lines, out_list)
+
+        simple_test_db.process_command_batch(["PROFILE STATUS", "PROFILE STOP"], out_list)
+        assert(out_list[:2] == ["OK", "sample"])
+
+        report = out_list[2:]
+        assert(int(report[0]) == len(report) - 1 and report[2].startswith("samples:") and int(report[2][len("samples:"):]) > 0)
+
+        with open(report[1][len("dump:"):]) as folded_file:
+            assert("process_command_batch" in folded_file.read())
+
+        out_list = []
+        simple_test_db.process_command_batch(["PROFILE STOP", "PROFILE START", "PROFILE START SAMPLE x", "PROFILE"], out_list)
+        assert(out_list == [PyMemDBProfiler.profiler_not_running_msg] + [PyMemDBProfiler.bad_profile_msg] * 3)
+
+    finally:
+        shutil.rmtree(profile_dir)
+
+    print "profiler: passed"
+
+''' ======== PIPELINE tests ======== '''
+
+# testing the batched stdin/stdout command pipeline
+def Test_process_command_stream():
+    simple_test_db = PyMemDB()
+
+    in_file = tempfile.TemporaryFile()
+    out_file = tempfile.TemporaryFile()
+
+    # last command has no trailing newline, anything after QUIT is never processed
+    in_file.write("PUT herp derp\nPULL herp\nBOGUS herp\nPUT flerp\nNUM_WITH_VALUE derp\nCOMMIT\nQUIT\nPULL herp")
+    in_file.seek(0)
+
+    simple_test_db.process_command_stream(in_file, out_file)
+
+    out_file.seek(0)
+    assert(out_file.read() == "derp\n1\nNO TRANSACTION\n")
+
+    # commands split across chunk boundaries should be stitched back together
+    in_file.seek(0)
+    in_file.truncate()
+    in_file.write("PUT onefish twofish\nPULL onefish\nPULL herp")
+    in_file.seek(0)
+
+    out_file.seek(0)
+    out_file.truncate()
+
+    simple_test_db.process_command_stream(in_file, out_file, 5)
+
+    out_file.seek(0)
+    assert(out_file.read() == "twofish\nderp\n")
+
+    # cursors stream out in blocks part way through the batch
+    simple_test_db = PyMemDB(keys_with_value_index=True)
+    simple_test_db.reply_block_size = 3
+
+    in_file.seek(0)
+    in_file.truncate()
+    in_file.write("".join(["PUT fish" + str(i) + " two\n" for i in range(0, 10)]) + "KEYS_WITH_VALUE two\nPULL fish0\n")
+    in_file.seek(0)
+
+    out_file.seek(0)
+    out_file.truncate()
+
+    simple_test_db.process_command_stream(in_file, out_file)
+
+    out_file.seek(0)
+    replies = out_file.read().split("\n")
+    assert(replies[0] == "10")
+    assert(sorted(replies[1:11]) == sorted(["fish" + str(i) for i in range(0, 10)]))
+    assert(replies[11:] == ["two", ""])
+
+    # replies streamed out part way through a batch only go out once the writes before them are flushed
+    class EventStream:
+        def __init__(self, events):
+            self.events = events
+
+        def write(self, data):
+            self.events.append(("write", data.split("\n")[0]))
+
+        def flush(self):
+            pass
+
+    class SyncRecorder(CommitRecorder):
+        def __init__(self, events):
+            CommitRecorder.__init__(self)
+            self.events = events
+
+        def on_commit(self, mutations, transaction):
+            self.events.append(("commit", mutations[0][0]))
+
+        def sync(self):
+            self.events.append(("sync", None))
+
+    events = []
+    simple_test_db.add_commit_listener(SyncRecorder(events))
+
+    in_file.seek(0)
+    in_file.truncate()
+    in_file.write("INCR counter\nKEYS_WITH_VALUE two\n")
+    in_file.seek(0)
+
+    simple_test_db.process_command_stream(in_file, EventStream(events))
+
+    assert(events[0] == ("commit", "counter"))
+    assert(events.index(("sync", None)) < events.index(("write", "1")))
+
+    # the chunking is shared, any process_batch can be fed from a stream, a QUIT (False) stops it reading
+    in_file.seek(0)
+    in_file.truncate()
+    in_file.write("herp\nderp\n\nflerp\nQUIT\nnope\n")
+    in_file.seek(0)
+
+    out_file.seek(0)
+    out_file.truncate()
+
+    batches = []
+
+    def process_batch(cmd_lines, out_list):
+        batches.append(cmd_lines)
+        out_list.extend(cmd_line.upper() for cmd_line in cmd_lines if cmd_line and cmd_line != "QUIT")
+
+        return "QUIT" not in cmd_lines
+
+    PyMemDBImpl.run_command_stream(in_file, out_file, process_batch, 8)
+
+    out_file.seek(0)
+    assert(out_file.read() == "HERP\nDERP\nFLERP\n")
+    assert(batches[0] == ["herp"] and batches[-1][-1] == "QUIT" and "nope" not in sum(batches, []))
+
+    print "process_command_stream: passed"
+
+''' ======== PERSISTENCE tests ======== '''
+
+# testing the append-only log only ever holds committed changes and replays back to the same state
+def Test_append_only_log():
+    log_path = tempfile.mktemp(suffix=".aof")
+
+    try:
+        simple_test_db = PyMemDB()
+        append_only_log = PyMemDBPersistence.open_append_only_log(simple_test_db, log_path, PyMemDBPersistence.FSYNC_ALWAYS)
+
+        simple_test_db.cmd_PUT("herp", "derp")
+        simple_test_db.cmd_PUT("flerp", "derp")
+        simple_test_db.cmd_DELETE("flerp")
+        simple_test_db.cmd_DELETE("not_exist")
+
+        # rolled back writes never reach the log
+        simple_test_db.cmd_START_COMMIT()
+        simple_test_db.cmd_PUT("herp", "flerp")
+        simple_test_db.cmd_START_COMMIT()
+        simple_test_db.cmd_PUT("onefish", "twofish")
+        simple_test_db.cmd_UN_COMMIT()
+        simple_test_db.cmd_PUT("cake", "lie")
+        simple_test_db.cmd_PUT("cake", "derp")
+
+        # nothing inside the open block is written until it's committed
+        simple_test_db.sync_commit_listeners()
+        assert(open(log_path, "rb").read() == "PUT herp derp\nPUT flerp derp\nDELETE flerp\n")
+
+        simple_test_db.cmd_END_COMMIT()
+
+        # rolling back a whole transaction writes nothing at all
+        simple_test_db.cmd_START_COMMIT()
+        simple_test_db.cmd_PUT("herp", "nope")
+        simple_test_db.cmd_UN_COMMIT()
+
+        simple_test_db.close_commit_listeners()
+
+        log_data = open(log_path, "rb").read()
+        assert("onefish" not in log_data and "nope" not in log_data)
+
+        # replay into a fresh database, state and value counts should match
+        replay_test_db = PyMemDB(keys_with_value_index=True)
+        PyMemDBPersistence.replay_log(log_path, replay_test_db)
+
+        assert(replay_test_db.mem_db_dict == {"herp": "flerp", "cake": "derp"})
+        assert(replay_test_db.cmd_NUM_WITH_VALUE("derp") == 1)
+        assert(list(replay_test_db.cmd_KEYS_WITH_VALUE("flerp")) == ["herp"])
+
+        # a transaction cut off part way through (crashed while writing it) and a torn last line are thrown away
+        with open(log_path, "ab") as log_file:
+            log_file.write("START_COMMIT\nPUT herp torn\nPUT cake torn\nCOMMIT")
+
+        replay_test_db = PyMemDB()
+        PyMemDBPersistence.replay_log(log_path, replay_test_db)
+        assert(replay_test_db.mem_db_dict == {"herp": "flerp", "cake": "derp"})
+
+    finally:
+        if os.path.exists(log_path):
+            os.remove(log_path)
+
+    print "append-only log: passed"
+
+# testing snapshots only hold committed state and load back with the same value counts, in the foreground and background
+def Test_snapshot():
+    snapshot_path = tempfile.mktemp(suffix=".snap")
+
+    try:
+        simple_test_db = PyMemDB()
+        simple_test_db.cmd_PUT("herp", "derp")
+        simple_test_db.cmd_PUT("flerp", "derp")
+        simple_test_db.cmd_PUT("cake", "lie")
+
+        # an open block's writes are not committed so they stay out of the snapshot
+        simple_test_db.cmd_START_COMMIT()
+        simple_test_db.cmd_PUT("herp", "uncommitted")
+        simple_test_db.cmd_PUT("onefish", "twofish")
+        simple_test_db.cmd_DELETE("cake")
+
+        PyMemDBPersistence.save_snapshot(simple_test_db, snapshot_path)
+
+        snapshot_test_db = PyMemDB(keys_with_value_index=True)
+        assert(PyMemDBPersistence.load_snapshot(snapshot_path, snapshot_test_db) == 3)
+
+        assert(snapshot_test_db.mem_db_dict == {"herp": "derp", "flerp": "derp", "cake": "lie"})
+        assert(snapshot_test_db.cmd_NUM_WITH_VALUE("derp") == 2)
+        assert(snapshot_test_db.cmd_NUM_WITH_VALUE("uncommitted") == 0)
+        assert(sorted(snapshot_test_db.cmd_KEYS_WITH_VALUE("derp")) == ["flerp", "herp"])
+
+        # the database we loaded into works just like any other
+        snapshot_test_db.cmd_PUT("herp", "lie")
+        assert(snapshot_test_db.cmd_NUM_WITH_VALUE("lie") == 2)
+
+        # once committed, a background SNAPSHOT picks up the changes
+        simple_test_db.cmd_END_COMMIT()
+
+        snapshot_writer = PyMemDBPersistence.SnapshotWriter(simple_test_db, snapshot_path)
+        simple_test_db.add_command("SNAPSHOT", 1, snapshot_writer.process_SNAPSHOT)
+
+        out_list = []
+        simple_test_db.process_command_line("SNAPSHOT", out_list)
+        assert(out_list == ["OK"])
+
+        snapshot_writer.wait()
+        assert(snapshot_writer.last_snapshot_ok() == True)
+
+        snapshot_test_db = PyMemDB()
+        PyMemDBPersistence.load_snapshot(snapshot_path, snapshot_test_db)
+        assert(snapshot_test_db.mem_db_dict == simple_test_db.mem_db_dict)
+        assert(snapshot_test_db.mem_db_value_count_index.value_counts == simple_test_db.mem_db_value_count_index.value_counts)
+
+    finally:
+        for cleanup_path in [snapshot_path, snapshot_path + ".tmp"]:
+            if os.path.exists(cleanup_path):
+                os.remove(cleanup_path)
+
+    print "snapshot: passed"
+
+# testing the log rewrite collapses the log down to the live names while new writes keep going
+def Test_rewrite_log():
+    log_path = tempfile.mktemp(suffix=".aof")
+
+    try:
+        simple_test_db = PyMemDB()
+        append_only_log = PyMemDBPersistence.open_append_only_log(simple_test_db, log_path)
+        simple_test_db.add_command("REWRITE_LOG", 1, append_only_log.process_REWRITE_LOG)
+
+        # lots of updates to the same few names
+        for i in range(0, 1000):
+            simple_test_db.cmd_PUT("herp", "derp" + str(i))
+            simple_test_db.cmd_PUT("fish" + str(i % 10), "twofish" + str(i))
+            simple_test_db.cmd_DELETE("fish" + str(i % 7))
+
+        # an open block is left out of the rewrite until it commits
+        simple_test_db.cmd_START_COMMIT()
+        simple_test_db.cmd_PUT("cake", "lie")
+
+        simple_test_db.sync_commit_listeners()
+
+        out_list = []
+        simple_test_db.process_command_line("REWRITE_LOG", out_list)
+        simple_test_db.process_command_line("REWRITE_LOG", out_list)
+        assert(out_list == ["OK", "REWRITE IN PROGRESS"])
+
+        # these land in the side buffer as well as the old log
+        simple_test_db.cmd_END_COMMIT()
+        simple_test_db.cmd_PUT("herp", "after")
+        simple_test_db.cmd_DELETE("fish9")
+
+        append_only_log.wait_rewrite()
+
+        rewrite_stats = append_only_log.last_rewrite_stats
+        assert(rewrite_stats["after_bytes"] < rewrite_stats["before_bytes"])
+
+        # new writes go to the new log
+        simple_test_db.cmd_PUT("onefish", "twofish")
+        simple_test_db.close_commit_listeners()
+
+        # one PUT per live name at the time of the rewrite, plus what came after
+        log_lines = open(log_path, "rb").read().split("\n")
+        assert(len(log_lines) < 20)
+
+        replay_test_db = PyMemDB()
+        PyMemDBPersistence.replay_log(log_path, replay_test_db)
+        assert(replay_test_db.mem_db_dict == simple_test_db.mem_db_dict)
+
+    finally:
+        for cleanup_path in [log_path, log_path + ".rewrite"]:
+            if os.path.exists(cleanup_path):
+                os.remove(cleanup_path)
+
+    print "rewrite log: passed"
+
+''' ======== SHARD tests ======== '''
+
+# testing the shard router gives the same replies as a single PyMemDB, and keeps transaction blocks on one shard
+def Test_shard_router():
+    shard_router = PyMemDBShards.ShardRouter(3)
+
+    try:
+        simple_test_db = PyMemDB()
+
+        cmd_lines = []
+
+        for i in range(0, 300):
+            cmd_lines.append("PUT herp" + str(i) + " derp" + str(i % 7))
+
+        cmd_lines += ["PULL herp" + str(i) for i in range(0, 300, 7)]
+        cmd_lines += ["NUM_WITH_VALUE derp" + str(i) for i in range(0, 8)]
+        cmd_lines += ["DELETE herp" + str(i) for i in range(0, 300, 3)]
+        cmd_lines += ["MPUT herp1 lie herp2 lie herp3 lie", "MPULL herp3 herp2 herp1 redfish", "MDELETE herp1 herp2"]
+        cmd_lines += ["NUM_WITH_VALUE lie", "PUTEX onefish twofish 100", "TTL onefish", "BOGUS herp", "PUT herp", "COMMIT"]
+        cmd_lines += ["RANGE herp1 herp3", "RANGE herp1 herp3 5", "PREFIX herp2", "PREFIX herp2 3", "RANGE herp3 herp1"]
+        cmd_lines += ["INCR hits" + str(i % 10) for i in range(0, 50)] + ["DECR hits0", "INCRBY hits1 -7", "INCR herp5"]
+        cmd_lines += ["COUNT_VALUE_RANGE 0 4", "COUNT_VALUE_RANGE 5 5"]
+        cmd_lines += ["CAS hits2 5 cas", "CAS hits3 4 cas", "CAS redfish NULL cas", "CAS redfish NULL lie", "MPULL hits2 redfish"]
+
+        out_list = []
+        simple_out_list = []
+
+        assert(shard_router.process_command_batch(cmd_lines, out_list) == True)
+        simple_test_db.process_command_batch(cmd_lines, simple_out_list)
+        assert(out_list == simple_out_list)
+
+        # every shard owns some of the names
+        assert(len(set(shard_router.get_shard("herp" + str(i)) for i in range(0, 300))) == 3)
+
+        # the names come back from every shard
+        out_list = []
+        shard_router.process_command_batch(["KEYS_WITH_VALUE derp0"], out_list)
+        assert(out_list[0] == str(simple_test_db.cmd_NUM_WITH_VALUE("derp0")))
+        assert(sorted(out_list[1:]) == sorted(simple_test_db.cmd_KEYS_WITH_VALUE("derp0")))
+
+        # find two names on different shards
+        herp_shard = shard_router.get_shard("herp1")
+        other_name = [name for name in ["herp" + str(i) for i in range(4, 300) if i % 3] if shard_router.get_shard(name) != herp_shard][0]
+
+        # the first write picks the shard, writes anywhere else are rejected, reads are fine
+        out_list = []
+        shard_router.process_command_batch(["START_COMMIT", "START_COMMIT", "PUT herp1 cake", "PUT " + other_name + " cake",
+                                            "MPUT herp1 cake " + other_name + " cake", "PULL " + other_name, "UN_COMMIT",
+                                            "PULL herp1", "UN_COMMIT", "PULL herp1", "UN_COMMIT"], out_list)
+        assert(out_list == ["CROSS SHARD TRANSACTION", "CROSS SHARD TRANSACTION", "derp" + str(int(other_name[4:]) % 7),
+                            "NULL", "NULL", "NO TRANSACTION"])
+
+        # once every block is closed the next block can pick another shard
+        out_list = []
+        shard_router.process_command_batch(["START_COMMIT", "PUT " + other_name + " cake", "COMMIT", "PULL " + other_name, "COMMIT"], out_list)
+        assert(out_list == ["cake", "NO TRANSACTION"])
+
+        # a COUNT_VALUE_RANGE with bounds that aren't numbers has no reply, the commands around it still get theirs
+        out_list = []
+        shard_router.process_command_batch(["PULL " + other_name, "COUNT_VALUE_RANGE x y", "COUNT_VALUE_RANGE 0 nope", "PULL " + other_name],
+                                           out_list)
+        assert(out_list == ["cake", "cake"])
+
+        # nothing after a QUIT is processed
+        out_list = []
+        assert(shard_router.process_command_batch(["PULL " + other_name, "QUIT", "PULL " + other_name], out_list) == False)
+        assert(out_list == ["cake"])
+
+        # the same stdin/stdout pipeline as PyMemDB, a command split across chunks and one with no trailing newline
+        in_file = tempfile.TemporaryFile()
+        out_file = tempfile.TemporaryFile()
+
+        in_file.write("PUT onefish twofish\nPULL onefish\nPULL " + other_name)
+        in_file.seek(0)
+
+        shard_router.process_command_stream(in_file, out_file, 5)
+
+        out_file.seek(0)
+        assert(out_file.read() == "twofish\ncake\n")
+
+    finally:
+        shard_router.close()
+
+    print "shard router: passed"
+
+''' ======== THREAD tests ======== '''
+
+# testing the striped database gives the same replies as PyMemDB, and keeps every thread's blocks to itself
+def Test_striped_db(mvcc=False):
+    striped_db = PyMemDBThreads.StripedPyMemDB(4, {"mvcc": mvcc})
+    simple_test_db = PyMemDB(mvcc=mvcc)
+
+    cmd_lines = []
+
+    for i in range(0, 300):
+        cmd_lines.append("PUT herp" + str(i) + " derp" + str(i % 7))
+
+    cmd_lines += ["PULL herp" + str(i) for i in range(0, 300, 7)]
+    cmd_lines += ["NUM_WITH_VALUE derp" + str(i) for i in range(0, 8)]
+    cmd_lines += ["DELETE herp" + str(i) for i in range(0, 300, 3)]
+    cmd_lines += ["MPUT herp1 lie herp2 lie herp3 lie", "MPULL herp3 herp2 herp1 redfish", "MDELETE herp1 herp2"]
+    cmd_lines += ["NUM_WITH_VALUE lie", "PUTEX onefish twofish 100", "TTL onefish", "BOGUS herp", "PUT herp", "PULL"]
+    cmd_lines += ["RANGE herp1 herp3", "RANGE herp1 herp3 5", "PREFIX herp2", "PREFIX herp2 3", "RANGE herp3 herp1", "RANGE a b c"]
+    cmd_lines += ["INCR hits" + str(i % 10) for i in range(0, 50)] + ["DECR hits0", "INCRBY hits1 -7", "INCR herp5"]
+    cmd_lines += ["COUNT_VALUE_RANGE 0 4", "COUNT_VALUE_RANGE 5 5", "COUNT_VALUE_RANGE 5 x"]
+    cmd_lines += ["CAS hits2 5 cas", "CAS hits3 4 cas", "CAS redfish NULL cas", "CAS redfish NULL lie", "MPULL hits2 redfish"]
+
+    # nested blocks spread over every stripe
+    cmd_lines += ["COMMIT", "UN_COMMIT", "START_COMMIT", "PUT herp4 cake", "START_COMMIT", "MPUT herp5 pie herp7 pie herp8 pie"]
+    cmd_lines += ["DELETE herp10", "MPULL herp4 herp5 herp7 herp10", "UN_COMMIT", "MPULL herp4 herp5 herp7 herp10", "START_COMMIT"]
+    cmd_lines += ["INCR hits4", "COMMIT", "UN_COMMIT", "MPULL herp4 hits4", "NUM_WITH_VALUE cake", "NUM_WITH_VALUE pie"]
+
+    # an unbroken WATCH commits
+    cmd_lines += ["WATCH herp4 herp5 herp11", "START_COMMIT", "PUT herp11 tea", "PUT herp13 tea", "COMMIT", "MPULL herp11 herp13"]
+    cmd_lines += ["WATCH herp4", "COMMIT", "WATCH herp4", "UNWATCH", "START_COMMIT", "PUT herp4 cup", "COMMIT", "PULL herp4"]
+
+    out_list = []
+    simple_out_list = []
+
+    assert(striped_db.process_command_batch(cmd_lines, out_list) == True)
+    simple_test_db.process_command_batch(cmd_lines, simple_out_list)
+    assert(out_list == simple_out_list)
+
+    # every stripe owns some of the names
+    assert(len(set(striped_db.get_stripe("herp" + str(i)) for i in range(0, 300))) == 4)
+    assert(striped_db.get_mem_db_size() == simple_test_db.get_mem_db_size())
+
+    # the names come back from every stripe
+    out_list = []
+    striped_db.process_command_batch(["KEYS_WITH_VALUE derp0"], out_list)
+    assert(out_list[0] == str(simple_test_db.cmd_NUM_WITH_VALUE("derp0")))
+    assert(sorted(out_list[1:]) == sorted(simple_test_db.cmd_KEYS_WITH_VALUE("derp0")))
+
+    # run a batch on another thread, returns its replies
+    def run_on_thread(cmd_lines):
+        thread_out_list = []
+
+        cmd_thread = threading.Thread(target=striped_db.process_command_batch, args=(cmd_lines, thread_out_list))
+        cmd_thread.start()
+        cmd_thread.join()
+
+        return thread_out_list
+
+    # another thread's blocks are its own, it can't commit or roll back ours, or see our writes in multi-version mode
+    out_list = []
+    striped_db.process_command_batch(["START_COMMIT", "PUT mine20 mine"], out_list)
+    assert(run_on_thread(["PULL mine20", "UN_COMMIT", "COMMIT", "START_COMMIT", "PUT theirs22 theirs", "UN_COMMIT", "PULL theirs22"]) ==
+           ["NULL" if mvcc else "mine", "NO TRANSACTION", "NO TRANSACTION", "NULL"])
+    striped_db.process_command_batch(["UN_COMMIT", "PULL mine20", "UN_COMMIT"], out_list)
+    assert(out_list == ["NULL", "NO TRANSACTION"])
+
+    # another thread's write breaks our WATCH, the whole transaction is rolled back
+    out_list = []
+    striped_db.process_command_batch(["WATCH watch23 watch25", "START_COMMIT", "PUT lost26 lost"], out_list)
+    assert(run_on_thread(["PUT watch25 theirs"]) == [])
+    striped_db.process_command_batch(["COMMIT", "MPULL watch25 lost26"], out_list)
+    assert(out_list == ["ABORTED", "theirs", "NULL"])
+    assert(striped_db.get_open_stripes(striped_db.thread_context) == [])
+
+    # a thread going away can roll back whatever it left open
+    def leave_open():
+        striped_db.process_command_batch(["START_COMMIT", "PUT left26 left", "START_COMMIT", "PUT left29 left"], [])
+        striped_db.roll_back_open_blocks()
+
+    cmd_thread = threading.Thread(target=leave_open)
+    cmd_thread.start()
+    cmd_thread.join()
+
+    assert(striped_db.cmd_PULL("left26") == "NULL" and striped_db.cmd_PULL("left29") == "NULL")
+
+    # many threads hammering the same counters never lose an increment
+    num_threads = 8
+    num_increments = 2000
+
+    def increment(thread_num):
+        for i in xrange(0, num_increments):
+            striped_db.cmd_INCRBY("counter" + str(i % 4), 1)
+
+            # each thread writes its own names in a block, every other one is rolled back
+            striped_db.cmd_START_COMMIT()
+            striped_db.cmd_PUT("thread" + str(thread_num) + "_" + str(i), "written")
+
+            if i % 2:
+                striped_db.cmd_UN_COMMIT()
+            else:
+                striped_db.cmd_END_COMMIT()
+
+    cmd_threads = [threading.Thread(target=increment, args=(thread_num,)) for thread_num in range(0, num_threads)]
+
+    for cmd_thread in cmd_threads:
+        cmd_thread.start()
+
+    for cmd_thread in cmd_threads:
+        cmd_thread.join()
+
+    assert([striped_db.cmd_PULL("counter" + str(i)) for i in range(0, 4)] == [str(num_threads * num_increments / 4)] * 4)
+    assert(striped_db.cmd_NUM_WITH_VALUE("written") == num_threads * num_increments / 2)
+    assert(striped_db.cmd_PULL("thread3_10") == "written" and striped_db.cmd_PULL("thread3_11") == "NULL")
+
+    # nothing after a QUIT is processed
+    out_list = []
+    assert(striped_db.process_command_batch(["PULL herp4", "QUIT", "PULL herp4"], out_list) == False)
+    assert(out_list == ["cup"])
+
+    print "striped db" + (" (mvcc)" if mvcc else "") + ": passed"
+
+''' ======== SERVER tests ======== '''
+
+# read reply lines off of a client socket until we have as many as we expect
+def read_reply_lines(client_sock, num_lines):
+    reply = ""
+
+    while reply.count("\n") < num_lines:
+        data = client_sock.recv(4096)
+
+        if not data:
+            break
+
+        reply += data
+
+    return reply.split("\n")[:num_lines]
+
+# testing the TCP server with pipelined commands and a transaction block per client
+def Test_PyMemDBServer():
+    mem_db_server = PyMemDBServer("127.0.0.1", 0)
+    server_thread = mem_db_server.start_background()
+
+    client_a = socket.create_connection(mem_db_server.get_address())
+    client_b = socket.create_connection(mem_db_server.get_address())
+
+    # pipeline a handful of commands in one write, we should get all of the replies back in order
+    client_a.sendall("PUT herp derp\nPULL herp\nPUT flerp derp\nNUM_WITH_VALUE derp\nPULL nope\nCOMMIT\n")
+    assert(read_reply_lines(client_a, 4) == ["derp", "2", "NULL", "NO TRANSACTION"])
+
+    # client a opens a transaction block, client b writes outside of any block
+    client_a.sendall("START_COMMIT\nPUT herp flerp\nPULL herp\n")
+    assert(read_reply_lines(client_a, 1) == ["flerp"])
+
+    client_b.sendall("PUT onefish twofish\nPULL herp\nUN_COMMIT\n")
+    assert(read_reply_lines(client_b, 2) == ["flerp", "NO TRANSACTION"])
+
+    # client a rolls back, client b's write should NOT have been captured by client a's block
+    client_a.sendall("UN_COMMIT\nPULL herp\nPULL onefish\n")
+    assert(read_reply_lines(client_a, 2) == ["derp", "twofish"])
+
+    # QUIT hangs up after flushing
+    client_b.sendall("QUIT\nPULL herp\n")
+    assert(client_b.recv(4096) == "")
+
+    client_a.close()
+    client_b.close()
+
+    mem_db_server.shutdown()
+    server_thread.join()
+
+    print "PyMemDBServer: passed"
+
+# testing that a big cursor reply over TCP is queued up in blocks as it's produced, not built as one giant list
+def Test_server_cursor_streaming(num_names=20000):
+    mem_db_server = PyMemDBServer("127.0.0.1", 0)
+    mem_db = mem_db_server.mem_db
+
+    for i in xrange(0, num_names):
+        mem_db.cmd_PUT("herp" + str(i), "derp")
+
+    # a connection of our own, so we can see what one batch queues up before anything is sent
+    server_sock, client_sock = socket.socketpair()
+    connection = PyMemDBConnection(server_sock, mem_db, {})
+
+    connection.process_batch(["KEYS_WITH_VALUE derp", "PULL herp0"])
+
+    reply_blocks = list(connection.out_chunks)
+    block_lines = [reply_block.split("\n")[:-1] for reply_block in reply_blocks]
+
+    assert(len(reply_blocks) > 1 and mem_db.reply_writer is None)
+    assert(all(len(reply_lines) <= 2 * mem_db.reply_block_size for reply_lines in block_lines))
+
+    reply_lines = [reply_line for reply_lines in block_lines for reply_line in reply_lines]
+    assert(reply_lines[0] == str(num_names) and reply_lines[-1] == "derp")
+    assert(sorted(reply_lines[1:-1]) == sorted("herp" + str(i) for i in xrange(0, num_names)))
+    assert(connection.get_queued_bytes() == sum(len(reply_block) for reply_block in reply_blocks))
+
+    connection.close()
+    client_sock.close()
+
+    # and the whole reply still makes it to a real client in order
+    server_thread = mem_db_server.start_background()
+    client_sock = socket.create_connection(mem_db_server.get_address())
+
+    reply_lines = send_commands(client_sock, ["KEYS_WITH_VALUE derp", "PULL herp0"], num_names + 2)
+    assert(reply_lines[0] == str(num_names) and reply_lines[-1] == "derp" and len(set(reply_lines[1:-1])) == num_names)
+
+    client_sock.close()
+
+    mem_db_server.shutdown()
+    server_thread.join()
+
+    print "server cursor streaming: passed"
+
+''' ======== REPLICATION tests ======== '''
+
+# send commands down a client socket and read back one reply per expected line
+def send_commands(client_sock, cmd_lines, num_reply_lines):
+    client_sock.sendall("".join(cmd_line + "\n" for cmd_line in cmd_lines))
+
+    return read_reply_lines(client_sock, num_reply_lines)
+
+# REPLICATION_INFO as a dict of key -> value
+def get_replication_info(client_sock):
+    client_sock.sendall("REPLICATION_INFO\n")
+
+    reply = ""
+
+    # the first line says how many more there are
+    while "\n" not in reply or reply.count("\n") <= int(reply.split("\n", 1)[0]):
+        reply += client_sock.recv(4096)
+
+    return dict(info_line.split(":", 1) for info_line in reply.split("\n")[1:-1])
+
+# keep calling check_func (every poll_secs) until it returns True, False if it never does within timeout seconds
+def wait_for(check_func, timeout=10.0, poll_secs=0.01):
+    give_up_time = timeit.default_timer() + timeout
+
+    while timeit.default_timer() < give_up_time:
+        if check_func():
+            return True
+
+        time.sleep(poll_secs)
+
+    return False
+
+# testing a primary and a replica server, full sync, streaming, read-only replicas and catching up from the backlog
+def Test_replication():
+    primary_db = PyMemDB()
+    primary_server = PyMemDBServer("127.0.0.1", 0, primary_db)
+    feed, listener = PyMemDBReplication.open_primary(primary_db, "127.0.0.1", 0, primary_server.socket_map)
+    replication_address = listener.get_address()
+
+    # some committed data before the replica shows up, it has to come over in the full sync
+    for i in range(0, 100):
+        primary_db.cmd_PUT("name" + str(i), "value" + str(i % 10))
+
+    primary_thread = primary_server.start_background()
+
+    replica_db = PyMemDB()
+    replica_server = PyMemDBServer("127.0.0.1", 0, replica_db)
+    replica_client = PyMemDBReplication.open_replica(replica_db, replication_address[0], replication_address[1],
+                                                     replica_server.socket_map)
+    replica_client.reconnect_secs = 0.05
+    replica_thread = replica_server.start_background()
+
+    primary_sock = socket.create_connection(primary_server.get_address())
+    other_primary_sock = socket.create_connection(primary_server.get_address())
+    replica_sock = socket.create_connection(replica_server.get_address())
+
+    assert(wait_for(lambda: send_commands(replica_sock, ["PULL name99", "NUM_WITH_VALUE value3"], 2) == ["value9", "10"]))
+
+    # the replica's clients can read but not write
+    assert(send_commands(replica_sock, ["PUT name1 nope", "DELETE name1", "MPUT a b", "PULL name1"], 4) ==
+           ["READ ONLY REPLICA", "READ ONLY REPLICA", "READ ONLY REPLICA", "value1"])
+
+    # rolled back and still open blocks never reach the replica, committed ones do
+    send_commands(primary_sock, ["START_COMMIT", "PUT name1 rolled_back", "UN_COMMIT"], 0)
+    send_commands(other_primary_sock, ["START_COMMIT", "PUT name2 still_open"], 0)
+    send_commands(primary_sock, ["START_COMMIT", "PUT name3 committed", "DELETE name4", "COMMIT", "PUT name5 plain"], 0)
+
+    assert(wait_for(lambda: send_commands(replica_sock, ["PULL name5"], 1) == ["plain"]))
+    assert(send_commands(replica_sock, ["PULL name1", "PULL name2", "PULL name3", "PULL name4"], 4) ==
+           ["value1", "value2", "committed", "NULL"])
+
+    send_commands(other_primary_sock, ["COMMIT"], 0)
+    assert(wait_for(lambda: send_commands(replica_sock, ["PULL name2"], 1) == ["still_open"]))
+
+    # both sides agree on the offset once the replica has ACKed everything
+    def is_caught_up():
+        primary_info = get_replication_info(primary_sock)
+
+        return (primary_info["connected_replicas"] == "1" and "lag_bytes=0" in primary_info["replica0"] and
+                get_replication_info(replica_sock)["offset"] == primary_info["offset"])
+
+    assert(wait_for(is_caught_up))
+
+    replica_info = get_replication_info(replica_sock)
+    assert(replica_info["role"] == "replica" and replica_info["state"] == "online")
+    assert(replica_info["full_syncs"] == "1" and replica_info["lag_bytes"] == "0")
+
+    # a replica asking to continue from an offset in the backlog just gets what it's missing
+    primary_info = get_replication_info(primary_sock)
+    send_commands(primary_sock, ["PUT name6 six"], 0)
+
+    raw_replica_sock = socket.create_connection(replication_address)
+    raw_replica_sock.sendall("SYNC " + primary_info["replid"] + " " + primary_info["offset"] + "\n")
+    assert(read_reply_lines(raw_replica_sock, 2) == ["CONTINUE " + primary_info["replid"] + " " + primary_info["offset"], "PUT name6 six"])
+    raw_replica_sock.close()
+
+    # take the primary down, change things while it's down and bring it back on the same replication port
+    primary_sock.close()
+    other_primary_sock.close()
+    primary_server.shutdown()
+    primary_thread.join()
+
+    assert(wait_for(lambda: get_replication_info(replica_sock)["state"] != "online"))
+
+    primary_db.cmd_PUT("name7", "seven")
+    primary_db.cmd_DELETE("name8")
+    primary_db.sync_commit_listeners()
+
+    primary_server = PyMemDBServer("127.0.0.1", 0, primary_db)
+    listener = PyMemDBReplication.ReplicationListener(feed, replication_address[0], replication_address[1], primary_server.socket_map)
+    primary_thread = primary_server.start_background()
+
+    # the replica picks up from the backlog rather than needing another full sync
+    assert(wait_for(lambda: send_commands(replica_sock, ["PULL name7", "PULL name8"], 2) == ["seven", "NULL"]))
+
+    replica_info = get_replication_info(replica_sock)
+    assert(replica_info["full_syncs"] == "1" and replica_info["partial_syncs"] == "1")
+
+    assert(replica_db.mem_db_dict == primary_db.mem_db_dict)
+    assert(replica_db.mem_db_value_count_index.value_counts == primary_db.mem_db_value_count_index.value_counts)
+
+    replica_sock.close()
+
+    replica_server.shutdown()
+    replica_thread.join()
+    primary_server.shutdown()
+    primary_thread.join()
+
+    print "replication: passed"
+
+# testing the command stats and the slow log follow a replica's applied writes when they're switched on and off
+def Test_replica_stats():
+    replica_db = PyMemDB()
+    PyMemDBStats.enable_command_stats(replica_db, 1)
+
+    # nothing is listening on the primary's port, we apply the primary's lines ourselves
+    replica_client = PyMemDBReplication.open_replica(replica_db, "127.0.0.1", get_free_port(), {})
+
+    # switched on before the replica started, its writes are counted
+    replica_client.apply_lines(["PUT herp derp", "PUT flerp derp"])
+    assert(replica_db.command_stats.get_command_info()["PUT"]["calls"] == 2)
+
+    # switched off, the plain process functions are back in every table, the replica's too
+    PyMemDBStats.disable_command_stats(replica_db)
+    assert(all(not hasattr(process_func, "process_func") for num_tokens, process_func in replica_client.apply_command_table.itervalues()))
+
+    replica_client.apply_lines(["PUT herp lie"])
+    assert(replica_db.cmd_PULL("herp") == "lie")
+
+    # switched back on after the replica started, with the slow log
+    PyMemDBStats.enable_slow_log(replica_db, 0)
+    replica_client.apply_lines(["DELETE herp"])
+
+    assert(replica_db.command_stats.get_command_info()["DELETE"]["calls"] == 1)
+    assert([entry[-1] for entry in replica_db.command_stats.slow_log.get_entries()] == [["DELETE", "herp"]])
+
+    # clients still can't write
+    out_list = []
+    replica_db.process_command_batch(["PUT herp derp", "PULL herp"], out_list)
+    assert(out_list == [PyMemDBReplication.read_only_msg, "NULL"])
+
+    replica_client.close()
+
+    print "replica stats: passed"
+
+''' ======== PUBSUB tests ======== '''
+
+# testing SUBSCRIBE/PSUBSCRIBE over the server, keyspace notifications only show up once they're committed
+def Test_pubsub():
+    mem_db_server = PyMemDBServer("127.0.0.1", 0)
+
+    arg_parser = argparse.ArgumentParser()
+    PyMemDBPubSub.add_pubsub_args(arg_parser)
+    pubsub_hub = PyMemDBPubSub.open_server_pubsub(mem_db_server, arg_parser.parse_args(["--pubsub"]))
+
+    server_thread = mem_db_server.start_background()
+
+    subscriber = socket.create_connection(mem_db_server.get_address())
+    writer = socket.create_connection(mem_db_server.get_address())
+
+    assert(send_commands(subscriber, ["PSUBSCRIBE __key__:user:*", "SUBSCRIBE news alerts", "SUBSCRIBE", "PUBLISH news"], 4) ==
+           ["1", "3", PyMemDBPubSub.bad_pubsub_msg, PyMemDBPubSub.bad_pubsub_msg])
+
+    # only the names matching the pattern, in the order they were committed
+    assert(send_commands(writer, ["PUT user:1 herp", "PUT other derp", "DELETE user:1", "PULL user:1"], 1) == ["NULL"])
+    assert(read_reply_lines(subscriber, 2) == ["PMESSAGE __key__:user:* __key__:user:1 PUT", "PMESSAGE __key__:user:* __key__:user:1 DELETE"])
+
+    # nothing in an open block goes out, the PUBLISH gets there first
+    assert(send_commands(writer, ["START_COMMIT", "PUT user:2 flerp", "START_COMMIT", "PUT user:3 blerp", "UN_COMMIT", "PULL user:2",
+                                  "PUBLISH news hello there"], 2) == ["flerp", "1"])
+    assert(read_reply_lines(subscriber, 1) == ["MESSAGE news hello there"])
+
+    # the commit only has what wasn't rolled back
+    assert(send_commands(writer, ["COMMIT", "PUBLISH alerts done"], 1) == ["1"])
+    assert(read_reply_lines(subscriber, 2) == ["PMESSAGE __key__:user:* __key__:user:2 PUT", "MESSAGE alerts done"])
+
+    assert(send_commands(subscriber, ["UNSUBSCRIBE news", "UNSUBSCRIBE", "PUBLISH alerts anyone"], 3) == ["2", "1", "0"])
+
+    # a subscriber sees its own writes too, ahead of the batch's replies
+    assert(send_commands(subscriber, ["PUT user:4 herp", "PULL user:4"], 2) == ["PMESSAGE __key__:user:* __key__:user:4 PUT", "herp"])
+
+    subscriber.sendall("PUBSUB_INFO\n")
+    info_lines = read_reply_lines(subscriber, 8)
+    assert(info_lines[0] == "7" and "subscribers:1" in info_lines and "channels:0" in info_lines and "patterns:1" in info_lines)
+
+    # with no one subscribed the hub stops listening to commits altogether
+    assert(send_commands(subscriber, ["PUNSUBSCRIBE"], 1) == ["0"])
+    assert(not pubsub_hub.listening)
+    assert(send_commands(writer, ["PUT user:5 herp", "PUBLISH news bye"], 1) == ["0"])
+
+    # a closed connection takes its subscriptions with it
+    send_commands(subscriber, ["PSUBSCRIBE *"], 1)
+    subscriber.close()
+
+    assert(wait_for(lambda: not pubsub_hub.pattern_subscribers) and not pubsub_hub.listening)
+    assert(send_commands(writer, ["PUBLISH news bye"], 1) == ["0"])
+
+    writer.close()
+
+    mem_db_server.shutdown()
+    server_thread.join()
+
+    print "pubsub: passed"
+
+# testing a subscriber that stops reading, the writers carry on and it gets a DROPPED line and the newest messages
+def Test_pubsub_backpressure(num_puts=50000):
+    mem_db_server = PyMemDBServer("127.0.0.1", 0)
+
+    arg_parser = argparse.ArgumentParser()
+    PyMemDBPubSub.add_pubsub_args(arg_parser)
+    pubsub_hub = PyMemDBPubSub.open_server_pubsub(mem_db_server, arg_parser.parse_args(["--pubsub", "--pubsub-max-pending", "100",
+                                                                                         "--pubsub-max-out-bytes", "4096"]))
+
+    server_thread = mem_db_server.start_background()
+
+    subscriber = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    subscriber.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    subscriber.connect(mem_db_server.get_address())
+
+    writer = socket.create_connection(mem_db_server.get_address())
+
+    assert(send_commands(subscriber, ["PSUBSCRIBE __key__:*"], 1) == ["1"])
+
+    # every write is answered while the subscriber isn't reading at all
+    for batch_start in range(0, num_puts, 1000):
+        cmd_lines = ["PUT herp" + str(i) + " derp" for i in range(batch_start, batch_start + 1000)]
+        assert(send_commands(writer, cmd_lines + ["PULL herp" + str(batch_start)], 1) == ["derp"])
+
+    writer.sendall("PUBSUB_INFO\n")
+    info = dict(info_line.split(":", 1) for info_line in read_reply_lines(writer, 8)[1:])
+    assert(int(info["dropped"]) > 0 and int(info["pending"]) <= 100)
+
+    # reading again, the last message makes it through after a gap
+    reply = ""
+    last_message = "PMESSAGE __key__:* __key__:herp" + str(num_puts - 1) + " PUT\n"
+
+    while not reply.endswith(last_message):
+        reply += subscriber.recv(65536)
+
+    message_lines = reply.split("\n")[:-1]
+    dropped_lines = [message_line for message_line in message_lines if message_line.startswith("DROPPED ")]
+
+    assert(dropped_lines and len(message_lines) - len(dropped_lines) + sum(int(dropped_line.split()[1]) for dropped_line in dropped_lines) == num_puts)
+
+    subscriber.close()
+    writer.close()
+
+    mem_db_server.shutdown()
+    server_thread.join()
+
+    print "pubsub backpressure: passed"
+
+''' ======== SCRIPT tests ======== '''
+
+# testing SCRIPT_LOAD/EVAL/EVALSHA, a script commits as one transaction or not at all
+def Test_scripts(mvcc=False):
+    simple_test_db = PyMemDB(mvcc=mvcc)
+    PyMemDBScripts.open_scripts(simple_test_db)
+
+    commit_recorder = CommitRecorder()
+    simple_test_db.add_commit_listener(commit_recorder)
+
+    rename_script = "PULL $1 ; CHECK_NOT %1 NULL ; PUT $2 %1 ; DELETE $1"
+    cas_script = "PULL $1 ; CHECK %1 $2 ; PUT $1 $3 ; PULL $1"
+
+    # nothing but the data commands, with the right number of arguments, and only earlier steps' replies
+    out_list = []
+    simple_test_db.process_command_batch(["SCRIPT_LOAD PUT a b ; START_COMMIT", "SCRIPT_LOAD QUIT", "SCRIPT_LOAD EVAL 0 PULL a",
+                                          "SCRIPT_LOAD PUT a", "SCRIPT_LOAD PULL %1", "SCRIPT_LOAD PULL a ; ; PULL b", "SCRIPT_LOAD PULL a ;",
+                                          "SCRIPT_LOAD CHECK a", "SCRIPT_LOAD HERP a", "EVAL x PULL a", "EVAL -1 PULL a", "EVAL 2 a PULL a",
+                                          "SCRIPT_LOAD"], out_list)
+    assert(out_list == [PyMemDBScripts.bad_script_msg] * 13)
+
+    out_list = []
+    simple_test_db.process_command_batch(["SCRIPT_LOAD " + rename_script, "SCRIPT_LOAD  " + cas_script.replace(" ", "   "),
+                                          "SCRIPT_EXISTS " + hashlib.sha1(cas_script).hexdigest(), "SCRIPT_EXISTS herp"], out_list)
+    rename_sha1 = hashlib.sha1(rename_script).hexdigest()
+    cas_sha1 = hashlib.sha1(cas_script).hexdigest()
+    assert(out_list == [rename_sha1, cas_sha1, "1", "0"])
+
+    # every step's replies, after the number of them
+    out_list = []
+    simple_test_db.process_command_batch(["PUT herp derp", "EVALSHA " + rename_sha1 + " herp flerp", "PULL herp", "PULL flerp",
+                                          "EVALSHA " + cas_sha1 + " flerp derp blerp", "EVALSHA " + cas_sha1 + " flerp"], out_list)
+    assert(out_list == ["1", "derp", "NULL", "derp", "2", "derp", "blerp", PyMemDBScripts.bad_script_msg])
+
+    # each script is one transaction with only its writes
+    assert(commit_recorder.commits[0] == ([("herp", "derp")], False))
+    assert(sorted(commit_recorder.commits[1][0]) == [("flerp", "derp"), ("herp", None)] and commit_recorder.commits[1][1])
+    assert(commit_recorder.commits[2] == ([("flerp", "blerp")], True) and len(commit_recorder.commits) == 3)
+
+    # a failed CHECK, or a step replying NOT AN INTEGER, undoes everything the script did
+    out_list = []
+    simple_test_db.process_command_batch(["EVALSHA " + cas_sha1 + " flerp derp nope", "EVALSHA " + rename_sha1 + " herp flerp",
+                                          "EVAL 3 onefish twofish flerp PUT $1 $2 ; INCR $1 ; PUT $3 $2", "EVAL 1 flerp INCR $1",
+                                          "PULL flerp", "PULL onefish", "PULL herp"], out_list)
+    assert(out_list == ["ABORTED", "ABORTED", "ABORTED", "ABORTED", "blerp", "NULL", "NULL"])
+    assert(len(commit_recorder.commits) == 3 and not simple_test_db.is_in_commit_block())
+
+    # inside a client's block the script's writes are the block's, the block is still open afterwards
+    out_list = []
+    simple_test_db.process_command_batch(["START_COMMIT", "PUT flerp one", "EVAL 2 flerp two PUT $1 $2 ; PULL $1 ; PUT herp %2", "PUT flerp three",
+                                          "EVAL 1 flerp PUT $1 four ; INCR $1", "PULL flerp", "PULL herp"], out_list)
+    assert(out_list == ["1", "two", "ABORTED", "three", "two"])
+    assert(simple_test_db.get_transaction_depth() == 1 and len(commit_recorder.commits) == 3)
+
+    out_list = []
+    simple_test_db.process_command_batch(["UN_COMMIT", "PULL flerp", "PULL herp", "START_COMMIT", "EVALSHA " + rename_sha1 + " flerp herp",
+                                          "COMMIT", "PULL flerp", "PULL herp"], out_list)
+    assert(out_list == ["blerp", "NULL", "1", "blerp", "NULL", "blerp"])
+    assert(len(commit_recorder.commits) == 4 and sorted(commit_recorder.commits[3][0]) == [("flerp", None), ("herp", "blerp")])
+
+    # the cache can be emptied
+    out_list = []
+    simple_test_db.process_command_batch(["SCRIPT_FLUSH", "SCRIPT_EXISTS " + rename_sha1, "EVALSHA " + rename_sha1 + " herp flerp"], out_list)
+    assert(out_list == ["OK", "0", PyMemDBScripts.no_script_msg])
+
+    print "scripts" + (" (mvcc)" if mvcc else "") + ": passed"
+
+''' ======== BENCHMARK tests ======== '''
+
+# testing the benchmark suite on a tiny database, every run has to see the same commands and --compare has to catch
+# a benchmark that got worse
+def Test_benchmark_suite():
+    arg_parser = argparse.ArgumentParser()
+    PyMemDBBench.add_bench_args(arg_parser)
+    args = arg_parser.parse_args(["--keys", "2000", "--ops", "3000", "--runs", "2", "--warmup", "1", "--batch-size", "100"])
+
+    # the same seed makes the same commands
+    for distribution in ["uniform", "zipf"]:
+        cmd_lines = [PyMemDBBench.make_mixed_commands("write_heavy", PyMemDBBench.key_sampler(distribution, args.keys, args.skew, random_gen),
+                                                      args.ops, args.values, random_gen)
+                     for random_gen in [random.Random(args.seed), random.Random(args.seed)]]
+
+        assert(cmd_lines[0] == cmd_lines[1] and len(cmd_lines[0]) == args.ops)
+
+    # zipf names pile up on the first few, uniform ones don't
+    random_gen = random.Random(args.seed)
+    next_key = PyMemDBBench.key_sampler("zipf", args.keys, args.skew, random_gen)
+    assert(len([i for i in range(0, 1000) if next_key() < 10]) > 200)
+
+    next_key = PyMemDBBench.key_sampler("uniform", args.keys, args.skew, random_gen)
+    assert(len([i for i in range(0, 1000) if next_key() < 10]) < 50)
+
+    # every transaction ends with everything committed
+    cmd_lines = PyMemDBBench.make_transaction_commands(lambda: 0, 20, 3, 2, 10, random.Random(args.seed))
+    assert(len(cmd_lines) == 22 and cmd_lines[0] == cmd_lines[3] == cmd_lines[6] == "START_COMMIT" and cmd_lines[9:11] == ["UN_COMMIT", "COMMIT"])
+    assert(cmd_lines[1].startswith("PUT key0 v"))
+
+    simple_test_db = PyMemDB()
+    simple_test_db.process_command_batch(cmd_lines, [])
+    assert(not simple_test_db.is_in_commit_block())
+
+    try:
+        PyMemDBBench.get_benchmark_names(arg_parser.parse_args(["--only", "load,herp"]))
+        assert(False)
+    except ValueError:
+        pass
+
+    args.only = "load,memory,write_heavy_zipf,transactions,pipeline"
+    results = PyMemDBBench.run_suite(PyMemDBBench.get_benchmark_names(args), args)
+
+    assert(PyMemDBBench.get_result_names(results) == args.only.split(","))
+    assert(results["settings"]["keys"] == 2000 and results["settings"]["seed"] == args.seed)
+
+    for name in results["results"]:
+        result = results["results"][name]
+
+        assert(len(result["runs"]) == 2 and result["min"] <= result["median"] <= result["max"] and result["min"] > 0)
+
+    # every command of the in-process runs gets a latency, the pipeline and memory only have a figure
+    assert(results["results"]["write_heavy_zipf"]["latency_us"]["count"] == 2 * args.ops)
+    assert("latency_us" not in results["results"]["pipeline"] and "latency_us" not in results["results"]["memory"])
+    assert(results["results"]["memory"]["higher_is_better"] is False)
+
+    report_lines = PyMemDBBench.format_report(results)
+    assert(len(report_lines) == 5 and report_lines[0].startswith("load ") and "p99" in report_lines[3])
+
+    # the results survive a trip through a file
+    results_file = tempfile.NamedTemporaryFile(suffix=".json", delete=False)
+    results_file.close()
+
+    try:
+        PyMemDBBench.save_results(results, results_file.name)
+        saved_results = PyMemDBBench.load_results(results_file.name)
+    finally:
+        os.remove(results_file.name)
+
+    assert(saved_results["results"]["transactions"]["median"] == results["results"]["transactions"]["median"])
+
+    comparison_rows = PyMemDBBench.compare_results(saved_results, results)
+    assert(len(comparison_rows) == 5 + 3 and set(row[4] for row in comparison_rows) == set([PyMemDBBench.same_verdict]))
+
+    # a baseline twice as fast with half the memory, everything got worse
+    baseline = json.loads(json.dumps(results))
+    baseline["settings"]["keys"] = 4000
+
+    for name, result in baseline["results"].items():
+        result["median"] = result["median"] * (2 if result["higher_is_better"] else 0.5)
+
+        if "latency_us" in result:
+            result["latency_us"]["p99"] = result["latency_us"]["p99"] + 100
+
+    comparison_rows = PyMemDBBench.compare_results(baseline, results, 10.0)
+    assert([row[0] for row in comparison_rows if row[4] != PyMemDBBench.same_verdict] == [row[0] for row in comparison_rows])
+
+    verdicts = dict((row[0], row[4]) for row in comparison_rows)
+    assert(verdicts["load"] == verdicts["memory"] == PyMemDBBench.regression_verdict)
+    assert(verdicts["load.p99_us"] == PyMemDBBench.improved_verdict)
+
+    # and the other way around it all improved, only the moves past the threshold count
+    comparison_rows = PyMemDBBench.compare_results(results, baseline, 60.0)
+    verdicts = dict((row[0], row[4]) for row in comparison_rows)
+    assert(verdicts["load"] == PyMemDBBench.improved_verdict and verdicts["memory"] == PyMemDBBench.same_verdict)
+    assert(verdicts["load.p99_us"] == PyMemDBBench.regression_verdict)
+
+    comparison_lines = PyMemDBBench.format_comparison(baseline, results, comparison_rows)
+    assert(comparison_lines[0] == "warning: keys was 4000 now 2000" and len(comparison_lines) == 2 + len(comparison_rows))
+
+    print "benchmark suite: passed"
+
+# the whole benchmark suite at its default sizes, PyMemDBBench.py --json/--compare is the way to track these
+# between commits, this just makes sure it runs and that NUM_WITH_VALUE stays a lookup rather than a scan
+def TestBenchmarkSuite():
+    arg_parser = argparse.ArgumentParser()
+    PyMemDBBench.add_bench_args(arg_parser)
+    args = arg_parser.parse_args([])
+
+    print "Running the benchmark suite on: " + str(args.keys) + " names, " + str(args.runs) + " runs each. be patient"
+
+    results = PyMemDBBench.run_suite(PyMemDBBench.get_benchmark_names(args), args)
+
+    for report_line in PyMemDBBench.format_report(results):
+        print report_line
+
+    # a scan of every name would manage a handful a second
+    assert(results["results"]["num_with_value"]["min"] > 10000)
+
+    print "benchmark suite performance: passed"
+
+# write out a script of mixed PUT/PULL/NUM_WITH_VALUE/DELETE commands for the pipeline benchmark
+def write_command_script(script_file, num_commands):
+    chunk_size = 100000
+
+    for chunk_start in range(0, num_commands, chunk_size):
+        cmd_lines = []
+
+        for i in xrange(chunk_start, min(chunk_start + chunk_size, num_commands)):
+            op = i % 4
+
+            if op == 0:
+                cmd_lines.append("PUT " + str(i) + " v" + str(i % 100))
+            elif op == 1:
+                cmd_lines.append("PULL " + str(i - 1))
+            elif op == 2:
+                cmd_lines.append("NUM_WITH_VALUE v" + str((i - 2) % 100))
+            else:
+                cmd_lines.append("DELETE " + str(i - 3))
+
+        script_file.write("\n".join(cmd_lines) + "\n")
+
+# run a command script through a PyMemDB process, returning how long it took
+def time_command_script(script_path, mem_db_args):
+    with open(script_path, "r") as script_file:
+        with open(os.devnull, "w") as null_file:
+            start_time = timeit.default_timer()
+            subprocess.check_call([sys.executable] + mem_db_args, stdin=script_file, stdout=null_file)
+
+            return timeit.default_timer() - start_time
+
+# the old way of doing things, one readline and one print per command
+line_at_a_time_code = """
+import sys
+import PyMemDBPersistence
+from PyMemDBImpl import PyMemDB
+simple_mem_db = PyMemDB()
+for mem_db_cmd in iter(sys.stdin.readline, ""):
+    if not simple_mem_db.process_command_line(mem_db_cmd):
+        break
+"""
+
+# throughput of the batched stdin/stdout pipeline vs. reading and printing one line at a time
+def TestBatchedPipelineThroughput(num_commands=10000000):
+    script_file = tempfile.NamedTemporaryFile(suffix=".txt", delete=False)
+
+    print "Writing a script with: " + str(num_commands) + " commands. be patient"
+
+    try:
+        write_command_script(script_file, num_commands)
+        script_file.close()
+
+        mem_db_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "PyMemDBImpl.py")
+
+        time_batched = time_command_script(script_file.name, [mem_db_path])
+        time_line_at_a_time = time_command_script(script_file.name, ["-c", line_at_a_time_code])
+
+    finally:
+        os.remove(script_file.name)
+
+    print "batched pipeline: " + str(int(num_commands / time_batched)) + " commands/sec in " + str(time_batched)
+    print "line at a time: " + str(int(num_commands / time_line_at_a_time)) + " commands/sec in " + str(time_line_at_a_time)
+
+    # batching should never be slower than going line by line
+    assert(time_batched < time_line_at_a_time)
+
+    print "batched pipeline throughput: passed"
+
+# time nested START_COMMIT/UN_COMMIT/COMMIT at max_depth blocks and a single block with max_writes writes
+def TestNestedTransactionPerformance(max_depth=10000, max_writes=1000000):
+    simple_test_db = PyMemDB()
+
+    # max_depth nested blocks with one write each, then roll them all back
+    start_time = timeit.default_timer()
+
+    for depth in xrange(0, max_depth):
+        simple_test_db.cmd_START_COMMIT()
+        simple_test_db.cmd_PUT(str(depth), "a")
+
+    time_start_commits = timeit.default_timer() - start_time
+
+    start_time = timeit.default_timer()
+
+    while simple_test_db.cmd_UN_COMMIT():
+        pass
+
+    time_un_commits = timeit.default_timer() - start_time
+
+    assert(simple_test_db.get_mem_db_size() == 0)
+
+    # same again, but commit them all in one go
+    for depth in xrange(0, max_depth):
+        simple_test_db.cmd_START_COMMIT()
+        simple_test_db.cmd_PUT(str(depth), "a")
+
+    time_deep_commit = timeit.timeit(simple_test_db.cmd_END_COMMIT, number=1)
+
+    assert(simple_test_db.get_mem_db_size() == max_depth)
+
+    print str(max_depth) + " nested blocks: START_COMMIT+PUT " + str(time_start_commits) + " UN_COMMIT all " + str(time_un_commits) + " COMMIT " + str(time_deep_commit)
+
+    # max_writes writes in a single block, rolled back and then committed
+    simple_test_db.cmd_START_COMMIT()
+
+    for i in xrange(0, max_writes):
+        simple_test_db.cmd_PUT(str(i), "b")
+
+    time_big_un_commit = timeit.timeit(simple_test_db.cmd_UN_COMMIT, number=1)
+
+    simple_test_db.cmd_START_COMMIT()
+
+    for i in xrange(0, max_writes):
+        simple_test_db.cmd_PUT(str(i), "b")
+
+    time_big_commit = timeit.timeit(simple_test_db.cmd_END_COMMIT, number=1)
+
+    print str(max_writes) + " writes in one block: UN_COMMIT " + str(time_big_un_commit) + " COMMIT " + str(time_big_commit)
+
+    # committing never replays anything, so it shouldn't depend on the depth
+    assert(time_deep_commit < 0.1)
+
+    # rolling back every block only touches each write once
+    assert(time_un_commits < 1.0)
+
+    print "nested transaction performance: passed"
+
+# rough size of an undo log, the list plus every entry tuple in it
+def get_undo_log_bytes(transaction_log):
+    undo_log_bytes = sys.getsizeof(transaction_log.undo_log)
+
+    for undo_entry in transaction_log.undo_log:
+        undo_log_bytes += sys.getsizeof(undo_entry)
+
+    return undo_log_bytes
+
+# a hot name written num_writes times in one block, with and without first write wins undo log compaction
+def TestUndoLogCompaction(num_writes=1000000):
+    for compact in [False, True]:
+        simple_test_db = PyMemDB()
+        simple_test_db.swap_transaction_log(simple_test_db.new_transaction_log(compact))
+
+        simple_test_db.cmd_PUT("hot", "start")
+        simple_test_db.cmd_START_COMMIT()
+
+        start_time = timeit.default_timer()
+
+        for i in xrange(0, num_writes):
+            simple_test_db.cmd_PUT("hot", "a")
+
+        time_writes = timeit.default_timer() - start_time
+
+        num_undo_entries = simple_test_db.get_num_cmds_in_current_transaction_block()
+        undo_log_bytes = get_undo_log_bytes(simple_test_db.mem_db_transaction_log)
+
+        time_un_commit = timeit.timeit(simple_test_db.cmd_UN_COMMIT, number=1)
+
+        assert(simple_test_db.cmd_PULL("hot") == "start")
+
+        print "compact=" + str(compact) + ": " + str(num_undo_entries) + " undo entries, " + str(undo_log_bytes) + " bytes, writes " + str(time_writes) + " UN_COMMIT " + str(time_un_commit)
+
+    # the compacted log only ever holds the one hot name
+    assert(num_undo_entries == 1)
+    assert(time_un_commit < 0.01)
+
+    print "undo log compaction performance: passed"
+
+# KEYS_WITH_VALUE for a rare value, using the value keys index vs. scanning every name
+def TestKeysWithValuePerformance(max_num_values=1000000, num_rare_values=1000):
+    simple_test_db = PyMemDB(keys_with_value_index=True)
+
+    print "Populating PyMemDB with: " + str(max_num_values) + " key-value pairs. be patient"
+    for i in xrange(0, max_num_values):
+        simple_test_db.cmd_PUT(str(i), "a")
+
+    for i in xrange(0, num_rare_values):
+        simple_test_db.cmd_PUT(str(i), "rare")
+
+    time_index = timeit.timeit(lambda: sum(1 for name in simple_test_db.cmd_KEYS_WITH_VALUE("rare")), number=1)
+    time_scan = timeit.timeit(lambda: sum(1 for name in simple_test_db.cmd_KEYS_WITH_VALUE_SLOW("rare")), number=1)
+
+    print "KEYS_WITH_VALUE index: " + str(time_index) + " scan: " + str(time_scan) + " for " + str(num_rare_values) + " of " + str(max_num_values) + " names"
+
+    # the index only walks the names that have the value
+    assert(time_index < time_scan)
+
+    print "KEYS_WITH_VALUE performance: passed"
+
+# RANGE/PREFIX through the ordered index vs. scanning every name, plus what keeping the index costs a PUT
+def TestOrderedIndexPerformance(sizes=[1000000, 10000000], scan_size=100, num_queries=1000, num_scan_queries=3, num_puts=200000):
+    for num_names in sizes:
+        name_values = dict(("name%09d" % i, "value") for i in xrange(0, num_names))
+
+        simple_test_db = PyMemDB(ordered_index=True)
+
+        print "Loading PyMemDB with: " + str(num_names) + " names. be patient"
+        start_time = timeit.default_timer()
+        simple_test_db.load_dict(name_values)
+        time_load = timeit.default_timer() - start_time
+
+        random_gen = random.Random(20160323)
+        starts = ["name%09d" % random_gen.randint(0, num_names - scan_size) for i in xrange(0, num_queries)]
+
+        # scan_size names in each range, and in each prefix of all but the last 2 digits
+        def run_queries(cmd_RANGE, starts):
+            for start in starts:
+                num_found, cursor = cmd_RANGE(start, "name%09d" % (int(start[4:]) + scan_size))
+                assert(num_found == scan_size and sum(1 for name in cursor) == scan_size)
+
+                num_found, cursor = simple_test_db.cmd_PREFIX(start[:-2])
+                assert(num_found == 100 and sum(1 for name in cursor) == 100)
+
+        time_index = timeit.timeit(lambda: run_queries(simple_test_db.cmd_RANGE, starts), number=1) / num_queries
+
+        # the scan is so slow only a few queries are timed, and without the prefix half
+        def run_scans():
+            for start in starts[:num_scan_queries]:
+                num_found, cursor = simple_test_db.cmd_RANGE_SLOW(start, "name%09d" % (int(start[4:]) + scan_size))
+                assert(num_found == scan_size)
+
+        time_scan = timeit.timeit(run_scans, number=1) / num_scan_queries
+
+        print "    " + str(num_names) + " names, index rebuilt in " + str(time_load) + "s"
+        print "    RANGE of " + str(scan_size) + " + PREFIX of 100 with the index: " + str(time_index * 1000) + "ms, RANGE scan: " + str(time_scan * 1000) + "ms"
+
+        # the index finds where to start in O(log n), so it has to be far faster than looking at every name
+        assert(time_index * 10 < time_scan)
+
+        # new names in random order, with and without the index
+        new_names = ["new%09d" % random_gen.randint(0, 999999999) for i in xrange(0, num_puts)]
+
+        time_index_puts = timeit.timeit(lambda: [simple_test_db.cmd_PUT(name, "value") for name in new_names], number=1)
+
+        simple_test_db = PyMemDB()
+        simple_test_db.load_dict(name_values)
+
+        time_plain_puts = timeit.timeit(lambda: [simple_test_db.cmd_PUT(name, "value") for name in new_names], number=1)
+
+        print "    new name PUTs with the index: " + str(num_puts / time_index_puts) + "/s, without: " + str(num_puts / time_plain_puts) + "/s"
+
+    print "ordered index performance: passed"
+
+# in-engine INCR vs. a PULL and PUT round trip per increment over the server, and COUNT_VALUE_RANGE with and without the index
+def TestNumericPerformance(num_increments=20000, sizes=[1000000, 10000000], num_queries=1000, num_scan_queries=3):
+    mem_db_server = PyMemDBServer("127.0.0.1", 0)
+    server_thread = mem_db_server.start_background()
+
+    client_sock = socket.create_connection(mem_db_server.get_address())
+
+    # no waiting on delayed ACKs between the PUT and the next PULL
+    client_sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    try:
+        def incr_in_engine():
+            for i in xrange(0, num_increments):
+                send_commands(client_sock, ["INCR counter"], 1)
+
+        # the client reads the counter, adds one and writes it back, with a PULL afterwards to know the PUT landed
+        def incr_round_trip():
+            for i in xrange(0, num_increments):
+                value = int(send_commands(client_sock, ["PULL round_trip_counter"], 1)[0].replace("NULL", "0"))
+                send_commands(client_sock, ["PUT round_trip_counter " + str(value + 1)], 0)
+
+        time_incr = timeit.timeit(incr_in_engine, number=1)
+        time_round_trip = timeit.timeit(incr_round_trip, number=1)
+
+        assert(send_commands(client_sock, ["PULL counter", "PULL round_trip_counter"], 2) == [str(num_increments)] * 2)
+
+        print "INCR: " + str(num_increments / time_incr) + " increments/s, PULL + PUT: " + str(num_increments / time_round_trip) + " increments/s"
+
+    finally:
+        client_sock.close()
+
+        mem_db_server.shutdown()
+        server_thread.join()
+
+    for num_names in sizes:
+        simple_test_db = PyMemDB(numeric_index=True)
+
+        print "Loading PyMemDB with: " + str(num_names) + " numeric values. be patient"
+        start_time = timeit.default_timer()
+        simple_test_db.load_dict(dict(("name" + str(i), str(i % 100000)) for i in xrange(0, num_names)))
+        time_load = timeit.default_timer() - start_time
+
+        random_gen = random.Random(20160323)
+        ranges = [sorted([random_gen.randint(0, 100000), random_gen.randint(0, 100000)]) for i in xrange(0, num_queries)]
+
+        time_index = timeit.timeit(lambda: [simple_test_db.cmd_COUNT_VALUE_RANGE(low, high) for low, high in ranges], number=1) / num_queries
+        time_scan = timeit.timeit(lambda: [simple_test_db.cmd_COUNT_VALUE_RANGE_SLOW(low, high) for low, high in ranges[:num_scan_queries]], number=1) / num_scan_queries
+
+        for low, high in ranges[:num_scan_queries]:
+            assert(simple_test_db.cmd_COUNT_VALUE_RANGE(low, high) == simple_test_db.cmd_COUNT_VALUE_RANGE_SLOW(low, high))
+
+        print "    " + str(num_names) + " names, index built in " + str(time_load) + "s, COUNT_VALUE_RANGE with the index: " + str(time_index * 1000) + "ms, scan: " + str(time_scan * 1000) + "ms"
+
+        assert(time_index * 100 < time_scan)
+
+    print "numeric performance: passed"
+
+# many clients all incrementing one counter, WATCH + COMMIT and CAS retry until they win, a plain PULL + PUT loses updates
+# a loser backs off for a random time (up to twice as long after each loss) so the clients don't keep colliding
+def TestWatchContention(num_increments=4000, client_counts=[1, 4, 16, 64], backoff_secs=0.0001, max_backoff_secs=0.01):
+    mem_db_server = PyMemDBServer("127.0.0.1", 0)
+    server_thread = mem_db_server.start_background()
+
+    def back_off(num_tries):
+        time.sleep(random.uniform(0, min(max_backoff_secs, backoff_secs * 2 ** min(num_tries, 10))))
+
+    # each function makes one increment with its own socket, returning how many tries it took
+    def incr_watch(client_sock, counter):
+        num_tries = 1
+
+        while True:
+            value = int(send_commands(client_sock, ["WATCH " + counter, "PULL " + counter], 1)[0].replace("NULL", "0"))
+
+            if send_commands(client_sock, ["START_COMMIT", "PUT " + counter + " " + str(value + 1), "COMMIT"], 1) == ["OK"]:
+                return num_tries
+
+            back_off(num_tries)
+            num_tries += 1
+
+    def incr_cas(client_sock, counter):
+        num_tries = 1
+
+        while True:
+            value = send_commands(client_sock, ["PULL " + counter], 1)[0]
+            new_value = str(int(value.replace("NULL", "0")) + 1)
+
+            if send_commands(client_sock, ["CAS " + counter + " " + value + " " + new_value], 1) == ["1"]:
+                return num_tries
+
+            back_off(num_tries)
+            num_tries += 1
+
+    def incr_unguarded(client_sock, counter):
+        value = int(send_commands(client_sock, ["PULL " + counter], 1)[0].replace("NULL", "0"))
+
+        # a PULL after the PUT so both take a round trip, like the other two
+        send_commands(client_sock, ["PUT " + counter + " " + str(value + 1), "PULL " + counter], 1)
+
+        return 1
+
+    try:
+        print "one counter, " + str(num_increments) + " increments split across the clients:"
+
+        for num_clients in client_counts:
+            for mode_name, incr_func in [("WATCH", incr_watch), ("CAS", incr_cas), ("PULL + PUT", incr_unguarded)]:
+                counter = "counter_" + mode_name.replace(" ", "") + "_" + str(num_clients)
+                client_tries = [0] * num_clients
+
+                client_socks = []
+
+                for i in xrange(0, num_clients):
+                    client_sock = socket.create_connection(mem_db_server.get_address())
+                    client_sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                    client_socks.append(client_sock)
+
+                def run_client(client_num):
+                    for i in xrange(0, num_increments // num_clients):
+                        client_tries[client_num] += incr_func(client_socks[client_num], counter)
+
+                client_threads = [threading.Thread(target=run_client, args=(i,)) for i in xrange(0, num_clients)]
+
+                start_time = timeit.default_timer()
+
+                for client_thread in client_threads:
+                    client_thread.start()
+
+                for client_thread in client_threads:
+                    client_thread.join()
+
+                run_secs = timeit.default_timer() - start_time
+
+                num_done = (num_increments // num_clients) * num_clients
+                final_value = int(send_commands(client_socks[0], ["PULL " + counter], 1)[0])
+                num_retries = sum(client_tries) - num_done
+
+                for client_sock in client_socks:
+                    client_sock.close()
+
+                print ("    " + str(num_clients) + " clients, " + mode_name + ": " + str(num_done / run_secs) + " increments/s, " +
+                       str(num_retries * 100.0 / sum(client_tries)) + "% of tries aborted, " + str(num_done - final_value) + " lost updates")
+
+                # optimistic locking never loses an update, no matter how many clients there are
+                if incr_func is not incr_unguarded:
+                    assert(final_value == num_done)
+
+    finally:
+        mem_db_server.shutdown()
+        server_thread.join()
+
+    print "WATCH contention: passed"
+
+# startup replay of an append-only log vs. pushing the same log through command dispatch, plus group commit vs. fsync per write
+def TestAppendOnlyLogPerformance(num_records=1000000, num_fsync_writes=2000):
+    log_path = tempfile.mktemp(suffix=".aof")
+
+    try:
+        with open(log_path, "wb") as log_file:
+            write_command_script(log_file, num_records)
+
+        simple_test_db = PyMemDB()
+        time_replay = timeit.timeit(lambda: PyMemDBPersistence.replay_log(log_path, simple_test_db), number=1)
+
+        dispatch_test_db = PyMemDB()
+        time_dispatch = timeit.timeit(lambda: dispatch_test_db.process_command_batch(open(log_path, "rb").read().split("\n"), []), number=1)
+
+        assert(simple_test_db.mem_db_dict == dispatch_test_db.mem_db_dict)
+
+        print "replay " + str(num_records) + " records: bulk load " + str(time_replay) + " command dispatch " + str(time_dispatch)
+
+        os.remove(log_path)
+
+        # fsync every single write vs. group commit with one fsync per batch of writes
+        for batch_size in [1, 1000]:
+            simple_test_db = PyMemDB()
+            append_only_log = PyMemDBPersistence.open_append_only_log(simple_test_db, log_path, PyMemDBPersistence.FSYNC_ALWAYS)
+
+            start_time = timeit.default_timer()
+
+            for i in xrange(0, num_fsync_writes):
+                simple_test_db.cmd_PUT(str(i), "a")
+
+                if i % batch_size == 0:
+                    simple_test_db.sync_commit_listeners()
+
+            simple_test_db.close_commit_listeners()
+
+            time_writes = timeit.default_timer() - start_time
+
+            print "fsync always, batch of " + str(batch_size) + ": " + str(int(num_fsync_writes / time_writes)) + " writes/sec"
+
+            os.remove(log_path)
+
+    finally:
+        if os.path.exists(log_path):
+            os.remove(log_path)
+
+    assert(time_replay < time_dispatch)
+
+    print "append-only log performance: passed"
+
+# startup time loading a snapshot vs. replaying the same data as PUT commands
+def TestSnapshotPerformance(sizes=[1000000, 10000000]):
+    snapshot_path = tempfile.mktemp(suffix=".snap")
+    script_path = tempfile.mktemp(suffix=".txt")
+
+    try:
+        for max_num_values in sizes:
+            print "Writing a snapshot and a PUT script for: " + str(max_num_values) + " key-value pairs. be patient"
+
+            # same shape as TestBigODifferences, every name set to "a"
+            simple_test_db = PyMemDB()
+            simple_test_db.load_dict(dict.fromkeys(imap(str, xrange(0, max_num_values)), "a"))
+
+            PyMemDBPersistence.save_snapshot(simple_test_db, snapshot_path)
+            snapshot_size = os.path.getsize(snapshot_path)
+
+            with open(script_path, "wb") as script_file:
+                for chunk_start in xrange(0, max_num_values, 100000):
+                    script_file.write("".join(["PUT " + str(i) + " a\n" for i in xrange(chunk_start, min(chunk_start + 100000, max_num_values))]))
+
+            # only keep one copy of the database around at a time
+            simple_test_db = None
+
+            snapshot_test_db = PyMemDB()
+            time_snapshot = timeit.timeit(lambda: PyMemDBPersistence.load_snapshot(snapshot_path, snapshot_test_db), number=1)
+
+            assert(snapshot_test_db.get_mem_db_size() == max_num_values)
+            assert(snapshot_test_db.cmd_NUM_WITH_VALUE("a") == max_num_values)
+
+            snapshot_test_db = None
+
+            replay_test_db = PyMemDB()
+
+            with open(script_path, "rb") as script_file:
+                with open(os.devnull, "w") as null_file:
+                    time_replay = timeit.timeit(lambda: replay_test_db.process_command_stream(script_file, null_file), number=1)
+
+            assert(replay_test_db.get_mem_db_size() == max_num_values)
+
+            replay_test_db = None
+
+            print str(max_num_values) + " keys: snapshot (" + str(snapshot_size) + " bytes) load " + str(time_snapshot) + " vs. PUT replay " + str(time_replay)
+
+            assert(time_snapshot < time_replay)
+
+    finally:
+        for cleanup_path in [snapshot_path, script_path]:
+            if os.path.exists(cleanup_path):
+                os.remove(cleanup_path)
+
+    print "snapshot performance: passed"
+
+# log size and replay time before and after a rewrite, num_names names each updated num_updates times
+def TestRewriteLogPerformance(num_names=100000, num_updates=20):
+    log_path = tempfile.mktemp(suffix=".aof")
+
+    try:
+        simple_test_db = PyMemDB()
+        append_only_log = PyMemDBPersistence.open_append_only_log(simple_test_db, log_path, PyMemDBPersistence.FSYNC_NEVER)
+
+        for update in xrange(0, num_updates):
+            for i in xrange(0, num_names):
+                simple_test_db.cmd_PUT(str(i), str(update))
+
+            simple_test_db.sync_commit_listeners()
+
+        # keep writing while the rewrite runs
+        start_time = timeit.default_timer()
+        append_only_log.start_rewrite()
+
+        num_writes_during = 0
+
+        while append_only_log.is_rewriting():
+            simple_test_db.cmd_PUT(str(num_writes_during % num_names), "during")
+            num_writes_during += 1
+
+            if num_writes_during % 1000 == 0:
+                simple_test_db.sync_commit_listeners()
+
+        time_rewrite = timeit.default_timer() - start_time
+
+        simple_test_db.close_commit_listeners()
+
+        rewrite_stats = append_only_log.last_rewrite_stats
+
+        print "rewrite of " + str(num_names * num_updates) + " records took " + str(time_rewrite) + " with " + str(num_writes_during) + " writes meanwhile"
+        print "before: " + str(rewrite_stats["before_bytes"]) + " bytes, replay " + str(rewrite_stats["before_replay_secs"])
+        print "after: " + str(rewrite_stats["after_bytes"]) + " bytes, replay " + str(rewrite_stats["after_replay_secs"])
+
+        replay_test_db = PyMemDB()
+        PyMemDBPersistence.replay_log(log_path, replay_test_db)
+        assert(replay_test_db.mem_db_dict == simple_test_db.mem_db_dict)
+
+    finally:
+        for cleanup_path in [log_path, log_path + ".rewrite"]:
+            if os.path.exists(cleanup_path):
+                os.remove(cleanup_path)
+
+    assert(rewrite_stats["after_bytes"] < rewrite_stats["before_bytes"])
+    assert(rewrite_stats["after_replay_secs"] < rewrite_stats["before_replay_secs"])
+
+    print "rewrite log performance: passed"
+
+# resident memory of this process in bytes
+def get_resident_bytes():
+    with open("/proc/self/statm") as statm_file:
+        return int(statm_file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+# bytes per key with and without compact storage, measured in a forked child so every run starts from the same heap
+# values repeat every num_values names and come in as separate copies, like they would off of a command line
+def TestCompactStorageMemory(sizes=[1000000, 10000000], num_values=100):
+    for num_keys in sizes:
+        bytes_per_key = {}
+
+        for compact_storage in [False, True]:
+            read_fd, write_fd = os.pipe()
+
+            child_pid = os.fork()
+
+            if child_pid == 0:
+                exit_code = 1
+
+                try:
+                    os.close(read_fd)
+
+                    start_bytes = get_resident_bytes()
+
+                    simple_test_db = PyMemDB(compact_storage=compact_storage)
+
+                    for i in xrange(0, num_keys):
+                        simple_test_db.cmd_PUT(str(i), "value" + str(i % num_values))
+
+                    os.write(write_fd, str(get_resident_bytes() - start_bytes))
+
+                    exit_code = 0
+                finally:
+                    os._exit(exit_code)
+
+            os.close(write_fd)
+
+            resident_bytes = int(os.read(read_fd, 64))
+
+            os.close(read_fd)
+            os.waitpid(child_pid, 0)
+
+            bytes_per_key[compact_storage] = float(resident_bytes) / num_keys
+
+            print str(num_keys) + " keys, compact_storage=" + str(compact_storage) + ": " + str(bytes_per_key[compact_storage]) + " bytes per key"
+
+        assert(bytes_per_key[True] < bytes_per_key[False])
+
+    print "compact storage memory: passed"
+
+# a flood of names all expiring at once, reclaimed by active expiry between batches of commands
+# reports the worst pause any one cycle added to the command loop vs. expiring everything in one go
+def TestActiveExpiryPerformance(num_names=200000, batch_size=1000):
+    time_cycles = {}
+
+    for sliced in [False, True]:
+        simple_test_db = PyMemDB()
+        fake_clock = FakeClock()
+        simple_test_db.clock = fake_clock
+
+        for i in xrange(0, num_names):
+            simple_test_db.cmd_PUTEX(str(i), "derp", 10)
+
+        fake_clock.now += 10
+
+        cmd_lines = ["PUT cake lie", "PULL cake"] * (batch_size / 2)
+
+        num_batches = 0
+        max_cycle_time = 0.0
+        start_time = timeit.default_timer()
+
+        while simple_test_db.get_mem_db_size() > 1:
+            simple_test_db.process_command_batch(cmd_lines, [])
+            num_batches += 1
+
+            cycle_start_time = timeit.default_timer()
+
+            if sliced:
+                simple_test_db.expire_cycle()
+            else:
+                simple_test_db.expire_cycle(num_names, float("inf"))
+
+            max_cycle_time = max(max_cycle_time, timeit.default_timer() - cycle_start_time)
+
+        time_total = timeit.default_timer() - start_time
+        time_cycles[sliced] = max_cycle_time
+
+        print "sliced=" + str(sliced) + ": expired " + str(num_names) + " names in " + str(time_total) + " over " + str(num_batches) + " batches, longest cycle " + str(max_cycle_time)
+
+        assert(simple_test_db.cmd_NUM_WITH_VALUE("derp") == 0)
+
+    # each slice is bounded, no single cycle stalls the command loop like expiring everything at once does
+    assert(time_cycles[True] < 0.05)
+    assert(time_cycles[True] < time_cycles[False])
+
+    print "active expiry performance: passed"
+
+# hit ratio and throughput of each eviction policy used as a cache in front of a Zipf distributed workload
+# every PULL that misses is followed by a PUT, like a cache filling itself from the backing store
+def TestEvictionHitRatio(num_ops=500000, num_names=100000, max_keys=10000, skew=1.0):
+    random_gen = random.Random(20160323)
+    next_rank = PyMemDBBench.zipf_sampler(num_names, skew, random_gen)
+
+    # the same workload for every policy, shuffled so popular names aren't also the lowest numbers
+    name_order = [str(i) for i in range(0, num_names)]
+    random_gen.shuffle(name_order)
+
+    workload = [name_order[next_rank()] for i in xrange(0, num_ops)]
+
+    hit_ratios = {}
+
+    for policy_name in [None] + PyMemDBEviction.eviction_policies:
+        simple_test_db = PyMemDB()
+
+        if policy_name is not None:
+            simple_test_db.set_eviction_policy(PyMemDBEviction.new_eviction_policy(policy_name, max_keys=max_keys, seed=1))
+
+        num_hits = 0
+        start_time = timeit.default_timer()
+
+        for name in workload:
+            if simple_test_db.cmd_PULL(name) == "NULL":
+                simple_test_db.cmd_PUT(name, "derp")
+            else:
+                num_hits += 1
+
+        time_ops = timeit.default_timer() - start_time
+
+        hit_ratios[policy_name] = float(num_hits) / num_ops
+
+        print "eviction=" + str(policy_name) + ": hit ratio " + str(hit_ratios[policy_name]) + ", " + str(num_ops / time_ops) + " ops/s, " + str(simple_test_db.get_mem_db_size()) + " names"
+
+    # knowing what's been used beats guessing
+    assert(hit_ratios[PyMemDBEviction.EVICT_LRU] > hit_ratios[PyMemDBEviction.EVICT_RANDOM])
+    assert(hit_ratios[PyMemDBEviction.EVICT_LFU] > hit_ratios[PyMemDBEviction.EVICT_RANDOM])
+
+    print "eviction hit ratio: passed"
+
+# MPUT/MPULL/MDELETE in groups of group_size vs. a loop of single key commands, as python calls and as command lines
+def TestMultiKeyPerformance(num_names=1000000, group_size=1000):
+    names = [str(i) for i in xrange(0, num_names)]
+    name_values = [(name, "v" + str(i % 100)) for i, name in enumerate(names)]
+
+    name_groups = [names[i:i + group_size] for i in xrange(0, num_names, group_size)]
+    name_value_groups = [name_values[i:i + group_size] for i in xrange(0, num_names, group_size)]
+
+    # python API
+    single_test_db = PyMemDB()
+    multi_test_db = PyMemDB()
+
+    start_time = timeit.default_timer()
+    for name, value in name_values:
+        single_test_db.cmd_PUT(name, value)
+    time_put = timeit.default_timer() - start_time
+
+    start_time = timeit.default_timer()
+    for name_value_group in name_value_groups:
+        multi_test_db.cmd_MPUT(name_value_group)
+    time_mput = timeit.default_timer() - start_time
+
+    start_time = timeit.default_timer()
+    single_values = [single_test_db.cmd_PULL(name) for name in names]
+    time_pull = timeit.default_timer() - start_time
+
+    start_time = timeit.default_timer()
+    multi_values = []
+    for name_group in name_groups:
+        multi_values.extend(multi_test_db.cmd_MPULL(name_group))
+    time_mpull = timeit.default_timer() - start_time
+
+    assert(single_values == multi_values)
+    assert(single_test_db.mem_db_value_count_index.value_counts == multi_test_db.mem_db_value_count_index.value_counts)
+
+    start_time = timeit.default_timer()
+    for name in names:
+        single_test_db.cmd_DELETE(name)
+    time_delete = timeit.default_timer() - start_time
+
+    start_time = timeit.default_timer()
+    for name_group in name_groups:
+        multi_test_db.cmd_MDELETE(name_group)
+    time_mdelete = timeit.default_timer() - start_time
+
+    assert(multi_test_db.get_mem_db_size() == 0)
+    assert(multi_test_db.mem_db_value_count_index.get_num_values() == 0)
+
+    print "python API, " + str(num_names) + " names:"
+    print "    cmd_PUT " + str(time_put) + " vs cmd_MPUT " + str(time_mput) + ", " + str(time_put / time_mput) + " times faster"
+    print "    cmd_PULL " + str(time_pull) + " vs cmd_MPULL " + str(time_mpull) + ", " + str(time_pull / time_mpull) + " times faster"
+    print "    cmd_DELETE " + str(time_delete) + " vs cmd_MDELETE " + str(time_mdelete) + ", " + str(time_delete / time_mdelete) + " times faster"
+
+    # command lines
+    single_lines = ["PUT " + name + " " + value for name, value in name_values] + ["PULL " + name for name in names]
+    multi_lines = ["MPUT " + " ".join(name + " " + value for name, value in name_value_group) for name_value_group in name_value_groups]
+    multi_lines += ["MPULL " + " ".join(name_group) for name_group in name_groups]
+
+    single_out_list = []
+    multi_out_list = []
+
+    time_single_lines = timeit.timeit(lambda: PyMemDB().process_command_batch(single_lines, single_out_list), number=1)
+    time_multi_lines = timeit.timeit(lambda: PyMemDB().process_command_batch(multi_lines, multi_out_list), number=1)
+
+    assert(single_out_list == multi_out_list)
+
+    print "command lines: PUT/PULL " + str(time_single_lines) + " vs MPUT/MPULL " + str(time_multi_lines) + ", " + str(time_single_lines / time_multi_lines) + " times faster"
+
+    assert(time_mput < time_put)
+    assert(time_mpull < time_pull)
+    assert(time_mdelete < time_delete)
+    assert(time_multi_lines < time_single_lines)
+
+    print "multi-key performance: passed"
+
+# commands per second through the shard router with 1 to max_shards workers vs. a single in process PyMemDB
+# the workload only uses PUT/PULL/DELETE, so every command goes to exactly one shard
+def TestShardScaling(num_commands=1000000, batch_size=10000, max_shards=4):
+    cmd_lines = []
+
+    for i in xrange(0, num_commands):
+        op = i % 4
+
+        if op == 0:
+            cmd_lines.append("PUT " + str(i) + " v" + str(i % 100))
+        elif op == 1:
+            cmd_lines.append("PULL " + str(i - 1))
+        elif op == 2:
+            cmd_lines.append("PULL " + str(i / 2))
+        else:
+            cmd_lines.append("DELETE " + str(i - 3))
+
+    cmd_batches = [cmd_lines[i:i + batch_size] for i in xrange(0, num_commands, batch_size)]
+
+    def run_batches(mem_db):
+        out_list = []
+
+        for cmd_batch in cmd_batches:
+            mem_db.process_command_batch(cmd_batch, out_list)
+
+        return out_list
+
+    print "shard scaling on " + str(multiprocessing.cpu_count()) + " cores:"
+
+    start_time = timeit.default_timer()
+    simple_out_list = run_batches(PyMemDB())
+    time_single = timeit.default_timer() - start_time
+
+    print "    in process: " + str(num_commands / time_single) + " cmd/s"
+
+    num_shards = 1
+
+    while num_shards <= max_shards:
+        shard_router = PyMemDBShards.ShardRouter(num_shards)
+
+        try:
+            start_time = timeit.default_timer()
+            out_list = run_batches(shard_router)
+            time_shards = timeit.default_timer() - start_time
+        finally:
+            shard_router.close()
+
+        assert(out_list == simple_out_list)
+
+        print "    " + str(num_shards) + " shards: " + str(num_commands / time_shards) + " cmd/s"
+
+        num_shards *= 2
+
+    print "shard scaling: passed"
+
+# threads sharing one database, a single lock around all of it (1 stripe) vs striped locks
+# *note* on a GIL build only one thread runs python at a time, so this shows what the locking costs, the
+# threads can only really run side by side on a free-threaded build
+def TestStripedThroughput(num_ops=400000, num_names=100000, batch_size=100, thread_counts=[1, 2, 4, 8], stripe_counts=[1, 16]):
+    random_gen = random.Random(42)
+
+    cmd_lines = []
+
+    for i in xrange(0, num_ops):
+        name = "name" + str(random_gen.randint(0, num_names - 1))
+        op = i % 4
+
+        if op == 0:
+            cmd_lines.append("PUT " + name + " v" + str(i % 100))
+        elif op == 3:
+            cmd_lines.append("INCR counter" + str(i / 4 % 64))
+        else:
+            cmd_lines.append("PULL " + name)
+
+    print "striped throughput on " + str(multiprocessing.cpu_count()) + " cores:"
+
+    # no threads and no locks at all
+    simple_test_db = PyMemDB()
+    out_list = []
+
+    start_time = timeit.default_timer()
+
+    for i in xrange(0, num_ops, batch_size):
+        simple_test_db.process_command_batch(cmd_lines[i:i + batch_size], out_list)
+
+    print "    PyMemDB, no locks: " + str(num_ops / (timeit.default_timer() - start_time)) + " cmd/s"
+
+    for num_threads in thread_counts:
+        ops_per_thread = num_ops / num_threads
+
+        # each thread gets its own slice of the commands, cut up into batches
+        thread_batches = [[cmd_lines[i:i + batch_size] for i in xrange(start, start + ops_per_thread, batch_size)]
+                          for start in xrange(0, ops_per_thread * num_threads, ops_per_thread)]
+
+        for num_stripes in stripe_counts:
+            striped_db = PyMemDBThreads.StripedPyMemDB(num_stripes)
+
+            def run_batches(cmd_batches):
+                out_list = []
+
+                for cmd_batch in cmd_batches:
+                    striped_db.process_command_batch(cmd_batch, out_list)
+
+            cmd_threads = [threading.Thread(target=run_batches, args=(cmd_batches,)) for cmd_batches in thread_batches]
+
+            start_time = timeit.default_timer()
+
+            for cmd_thread in cmd_threads:
+                cmd_thread.start()
+
+            for cmd_thread in cmd_threads:
+                cmd_thread.join()
+
+            run_time = timeit.default_timer() - start_time
+
+            # every INCR made it
+            num_incrs = sum(cmd_line.startswith("INCR") for cmd_batches in thread_batches for cmd_batch in cmd_batches
+                            for cmd_line in cmd_batch)
+            assert(sum(int(striped_db.cmd_PULL("counter" + str(i))) for i in range(0, 64)) == num_incrs)
+
+            print "    " + str(num_threads) + " threads, " + str(num_stripes) + " stripes: " + str(ops_per_thread * num_threads / run_time) + " cmd/s"
+
+    print "striped throughput: passed"
+
+# what counting and timing every command costs, against the same batches with stats off
+# stats off is the plain command tables, so it should match a PyMemDB that never had stats at all
+def TestStatsOverhead(num_commands=1000000, batch_size=10000, num_runs=5, sample_counts=[1, 16]):
+    cmd_lines = []
+
+    for i in xrange(0, num_commands):
+        op = i % 4
+
+        if op == 0:
+            cmd_lines.append("PUT " + str(i) + " v" + str(i % 100))
+        elif op == 3:
+            cmd_lines.append("INCR counter" + str(i % 64))
+        else:
+            cmd_lines.append("PULL " + str(i - op))
+
+    cmd_batches = [cmd_lines[i:i + batch_size] for i in xrange(0, num_commands, batch_size)]
+
+    # one run on a fresh database, None is stats switched on and then off again, which has to be just as fast
+    # as never having switched them on
+    def time_batches(sample_every):
+        mem_db = PyMemDB()
+
+        PyMemDBStats.enable_command_stats(mem_db, sample_every or 1)
+
+        if sample_every is None:
+            PyMemDBStats.disable_command_stats(mem_db)
+
+        out_list = []
+
+        start_time = timeit.default_timer()
+
+        for cmd_batch in cmd_batches:
+            mem_db.process_command_batch(cmd_batch, out_list)
+
+        run_time = timeit.default_timer() - start_time
+
+        if sample_every is not None:
+            assert(mem_db.command_stats.get_total_calls() == num_commands)
+
+        return run_time
+
+    # the settings take turns so drift on a busy machine hits them all the same, best of num_runs each
+    settings = [None] + sample_counts
+    best_times = dict((sample_every, None) for sample_every in settings)
+
+    for run in range(0, num_runs):
+        for sample_every in settings:
+            run_time = time_batches(sample_every)
+
+            if best_times[sample_every] is None or run_time < best_times[sample_every]:
+                best_times[sample_every] = run_time
+
+    time_off = best_times[None]
+
+    print "stats overhead:"
+    print "    stats off: " + str(num_commands / time_off) + " cmd/s"
+
+    for sample_every in sample_counts:
+        time_on = best_times[sample_every]
+
+        print ("    stats on, timing 1 in " + str(sample_every) + ": " + str(num_commands / time_on) + " cmd/s, " +
+               str(100.0 * (time_on - time_off) / time_off) + "% overhead")
+
+    print "stats overhead: passed"
+
+# PUT throughput without pub/sub, with it but no one subscribed, and with subscribers that never read anything
+# every setting runs the batched command loop on a fresh database, syncing the commit listeners after every batch
+def TestPubSubOverhead(num_puts=500000, batch_size=1000, num_subscribers=10, max_pending=10000):
+    batches = [["PUT herp" + str(i) + " derp" for i in xrange(batch_start, batch_start + batch_size)] for batch_start in xrange(0, num_puts, batch_size)]
+
+    time_settings = {}
+
+    for setting in ["off", "no subscribers", "stalled subscribers"]:
+        simple_test_db = PyMemDB()
+        pubsub_hub = None
+
+        if setting != "off":
+            pubsub_hub = PyMemDBPubSub.open_pubsub(simple_test_db, max_pending)
+
+        # each subscriber is its own client, none of them has a connection to deliver to so everything piles up
+        if setting == "stalled subscribers":
+            for i in range(0, num_subscribers):
+                other_transaction_log = simple_test_db.swap_transaction_log(simple_test_db.new_transaction_log())
+                simple_test_db.process_command_batch(["PSUBSCRIBE __key__:herp*"], [])
+                simple_test_db.swap_transaction_log(other_transaction_log)
+
+        gc.collect()
+
+        start_time = timeit.default_timer()
+
+        for batch in batches:
+            simple_test_db.process_command_batch(batch, [])
+            simple_test_db.sync_commit_listeners()
+
+        time_settings[setting] = timeit.default_timer() - start_time
+
+        print "pubsub " + setting + ": " + str(int(num_puts / time_settings[setting])) + " PUTs/sec"
+
+        # the stalled subscribers only ever hold on to their newest max_pending messages
+        if pubsub_hub is not None and pubsub_hub.subscribers:
+            assert(all(len(subscriber.pending) == max_pending for subscriber in pubsub_hub.subscribers.itervalues()))
+            assert(all(subscriber.total_dropped == num_puts - max_pending for subscriber in pubsub_hub.subscribers.itervalues()))
+
+    # with no one subscribed the hub isn't even a commit listener
+    assert(time_settings["no subscribers"] < time_settings["off"] * 1.25)
+
+    print "pubsub overhead: passed"
+
+# renames done as a script against the same renames done as plain commands, in-process and over the server
+# in-process a script pays for resolving its slots, over the server it saves every round trip after the first
+def TestScriptThroughput(num_renames=100000, num_round_trips=5000):
+    rename_script = "PULL $1 ; CHECK_NOT %1 NULL ; PUT $2 %1 ; DELETE $1"
+
+    # in-process, the same commands the script runs against one EVALSHA each
+    simple_test_db = PyMemDB()
+    rename_sha1 = PyMemDBScripts.open_scripts(simple_test_db).load_script(rename_script.split()).sha1
+
+    simple_test_db.cmd_PUT("herp0", "derp")
+
+    command_batch = []
+    script_batch = []
+
+    for i in xrange(0, num_renames):
+        from_name, to_name = "herp" + str(i), "herp" + str(i + 1)
+        command_batch.extend(["PULL " + from_name, "START_COMMIT", "PUT " + to_name + " derp", "DELETE " + from_name, "COMMIT"])
+        script_batch.append("EVALSHA " + rename_sha1 + " " + to_name + " " + from_name)
+
+    script_batch.reverse()
+
+    gc.collect()
+
+    time_commands = timeit.timeit(lambda: simple_test_db.process_command_batch(command_batch, []), number=1)
+
+    # the commands renamed herp0 all the way up, the script renames it all the way back down
+    assert(simple_test_db.cmd_PULL("herp" + str(num_renames)) == "derp")
+
+    time_scripts = timeit.timeit(lambda: simple_test_db.process_command_batch(script_batch, []), number=1)
+
+    assert(simple_test_db.cmd_PULL("herp0") == "derp" and simple_test_db.get_mem_db_size() == 1)
+
+    print "in-process commands: " + str(int(num_renames / time_commands)) + " renames/sec"
+    print "in-process EVALSHA: " + str(int(num_renames / time_scripts)) + " renames/sec"
+
+    # over the server, WATCH and PULL then a block with the writes, against one EVALSHA
+    mem_db_server = PyMemDBServer("127.0.0.1", 0)
+    PyMemDBScripts.open_scripts(mem_db_server.mem_db)
+    server_thread = mem_db_server.start_background()
+
+    client_sock = socket.create_connection(mem_db_server.get_address())
+    client_sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    try:
+        assert(send_commands(client_sock, ["PUT herp derp", "SCRIPT_LOAD " + rename_script], 1) == [rename_sha1])
+
+        start_time = timeit.default_timer()
+
+        for i in xrange(0, num_round_trips):
+            from_name, to_name = ("herp", "flerp") if i % 2 == 0 else ("flerp", "herp")
+
+            value = send_commands(client_sock, ["WATCH " + from_name, "PULL " + from_name], 1)[0]
+            assert(send_commands(client_sock, ["START_COMMIT", "PUT " + to_name + " " + value, "DELETE " + from_name, "COMMIT"], 1) == ["OK"])
+
+        time_watch = timeit.default_timer() - start_time
+
+        start_time = timeit.default_timer()
+
+        for i in xrange(0, num_round_trips):
+            from_name, to_name = ("herp", "flerp") if i % 2 == 0 else ("flerp", "herp")
+
+            assert(send_commands(client_sock, ["EVALSHA " + rename_sha1 + " " + from_name + " " + to_name], 2) == ["1", "derp"])
+
+        time_evalsha = timeit.default_timer() - start_time
+
+        assert(send_commands(client_sock, ["PULL herp", "PULL flerp"], 2) == ["derp", "NULL"])
+
+    finally:
+        client_sock.close()
+
+        mem_db_server.shutdown()
+        server_thread.join()
+
+    print "server WATCH then block: " + str(int(num_round_trips / time_watch)) + " renames/sec"
+    print "server EVALSHA: " + str(int(num_round_trips / time_evalsha)) + " renames/sec"
+
+    # one round trip instead of two
+    assert(time_evalsha < time_watch)
+
+    print "script throughput: passed"
+
+# a port nothing is listening on right now
+def get_free_port():
+    free_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    free_sock.bind(("127.0.0.1", 0))
+    free_port = free_sock.getsockname()[1]
+    free_sock.close()
+
+    return free_port
+
+# readers against a server in its own process while another client runs big transactions, with and without --mvcc
+# counts how often a reader sees a value that was never committed, and how often a scan inside a block sees two generations
+def TestMVCCReadThroughput(num_names=100000, transaction_size=100000, read_batch_size=1000, scan_size=10000, run_secs=3.0):
+    names = ["name" + str(i) for i in xrange(0, num_names)]
+
+    for server_args in [[], ["--mvcc"]]:
+        server_port = get_free_port()
+        server_process = subprocess.Popen([sys.executable, "PyMemDBServer.py", "--port", str(server_port)] + server_args,
+                                          stdout=subprocess.PIPE)
+
+        try:
+            server_process.stdout.readline()
+
+            def connect():
+                client_sock = socket.create_connection(("127.0.0.1", server_port))
+                client_sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+                return client_sock
+
+            reader_sock = connect()
+            writer_sock = connect()
+
+            for batch_start in xrange(0, num_names, 10000):
+                send_commands(writer_sock, ["MPUT " + " ".join(name + " gen0" for name in names[batch_start:batch_start + 10000])], 0)
+
+            assert(send_commands(writer_sock, ["PULL name0"], 1) == ["gen0"])
+
+            # the writer keeps running transaction_size PUTs in a block and then COMMITs or rolls them back
+            def run_writer(stop_event, end_cmd):
+                generation = 0
+
+                while not stop_event.is_set():
+                    generation += 1
+                    writer_sock.sendall("START_COMMIT\n")
+
+                    for batch_start in xrange(0, transaction_size, 10000):
+                        writer_sock.sendall("".join("PUT " + names[i % num_names] + " gen" + str(generation) + "\n"
+                                                    for i in xrange(batch_start, min(batch_start + 10000, transaction_size))))
+
+                    send_commands(writer_sock, [end_cmd, "PULL name0"], 1)
+
+            # reads for run_secs, plus the writer if there is one, returns reads/s and how many reads were of a rolled back value
+            def run_reads(end_cmd):
+                stop_event = threading.Event()
+                writer_thread = None
+
+                if end_cmd is not None:
+                    writer_thread = threading.Thread(target=run_writer, args=(stop_event, end_cmd))
+                    writer_thread.start()
+
+                random_gen = random.Random(20160323)
+                num_reads = 0
+                num_dirty_reads = 0
+                committed_values = set(["gen0"])
+
+                start_time = timeit.default_timer()
+
+                while timeit.default_timer() - start_time < run_secs:
+                    values = send_commands(reader_sock, ["PULL " + random_gen.choice(names) for i in xrange(0, read_batch_size)], read_batch_size)
+                    num_reads += read_batch_size
+
+                    if end_cmd == "UN_COMMIT":
+                        num_dirty_reads += sum(1 for value in values if value not in committed_values)
+
+                read_secs = timeit.default_timer() - start_time
+
+                stop_event.set()
+
+                if writer_thread is not None:
+                    writer_thread.join()
+
+                return num_reads / read_secs, num_dirty_reads
+
+            # long scans of scan_size names inside a block, one round trip per batch, while the writer COMMITs generation after generation
+            def run_scans():
+                stop_event = threading.Event()
+                writer_thread = threading.Thread(target=run_writer, args=(stop_event, "COMMIT"))
+                writer_thread.start()
+
+                num_scans = 0
+                num_torn_scans = 0
+                start_time = timeit.default_timer()
+
+                while timeit.default_timer() - start_time < run_secs:
+                    send_commands(reader_sock, ["START_COMMIT"], 0)
+
+                    generations = set()
+
+                    for batch_start in xrange(0, scan_size, read_batch_size):
+                        generations.update(send_commands(reader_sock, ["PULL " + name for name in names[batch_start:batch_start + read_batch_size]], read_batch_size))
+
+                    send_commands(reader_sock, ["UN_COMMIT", "PULL name0"], 1)
+
+                    num_scans += 1
+
+                    if len(generations) > 1:
+                        num_torn_scans += 1
+
+                stop_event.set()
+                writer_thread.join()
+
+                return num_scans, num_torn_scans
+
+            reads_alone, dirty_alone = run_reads(None)
+            reads_rolled_back, dirty_rolled_back = run_reads("UN_COMMIT")
+            reads_committed, dirty_committed = run_reads("COMMIT")
+            num_scans, num_torn_scans = run_scans()
+
+            reader_sock.close()
+            writer_sock.close()
+
+        finally:
+            server_process.terminate()
+            server_process.wait()
+
+        print "PyMemDBServer " + " ".join(server_args) + " with " + str(num_names) + " names, " + str(transaction_size) + " PUTs per transaction:"
+        print "    reads alone: " + str(reads_alone) + "/s"
+        print "    reads next to transactions that roll back: " + str(reads_rolled_back) + "/s, " + str(dirty_rolled_back) + " reads of a value never committed"
+        print "    reads next to transactions that commit: " + str(reads_committed) + "/s"
+        print "    " + str(num_scans) + " scans of " + str(scan_size) + " names inside a block, " + str(num_torn_scans) + " saw more than one generation"
+
+        if server_args:
+            assert(dirty_rolled_back == 0 and num_torn_scans == 0)
+
+    print "mvcc read throughput: passed"
+
+# full sync time, streaming throughput and write-to-visible latency with the replica in its own process
+def TestReplicationLag(num_names=1000000, num_writes=200000, batch_size=1000, num_latency_writes=200):
+    primary_db = PyMemDB()
+    primary_db.load_dict(dict(("name" + str(i), "value" + str(i % 1000)) for i in xrange(0, num_names)))
+
+    primary_server = PyMemDBServer("127.0.0.1", 0, primary_db)
+    feed, listener = PyMemDBReplication.open_primary(primary_db, "127.0.0.1", 0, primary_server.socket_map)
+    primary_thread = primary_server.start_background()
+
+    replica_port = get_free_port()
+    replica_process = subprocess.Popen([sys.executable, "PyMemDBServer.py", "--port", str(replica_port),
+                                        "--replica-of", "127.0.0.1:" + str(listener.get_address()[1])],
+                                       stdout=subprocess.PIPE)
+
+    try:
+        replica_process.stdout.readline()
+
+        start_time = timeit.default_timer()
+
+        primary_sock = socket.create_connection(primary_server.get_address())
+        replica_sock = socket.create_connection(("127.0.0.1", replica_port))
+
+        def is_caught_up():
+            replica_info = get_replication_info(replica_sock)
+
+            return replica_info["state"] == "online" and replica_info["offset"] == get_replication_info(primary_sock)["offset"]
+
+        assert(wait_for(is_caught_up, 120.0))
+
+        full_sync_secs = timeit.default_timer() - start_time
+
+        # stream a steady run of writes, sampling how far behind the replica is as we go
+        max_lag_bytes = 0
+
+        start_time = timeit.default_timer()
+
+        for batch_start in xrange(0, num_writes, batch_size):
+            cmd_lines = ["PUT name" + str(i % num_names) + " streamed" + str(i) for i in xrange(batch_start, batch_start + batch_size)]
+            assert(send_commands(primary_sock, cmd_lines + ["PULL name0"], 1))
+
+            if (batch_start // batch_size) % 20 == 0:
+                max_lag_bytes = max(max_lag_bytes, int(get_replication_info(replica_sock)["lag_bytes"]))
+
+        write_secs = timeit.default_timer() - start_time
+
+        assert(wait_for(is_caught_up, 120.0))
+
+        catch_up_secs = timeit.default_timer() - start_time - write_secs
+
+        # how long one write takes to show up on the replica
+        latencies = []
+
+        for i in xrange(0, num_latency_writes):
+            start_time = timeit.default_timer()
+            send_commands(primary_sock, ["PUT latency " + str(i)], 0)
+
+            assert(wait_for(lambda: send_commands(replica_sock, ["PULL latency"], 1) == [str(i)], poll_secs=0.0001))
+
+            latencies.append(timeit.default_timer() - start_time)
+
+        latencies.sort()
+
+        print "replication with the replica in its own process:"
+        print "    full sync of " + str(num_names) + " names: " + str(full_sync_secs) + "s"
+        print "    streamed " + str(num_writes / write_secs) + " writes/s, max sampled lag " + str(max_lag_bytes) + " bytes, caught up " + str(catch_up_secs) + "s after the last write"
+        print "    write to visible on the replica: median " + str(latencies[len(latencies) // 2] * 1000) + "ms, p99 " + str(latencies[len(latencies) * 99 // 100] * 1000) + "ms"
+
+        primary_sock.close()
+        replica_sock.close()
+
+    finally:
+        replica_process.terminate()
+        replica_process.wait()
+
+        primary_server.shutdown()
+        primary_thread.join()
+
+    print "replication lag: passed"
+
+# start up the application and listen to our SimpleMemDB commands!
+if __name__ == "__main__":
+
+    ''' ===== SIMPLE tests ===== '''
+    Test_cmd_PUT()
+    Test_cmd_PULL()
+    Test_cmd_DELETE()
+    Test_cmd_NUM_WITH_VALUE()
+    Test_value_count_index()
+    Test_compact_storage()
+    Test_cmd_KEYS_WITH_VALUE()
+    Test_cmd_RANGE_PREFIX()
+    Test_cmd_INCR()
+    Test_cmd_COUNT_VALUE_RANGE()
+    Test_cmd_MPUT_MPULL_MDELETE()
+    Test_cmd_EXPIRE()
+    Test_expire_cycle()
+    Test_cmd_QUIT()
+
+    ''' ===== TRANSACTION tests ===== '''
+    Test_cmd_START_COMMIT()
+    Test_cmd_UN_COMMIT()
+    Test_cmd_END_COMMIT()
+    Test_nested_UN_COMMIT()
+    Test_undo_log_compaction()
+    Test_expiry_transactions()
+    Test_cmd_WATCH_CAS()
+    Test_cmd_WATCH_CAS(mvcc=True)
+    Test_mvcc()
+
+    ''' ===== DIFFERENTIAL tests ===== '''
+    Test_value_count_index_differential()
+    Test_value_count_index_differential(compact_storage=True)
+
+    ''' ===== EVICTION tests ===== '''
+    Test_eviction()
+    Test_eviction_policies()
+
+    ''' ===== STATS tests ===== '''
+    Test_stats()
+    Test_slowlog()
+    Test_profiler()
+
+    ''' ===== PIPELINE tests ===== '''
+    Test_process_command_stream()
+
+    ''' ===== PERSISTENCE tests ===== '''
+    Test_append_only_log()
+    Test_snapshot()
+    Test_rewrite_log()
+
+    ''' ===== SHARD tests ===== '''
+    Test_shard_router()
+
+    ''' ===== THREAD tests ===== '''
+    Test_striped_db()
+    Test_striped_db(mvcc=True)
+
+    ''' ===== SERVER tests ===== '''
+    Test_PyMemDBServer()
+    Test_server_cursor_streaming()
+
+    ''' ===== REPLICATION tests ===== '''
+    Test_replication()
+    Test_replica_stats()
+
+    ''' ===== PUBSUB tests ===== '''
+    Test_pubsub()
+    Test_pubsub_backpressure()
+
+    ''' ===== SCRIPT tests ===== '''
+    Test_scripts()
+    Test_scripts(mvcc=True)
+
+    ''' ===== BENCHMARK tests ===== '''
+    Test_benchmark_suite()
 
     ''' ===== PERFORMANCE tests ===== '''
-    TestBigODifferences()
+    TestBenchmarkSuite()
+    TestBatchedPipelineThroughput()
+    TestNestedTransactionPerformance()
+    TestUndoLogCompaction()
+    TestKeysWithValuePerformance()
+    TestOrderedIndexPerformance()
+    TestNumericPerformance()
+    TestWatchContention()
+    TestMVCCReadThroughput()
+    TestAppendOnlyLogPerformance()
+    TestSnapshotPerformance()
+    TestRewriteLogPerformance()
+    TestCompactStorageMemory()
+    TestActiveExpiryPerformance()
+    TestEvictionHitRatio()
+    TestMultiKeyPerformance()
+    TestShardScaling()
+    TestStripedThroughput()
+    TestStatsOverhead()
+    TestPubSubOverhead()
+    TestScriptThroughput()
+    TestReplicationLag()
@@ -0,0 +1,517 @@
+'''
+    PyMemDBThreads ~ thread-safe PyMemDB for embedding, the names are striped across N PyMemDBs each behind its own lock
+    depenencies: Python 2.7.x
+
+    a single PyMemDB has no locking at all, its dict, value count index, undo logs and expiry heap are only ever
+    touched by one thread at a time (PyMemDBServer gets that for free from asyncore), StripedPyMemDB lets any number
+    of threads share one database by hashing every name to one of num_stripes PyMemDBs (stripes) and only ever
+    running a command on a stripe while holding that stripe's lock, threads working on names in different stripes
+    never wait on each other
+
+        PUT/PULL/DELETE/EXPIRE/TTL/PERSIST/PUTEX  - run on the stripe that owns the name, under its lock
+        INCR/INCRBY/DECR/CAS                      - same, so a read-modify-write is atomic
+        MPUT/MPULL/MDELETE                        - split up by stripe, one stripe at a time
+        NUM_WITH_VALUE/KEYS_WITH_VALUE            - every stripe in turn under its lock, the counts summed
+        COUNT_VALUE_RANGE                         - same
+        RANGE/PREFIX                              - every stripe in turn under its lock, the sorted names merged
+
+    every thread gets its own transaction context, its depth and one transaction log per stripe, so START_COMMIT
+    in one thread never captures another thread's writes, a stripe only opens blocks once the thread touches it
+    (in --mvcc mode that's also when the stripe's snapshot is taken), UN_COMMIT and COMMIT go to every stripe the
+    blocks touched, one at a time, WATCH + COMMIT takes the lock of every stripe involved (always in stripe order,
+    so two threads can't deadlock) so the check and the commit happen together
+
+    multi-stripe commands aren't atomic across stripes, same as PyMemDBShards, and there are no commit listeners
+    (persistence and replication want one ordered stream of changes, use PyMemDBServer for those)
+'''
+
+import heapq
+import threading
+
+from itertools import islice
+
+from PyMemDBImpl import PyMemDB
+
+class StripeThreadContext(threading.local):
+    '''
+        StripeThreadContext ~ one thread's transaction blocks, every attribute is private to the thread that set it
+    '''
+
+    # how deeply nested the thread's open blocks are
+    transaction_depth = 0
+
+    # the thread's transaction log on each stripe, None until the thread first touches the stripe
+    transaction_logs = None
+
+    # stripe -> names the thread is WATCHing on it
+    watched_stripes = None
+
+    # threading.local runs this again the first time each thread uses the context
+    def __init__(self, num_stripes):
+        self.transaction_depth = 0
+        self.transaction_logs = [None] * num_stripes
+        self.watched_stripes = {}
+
+class StripedPyMemDB:
+    '''
+        StripedPyMemDB ~ num_stripes PyMemDBs behind one lock each, safe to share between threads
+    '''
+
+    # how many PyMemDBs (and locks) the names are spread over
+    num_stripes = 16
+
+    # the stripes and their locks, stripe_locks[i] guards everything in stripes[i]
+    stripes = []
+    stripe_locks = []
+
+    # per thread transaction blocks, see StripeThreadContext
+    thread_context = None
+
+    # the next stripe to get a slice of active expiry and garbage collection
+    maintenance_stripe = 0
+
+    # command -> (number of tokens, route function), None means any number of tokens
+    route_table = {}
+
+    # commands that name a single key, they run on the stripe that owns split_cmd[1]
+    key_commands = ["PUT", "PULL", "DELETE", "EXPIRE", "TTL", "PERSIST", "PUTEX", "INCR", "INCRBY", "DECR", "CAS"]
+
+    # no transaction message
+    no_transaction_msg = PyMemDB.no_transaction_msg
+
+    # replies to a COMMIT after a WATCH
+    committed_msg = PyMemDB.committed_msg
+    aborted_msg = PyMemDB.aborted_msg
+
+    def __init__(self, num_stripes=16, db_kwargs=None):
+        self.num_stripes = num_stripes
+        self.stripes = [PyMemDB(**(db_kwargs or {})) for stripe in range(0, num_stripes)]
+        self.stripe_locks = [threading.Lock() for stripe in range(0, num_stripes)]
+        self.thread_context = StripeThreadContext(num_stripes)
+        self.maintenance_stripe = 0
+
+        self.route_table = {
+            "MPUT": (None, self.route_MPUT),
+            "MPULL": (None, self.route_MPULL),
+            "MDELETE": (None, self.route_MDELETE),
+            "NUM_WITH_VALUE": (2, self.route_NUM_WITH_VALUE),
+            "KEYS_WITH_VALUE": (2, self.route_KEYS_WITH_VALUE),
+            "COUNT_VALUE_RANGE": (3, self.route_KEYS_WITH_VALUE),
+            "RANGE": (None, self.route_RANGE),
+            "PREFIX": (None, self.route_RANGE),
+            "START_COMMIT": (1, self.route_START_COMMIT),
+            "COMMIT": (1, self.route_COMMIT),
+            "UN_COMMIT": (1, self.route_UN_COMMIT),
+            "WATCH": (None, self.route_WATCH),
+            "UNWATCH": (1, self.route_UNWATCH),
+            "QUIT": (1, self.route_QUIT),
+        }
+
+        # the stripe's own command table checks the number of tokens for these
+        for command in self.key_commands:
+            self.route_table[command] = (None, self.route_key)
+
+    ''' ============= STRIPE functions ========== '''
+
+    # the stripe that owns name, str hashes are cached on the string so this is cheap
+    def get_stripe(self, name):
+        return hash(name) % self.num_stripes
+
+    # the calling thread's transaction log on stripe, opening blocks until it's as deep as the thread's
+    # *note* only call with the stripe's lock held
+    def get_transaction_log(self, context, stripe):
+        mem_db = self.stripes[stripe]
+        transaction_log = context.transaction_logs[stripe]
+
+        if transaction_log is None:
+            transaction_log = context.transaction_logs[stripe] = mem_db.new_transaction_log()
+
+        if transaction_log.get_depth() < context.transaction_depth:
+            other_transaction_log = mem_db.swap_transaction_log(transaction_log)
+
+            try:
+                while transaction_log.get_depth() < context.transaction_depth:
+                    mem_db.cmd_START_COMMIT()
+            finally:
+                mem_db.swap_transaction_log(other_transaction_log)
+
+        return transaction_log
+
+    # run func(mem_db, *args) on a stripe as the calling thread, returns whatever func does
+    # *note* only call with the stripe's lock held
+    def run_locked(self, stripe, func, *args):
+        mem_db = self.stripes[stripe]
+
+        other_transaction_log = mem_db.swap_transaction_log(self.get_transaction_log(self.thread_context, stripe))
+
+        try:
+            return func(mem_db, *args)
+        finally:
+            mem_db.swap_transaction_log(other_transaction_log)
+
+    # take the stripe's lock and run func(mem_db, *args) on it as the calling thread
+    def run_on_stripe(self, stripe, func, *args):
+        with self.stripe_locks[stripe]:
+            return self.run_locked(stripe, func, *args)
+
+    # run an already split command on a stripe, its replies are appended to out_list
+    def dispatch_on_stripe(self, stripe, split_cmd, out_list):
+        return self.run_on_stripe(stripe, lambda mem_db: mem_db.dispatch_command(mem_db.command_table, split_cmd, out_list))
+
+    # the stripes the calling thread has open blocks on, in stripe order
+    def get_open_stripes(self, context):
+        return [stripe for stripe, transaction_log in enumerate(context.transaction_logs)
+                if transaction_log is not None and transaction_log.is_open()]
+
+    # a slice of active expiry and multi-version garbage collection on the next stripe, round robin
+    def maintenance_cycle(self):
+        stripe = self.maintenance_stripe
+        self.maintenance_stripe = (stripe + 1) % self.num_stripes
+
+        mem_db = self.stripes[stripe]
+
+        with self.stripe_locks[stripe]:
+            mem_db.expire_cycle()
+            mem_db.collect_old_versions()
+
+    # total number of names, takes every lock in turn
+    def get_mem_db_size(self):
+        return sum(self.run_on_stripe(stripe, PyMemDB.get_mem_db_size) for stripe in range(0, self.num_stripes))
+
+    '''================== SIMPLE commands ==================
+        the same calls as PyMemDB, safe to make from any thread
+    '''
+
+    def cmd_PUT(self, name, value):
+        self.run_on_stripe(self.get_stripe(name), PyMemDB.cmd_PUT, name, value)
+
+    def cmd_PULL(self, name):
+        return self.run_on_stripe(self.get_stripe(name), PyMemDB.cmd_PULL, name)
+
+    def cmd_DELETE(self, name):
+        self.run_on_stripe(self.get_stripe(name), PyMemDB.cmd_DELETE, name)
+
+    def cmd_INCRBY(self, name, delta):
+        return self.run_on_stripe(self.get_stripe(name), PyMemDB.cmd_INCRBY, name, delta)
+
+    def cmd_CAS(self, name, expected, value):
+        return self.run_on_stripe(self.get_stripe(name), PyMemDB.cmd_CAS, name, expected, value)
+
+    # every stripe in turn under its lock, counting can remove a stripe's expired names
+    def cmd_NUM_WITH_VALUE(self, value):
+        return sum(self.run_on_stripe(stripe, PyMemDB.cmd_NUM_WITH_VALUE, value) for stripe in range(0, self.num_stripes))
+
+    '''================== TRANSACTION commands ==================
+        the blocks belong to the calling thread
+    '''
+
+    def cmd_START_COMMIT(self):
+
+        # the stripes catch up the next time the thread touches them, see get_transaction_log
+        self.thread_context.transaction_depth += 1
+
+    def cmd_UN_COMMIT(self):
+        context = self.thread_context
+
+        if not context.transaction_depth:
+            return False
+
+        # only the stripes written to since the innermost block was opened have it open
+        for stripe in self.get_open_stripes(context):
+            if context.transaction_logs[stripe].get_depth() == context.transaction_depth:
+                self.run_on_stripe(stripe, PyMemDB.cmd_UN_COMMIT)
+
+        context.transaction_depth -= 1
+
+        # discarding the outermost block discards the WATCH along with it
+        if not context.transaction_depth:
+            self.cmd_UNWATCH()
+
+        return True
+
+    def cmd_END_COMMIT(self):
+        context = self.thread_context
+
+        if not context.transaction_depth:
+            return False
+
+        open_stripes = self.get_open_stripes(context)
+
+        # every block is closing, the stripes shouldn't catch up on any of them now
+        context.transaction_depth = 0
+
+        for stripe in open_stripes:
+            self.run_on_stripe(stripe, PyMemDB.cmd_END_COMMIT)
+
+        return True
+
+    # COMMIT for a thread that's WATCHing, None if there's no block open, True if it went through
+    # False if someone else changed a watched name, every open block is rolled back instead
+    def cmd_CHECKED_COMMIT(self):
+        context = self.thread_context
+
+        if not context.transaction_depth:
+            self.cmd_UNWATCH()
+
+            return None
+
+        open_stripes = self.get_open_stripes(context)
+        stripes = sorted(set(open_stripes) | set(context.watched_stripes))
+
+        context.transaction_depth = 0
+
+        # every lock at once, in stripe order, no one can write a watched name between the check and the commit
+        for stripe in stripes:
+            self.stripe_locks[stripe].acquire()
+
+        try:
+            committed = not any(self.run_locked(stripe, PyMemDB.is_watch_broken) for stripe in stripes)
+
+            for stripe in stripes:
+                if stripe in open_stripes:
+                    self.run_locked(stripe, PyMemDB.cmd_END_COMMIT if committed else PyMemDB.roll_back_watched)
+
+                self.run_locked(stripe, PyMemDB.cmd_UNWATCH)
+        finally:
+            for stripe in stripes:
+                self.stripe_locks[stripe].release()
+
+        context.watched_stripes.clear()
+
+        return committed
+
+    # start watching names for the calling thread
+    def cmd_WATCH(self, names):
+        watched_stripes = self.thread_context.watched_stripes
+
+        for stripe, positions_names in self.split_names(names).iteritems():
+            stripe_names = [name for position, name in positions_names]
+
+            self.run_on_stripe(stripe, PyMemDB.cmd_WATCH, stripe_names)
+            watched_stripes.setdefault(stripe, []).extend(stripe_names)
+
+    # stop watching everything for the calling thread
+    def cmd_UNWATCH(self):
+        watched_stripes = self.thread_context.watched_stripes
+
+        for stripe in sorted(watched_stripes):
+            self.run_on_stripe(stripe, PyMemDB.cmd_UNWATCH)
+
+        watched_stripes.clear()
+
+    # roll back anything the calling thread left open and forget its WATCH, call before the thread goes away
+    def roll_back_open_blocks(self):
+        while self.thread_context.transaction_depth:
+            self.cmd_UN_COMMIT()
+
+        self.cmd_UNWATCH()
+
+    '''================== COMMAND LINES ==================
+        the same line based protocol as PyMemDB, see process_command_batch
+    '''
+
+    # PUT/PULL/DELETE/EXPIRE/TTL/PERSIST/PUTEX/INCR/INCRBY/DECR/CAS name ..., on the stripe that owns the name
+    # by far the most common route, so get_stripe and run_on_stripe are inlined
+    def route_key(self, split_cmd, out_list):
+        if len(split_cmd) < 2:
+            return True
+
+        stripe = hash(split_cmd[1]) % self.num_stripes
+        mem_db = self.stripes[stripe]
+        context = self.thread_context
+
+        with self.stripe_locks[stripe]:
+            transaction_log = context.transaction_logs[stripe]
+
+            if transaction_log is None or transaction_log.get_depth() < context.transaction_depth:
+                transaction_log = self.get_transaction_log(context, stripe)
+
+            other_transaction_log = mem_db.swap_transaction_log(transaction_log)
+
+            try:
+                return mem_db.dispatch_command(mem_db.command_table, split_cmd, out_list)
+            finally:
+                mem_db.swap_transaction_log(other_transaction_log)
+
+    # split names up by the stripe that owns them, stripe -> list of (position in names, name)
+    def split_names(self, names):
+        stripe_names = {}
+
+        for position, name in enumerate(names):
+            stripe_names.setdefault(self.get_stripe(name), []).append((position, name))
+
+        return stripe_names
+
+    # MPUT name value [name value ...], one MPUT per stripe
+    def route_MPUT(self, split_cmd, out_list):
+        if len(split_cmd) < 3 or len(split_cmd) % 2 == 0:
+            return True
+
+        values = split_cmd[2::2]
+
+        for stripe, positions_names in sorted(self.split_names(split_cmd[1::2]).iteritems()):
+            stripe_cmd = ["MPUT"]
+
+            for position, name in positions_names:
+                stripe_cmd += [name, values[position]]
+
+            self.dispatch_on_stripe(stripe, stripe_cmd, out_list)
+
+        return True
+
+    # MDELETE name [name ...], one MDELETE per stripe
+    def route_MDELETE(self, split_cmd, out_list):
+        if len(split_cmd) < 2:
+            return True
+
+        for stripe, positions_names in sorted(self.split_names(split_cmd[1:]).iteritems()):
+            self.dispatch_on_stripe(stripe, ["MDELETE"] + [name for position, name in positions_names], out_list)
+
+        return True
+
+    # MPULL name [name ...], one MPULL per stripe, the values are put back in the order they were asked for
+    def route_MPULL(self, split_cmd, out_list):
+        names = split_cmd[1:]
+
+        if not names:
+            return True
+
+        values = [None] * len(names)
+
+        for stripe, positions_names in sorted(self.split_names(names).iteritems()):
+            stripe_out_list = []
+
+            self.dispatch_on_stripe(stripe, ["MPULL"] + [name for position, name in positions_names], stripe_out_list)
+
+            for (position, name), value in zip(positions_names, stripe_out_list):
+                values[position] = value
+
+        out_list.extend(values)
+
+        return True
+
+    # run the same command on every stripe in turn, returns each stripe's replies
+    def scatter_cmd(self, split_cmd):
+        replies = []
+
+        for stripe in range(0, self.num_stripes):
+            stripe_out_list = []
+
+            self.dispatch_on_stripe(stripe, split_cmd, stripe_out_list)
+            replies.append(stripe_out_list)
+
+        return replies
+
+    # NUM_WITH_VALUE value, the sum of every stripe's count
+    def route_NUM_WITH_VALUE(self, split_cmd, out_list):
+        out_list.append(str(self.cmd_NUM_WITH_VALUE(split_cmd[1])))
+
+        return True
+
+    # KEYS_WITH_VALUE value and COUNT_VALUE_RANGE low high, the sum of every stripe's count followed by any names
+    def route_KEYS_WITH_VALUE(self, split_cmd, out_list):
+        replies = self.scatter_cmd(split_cmd)
+
+        # a COUNT_VALUE_RANGE with bad numbers has no reply on any stripe
+        if not replies[0]:
+            return True
+
+        out_list.append(str(sum(int(stripe_reply[0]) for stripe_reply in replies)))
+
+        for stripe_reply in replies:
+            out_list.extend(stripe_reply[1:])
+
+        return True
+
+    # RANGE start end [limit] and PREFIX prefix [limit], every stripe's names merged back into order
+    def route_RANGE(self, split_cmd, out_list):
+        replies = self.scatter_cmd(split_cmd)
+
+        # badly formed, no reply on any stripe
+        if not replies[0]:
+            return True
+
+        limit_token = 3 if split_cmd[0] == "RANGE" else 2
+
+        num_names = sum(int(stripe_reply[0]) for stripe_reply in replies)
+
+        if len(split_cmd) > limit_token:
+            num_names = min(num_names, max(int(split_cmd[limit_token]), 0))
+
+        out_list.append(str(num_names))
+        out_list.extend(islice(heapq.merge(*[stripe_reply[1:] for stripe_reply in replies]), num_names))
+
+        return True
+
+    # START_COMMIT
+    def route_START_COMMIT(self, split_cmd, out_list):
+        self.cmd_START_COMMIT()
+
+        return True
+
+    # COMMIT, after a WATCH the thread always hears whether the blocks went through
+    def route_COMMIT(self, split_cmd, out_list):
+        if self.thread_context.watched_stripes:
+            committed = self.cmd_CHECKED_COMMIT()
+
+            if committed is None:
+                out_list.append(self.no_transaction_msg)
+            elif committed:
+                out_list.append(self.committed_msg)
+            else:
+                out_list.append(self.aborted_msg)
+
+        elif not self.cmd_END_COMMIT():
+            out_list.append(self.no_transaction_msg)
+
+        return True
+
+    # UN_COMMIT
+    def route_UN_COMMIT(self, split_cmd, out_list):
+        if not self.cmd_UN_COMMIT():
+            out_list.append(self.no_transaction_msg)
+
+        return True
+
+    # WATCH name [name ...]
+    def route_WATCH(self, split_cmd, out_list):
+        if len(split_cmd) >= 2:
+            self.cmd_WATCH(split_cmd[1:])
+
+        return True
+
+    # UNWATCH
+    def route_UNWATCH(self, split_cmd, out_list):
+        self.cmd_UNWATCH()
+
+        return True
+
+    # QUIT, stop processing
+    def route_QUIT(self, split_cmd, out_list):
+        return False
+
+    # process a batch of raw command lines as the calling thread, all replies are appended to out_list
+    # returns False once we receive a QUIT, any commands after it are not processed
+    def process_command_batch(self, cmd_lines, out_list):
+        route_table = self.route_table
+
+        keep_processing = True
+
+        for split_cmd in map(str.split, cmd_lines):
+            if not split_cmd:
+                continue
+
+            route_entry = route_table.get(split_cmd[0])
+
+            # badly formed and unknown commands are ignored, just like PyMemDB
+            if route_entry is None or (route_entry[0] != len(split_cmd) and route_entry[0] is not None):
+                continue
+
+            if not route_entry[1](split_cmd, out_list):
+                keep_processing = False
+                break
+
+        # a slice of active expiry between batches, one stripe per batch
+        self.maintenance_cycle()
+
+        return keep_processing